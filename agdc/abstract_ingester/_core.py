@@ -190,6 +190,8 @@ class AbstractIngester(object):
         for dataset_path in dataset_list:
             self.ingest_individual_dataset(dataset_path)
 
+        self.invalidate_query_cache()
+
         self.log_ingestion_process_complete(source_dir, datetime.now() - start_datetime)
 
     def ingest_individual_dataset(self, dataset_path):
@@ -226,6 +228,21 @@ class AbstractIngester(object):
         else:
             self.log_dataset_ingest_complete(dataset_path, datetime.now() - start_datetime)
 
+    @staticmethod
+    def invalidate_query_cache():
+        """Discard the query results cached by the datacube API.
+
+        They may no longer match the database after an ingest. Nothing
+        is done if the API is not installed.
+        """
+
+        try:
+            from datacube.api.query import invalidate_query_cache
+        except ImportError:
+            return
+
+        invalidate_query_cache()
+
     def filter_on_metadata(self, dataset):
         """Raises a DatasetError unless the dataset passes the filter."""
 
@@ -265,9 +282,13 @@ class AbstractIngester(object):
             overlap_list = dataset_record.get_removal_overlaps()
             with self.collection.lock_datasets(overlap_list):
                 with self.collection.transaction():
+                    cell_list = dataset_record.get_elevation_cells(
+                        overlap_list)
                     dataset_record.remove_mosaics(overlap_list)
                     dataset_record.remove_tiles()
                     dataset_record.update()
+                    dataset_record.refresh_acquisition_cells(overlap_list,
+                                                             cell_list)
 
         return dataset_record
 
@@ -297,6 +318,7 @@ class AbstractIngester(object):
         with self.collection.lock_datasets(overlap_list):
             with self.collection.transaction():
                 dataset_record.create_mosaics(overlap_list)
+                dataset_record.refresh_acquisition_cells(overlap_list)
 
     #
     # Abstract methods
@@ -271,6 +271,32 @@ class DatasetRecord(object):
                 for tr in tile_record_list:
                     self.db.update_tile_class(tr['tile_id'], TC_SINGLE_SCENE)
 
+    def get_elevation_cells(self, dataset_filter):
+        """Return the cells of the DSM/DEM datasets among these ones.
+
+        Call this BEFORE removing tiles: the acquisition_cell rows of a
+        DSM/DEM dataset are found from its tiles, so once they are gone
+        the cells they covered have to be refreshed explicitly (see
+        refresh_acquisition_cells).
+        """
+
+        return self.db.get_elevation_cells(
+            set(dataset_filter) | set([self.dataset_id]))
+
+    def refresh_acquisition_cells(self, dataset_filter, cell_list=()):
+        """Refresh the acquisition_cell rows affected by the dataset.
+
+        'dataset_filter' is the list of (locked) dataset_ids whose
+        tiles may have been changed along with this one's, i.e. by
+        mosaic creation or removal. 'cell_list' is a list of cells
+        whose tiles have been removed (from get_elevation_cells).
+        """
+
+        for dataset_id in set(dataset_filter) | set([self.dataset_id]):
+            self.db.refresh_acquisition_cell(dataset_id)
+
+        self.db.refresh_acquisition_cell_cells(cell_list)
+
     def get_removal_overlaps(self):
         """Returns a list of overlapping dataset ids for mosaic removal."""
 
@@ -88,6 +88,11 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
     # This is the +- percentage to match within for fuzzy datetime matches.
     FUZZY_MATCH_PERCENTAGE = 15
 
+    # These are the (processing) level names of the elevation datasets.
+    # Their acquisition_cell rows are refreshed by cell rather than by
+    # acquisition (see refresh_acquisition_cell in the v7 database change).
+    ELEVATION_LEVEL_NAMES = ('DSM', 'DEM', 'DEM-S', 'DEM-H')
+
     #
     # Utility Functions
     #
@@ -776,3 +781,75 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
                   'new_tile_class_id': new_tile_class_id
                   }
         self.execute_sql_single(sql, params)
+
+    def has_acquisition_cell(self):
+        """Returns True if the database has the acquisition_cell table.
+
+        The table (and its refresh function) is added by the v7 database
+        change so older databases may not have it. The answer is cached.
+        """
+
+        if not hasattr(self, '_has_acquisition_cell'):
+            sql = ("SELECT EXISTS (SELECT 1 FROM pg_proc\n" +
+                   "WHERE proname = 'refresh_acquisition_cell');")
+            result = self.execute_sql_single(sql, ())
+            self._has_acquisition_cell = result[0]
+
+        return self._has_acquisition_cell
+
+    def refresh_acquisition_cell(self, dataset_id):
+        """Refreshes the acquisition_cell rows affected by a dataset.
+
+        This should be called (in the same transaction) whenever the
+        tiles of a dataset are created, removed or change tile class.
+        Does nothing if the database does not have the acquisition_cell
+        table.
+        """
+
+        if not self.has_acquisition_cell():
+            return
+
+        sql = "SELECT refresh_acquisition_cell(%(dataset_id)s);"
+        self.execute_sql_single(sql, {'dataset_id': dataset_id})
+
+    def get_elevation_cells(self, dataset_filter):
+        """Returns the (x_index, y_index) cells of the DSM/DEM datasets.
+
+        Only the datasets in 'dataset_filter' at one of the
+        ELEVATION_LEVEL_NAMES levels are considered. Their acquisition_cell rows are refreshed by cell
+        rather than by acquisition, so the cells have to be found before
+        their tiles are removed. Returns an empty list if the database
+        does not have the acquisition_cell table.
+        """
+
+        if not dataset_filter or not self.has_acquisition_cell():
+            return []
+
+        sql = ("SELECT DISTINCT tile.x_index, tile.y_index FROM tile\n" +
+               "JOIN dataset ON dataset.dataset_id = tile.dataset_id\n" +
+               "JOIN processing_level\n" +
+               "    ON processing_level.level_id = dataset.level_id\n" +
+               "WHERE tile.dataset_id IN %(dataset_filter)s\n" +
+               "AND processing_level.level_name IN %(level_names)s;")
+        params = {'dataset_filter': tuple(dataset_filter),
+                  'level_names': self.ELEVATION_LEVEL_NAMES}
+        result = self.execute_sql_multi(sql, params)
+
+        return [(tup[0], tup[1]) for tup in result]
+
+    def refresh_acquisition_cell_cells(self, cell_list):
+        """Refreshes the acquisition_cell rows of the given cells.
+
+        'cell_list' is a list of (x_index, y_index) tuples, as returned
+        by get_elevation_cells. Does nothing if the database does not
+        have the acquisition_cell table.
+        """
+
+        if not cell_list or not self.has_acquisition_cell():
+            return
+
+        sql = ("SELECT refresh_acquisition_cell_cells(" +
+               "%(x_index)s::integer[], %(y_index)s::integer[]);")
+        params = {'x_index': [cell[0] for cell in cell_list],
+                  'y_index': [cell[1] for cell in cell_list]}
+        self.execute_sql_single(sql, params)
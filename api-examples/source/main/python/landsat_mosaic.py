@@ -37,8 +37,10 @@ import logging
 import os
 import gdal
 import numpy
+from datacube.api.composite import Compositor, CompositeMethod, take_provenance
 from datacube.api.model import DatasetType, Ls57Arg25Bands, Satellite, Ls8Arg25Bands
-from datacube.api.utils import NDV, empty_array, get_dataset_metadata, get_dataset_data_with_pq, raster_create, \
+from datacube.api.reader import read_as_generator
+from datacube.api.utils import NDV, get_dataset_metadata, get_dataset_data_with_pq, raster_create, \
     get_dataset_data
 from datacube.api.workflow import SummaryTask, CellTask, Workflow
 
@@ -67,98 +69,63 @@ class LandsatMosaicCellTask(CellTask):
                                                                                           acq_max=self.acq_max))
 
     def doit(self):
-        shape = (4000, 4000)
         no_data_value = NDV
 
-        best_pixel_data = dict()
-
         # TODO
         if Satellite.LS8.value in self.satellites:
             bands = Ls8Arg25Bands
         else:
             bands = Ls57Arg25Bands
 
-        for band in bands:
-            best_pixel_data[band] = empty_array(shape=shape, dtype=numpy.int16, ndv=no_data_value)
-
-        best_pixel_satellite = empty_array(shape=shape, dtype=numpy.int16, ndv=NDV)
-        # best_pixel_epoch = empty_array(shape=shape, dtype=numpy.int32, ndv=NDV)
-        best_pixel_date = empty_array(shape=shape, dtype=numpy.int32, ndv=NDV)
-
-        current_satellite = empty_array(shape=shape, dtype=numpy.int16, ndv=NDV)
-        # current_epoch = empty_array(shape=shape, dtype=numpy.int32, ndv=NDV)
-        current_date = empty_array(shape=shape, dtype=numpy.int32, ndv=NDV)
-
         metadata = None
 
         SATELLITE_DATA_VALUES = {Satellite.LS5: 5, Satellite.LS7: 7, Satellite.LS8: 8}
 
-        for tile in self.get_tiles(sort=SortType.DESC):
-            # Get ARG25 dataset
+        # Take each pixel from the youngest tile that has a value for it (band values are propagated "as a job lot"
+        # so can just check any band)
 
-            dataset = tile.datasets[DatasetType.ARG25]
-            _log.info("Processing ARG tile [%s]", dataset.path)
+        # TODO better way than just saying....RED....?
+        compositor = Compositor(CompositeMethod.FIRST, key=bands.RED, ndv=no_data_value)
 
-            if not metadata:
-                metadata = get_dataset_metadata(dataset)
+        satellites = list()
+        dates = list()
 
-            band_data = None
+        # Read the tiles in parallel ahead of them being processed
 
+        def read(tile):
             if self.apply_pq_filter:
-                band_data = get_dataset_data_with_pq(dataset, tile.datasets[DatasetType.PQ25])
+                return get_dataset_data_with_pq(tile.datasets[DatasetType.ARG25], tile.datasets[DatasetType.PQ25])
             else:
-                band_data = get_dataset_data(dataset)
-
-            # Create the provenance datasets
+                return get_dataset_data(tile.datasets[DatasetType.ARG25])
 
-            # NOTE: need to do this BEFORE selecting the pixel since it is actually using the fact that the
-            # selected pixel currently doesn't have a value
+        for tile, band_data in read_as_generator(self.get_tiles(sort=SortType.DESC), read):
+            # Get ARG25 dataset
 
-            # NOTE: band values are propagated "as a job lot" so can just check any band
+            dataset = tile.datasets[DatasetType.ARG25]
+            _log.info("Processing ARG tile [%s]", dataset.path)
 
-            # TODO better way than just saying....RED....?
-            band = bands.RED
+            if not metadata:
+                metadata = get_dataset_metadata(dataset)
 
-            # Satellite
+            compositor.update(dict((band, band_data[band]) for band in bands))
 
-            current_satellite.fill(SATELLITE_DATA_VALUES[dataset.satellite])
-            best_pixel_satellite = numpy.where(best_pixel_data[band] == no_data_value, current_satellite, best_pixel_satellite)
+            # Provenance values of this tile - the provenance datasets are created from the selected tile index
 
-            # # Epoch dataset
-            #
-            # current_epoch.fill(calendar.timegm(tile.end_datetime.timetuple()))
-            # best_pixel_epoch = numpy.where(best_pixel_data[band] == no_data_value, current_epoch, best_pixel_epoch)
+            satellites.append(SATELLITE_DATA_VALUES[dataset.satellite])
 
             # Date dataset (20150101)
 
-            current_date.fill(tile.end_datetime.year * 10000 + tile.end_datetime.month * 100 + tile.end_datetime.day)
-            best_pixel_date = numpy.where(best_pixel_data[band] == no_data_value, current_date, best_pixel_date)
+            dates.append(tile.end_datetime.year * 10000 + tile.end_datetime.month * 100 + tile.end_datetime.day)
 
-            for band in bands:
-                data = band_data[band]
-                # _log.debug("data = \n%s", data)
+            # Stop reading tiles once every pixel has a value
 
-                # Replace any NO DATA best pixels with data pixels
-                # TODO should I explicitly do the AND data is not NO DATA VALUE?
-                best_pixel_data[band] = numpy.where(best_pixel_data[band] == no_data_value, data, best_pixel_data[band])
-                # _log.debug("best pixel = \n%s", best_pixel_data[band])
-
-            still_no_data = numpy.any(numpy.array([best_pixel_data[b] for b in bands]) == no_data_value)
-            # _log.debug("still no data pixels = %s", still_no_data)
-
-            if not still_no_data:
+            if compositor.is_complete():
                 break
 
-        # Now want to mask out values in the provenance datasets if we haven't actually got a value
-
-        # TODO better way than just saying....RED....?
-        band = bands.RED
-
-        mask = numpy.ma.masked_equal(best_pixel_data[band], NDV).mask
+        best_pixel_data = compositor.layers
 
-        best_pixel_satellite = numpy.ma.array(best_pixel_satellite, mask=mask).filled(NDV)
-        # best_pixel_epoch = numpy.ma.array(best_pixel_epoch, mask=mask).fill(NDV)
-        best_pixel_date = numpy.ma.array(best_pixel_date, mask=mask).filled(NDV)
+        best_pixel_satellite = take_provenance(satellites, compositor.index, ndv=NDV, dtype=numpy.int16)
+        best_pixel_date = take_provenance(dates, compositor.index, ndv=NDV, dtype=numpy.int32)
 
         # Composite NBAR dataset
 
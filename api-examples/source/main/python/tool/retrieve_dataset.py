@@ -39,8 +39,8 @@ import logging
 import os
 from datacube.api.model import DatasetType, Satellite, dataset_type_database, dataset_type_derived_nbar, BANDS
 from datacube.api.query import list_tiles
-from datacube.api.utils import PqaMask, raster_create, intersection, calculate_ndvi, calculate_evi, calculate_nbr
-from datacube.api.utils import get_dataset_data, get_dataset_data_with_pq, get_dataset_metadata, NDV
+from datacube.api.utils import PqaMask, raster_create, intersection, get_virtual_dataset_data, get_mask_pqa
+from datacube.api.utils import get_dataset_data, get_dataset_data_with_pq, get_dataset_metadata, NDV, NAN
 from datacube.api.workflow import writeable_dir
 from datacube.config import Config
 
@@ -291,32 +291,31 @@ class DatasetRetrievalWorkflow():
                         subprocess.call(["gdalbuildvrt", "-separate", "-b", str(band.value), "-input_file_list", path, path_vrt])
 
     def generate_derived_nbar(self, dataset_types, nbar, pqa, pqa_masks, overwrite=False):
-        for dataset_type in dataset_types:
-            filename = self.get_output_filename_derived_nbar(nbar, dataset_type)
-            _log.info("Generating data from [%s] with pq [%s] and pq mask [%s] to [%s]", nbar.path, pqa and pqa.path or "", pqa and pqa_masks or "", filename)
 
-            metadata = get_dataset_metadata(nbar)
+        if not dataset_types:
+            return
+
+        _log.info("Generating %s from [%s] with pq [%s] and pq mask [%s]", [d.name for d in dataset_types], nbar.path,
+                  pqa and pqa.path or "", pqa and pqa_masks or "")
 
-            data = None
+        metadata = get_dataset_metadata(nbar)
 
-            if pqa:
-                data = get_dataset_data_with_pq(nbar, pqa, pq_masks=pqa_masks)
-            else:
-                data = get_dataset_data(nbar)
+        mask = None
 
-            _log.debug("data is [%s]", data)
+        if pqa:
+            mask = get_mask_pqa(pqa, pqa_masks)
 
-            if dataset_type == DatasetType.NDVI:
-                ndvi = calculate_ndvi(data[nbar.bands.RED], data[nbar.bands.NEAR_INFRARED])
-                raster_create(filename, [ndvi], metadata.transform, metadata.projection, NDV, gdal.GDT_Float32)
+        # Read the NBAR bands needed for all the derived datasets once
 
-            elif dataset_type == DatasetType.EVI:
-                evi = calculate_evi(data[nbar.bands.RED], data[nbar.bands.BLUE], data[nbar.bands.NEAR_INFRARED])
-                raster_create(filename, [evi], metadata.transform, metadata.projection, NDV, gdal.GDT_Float32)
+        data = get_virtual_dataset_data(nbar, dataset_types, mask=mask)
+
+        for dataset_type in dataset_types:
+            filename = self.get_output_filename_derived_nbar(nbar, dataset_type)
+            _log.info("Writing [%s]", filename)
 
-            elif dataset_type == DatasetType.NBR:
-                nbr = calculate_nbr(data[nbar.bands.NEAR_INFRARED], data[nbar.bands.SHORT_WAVE_INFRARED_2])
-                raster_create(filename, [nbr], metadata.transform, metadata.projection, NDV, gdal.GDT_Float32)
+            raster_create(filename, [data[dataset_type][band] for band in BANDS[dataset_type, nbar.satellite]],
+                          metadata.transform, metadata.projection, get_ndv_derived_nbar(dataset_type),
+                          gdal.GDT_Float32)
 
     def get_output_filename(self, dataset):
 
@@ -346,7 +345,8 @@ class DatasetRetrievalWorkflow():
         dataset_type_string = {
             DatasetType.NDVI: "_NDVI_",
             DatasetType.EVI: "_EVI_",
-            DatasetType.NBR: "_NBR_"
+            DatasetType.NBR: "_NBR_",
+            DatasetType.TCI: "_TCI_"
         }[dataset_type]
 
         if self.apply_pqa_filter:
@@ -357,6 +357,18 @@ class DatasetRetrievalWorkflow():
         return os.path.join(self.output_directory, filename)
 
 
+def get_ndv_derived_nbar(dataset_type):
+
+    # The index functions fill no data with NDV but the tassel cap indices fill it with NaN
+
+    return {
+        DatasetType.NDVI: NDV,
+        DatasetType.EVI: NDV,
+        DatasetType.NBR: NDV,
+        DatasetType.TCI: NAN
+    }[dataset_type]
+
+
 def decode_dataset_type(dataset_type):
     return {DatasetType.ARG25: "Surface Reflectance",
               DatasetType.PQ25: "Pixel Quality",
@@ -39,11 +39,16 @@ from gdalconst import GA_ReadOnly, GA_Update
 import logging
 import os
 import resource
+from datacube.api.chunk import get_chunk_windows, plan_chunk_size_for_dataset
+from datacube.api.composite import CompositeMethod, calculate_composite_index, gather
 from datacube.api.model import DatasetType, Satellite, get_bands, dataset_type_database
 from datacube.api.query import list_tiles_as_list
-from datacube.api.utils import PqaMask, get_dataset_metadata, get_dataset_data, get_dataset_data_with_pq, empty_array
-from datacube.api.utils import NDV, UINT16_MAX
+from datacube.api.reader import read_as_generator
+from datacube.api.statistics import calculate_percentiles, PercentileInterpolation
+from datacube.api.utils import PqaMask, get_dataset_metadata, get_dataset_data, get_dataset_data_with_pq
+from datacube.api.utils import NDV, UINT16_MAX, calculate_medoid_stack
 from datacube.api.workflow import writeable_dir
+from datacube.api.writer import RasterWriter
 from datacube.config import Config
 from enum import Enum
 
@@ -124,6 +129,7 @@ class SummariseDatasetTimeSeriesWorkflow():
 
     chunk_size_x = None
     chunk_size_y = None
+    align_chunks = None
 
     def __init__(self, application_name):
         self.application_name = application_name
@@ -175,7 +181,7 @@ class SummariseDatasetTimeSeriesWorkflow():
         supported_summary_methods = [
             TimeSeriesSummaryMethod.YOUNGEST_PIXEL,
             TimeSeriesSummaryMethod.OLDEST_PIXEL,
-            # TimeSeriesSummaryMethod.MEDOID_PIXEL,
+            TimeSeriesSummaryMethod.MEDOID_PIXEL,
             TimeSeriesSummaryMethod.COUNT,
             TimeSeriesSummaryMethod.MIN,
             TimeSeriesSummaryMethod.MAX,
@@ -195,6 +201,7 @@ class SummariseDatasetTimeSeriesWorkflow():
 
         parser.add_argument("--chunk-size-x", help="Number of X pixels to process at once", action="store", dest="chunk_size_x", type=int, choices=range(0, 4000+1), default=4000, metavar="[1 - 4000]")
         parser.add_argument("--chunk-size-y", help="Number of Y pixels to process at once", action="store", dest="chunk_size_y", type=int, choices=range(0, 4000+1), default=4000, metavar="[1 - 4000]")
+        parser.add_argument("--no-align-chunks", help="Use the chunk size as given rather than aligning it to the tiles' block layout", action="store_false", dest="align_chunks", default=True)
 
         args = parser.parse_args()
 
@@ -265,6 +272,7 @@ class SummariseDatasetTimeSeriesWorkflow():
 
         self.chunk_size_x = args.chunk_size_x
         self.chunk_size_y = args.chunk_size_y
+        self.align_chunks = args.align_chunks
 
         _log.info("""
         x = {x:03d}
@@ -281,6 +289,7 @@ class SummariseDatasetTimeSeriesWorkflow():
         list only = {list_only}
         summary method = {summary_method}
         chunk size = {chunk_size_x:4d} x {chunk_size_y:4d} pixels
+        align chunks = {align_chunks}
         """.format(x=self.x, y=self.y,
                    acq_min=self.acq_min, acq_max=self.acq_max,
                    process_min=self.process_min, process_max=self.process_max,
@@ -293,7 +302,8 @@ class SummariseDatasetTimeSeriesWorkflow():
                    list_only=self.list_only,
                    summary_method=self.summary_method,
                    chunk_size_x=self.chunk_size_x,
-                   chunk_size_y=self.chunk_size_y))
+                   chunk_size_y=self.chunk_size_y,
+                   align_chunks=self.align_chunks))
 
     def run(self):
         self.parse_arguments()
@@ -325,7 +335,7 @@ class SummariseDatasetTimeSeriesWorkflow():
                                    password=config.get_db_password(),
                                    host=config.get_db_host(), port=config.get_db_port())
 
-        raster = None
+        writer = None
         metadata = None
 
         # TODO - PQ is UNIT16 (others are INT16) and so -999 NDV doesn't work
@@ -333,34 +343,41 @@ class SummariseDatasetTimeSeriesWorkflow():
 
         _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
-        import itertools
-        for x, y in itertools.product(range(0, 4000, self.chunk_size_x), range(0, 4000, self.chunk_size_y)):
+        if self.align_chunks and tiles:
+            self.chunk_size_x, self.chunk_size_y = plan_chunk_size_for_dataset(tiles[0].datasets[self.dataset_type],
+                                                                               self.chunk_size_x, self.chunk_size_y)
+            _log.info("Aligned chunk size is [%d x %d] pixels", self.chunk_size_x, self.chunk_size_y)
 
-            _log.info("About to read data chunk ({xmin:4d},{ymin:4d}) to ({xmax:4d},{ymax:4d})".format(xmin=x, ymin=y, xmax=x+self.chunk_size_x-1, ymax=y+self.chunk_size_y-1))
+        for x, y, x_size, y_size in get_chunk_windows(self.chunk_size_x, self.chunk_size_y):
+
+            _log.info("About to read data chunk ({xmin:4d},{ymin:4d}) to ({xmax:4d},{ymax:4d})".format(xmin=x, ymin=y, xmax=x+x_size-1, ymax=y+y_size-1))
             _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
             stack = dict()
 
-            for tile in tiles:
-
-                if self.list_only:
+            if self.list_only:
+                for tile in tiles:
                     _log.info("Would summarise dataset [%s]", tile.datasets[self.dataset_type].path)
-                    continue
+                continue
 
-                pqa = None
+            # Read the tiles in parallel
 
-                _log.debug("Reading dataset [%s]", tile.datasets[self.dataset_type].path)
+            def read(tile):
 
-                if not metadata:
-                    metadata = get_dataset_metadata(tile.datasets[self.dataset_type])
+                _log.debug("Reading dataset [%s]", tile.datasets[self.dataset_type].path)
 
                 # Apply PQA if specified
 
                 if self.apply_pqa_filter:
-                    data = get_dataset_data_with_pq(tile.datasets[self.dataset_type], tile.datasets[DatasetType.PQ25], bands=bands, x=x, y=y, x_size=self.chunk_size_x, y_size=self.chunk_size_y, pq_masks=self.pqa_mask, ndv=ndv)
+                    return get_dataset_data_with_pq(tile.datasets[self.dataset_type], tile.datasets[DatasetType.PQ25], bands=bands, x=x, y=y, x_size=x_size, y_size=y_size, pq_masks=self.pqa_mask, ndv=ndv)
 
                 else:
-                    data = get_dataset_data(tile.datasets[self.dataset_type], bands=bands, x=x, y=y, x_size=self.chunk_size_x, y_size=self.chunk_size_y)
+                    return get_dataset_data(tile.datasets[self.dataset_type], bands=bands, x=x, y=y, x_size=x_size, y_size=y_size)
+
+            for tile, data in read_as_generator(tiles, read):
+
+                if not metadata:
+                    metadata = get_dataset_metadata(tile.datasets[self.dataset_type])
 
                 for band in bands:
                     if band in stack:
@@ -374,11 +391,19 @@ class SummariseDatasetTimeSeriesWorkflow():
 
             # Apply summary method
 
-            _log.info("Finished reading {count} datasets for chunk ({xmin:4d},{ymin:4d}) to ({xmax:4d},{ymax:4d}) - about to summarise them".format(count=len(tiles), xmin=x, ymin=y, xmax=x+self.chunk_size_x-1, ymax=y+self.chunk_size_y-1))
+            _log.info("Finished reading {count} datasets for chunk ({xmin:4d},{ymin:4d}) to ({xmax:4d},{ymax:4d}) - about to summarise them".format(count=len(tiles), xmin=x, ymin=y, xmax=x+x_size-1, ymax=y+y_size-1))
             _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
             masked_stack = dict()
 
+            # The medoid considers all the bands at once so calculate it up front
+
+            medoid = None
+
+            if self.summary_method == TimeSeriesSummaryMethod.MEDOID_PIXEL:
+                medoid = dict(zip(bands, calculate_medoid_stack(
+                    numpy.array([[stack[band][t] for band in bands] for t in range(len(stack[bands[0]]))]), ndv=ndv)))
+
             for band in bands:
                 masked_stack[band] = numpy.ma.masked_equal(stack[band], ndv)
                 _log.debug("masked_stack[%s] is %s", band.name, masked_stack[band])
@@ -395,14 +420,15 @@ class SummariseDatasetTimeSeriesWorkflow():
                     masked_summary = numpy.mean(masked_stack[band], axis=0)
 
                 elif self.summary_method == TimeSeriesSummaryMethod.MEDIAN:
-                    masked_summary = numpy.median(masked_stack[band], axis=0)
+                    masked_summary = numpy.ma.masked_equal(
+                        calculate_percentiles(stack[band], [50], ndv=ndv, output_ndv=ndv)[0], ndv)
 
                 # aka 50th percentile
 
                 elif self.summary_method == TimeSeriesSummaryMethod.MEDIAN_NON_INTERPOLATED:
-                    masked_sorted = numpy.ma.sort(masked_stack[band], axis=0)
-                    masked_percentile_index = numpy.ma.floor(numpy.ma.count(masked_sorted, axis=0) * 0.95).astype(numpy.int16)
-                    masked_summary = numpy.ma.choose(masked_percentile_index, masked_sorted)
+                    masked_summary = numpy.ma.masked_equal(
+                        calculate_percentiles(stack[band], [50], ndv=ndv, interpolation=PercentileInterpolation.RANK,
+                                              output_ndv=ndv, dtype=masked_stack[band].dtype)[0], ndv)
 
                 elif self.summary_method == TimeSeriesSummaryMethod.COUNT:
                     # TODO Need to artificially create masked array here since it is being expected/filled below!!!
@@ -420,47 +446,29 @@ class SummariseDatasetTimeSeriesWorkflow():
                 # currently 95th percentile
 
                 elif self.summary_method == TimeSeriesSummaryMethod.PERCENTILE:
-                    masked_sorted = numpy.ma.sort(masked_stack[band], axis=0)
-                    masked_percentile_index = numpy.ma.floor(numpy.ma.count(masked_sorted, axis=0) * 0.95).astype(numpy.int16)
-                    masked_summary = numpy.ma.choose(masked_percentile_index, masked_sorted)
+                    masked_summary = numpy.ma.masked_equal(
+                        calculate_percentiles(stack[band], [95], ndv=ndv, interpolation=PercentileInterpolation.RANK,
+                                              output_ndv=ndv, dtype=masked_stack[band].dtype)[0], ndv)
 
-                elif self.summary_method == TimeSeriesSummaryMethod.YOUNGEST_PIXEL:
+                elif self.summary_method == TimeSeriesSummaryMethod.MEDOID_PIXEL:
+                    masked_summary = numpy.ma.masked_equal(medoid[band], ndv)
 
-                    # TODO the fact that this is band at a time might be problematic.  We really should be considering
-                    # all bands at once (that is what the landsat_mosaic logic did).  If PQA is being applied then
-                    # it's probably all good but if not then we might get odd results....
-
-                    masked_summary = empty_array(shape=(self.chunk_size_x, self.chunk_size_x), dtype=numpy.int16, ndv=ndv)
-
-                    # Note the reversed as the stack is created oldest first
-                    for d in reversed(stack[band]):
-                        masked_summary = numpy.where(masked_summary == ndv, d, masked_summary)
-
-                        # If the summary doesn't contain an no data values then we can stop
-                        if not numpy.any(masked_summary == ndv):
-                            break
-
-                    # TODO Need to artificially create masked array here since it is being expected/filled below!!!
-                    masked_summary = numpy.ma.masked_equal(masked_summary, ndv)
-
-                elif self.summary_method == TimeSeriesSummaryMethod.OLDEST_PIXEL:
+                elif self.summary_method in [TimeSeriesSummaryMethod.YOUNGEST_PIXEL,
+                                             TimeSeriesSummaryMethod.OLDEST_PIXEL]:
 
                     # TODO the fact that this is band at a time might be problematic.  We really should be considering
                     # all bands at once (that is what the landsat_mosaic logic did).  If PQA is being applied then
                     # it's probably all good but if not then we might get odd results....
 
-                    masked_summary = empty_array(shape=(self.chunk_size_x, self.chunk_size_x), dtype=numpy.int16, ndv=ndv)
+                    # Note the stack is created oldest first so the youngest pixel is the last valid one
 
-                    # Note the NOT reversed as the stack is created oldest first
-                    for d in stack[band]:
-                        masked_summary = numpy.where(masked_summary == ndv, d, masked_summary)
+                    method = {TimeSeriesSummaryMethod.YOUNGEST_PIXEL: CompositeMethod.LAST,
+                              TimeSeriesSummaryMethod.OLDEST_PIXEL: CompositeMethod.FIRST}[self.summary_method]
 
-                        # If the summary doesn't contain an no data values then we can stop
-                        if not numpy.any(masked_summary == ndv):
-                            break
+                    band_stack = numpy.array(stack[band])
 
-                    # TODO Need to artificially create masked array here since it is being expected/filled below!!!
-                    masked_summary = numpy.ma.masked_equal(masked_summary, ndv)
+                    masked_summary = numpy.ma.masked_equal(
+                        gather(band_stack, calculate_composite_index(band_stack, method, ndv=ndv), ndv=ndv), ndv)
 
                 masked_stack[band] = None
                 _log.debug("NONE-ing masked stack[%s]", band.name)
@@ -471,38 +479,31 @@ class SummariseDatasetTimeSeriesWorkflow():
 
                 # Create the output file
 
-                if not os.path.exists(path):
+                if not writer:
                     _log.info("Creating raster [%s]", path)
 
-                    driver = gdal.GetDriverByName("GTiff")
-                    assert driver
+                    writer = RasterWriter(path, metadata.shape[0], metadata.shape[1], len(bands), gdal.GDT_Int16,
+                                          metadata.transform, metadata.projection, ndv=ndv)
 
-                    raster = driver.Create(path, metadata.shape[0], metadata.shape[1], len(bands), gdal.GDT_Int16)
-                    assert raster
-
-                    raster.SetGeoTransform(metadata.transform)
-                    raster.SetProjection(metadata.projection)
-
-                    for b in bands:
-                        raster.GetRasterBand(b.value).SetNoDataValue(ndv)
+                # The chunk is written (and the band statistics updated) on a background thread while the next
+                # band/chunk is summarised
 
                 _log.info("Writing band [%s] data to raster [%s]", band.name, path)
                 _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
-                raster.GetRasterBand(band.value).WriteArray(masked_summary.filled(ndv), xoff=x, yoff=y)
-                raster.GetRasterBand(band.value).ComputeStatistics(True)
-
-                raster.FlushCache()
+                writer.write(band.value, masked_summary.filled(ndv), x, y)
 
                 masked_summary = None
                 _log.debug("NONE-ing the masked summary")
                 _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
             stack = None
+            medoid = None
             _log.debug("Just NONE-ed the stack")
             _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
-        raster = None
+        if writer:
+            writer.close()
 
         _log.debug("Just NONE'd the raster")
         _log.debug("Current MAX RSS  usage is [%d] MB",  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
@@ -36,9 +36,12 @@ import logging
 import luigi
 import numpy
 import os
+from datacube.api.composite import Compositor, CompositeMethod, take_provenance
 from datacube.api.model import DatasetType, Fc25Bands, Ls57Arg25Bands, Satellite
-from datacube.api.utils import NDV, empty_array, get_mask_pqa, get_dataset_data_masked, calculate_ndvi, get_mask_wofs
-from datacube.api.utils import propagate_using_selected_pixel, get_dataset_metadata, raster_create, date_to_integer
+from datacube.api.reader import read_as_generator
+from datacube.api.utils import NDV, get_mask_pqa, get_dataset_data_masked, calculate_ndvi, get_mask_wofs
+from datacube.api.utils import get_dataset_data, apply_mask
+from datacube.api.utils import get_dataset_metadata, raster_create, date_to_integer
 from datacube.api.workflow.cell import Workflow, SummaryTask, CellTask
 
 
@@ -104,62 +107,58 @@ class BareSoilCellTask(CellTask):
 
     def run(self):
 
-        shape = (4000, 4000)
         no_data_value = NDV
 
-        best_pixel_fc = dict()
+        # Take each pixel from the tile with the most bare soil (along with all its NBAR/FC bands)
 
-        for band in Fc25Bands:
-            # best_pixel_fc[band] = empty_array(shape=shape, dtype=numpy.int16, ndv=INT16_MIN)
-            best_pixel_fc[band] = empty_array(shape=shape, dtype=numpy.int16, ndv=NDV)
+        compositor = Compositor(CompositeMethod.MAX, key=None, ndv=NDV)
 
-        best_pixel_nbar = dict()
-
-        for band in Ls57Arg25Bands:
-            best_pixel_nbar[band] = empty_array(shape=shape, dtype=numpy.int16, ndv=NDV)
-
-        best_pixel_satellite = empty_array(shape=shape, dtype=numpy.int16, ndv=NDV)
-        best_pixel_date = empty_array(shape=shape, dtype=numpy.int32, ndv=NDV)
-
-        current_satellite = empty_array(shape=shape, dtype=numpy.int16, ndv=NDV)
-        current_date = empty_array(shape=shape, dtype=numpy.int32, ndv=NDV)
+        satellites = list()
+        dates = list()
 
         SATELLITE_DATA_VALUES = {Satellite.LS5: 5, Satellite.LS7: 7, Satellite.LS8: 8}
 
         metadata_nbar = None
         metadata_fc = None
 
-        for tile in self.get_tiles():
+        # Read the tiles (the PQA/WOFS mask, the masked NBAR and the as yet unmasked FC) in parallel ahead of them
+        # being processed
+
+        def read(tile):
 
             pqa = tile.datasets[DatasetType.PQ25]
             nbar = tile.datasets[DatasetType.ARG25]
             fc = tile.datasets[DatasetType.FC25]
             wofs = DatasetType.WATER in tile.datasets and tile.datasets[DatasetType.WATER] or None
 
-            _log.info("Processing [%s]", fc.path)
-
-            data = dict()
-
             # Create an initial "no mask" mask
 
             mask = numpy.ma.make_mask_none((4000, 4000))
-            # _log.info("### mask is [%s]", mask[1000][1000])
 
             # Add the PQA mask if we are doing PQA masking
 
             if self.mask_pqa_apply:
                 mask = get_mask_pqa(pqa, pqa_masks=self.mask_pqa_mask, mask=mask)
-                # _log.info("### mask PQA is [%s]", mask[1000][1000])
 
             # Add the WOFS mask if we are doing WOFS masking
 
             if self.mask_wofs_apply and wofs:
                 mask = get_mask_wofs(wofs, wofs_masks=self.mask_wofs_mask, mask=mask)
-                # _log.info("### mask PQA is [%s]", mask[1000][1000])
+
+            return mask, get_dataset_data_masked(nbar, mask=mask), get_dataset_data(fc)
+
+        for tile, (mask, data_nbar, data_fc) in read_as_generator(self.get_tiles(), read):
+
+            nbar = tile.datasets[DatasetType.ARG25]
+            fc = tile.datasets[DatasetType.FC25]
+
+            _log.info("Processing [%s]", fc.path)
+
+            data = dict()
 
             # Get NBAR dataset
 
-            data[DatasetType.ARG25] = get_dataset_data_masked(nbar, mask=mask)
+            data[DatasetType.ARG25] = data_nbar
             # _log.info("### NBAR/RED is [%s]", data[DatasetType.ARG25][Ls57Arg25Bands.RED][1000][1000])
 
             # Get the NDVI dataset
@@ -175,7 +174,7 @@ class BareSoilCellTask(CellTask):
 
             # Get FC25 dataset
 
-            data[DatasetType.FC25] = get_dataset_data_masked(fc, mask=mask)
+            data[DatasetType.FC25] = dict((band, apply_mask(data_fc[band], mask=mask)) for band in data_fc)
             # _log.info("### FC/BS is [%s]", data[DatasetType.FC25][Fc25Bands.BARE_SOIL][1000][1000])
 
             # Add the bare soil value range mask (to the existing mask)
@@ -188,44 +187,18 @@ class BareSoilCellTask(CellTask):
             data_bare_soil = numpy.ma.MaskedArray(data=data[DatasetType.FC25][Fc25Bands.BARE_SOIL], mask=mask).filled(NDV)
             # _log.info("### bare soil is [%s]", data_bare_soil[1000][1000])
 
-            # Compare the bare soil value from this dataset to the current "best" value
-
-            best_pixel_fc[Fc25Bands.BARE_SOIL] = numpy.fmax(best_pixel_fc[Fc25Bands.BARE_SOIL], data_bare_soil)
-            # _log.info("### best pixel bare soil is [%s]", best_pixel_fc[Fc25Bands.BARE_SOIL][1000][1000])
-
-            # Now update the other best pixel datasets/bands to grab the pixels we just selected
-
-            for band in Ls57Arg25Bands:
-                best_pixel_nbar[band] = propagate_using_selected_pixel(best_pixel_fc[Fc25Bands.BARE_SOIL],
-                                                                       data_bare_soil,
-                                                                       data[DatasetType.ARG25][band],
-                                                                       best_pixel_nbar[band])
+            # Select the pixels where the bare soil value from this dataset beats the current "best" value and take
+            # all the NBAR and FC bands from them
 
-            for band in [Fc25Bands.PHOTOSYNTHETIC_VEGETATION, Fc25Bands.NON_PHOTOSYNTHETIC_VEGETATION, Fc25Bands.UNMIXING_ERROR]:
-                best_pixel_fc[band] = propagate_using_selected_pixel(best_pixel_fc[Fc25Bands.BARE_SOIL],
-                                                                     data_bare_soil,
-                                                                     data[DatasetType.FC25][band],
-                                                                     best_pixel_fc[band])
+            layers = dict(data[DatasetType.ARG25])
+            layers.update(data[DatasetType.FC25])
 
-            # And now the other "provenance" data
+            compositor.update(layers, key=data_bare_soil)
 
-            # Satellite "provenance" data
+            # The "provenance" values of this tile - the provenance datasets are created from the selected tile index
 
-            current_satellite.fill(SATELLITE_DATA_VALUES[fc.satellite])
-
-            best_pixel_satellite = propagate_using_selected_pixel(best_pixel_fc[Fc25Bands.BARE_SOIL],
-                                                                  data_bare_soil,
-                                                                  current_satellite,
-                                                                  best_pixel_satellite)
-
-            # Date "provenance" data
-
-            current_date.fill(date_to_integer(tile.end_datetime))
-
-            best_pixel_date = propagate_using_selected_pixel(best_pixel_fc[Fc25Bands.BARE_SOIL],
-                                                             data_bare_soil,
-                                                             current_date,
-                                                             best_pixel_date)
+            satellites.append(SATELLITE_DATA_VALUES[fc.satellite])
+            dates.append(date_to_integer(tile.end_datetime))
 
             # Grab the metadata from the input datasets for use later when creating the output datasets
 
@@ -235,6 +208,12 @@ class BareSoilCellTask(CellTask):
             if not metadata_fc:
                 metadata_fc = get_dataset_metadata(fc)
 
+        best_pixel_fc = dict((band, compositor.layers[band]) for band in Fc25Bands)
+        best_pixel_nbar = dict((band, compositor.layers[band]) for band in Ls57Arg25Bands)
+
+        best_pixel_satellite = take_provenance(satellites, compositor.index, ndv=no_data_value, dtype=numpy.int16)
+        best_pixel_date = take_provenance(dates, compositor.index, ndv=no_data_value, dtype=numpy.int32)
+
         # Create the output datasets
 
         # FC composite
@@ -58,7 +58,8 @@ class PixelStatisticsWorkflow(Workflow):
                                                output_directory=self.output_directory, csv=self.csv, dummy=self.dummy,
                                                mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
                                                dataset_type=self.dataset_type, bands=self.bands,
-                                               chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y)]
+                                               chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                                               chunk_workers=self.chunk_workers, chunk_threads=self.chunk_threads)]
 
 
 class PixelStatisticsSummaryTask(SummaryTask):
@@ -70,7 +71,8 @@ class PixelStatisticsSummaryTask(SummaryTask):
                                            output_directory=self.output_directory, csv=self.csv, dummy=self.dummy,
                                            mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
                                            dataset_type=self.dataset_type, bands=self.bands,
-                                           chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y)
+                                           chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                                           chunk_workers=self.chunk_workers, chunk_threads=self.chunk_threads)
 
 
 class PixelStatisticsCellTask(CellTask):
@@ -84,7 +86,9 @@ class PixelStatisticsCellTask(CellTask):
                                                       mask_pqa_apply=self.mask_pqa_apply,
                                                       mask_pqa_mask=self.mask_pqa_mask,
                                                       dataset_type=self.dataset_type, band=band,
-                                                      chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y)
+                                                      chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                                                      chunk_workers=self.chunk_workers,
+                                                      chunk_threads=self.chunk_threads)
 
 
 class PixelStatisticsCellDatasetBandTask(CellDatasetBandTask):
@@ -120,7 +124,7 @@ class PixelStatisticsCellDatasetBandTask(CellDatasetBandTask):
 
         return luigi.LocalTarget(filename)
 
-    def run(self):
+    def run_cell_dataset_band(self):
 
         print "****", self.output().path
 
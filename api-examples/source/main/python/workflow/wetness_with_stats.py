@@ -37,9 +37,11 @@ import numpy
 import os
 import osr
 from datacube.api.model import DatasetType, TciBands
+from datacube.api.statistics import StatisticsAccumulator, PercentileAccumulator, calculate_percentiles
 from datacube.api.workflow import TileListCsvTask
 from datacube.api.workflow.tile import TileTask
-from datacube.api.workflow.cell_chunk import Workflow, SummaryTask, CellTask, CellChunkTask
+from datacube.api.store import CellStore
+from datacube.api.workflow.cell_chunk import Workflow, SummaryTask, CellTask, CellChunkTask, CellStoreChunkTarget
 from enum import Enum
 import gdal
 from datacube.api.utils import get_dataset_metadata, get_mask_pqa, get_mask_wofs, get_dataset_ndv, log_mem
@@ -49,6 +51,13 @@ from datacube.api.utils import get_dataset_data_masked, raster_create
 _log = logging.getLogger()
 
 
+# The range of the wetness values over which the approximate percentiles' histograms are built (values outside it are
+# counted in the first/last bin)
+
+WETNESS_MINIMUM = -1.0
+WETNESS_MAXIMUM = 1.0
+
+
 class Statistic(Enum):
     __order__ = "COUNT COUNT_OBSERVED MIN MAX MEAN SUM STANDARD_DEVIATION VARIANCE PERCENTILE_25 PERCENTILE_50 PERCENTILE_75 PERCENTILE_90 PERCENTILE_95"
 
@@ -73,6 +82,38 @@ class WetnessWorkflow(Workflow):
 
         Workflow.__init__(self, name="Wetness In the Landscape - 2015-04-17")
 
+        self.percentile_bins = None
+
+    def setup_arguments(self):
+
+        # Call method on super class
+        # super(self.__class__, self).setup_arguments()
+        Workflow.setup_arguments(self)
+
+        self.parser.add_argument("--percentile-bins",
+                                 help="Approximate the percentiles from a histogram of this many bins per pixel (see "
+                                      "PercentileAccumulator) rather than holding each chunk's whole time series in "
+                                      "memory - 0 for exact percentiles",
+                                 action="store", dest="percentile_bins", type=int, default=0)
+
+    def process_arguments(self, args):
+
+        # Call method on super class
+        # super(self.__class__, self).process_arguments(args)
+        Workflow.process_arguments(self, args)
+
+        self.percentile_bins = args.percentile_bins
+
+    def log_arguments(self):
+
+        # Call method on super class
+        # super(self.__class__, self).log_arguments()
+        Workflow.log_arguments(self)
+
+        _log.info("""
+        percentile bins = {percentile_bins}
+        """.format(percentile_bins=self.percentile_bins))
+
     def create_summary_tasks(self):
 
         return [WetnessSummaryTask(x_min=self.x_min, x_max=self.x_max, y_min=self.y_min, y_max=self.y_max,
@@ -80,22 +121,30 @@ class WetnessWorkflow(Workflow):
                                    output_directory=self.output_directory, csv=self.csv, dummy=self.dummy,
                                    mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
                                    mask_wofs_apply=self.mask_wofs_apply, mask_wofs_mask=self.mask_wofs_mask,
-                                   chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y)]
+                                   chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                                   chunk_workers=self.chunk_workers, chunk_threads=self.chunk_threads,
+                                   percentile_bins=self.percentile_bins)]
 
 
 class WetnessSummaryTask(SummaryTask):
 
+    percentile_bins = luigi.IntParameter(default=0)
+
     def create_cell_tasks(self, x, y):
 
         return WetnessCellTask(x=x, y=y, acq_min=self.acq_min, acq_max=self.acq_max, satellites=self.satellites,
                                output_directory=self.output_directory, csv=self.csv, dummy=self.dummy,
                                mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
                                mask_wofs_apply=self.mask_wofs_apply, mask_wofs_mask=self.mask_wofs_mask,
-                               chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y)
+                               chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                               chunk_workers=self.chunk_workers, chunk_threads=self.chunk_threads,
+                               percentile_bins=self.percentile_bins)
 
 
 class WetnessCellTask(CellTask):
 
+    percentile_bins = luigi.IntParameter(default=0)
+
     def create_cell_chunk_task(self, x_offset, y_offset):
 
         return WetnessCellChunkTask(x=self.x, y=self.y, acq_min=self.acq_min, acq_max=self.acq_max,
@@ -104,7 +153,7 @@ class WetnessCellTask(CellTask):
                                     mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
                                     mask_wofs_apply=self.mask_wofs_apply, mask_wofs_mask=self.mask_wofs_mask,
                                     chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
-                                    x_offset=x_offset, y_offset=y_offset)
+                                    x_offset=x_offset, y_offset=y_offset, percentile_bins=self.percentile_bins)
 
     def output(self):
 
@@ -122,27 +171,9 @@ class WetnessCellTask(CellTask):
 
         return luigi.LocalTarget(filename)
 
-    def run(self):
-
-        print "*** Aggregating chunk NPY files into TIF"
-        # Create output raster - which has len(statistics) bands
-
-        # for each statistic
-
-            # get the band
-
-            # for each chunk file
-
-                # read the chunk
-                # write it to the band of the output raster
+    def run_cell(self):
 
-        # tile = self.get_tiles()[0]
-        #
-        # filename = tile.datasets[DatasetType.TCI]
-        # filename = map_filename_nbar_to_wetness(filename)
-        # filename = os.path.join(self.output_directory, filename)
-        #
-        # metadata = get_dataset_metadata(filename)
+        print "*** Converting the cell statistics store into TIF"
 
         transform = (self.x, 0.00025, 0.0, self.y+1, 0.0, -0.00025)
 
@@ -151,68 +182,16 @@ class WetnessCellTask(CellTask):
 
         projection = srs.ExportToWkt()
 
-        driver = gdal.GetDriverByName("GTiff")
-        assert driver
+        # The chunk tasks have written their statistics straight into the store so this is a single streaming pass
 
-        # Create the output TIF
+        store = get_statistics_store(self.output_directory, self.satellites, self.x, self.y, self.acq_min,
+                                     self.acq_max, self.chunk_size_x, self.chunk_size_y)
 
-        # TODO
+        store.to_raster(self.output().path, transform, projection, numpy.nan, gdal.GDT_Float32,
+                        band_descriptions=[statistic.name for statistic in Statistic],
+                        metadata=self.generate_raster_metadata())
 
-        raster = driver.Create(self.output().path, 4000, 4000, len(Statistic), gdal.GDT_Float32)
-        assert raster
-
-        # TODO
-        raster.SetGeoTransform(transform)
-        raster.SetProjection(projection)
-
-        raster.SetMetadata(self.generate_raster_metadata())
-
-        # statistics = [Statistic.COUNT, Statistic.MIN]
-        statistics = [s for s in Statistic]
-
-        import itertools
-
-        for index, statistic in enumerate(statistics, start=1):
-
-            _log.info("Doing statistic [%s] which is band [%s]", statistic.name, index)
-
-            band = raster.GetRasterBand(index)
-            assert band
-
-            # TODO
-            band.SetNoDataValue(numpy.nan)
-            band.SetDescription(statistic.name)
-
-            for x_offset, y_offset in itertools.product(range(0, 4000, self.chunk_size_x),
-                                                        range(0, 4000, self.chunk_size_y)):
-                filename = os.path.join(self.output_directory,
-                                        self.get_statistic_filename(statistic=statistic,
-                                                                    ulx=x_offset, uly=y_offset,
-                                                                    lrx=(x_offset + self.chunk_size_x),
-                                                                    lry=(y_offset + self.chunk_size_y)))
-
-                _log.info("Processing chunk [%4d|%4d] for [%s] from [%s]", x_offset, y_offset, statistic.name, filename)
-
-                # read the chunk
-                data = numpy.load(filename)
-
-                _log.info("data is [%s]\n[%s]", numpy.shape(data), data)
-                _log.info("Writing it to (%d,%d)", x_offset, y_offset)
-
-                # write the chunk to the TIF at the offset
-                band.WriteArray(data, x_offset, y_offset)
-
-                band.FlushCache()
-
-            band.ComputeStatistics(True)
-            band.FlushCache()
-
-            del band
-
-        raster.FlushCache()
-        del raster
-
-        # TODO delete .npy files?
+        store.remove()
 
     def generate_raster_metadata(self):
         return {
@@ -226,26 +205,11 @@ class WetnessCellTask(CellTask):
             "STATISTICS": " ".join([s.name for s in Statistic])
         }
 
-    def get_statistic_filename(self, statistic, ulx, uly, lrx, lry):
-        from datacube.api.utils import get_satellite_string
-        from datacube.api.workflow import format_date
-
-        # if statistic in [Statistic.PERCENTILE_25, Statistic.PERCENTILE_50, Statistic.PERCENTILE_75,
-        #                  Statistic.PERCENTILE_90, Statistic.PERCENTILE_95]:
-        #     statistic_name = "PERCENTILE"
-        # else:
-        #     statistic_name = statistic.name
-        statistic_name = statistic.name
-
-        filename = "{satellites}_WETNESS_{statistic}_{x:03d}_{y:04d}_{acq_min}_{acq_max}_{ulx:04d}_{uly:04d}_{lrx:04d}_{lry:04d}.npy".format(
-            satellites=get_satellite_string(self.satellites), statistic=statistic_name,
-            x=self.x, y=self.y, acq_min=format_date(self.acq_min), acq_max=format_date(self.acq_max),
-            ulx=ulx, uly=uly, lrx=lrx, lry=lry)
-        return os.path.join(self.output_directory, filename)
-
 
 class WetnessCellChunkTask(CellChunkTask):
 
+    percentile_bins = luigi.IntParameter(default=0)
+
     def requires(self):
 
         if self.csv:
@@ -271,37 +235,35 @@ class WetnessCellChunkTask(CellChunkTask):
 
         return [DatasetType.TCI]
 
-    def get_statistic_filename(self, statistic):
-        from datacube.api.utils import get_satellite_string
-        from datacube.api.workflow import format_date
+    def output(self):
 
-        # if statistic in [Statistic.PERCENTILE_25, Statistic.PERCENTILE_50, Statistic.PERCENTILE_75,
-        #                  Statistic.PERCENTILE_90, Statistic.PERCENTILE_95]:
-        #     statistic_name = "PERCENTILE"
-        # else:
-        #     statistic_name = statistic.name
-        statistic_name = statistic.name
-
-        filename = "{satellites}_WETNESS_{statistic}_{x:03d}_{y:04d}_{acq_min}_{acq_max}_{ulx:04d}_{uly:04d}_{lrx:04d}_{lry:04d}.npy".format(
-            satellites=get_satellite_string(self.satellites), statistic=statistic_name,
-            x=self.x, y=self.y, acq_min=format_date(self.acq_min), acq_max=format_date(self.acq_max),
-            ulx=self.x_offset, uly=self.y_offset,
-            lrx=(self.x_offset + self.chunk_size_x),
-            lry=(self.y_offset + self.chunk_size_y)
-        )
-        return os.path.join(self.output_directory, filename)
+        return CellStoreChunkTarget(self.get_store(), self.x_offset, self.y_offset)
 
-    def output(self):
+    def get_store(self):
 
-        # statistics = [Statistic.COUNT, Statistic.MIN]
-        statistics = [s for s in Statistic]
-        return [luigi.LocalTarget(self.get_statistic_filename(statistic)) for statistic in statistics]
+        return get_statistics_store(self.output_directory, self.satellites, self.x, self.y, self.acq_min,
+                                    self.acq_max, self.chunk_size_x, self.chunk_size_y)
 
     def run(self):
 
-        stack = list()
+        # The moments are accumulated a tile at a time (see StatisticsAccumulator) - the stack is only kept for the
+        # exact percentiles.  With percentile bins the percentiles are approximated from per pixel histograms (see
+        # PercentileAccumulator) instead so memory doesn't grow with the number of tiles.
 
-        for tile in self.get_tiles():
+        x_size, y_size = self.get_window_size()
+
+        tiles = self.get_tiles()
+
+        accumulator = None
+        percentile_accumulator = None
+
+        # The stack is allocated once (when the first tile is read) and filled in place rather than being a list of
+        # the tiles' data copied into an array at the end
+
+        stack = None
+        stack_depth = 0
+
+        for tile in tiles:
 
             # The Tassel Cap dataset is a virtual dataset derived from the NBAR so it's path is actually the NBAR path
 
@@ -317,144 +279,104 @@ class WetnessCellChunkTask(CellChunkTask):
 
             data = read_dataset_data(filename, bands=[TciBands.WETNESS],
                                      x=self.x_offset, y=self.y_offset,
-                                     x_size=self.chunk_size_x, y_size=self.chunk_size_y)
+                                     x_size=x_size, y_size=y_size)
 
             log_mem("After get data")
 
-            # stack.append(data[TciBands.WETNESS])
-            stack.append(data)
+            if accumulator is None:
+                accumulator = StatisticsAccumulator(numpy.shape(data))
 
-            del data
+                if self.percentile_bins:
+                    percentile_accumulator = PercentileAccumulator(numpy.shape(data), WETNESS_MINIMUM, WETNESS_MAXIMUM,
+                                                                   bins=self.percentile_bins)
 
-            log_mem("After adding data to stack and deleting it")
+            accumulator.update(data)
 
-        if len(stack) == 0:
-            return
+            if percentile_accumulator:
+                percentile_accumulator.update(data)
 
-        stack = numpy.array(stack)
-        stack_depth, stack_size_y, stack_size_x = numpy.shape(stack)
+            else:
+                if stack is None:
+                    stack = numpy.empty((len(tiles),) + numpy.shape(data), dtype=data.dtype)
 
-        _log.info("stack depth [%d] x_size [%d] y size [%d]", stack_depth, stack_size_x, stack_size_y)
+                stack[stack_depth] = data
+                stack_depth += 1
 
-        log_mem("Before COUNT")
+            del data
 
-        # COUNT
-        print "COUNT"
-        stack_stat = numpy.empty((stack_size_y, stack_size_x), dtype=numpy.float32)
-        stack_stat.fill(stack_depth)
-        numpy.save(self.get_statistic_filename(Statistic.COUNT), stack_stat)
-        del stack_stat
+            log_mem("After adding data to stack and deleting it")
 
-        log_mem("Before MIN")
+        store = self.get_store()
 
-        # MIN
-        print "MIN"
-        stack_stat = numpy.nanmin(stack, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.MIN), stack_stat)
-        del stack_stat
+        if accumulator is None:
+            for statistic in Statistic:
+                store.write(get_statistic_band(statistic),
+                            numpy.full((y_size, x_size), numpy.nan, dtype=numpy.float32),
+                            self.x_offset, self.y_offset)
 
-        log_mem("Before MAX")
+            store.mark_done(self.x_offset, self.y_offset)
+            return
 
-        # MAX
-        print "MAX"
-        stack_stat = numpy.nanmax(stack, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.MAX), stack_stat)
-        del stack_stat
+        log_mem("Before MOMENTS")
 
-        log_mem("Before MEAN")
+        # COUNT, COUNT_OBSERVED, MIN, MAX, MEAN, SUM, STANDARD_DEVIATION and VARIANCE all at once
+        print "MOMENTS"
+        for statistic, stack_stat in accumulator.get_statistics().iteritems():
+            store.write(get_statistic_band(Statistic[statistic.name]), stack_stat, self.x_offset, self.y_offset)
 
-        # MEAN
-        print "MEAN"
-        stack_stat = numpy.nanmean(stack, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.MEAN), stack_stat)
-        del stack_stat
+        del accumulator
 
-        log_mem("Before SUM")
+        log_mem("Before PERCENTILES")
 
-        # SUM
-        print "SUM"
-        stack_stat = numpy.nansum(stack, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.SUM), stack_stat)
-        del stack_stat
+        print "PERCENTILES"
+        percentiles = [(25, Statistic.PERCENTILE_25), (50, Statistic.PERCENTILE_50), (75, Statistic.PERCENTILE_75),
+                       (90, Statistic.PERCENTILE_90), (95, Statistic.PERCENTILE_95)]
 
-        log_mem("Before STD")
+        if percentile_accumulator:
+            stack_stat = percentile_accumulator.get_percentiles([percentile for percentile, _ in percentiles])
 
-        # STANDARD_DEVIATION
-        print "STD"
-        stack_stat = numpy.nanstd(stack, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.STANDARD_DEVIATION), stack_stat)
-        del stack_stat
+            del percentile_accumulator
 
-        log_mem("Before VAR")
+        else:
+            stack_size_y, stack_size_x = numpy.shape(stack)[1:]
 
-        # VARIANCE
-        print "VAR"
-        stack_stat = numpy.nanvar(stack, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.VARIANCE), stack_stat)
-        del stack_stat
+            _log.info("stack depth [%d] x_size [%d] y size [%d]", stack_depth, stack_size_x, stack_size_y)
 
-        # log_mem("Before PERCENTILES")
-        #
-        # # PERCENTILES
-        # print "PERCENTILES"
-        # stack_stat = numpy.nanpercentile(stack, [25, 50, 75, 90, 95], axis=0)
-        #
-        # for index, statistic in enumerate([Statistic.PERCENTILE_25, Statistic.PERCENTILE_50,
-        #                                    Statistic.PERCENTILE_75, Statistic.PERCENTILE_90,
-        #                                    Statistic.PERCENTILE_95]):
-        #     numpy.save(self.get_statistic_filename(statistic), stack_stat[index])
-        #
-        # del stack_stat
-
-        log_mem("Before P25")
-
-        # PERCENTILE_25
-        print "P25"
-        stack_stat = numpy.nanpercentile(stack, 25, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.PERCENTILE_25), stack_stat)
-        del stack_stat
+            # All of them from a single partition of the stack
 
-        log_mem("Before P50")
+            stack_stat = calculate_percentiles(stack[:stack_depth], [percentile for percentile, _ in percentiles])
 
-        # PERCENTILE_50
-        print "P50"
-        stack_stat = numpy.nanpercentile(stack, 50, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.PERCENTILE_50), stack_stat)
-        del stack_stat
+            del stack
 
-        log_mem("Before P75")
+        for index, (_, statistic) in enumerate(percentiles):
+            store.write(get_statistic_band(statistic), stack_stat[index], self.x_offset, self.y_offset)
 
-        # PERCENTILE_75
-        print "P75"
-        stack_stat = numpy.nanpercentile(stack, 75, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.PERCENTILE_75), stack_stat)
         del stack_stat
 
-        log_mem("Before P90")
+        store.mark_done(self.x_offset, self.y_offset)
 
-        # PERCENTILE_90
-        print "P90"
-        stack_stat = numpy.nanpercentile(stack, 90, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.PERCENTILE_90), stack_stat)
-        del stack_stat
+        log_mem("DONE")
 
-        log_mem("Before P95")
 
-        # PERCENTILE_95
-        print "P95"
-        stack_stat = numpy.nanpercentile(stack, 95, axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.PERCENTILE_95), stack_stat)
-        del stack_stat
+def get_statistic_band(statistic):
+    return list(Statistic).index(statistic) + 1
 
-        log_mem("Before OBSERVED COUNT")
 
-        # COUNT OBSERVED - note the copy=False is modifying the array so this is done last
-        print "COUNT OBSERVED"
-        stack_stat = numpy.ma.masked_invalid(stack, copy=False).count(axis=0)
-        numpy.save(self.get_statistic_filename(Statistic.COUNT_OBSERVED), stack_stat)
-        del stack_stat
+def get_statistics_store(output_directory, satellites, x, y, acq_min, acq_max, chunk_size_x, chunk_size_y):
 
-        log_mem("DONE")
+    """
+    The store (one float32 band per statistic) the chunk tasks of a cell write their statistics into
+    """
+
+    from datacube.api.utils import get_satellite_string
+    from datacube.api.workflow import format_date
+
+    filename = "{satellites}_WETNESS_STATISTICS_{x:03d}_{y:04d}_{acq_min}_{acq_max}.dat".format(
+        satellites=get_satellite_string(satellites), x=x, y=y,
+        acq_min=format_date(acq_min), acq_max=format_date(acq_max))
+
+    return CellStore(os.path.join(output_directory, filename), count=len(Statistic), dtype=numpy.float32,
+                     chunk_size_x=chunk_size_x, chunk_size_y=chunk_size_y)
 
 
 def map_filename_nbar_to_wetness(filename):
@@ -44,6 +44,7 @@ setup(name="agdc-api",
           "source/main/python/datacube/api/tool/retrieve_dataset.py",
           "source/main/python/datacube/api/tool/retrieve_dataset_stack.py",
           "source/main/python/datacube/api/tool/retrieve_aoi_time_series.py",
+          "source/main/python/datacube/api/tool/export_tile_index.py",
 
           # Workflows
           "source/main/python/datacube/api/workflow/band_stack.py"],
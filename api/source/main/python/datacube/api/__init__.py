@@ -24,7 +24,7 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 # ===============================================================================
-from datacube.api.query import Month
+from datacube.api.query import Month, FileFormat
 
 __author__ = "Simon Oldfield"
 
@@ -192,6 +192,12 @@ def output_format_arg(s):
     raise argparse.ArgumentTypeError("{0} is not a supported output format".format(s))
 
 
+def file_format_arg(s):
+    if s in [f.name for f in FileFormat]:
+        return FileFormat[s]
+    raise argparse.ArgumentTypeError("{0} is not a supported file format".format(s))
+
+
 
 
 
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import logging
+from datacube.api.utils import open_dataset
+
+
+_log = logging.getLogger(__name__)
+
+
+# Size of a cell in pixels
+
+CELL_SIZE_X = 4000
+CELL_SIZE_Y = 4000
+
+
+def get_block_size(path):
+
+    """
+    Return the internal block (tile or strip) size of the (first band of the) raster
+
+    :param path: The path to the raster file
+    :type path: str
+    :return: The (x, y) block size
+    :rtype: (int, int)
+    """
+
+    raster = open_dataset(path)
+
+    block_size = raster.GetRasterBand(1).GetBlockSize()
+
+    del raster
+
+    return block_size[0], block_size[1]
+
+
+def snap_to_block(size, block, extent):
+
+    """
+    Snap a chunk size in one dimension so that chunks don't straddle blocks
+
+    Sizes covering the whole raster are left as they are.  Other sizes bigger than a block are rounded down to a whole
+    number of blocks and sizes smaller than a block are rounded up to a whole block (reading part of a block still
+    means decoding all of it).
+
+    :param size: The requested chunk size
+    :type size: int
+    :param block: The block size
+    :type block: int
+    :param extent: The size of the raster
+    :type extent: int
+    :rtype: int
+    """
+
+    size = max(1, min(size, extent))
+
+    if block >= extent or size == extent:
+        return size
+
+    if size >= block:
+        return (size // block) * block
+
+    return block
+
+
+def plan_chunk_size(block_size, chunk_size_x=None, chunk_size_y=None, memory=None, pixel_bytes=None,
+                    width=CELL_SIZE_X, height=CELL_SIZE_Y):
+
+    """
+    Return a chunk size aligned to the raster's block structure
+
+    The number of pixels per chunk is the requested chunk size (the whole cell if not given), capped at memory /
+    pixel_bytes if a memory budget is given.  pixel_bytes is the memory needed per pixel of the chunk, e.g. the number
+    of tiles in the stack times the number of bands times the size of the data type.
+
+    For stripped (or single block) rasters chunks are whole rows - the cell width by the number of rows closest to the
+    pixel budget, rounded to a whole number of strips - so a 100 x 100 request reads 4000 x 3 (1 row strips) rather
+    than 100 x 100 pixels.  Otherwise the X size is snapped to the block width and the Y size fills the rest of the
+    pixel budget, snapped to the block height.  Chunks are never smaller than a block (so may be a little over the
+    memory budget).  A chunk size that differs from the one requested is logged.
+
+    The block size rarely divides the cell so the last chunk in each dimension is generally smaller - use
+    get_chunk_windows() to get the windows clipped to the cell.
+
+    :param block_size: The (x, y) block size of the rasters
+    :type block_size: (int, int)
+    :param chunk_size_x: The requested X chunk size
+    :type chunk_size_x: int
+    :param chunk_size_y: The requested Y chunk size
+    :type chunk_size_y: int
+    :param memory: Optional memory budget for a chunk in bytes
+    :type memory: int
+    :param pixel_bytes: The bytes needed per chunk pixel (required with memory)
+    :type pixel_bytes: int
+    :param width: The width of the raster
+    :type width: int
+    :param height: The height of the raster
+    :type height: int
+    :return: The (x, y) chunk size
+    :rtype: (int, int)
+    """
+
+    block_x, block_y = block_size
+
+    chunk_size_x = chunk_size_x or width
+    chunk_size_y = chunk_size_y or height
+
+    pixels = chunk_size_x * chunk_size_y
+
+    if memory and pixel_bytes:
+        pixels = min(pixels, max(1, memory // pixel_bytes))
+
+    if block_x >= width:
+        x_size = width
+
+        if block_y >= height:
+            y_size = height
+
+        else:
+            strips = int(round(float(pixels) / (width * block_y)))
+            y_size = min(max(1, strips) * block_y, height)
+
+    else:
+        x_size = snap_to_block(min(chunk_size_x, pixels), block_x, width)
+        y_size = snap_to_block(max(1, pixels // x_size), block_y, height)
+
+    if (x_size, y_size) != (chunk_size_x, chunk_size_y):
+        _log.info("Adjusted chunk size from requested [%d x %d] to [%d x %d] (%d pixels) for block size [%d x %d]",
+                  chunk_size_x, chunk_size_y, x_size, y_size, x_size * y_size, block_x, block_y)
+
+    return x_size, y_size
+
+
+def plan_chunk_size_for_dataset(dataset, chunk_size_x=None, chunk_size_y=None, memory=None, pixel_bytes=None):
+
+    """
+    Return a chunk size aligned to the block structure of the dataset
+
+    :param dataset: A dataset representative of the ones to be processed
+    :type dataset: datacube.api.model.DatasetTile
+    :type chunk_size_x: int
+    :type chunk_size_y: int
+    :type memory: int
+    :type pixel_bytes: int
+    :return: The (x, y) chunk size
+    :rtype: (int, int)
+    """
+
+    return plan_chunk_size(get_block_size(dataset.path), chunk_size_x=chunk_size_x, chunk_size_y=chunk_size_y,
+                           memory=memory, pixel_bytes=pixel_bytes)
+
+
+def plan_chunk_size_for_tiles(tiles, dataset_type, chunk_size_x=None, chunk_size_y=None, memory=None,
+                              pixel_bytes=None):
+
+    """
+    Return a chunk size aligned to the block structure of the tiles
+
+    The first tile with the dataset type is taken as representative.  If there isn't one the requested chunk size is
+    returned unchanged.
+
+    :param tiles: The tiles
+    :type tiles: collections.Iterable[datacube.api.model.Tile]
+    :type dataset_type: datacube.api.model.DatasetType
+    :type chunk_size_x: int
+    :type chunk_size_y: int
+    :type memory: int
+    :type pixel_bytes: int
+    :return: The (x, y) chunk size
+    :rtype: (int, int)
+    """
+
+    for tile in tiles:
+        if dataset_type in tile.datasets:
+            return plan_chunk_size_for_dataset(tile.datasets[dataset_type],
+                                               chunk_size_x=chunk_size_x, chunk_size_y=chunk_size_y,
+                                               memory=memory, pixel_bytes=pixel_bytes)
+
+    _log.info("No [%s] tiles to align the chunk size to - using requested chunk size", dataset_type.name)
+
+    return chunk_size_x, chunk_size_y
+
+
+def get_chunks(chunk_size_x, chunk_size_y, width=CELL_SIZE_X, height=CELL_SIZE_Y):
+
+    """
+    Return the offsets of the chunks covering the raster
+
+    Note that the last chunk in each dimension may extend past the raster - see get_chunk_windows().
+
+    :type chunk_size_x: int
+    :type chunk_size_y: int
+    :type width: int
+    :type height: int
+    :return: The (x, y) offsets of the chunks
+    :rtype: list[(int, int)]
+    """
+
+    import itertools
+
+    return list(itertools.product(range(0, width, chunk_size_x), range(0, height, chunk_size_y)))
+
+
+def get_chunk_window_size(x, y, chunk_size_x, chunk_size_y, width=CELL_SIZE_X, height=CELL_SIZE_Y):
+
+    """
+    Return the size of the window of the chunk at (x, y) - i.e. the chunk size clipped to the raster
+
+    :type x: int
+    :type y: int
+    :type chunk_size_x: int
+    :type chunk_size_y: int
+    :type width: int
+    :type height: int
+    :return: The (x, y) size of the window
+    :rtype: (int, int)
+    """
+
+    return min(chunk_size_x, width - x), min(chunk_size_y, height - y)
+
+
+def get_chunk_windows(chunk_size_x, chunk_size_y, width=CELL_SIZE_X, height=CELL_SIZE_Y):
+
+    """
+    Return the windows of the chunks covering the raster clipped to the raster
+
+    :type chunk_size_x: int
+    :type chunk_size_y: int
+    :type width: int
+    :type height: int
+    :return: The (x, y, x size, y size) windows of the chunks
+    :rtype: list[(int, int, int, int)]
+    """
+
+    return [(x, y) + get_chunk_window_size(x, y, chunk_size_x, chunk_size_y, width=width, height=height)
+            for x, y in get_chunks(chunk_size_x, chunk_size_y, width=width, height=height)]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import logging
+import numpy
+from datacube.api.utils import NDV
+from enum import Enum
+
+
+_log = logging.getLogger(__name__)
+
+
+class CompositeMethod(Enum):
+    __order__ = "FIRST LAST MIN MAX"
+
+    FIRST = "FIRST"     # The first valid observation (e.g. youngest if the observations are newest first)
+    LAST = "LAST"       # The last valid observation
+    MIN = "MIN"         # The observation with the smallest key value (ties go to the later observation)
+    MAX = "MAX"         # The observation with the largest key value (ties go to the later observation)
+
+
+def get_valid(data, ndv=NDV):
+
+    valid = data != ndv
+
+    if data.dtype.kind == "f":
+        numpy.logical_and(valid, numpy.isfinite(data), out=valid)
+
+    return valid
+
+
+def calculate_composite_index(key, method, ndv=NDV):
+
+    """
+    Return the index (along the time axis) of the observation selected for each pixel of a (time, ...) stack
+
+    :param key: The stack of the values used to select the observations (time, y, x)
+    :type key: numpy.ndarray
+    :param method: The selection method
+    :type method: CompositeMethod
+    :param ndv: The no data value of the key
+    :return: The selected index of each pixel (-1 where there are no valid observations)
+    :rtype: numpy.ndarray
+    """
+
+    key = numpy.asarray(key)
+
+    times = key.shape[0]
+
+    valid = get_valid(key, ndv)
+
+    if method == CompositeMethod.FIRST:
+        index = numpy.argmax(valid, axis=0)
+
+    elif method == CompositeMethod.LAST:
+        index = times - 1 - numpy.argmax(valid[::-1], axis=0)
+
+    elif method in [CompositeMethod.MIN, CompositeMethod.MAX]:
+
+        # Search the reversed stack so that ties go to the later observation
+
+        if method == CompositeMethod.MIN:
+            values = numpy.where(valid, key, numpy.inf)[::-1]
+            index = times - 1 - numpy.argmin(values, axis=0)
+        else:
+            values = numpy.where(valid, key, -numpy.inf)[::-1]
+            index = times - 1 - numpy.argmax(values, axis=0)
+
+    else:
+        raise ValueError("Unsupported composite method [{method}]".format(method=method))
+
+    index[~numpy.any(valid, axis=0)] = -1
+
+    return index
+
+
+def gather(stack, index, ndv=NDV):
+
+    """
+    Return the selected observation of each pixel of a (time, ...) stack
+
+    :param stack: The stack (time, y, x) or (time, band, y, x)
+    :type stack: numpy.ndarray
+    :param index: The index of the selected observation of each pixel (-1 for none) e.g. from calculate_composite_index
+    :type index: numpy.ndarray
+    :param ndv: The value for pixels with no selected observation
+    :return: The composite (y, x) or (band, y, x)
+    :rtype: numpy.ndarray
+    """
+
+    stack = numpy.asarray(stack)
+
+    pixels = numpy.arange(index.size)
+    flat = index.ravel()
+
+    data = stack.reshape(stack.shape[:-index.ndim] + (-1,))
+
+    # One fancy index take for all the bands
+
+    out = data[numpy.maximum(flat, 0), ..., pixels]
+
+    if out.ndim > 1:
+        out = out.T
+
+    out = numpy.array(out)
+    out[..., flat < 0] = ndv
+
+    return out.reshape(stack.shape[1:])
+
+
+def take_provenance(values, index, ndv=NDV, dtype=numpy.int32):
+
+    """
+    Return the per observation values (e.g. satellite or acquisition date) of the selected observation of each pixel
+
+    :param values: The value for each observation
+    :type values: list
+    :param index: The index of the selected observation of each pixel (-1 for none)
+    :type index: numpy.ndarray
+    :param ndv: The value for pixels with no selected observation
+    :param dtype: The data type of the returned array
+    :rtype: numpy.ndarray
+    """
+
+    out = numpy.take(numpy.asarray(values, dtype=dtype), numpy.maximum(index, 0))
+    out[index < 0] = ndv
+
+    return out
+
+
+class Compositor(object):
+
+    """
+    Composite observations a tile (or chunk) at a time
+
+    Each update() works out the pixels where the new observation is selected (once) and copies them into all the
+    composite layers.  The index of the observation selected for each pixel is kept so that provenance layers
+    (satellite, date, ...) can be produced at the end with take_provenance() rather than being updated per observation.
+
+    For CompositeMethod.FIRST the caller can stop reading observations as soon as is_complete().
+
+    Usage::
+
+        compositor = Compositor(CompositeMethod.FIRST, key=Ls57Arg25Bands.RED)
+
+        for tile, data in read_as_generator(tiles, read):
+            compositor.update(data)
+
+            if compositor.is_complete():
+                break
+
+        satellite = take_provenance([satellite_of(tile) for tile in tiles], compositor.index)
+    """
+
+    def __init__(self, method, key, ndv=NDV):
+
+        """
+        :param method: The selection method
+        :type method: CompositeMethod
+        :param key: The layer used to select the observations (or None to pass the key to update())
+        :param ndv: The no data value
+        """
+
+        self.method = method
+        self.key = key
+        self.ndv = ndv
+
+        self.observations = 0
+
+        self.index = None
+        self.best = None
+        self.layers = None
+
+    def update(self, data, key=None):
+
+        """
+        Add an observation
+
+        :param data: The layers of the observation e.g. band/data
+        :type data: dict
+        :param key: The values used to select the observation (defaults to data[key] for the compositor's key)
+        :type key: numpy.ndarray
+        """
+
+        if key is None:
+            key = data[self.key]
+
+        valid = get_valid(key, self.ndv)
+
+        if self.index is None:
+            self.index = numpy.empty(numpy.shape(key), dtype=numpy.int32)
+            self.index.fill(-1)
+
+            self.layers = dict()
+
+            for name, layer in data.iteritems():
+                self.layers[name] = numpy.empty_like(layer)
+                self.layers[name].fill(self.ndv)
+
+            if self.method in [CompositeMethod.MIN, CompositeMethod.MAX]:
+                self.best = numpy.empty_like(key)
+
+        empty = self.index < 0
+
+        if self.method == CompositeMethod.FIRST:
+            selected = numpy.logical_and(valid, empty)
+
+        elif self.method == CompositeMethod.LAST:
+            selected = valid
+
+        elif self.method == CompositeMethod.MIN:
+            selected = numpy.logical_and(valid, numpy.logical_or(empty, key <= self.best))
+
+        elif self.method == CompositeMethod.MAX:
+            selected = numpy.logical_and(valid, numpy.logical_or(empty, key >= self.best))
+
+        else:
+            raise ValueError("Unsupported composite method [{method}]".format(method=self.method))
+
+        if self.best is not None:
+            numpy.copyto(self.best, key, where=selected)
+
+        for name, layer in self.layers.iteritems():
+            numpy.copyto(layer, data[name], where=selected)
+
+        self.index[selected] = self.observations
+
+        self.observations += 1
+
+    def is_complete(self):
+
+        """
+        Whether every pixel has an observation selected (further FIRST observations won't change anything)
+        """
+
+        return self.index is not None and not numpy.any(self.index < 0)
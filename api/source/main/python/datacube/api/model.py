@@ -32,8 +32,10 @@ __author__ = "Simon Oldfield"
 
 
 import logging
+from collections import OrderedDict
 from enum import Enum
 import os
+import threading
 
 
 _log = logging.getLogger(__name__)
@@ -197,32 +199,49 @@ dataset_type_filesystem = []
 dataset_type_derived_nbar = [DatasetType.NDVI, DatasetType.EVI, DatasetType.NBR, DatasetType.TCI]  # TCI, SAVI, etc...
 
 
-class DatasetTile:
+class DatasetTile(object):
 
-    #: :type: Satellite
-    satellite = None
-    #: :type: DatasetType
-    dataset_type = None
-    #: :type: str
-    path = None
-    #: :type: enum
-    bands = None
+    __slots__ = ("satellite", "dataset_type", "path")
 
     def __init__(self, satellite_id, type_id, path):
+        #: :type: Satellite
         self.satellite = satellite_id and Satellite[satellite_id] or None
+        #: :type: DatasetType
         self.dataset_type = DatasetType[type_id]
+        #: :type: str
         self.path = warp_file_paths(path)
 
+    @property
+    def bands(self):
+
+        """
+        The bands of the dataset (looked up when needed rather than stored on every dataset)
+
+        :rtype: enum
+        """
+
         # TODO ???
         if (self.dataset_type, self.satellite) in BANDS:
-            self.bands = BANDS[(self.dataset_type, self.satellite)]
+            return BANDS[(self.dataset_type, self.satellite)]
         elif (self.dataset_type, None) in BANDS:
-            self.bands = BANDS[(self.dataset_type, None)]
+            return BANDS[(self.dataset_type, None)]
+
+        return None
+
+    def __getstate__(self):
+        return self.satellite and self.satellite.value, self.dataset_type.value, self.path
+
+    def __setstate__(self, state):
+        satellite_id, type_id, path = state
+
+        self.satellite = satellite_id and Satellite[satellite_id] or None
+        self.dataset_type = DatasetType[type_id]
+        self.path = path
 
     @staticmethod
     def from_db_array(satellite_id, datasets):
 
-        out = {}
+        out = TileDatasets()
 
         for dataset in datasets:
             dst = DatasetTile(satellite_id, dataset[0], dataset[1])
@@ -232,11 +251,10 @@ class DatasetTile:
 
         # Construct a WOFS dataset based on the NBAR dataset
         # If one exists on the filesystem then add it otherwise (None is returned by the make_wofs_dataset) we don't
+        #
+        # This is only done when the WOFS dataset is asked for (or all the datasets are listed)
 
-        dst = make_wofs_dataset(satellite_id, out[DatasetType.ARG25])
-
-        if dst:
-            out[DatasetType.WATER] = dst
+        out.set_wofs_source(satellite_id, out[DatasetType.ARG25])
 
         return out
 
@@ -286,20 +304,115 @@ class DatasetTile:
         return out
 
 
+class TileDatasets(dict):
+
+    """
+    The datasets of a tile keyed by dataset type
+
+    The WOFS dataset (which isn't in the database) is only looked for on the filesystem the first time it is asked for
+    - either directly or by listing the datasets - rather than when the tile is created.
+    """
+
+    __slots__ = ("_wofs_source",)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._wofs_source = None
+
+    def set_wofs_source(self, satellite_id, nbar):
+        self._wofs_source = (satellite_id, nbar)
+
+    def resolve(self):
+
+        if self._wofs_source:
+
+            satellite_id, nbar = self._wofs_source
+            self._wofs_source = None
+
+            dst = make_wofs_dataset(satellite_id, nbar)
+
+            if dst:
+                dict.__setitem__(self, DatasetType.WATER, dst)
+
+    def __contains__(self, key):
+        if key == DatasetType.WATER:
+            self.resolve()
+        return dict.__contains__(self, key)
+
+    def __getitem__(self, key):
+        if key == DatasetType.WATER:
+            self.resolve()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key == DatasetType.WATER:
+            self.resolve()
+        return dict.get(self, key, default)
+
+    def has_key(self, key):
+        return self.__contains__(key)
+
+    def __iter__(self):
+        self.resolve()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.resolve()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.resolve()
+        return dict.keys(self)
+
+    def values(self):
+        self.resolve()
+        return dict.values(self)
+
+    def items(self):
+        self.resolve()
+        return dict.items(self)
+
+    def iterkeys(self):
+        self.resolve()
+        return dict.iterkeys(self)
+
+    def itervalues(self):
+        self.resolve()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self.resolve()
+        return dict.iteritems(self)
+
+    def __reduce__(self):
+        self.resolve()
+        return dict, (dict(self),)
+
+
 # TODO use Cell in Tile - probably
 
-class Cell:
-    #: :type: int
-    x = None
-    #: :type: int
-    y = None
-    #: :type: (int, int)
-    xy = None
+class Cell(object):
+
+    __slots__ = ("x", "y")
 
     def __init__(self, x_index, y_index):
+        #: :type: int
         self.x = x_index
+        #: :type: int
         self.y = y_index
-        self.xy = (self.x, self.y)  # TODO
+
+    @property
+    def xy(self):
+        """
+        :rtype: (int, int)
+        """
+        return self.x, self.y  # TODO
+
+    def __getstate__(self):
+        return self.x, self.y
+
+    def __setstate__(self, state):
+        self.x, self.y = state
 
     @staticmethod
     def from_csv_record(record):
@@ -311,38 +424,44 @@ class Cell:
         return Cell(x_index=record["x_index"], y_index=record["y_index"])
 
 
-class Tile:
-    #: :type: int
-    acquisition_id = None
-    #: :type: int
-    x = None
-    #: :type: int
-    y = None
-    #: :type: (int, int)
-    xy = None
-    #: :type: datetime
-    start_datetime = None
-    #: :type: datetime
-    end_datetime = None
-    #: :type: int
-    end_datetime_year = None
-    #: :type: int
-    end_datetime_month = None
-    #: :type: str
-    datasets = None
+class Tile(object):
+
+    __slots__ = ("acquisition_id", "x", "y", "start_datetime", "end_datetime", "end_datetime_year",
+                 "end_datetime_month", "datasets")
 
     def __init__(self, acquisition_id, x_index, y_index,
                  start_datetime, end_datetime, end_datetime_year, end_datetime_month, datasets):
+        #: :type: int
         self.acquisition_id = acquisition_id
+        #: :type: int
         self.x = x_index
+        #: :type: int
         self.y = y_index
-        self.xy = (self.x, self.y)  # TODO
+        #: :type: datetime
         self.start_datetime = start_datetime
+        #: :type: datetime
         self.end_datetime = end_datetime
+        #: :type: int
         self.end_datetime_year = end_datetime_year and int(end_datetime_year) or None
+        #: :type: int
         self.end_datetime_month = end_datetime_month and int(end_datetime_month) or None
+        #: :type: dict[DatasetType, DatasetTile]
         self.datasets = datasets
 
+    @property
+    def xy(self):
+        """
+        :rtype: (int, int)
+        """
+        return self.x, self.y  # TODO
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in Tile.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(Tile.__slots__, state):
+            setattr(self, name, value)
+
     @staticmethod
     def from_csv_record(record):
         return Tile(
@@ -437,6 +556,10 @@ def parse_datetime(s):
 
 
 # TODO TEMPORARY UNTIL WOFS IS AVAILABLE AS INGESTED DATA
+
+WOFS_EXTENTS_DIRECTORY = "/g/data/fk4/wofs/water_f7q/extents"
+
+
 def make_wofs_dataset(satellite_id, nbar):
     fields = os.path.basename(nbar.path).split("_")
 
@@ -475,12 +598,57 @@ def make_wofs_dataset(satellite_id, nbar):
         dt = fields[5].replace(".vrt", "").replace(".tif", "")
 
     # path = "/g/data/u46/wofs/water_f7q/extents/{x:03d}_{y:04d}/{satellite}_{sensor}_WATER_{x:03d}_{y:04d}_{date}.tif".format(x=x, y=y, satellite=satellite, sensor=sensor, date=dt)
-    path = "/g/data/fk4/wofs/water_f7q/extents/{x:03d}_{y:04d}/{satellite}_{sensor}_WATER_{x:03d}_{y:04d}_{date}.tif".format(x=x, y=y, satellite=satellite, sensor=sensor, date=dt)
+    path = "{extents}/{x:03d}_{y:04d}/{satellite}_{sensor}_WATER_{x:03d}_{y:04d}_{date}.tif".format(extents=WOFS_EXTENTS_DIRECTORY, x=x, y=y, satellite=satellite, sensor=sensor, date=dt)
     # path = "/g/data/u46/sjo/geoserver/wofs_f7q/extents/{x:03d}_{y:04d}/{satellite}_{sensor}_WATER_{x:03d}_{y:04d}_{date}.tif".format(x=x, y=y, satellite=satellite, sensor=sensor, date=dt)
 
     path = warp_file_paths(path)
 
-    if os.path.isfile(path):
+    if wofs_file_exists(path):
         return DatasetTile(satellite, DatasetType.WATER.value, path)
 
     return None
+
+
+# Contents of the WOFS extent directories (one per cell) - listed once rather than checking for each file in turn.
+# Only the most recently used WOFS_DIRECTORY_LISTINGS_SIZE are kept (in least to most recently used order).
+
+WOFS_DIRECTORY_LISTINGS_SIZE = 64
+
+_wofs_directory_listings = OrderedDict()
+_wofs_directory_listings_lock = threading.Lock()
+
+
+def wofs_file_exists(path):
+
+    directory, filename = os.path.split(path)
+
+    with _wofs_directory_listings_lock:
+        listing = _wofs_directory_listings.pop(directory, None)
+
+        if listing is not None:
+            _wofs_directory_listings[directory] = listing
+
+    if listing is None:
+        try:
+            listing = frozenset(os.listdir(directory))
+
+        except OSError:
+            listing = frozenset()
+
+        with _wofs_directory_listings_lock:
+            _wofs_directory_listings[directory] = listing
+
+            while len(_wofs_directory_listings) > WOFS_DIRECTORY_LISTINGS_SIZE:
+                _wofs_directory_listings.popitem(last=False)
+
+    return filename in listing
+
+
+def clear_wofs_directory_listings():
+
+    """
+    Forget the cached WOFS extent directory listings (e.g. if new WOFS extents have been created)
+    """
+
+    with _wofs_directory_listings_lock:
+        _wofs_directory_listings.clear()
@@ -31,15 +31,24 @@
 __author__ = "Simon Oldfield"
 
 
+import cPickle
+import csv
+import hashlib
 import logging
 import psycopg2
 import psycopg2.extras
+import itertools
+import numpy
 import sys
 import os
-from collections import namedtuple
-from datacube.api.utils import extract_feature_geometry_wkb
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from datacube.api.utils import extract_feature_geometry_wkb, lazy_mogrify, log_timing
 from datacube.config import Config
-from datacube.api.model import Tile, Cell, DatasetType, Satellite
+from datacube.api.model import Tile, Cell, DatasetTile, DatasetType, Satellite
 from datetime import date
 from enum import Enum
 
@@ -125,6 +134,13 @@ class SortType(Enum):
     DESC = "DESC"
 
 
+class FileFormat(Enum):
+    __order__ = "CSV NPZ"
+
+    CSV = "CSV"
+    NPZ = "NPZ"
+
+
 def print_tile(tile):
     _log.debug("id=%7d x=%3d y=%3d start=[%s] end=[%s] year=[%4d] month=[%2d] datasets=[%s]",
                tile.acquisition_id, tile.x, tile.y,
@@ -133,42 +149,719 @@ def print_tile(tile):
                ",".join("|".join([ds.type_id, ds.path]) for ds in tile.datasets))
 
 
-def connect_to_db(config=None):
+_default_config = None
+
+
+def get_default_config():
+
+    """
+    Return the default configuration - read ONCE per process from $HOME/.datacube/config
+
+    :return: Configuration
+    :rtype: datacube.config.Config
+    """
+
+    global _default_config
+
+    if not _default_config:
+        _default_config = Config(os.path.expandvars("$HOME/.datacube/config"))
+        _log.debug(_default_config.to_str())
+
+    return _default_config
+
+
+def build_connection_string(config):
+
+    """
+    Build the psycopg2 connection string for the AGDC DB
+
+    :param config: Configuration
+    :type config: datacube.config.Config
+
+    :return: The connection string
+    :rtype: str
+    """
+
+    connection_string = ""
+
+    if config.get_db_host():
+        connection_string += "host={host}".format(host=config.get_db_host())
+
+    if config.get_db_port():
+        connection_string += " port={port}".format(port=config.get_db_port())
+
+    connection_string += " dbname={database} user={user} password={password}".format(database=config.get_db_database(),
+                                                                                     user=config.get_db_username(),
+                                                                                     password=config.get_db_password())
+
+    return connection_string
+
+
+def prepare_connection(connection):
+
+    """
+    Perform the once per connection (session) setup
+
+    .. note::
+        The search path is committed so that it survives the rollback done when a connection is returned to the pool
+
+    :param connection: DB connection
+    :type connection: psycopg2.connection
+    """
+
+    cursor = connection.cursor()
+    cursor.execute("set search_path to public, {schema}".format(schema="gis, topology, ztmp"))
+    cursor.close()
+
+    connection.commit()
+
+
+def connect_to_db(config=None):
+
+    """
+    Connect to the AGDC DB
+
+    .. note::
+        This opens a NEW connection which the caller is responsible for closing.
+        Use datacube.api.query.borrow_connection() to get a connection from the connection pool instead.
+
+    :param config: Configuration
+    :type config: datacube.config.Config
+
+    :return: DB connection and cursor
+    :rtype: (psycopg2.connection, psycopg2.cursor)
+    """
+
+    if not config:
+        config = get_default_config()
+
+    connection = psycopg2.connect(build_connection_string(config))
+    prepare_connection(connection)
+
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+    return connection, cursor
+
+
+class ConnectionPool(object):
+
+    """
+    A thread safe pool of prepared DB connections
+
+    Connections are created on demand - the pool never blocks - and at most size idle connections are retained.
+    Connections that have been idle for more than idle_timeout seconds are closed.
+
+    The pool is fork safe in that a pool used in a process other than the one that created it discards (WITHOUT
+    closing them as the sockets are shared with the parent) the connections it inherited.
+    """
+
+    def __init__(self, connection_string, size, idle_timeout, connection_factory=None):
+
+        """
+        :param connection_string: The psycopg2 connection string
+        :type connection_string: str
+        :param size: Maximum number of idle connections retained
+        :type size: int
+        :param idle_timeout: Seconds after which an idle connection is closed (0 or None to keep them)
+        :type idle_timeout: float
+        :param connection_factory: Function to open a connection given the connection string (default
+            psycopg2.connect)
+        """
+
+        self.connection_string = connection_string
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connection_factory = connection_factory or psycopg2.connect
+
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+        #: :type: list[(psycopg2.connection, float)]
+        self._idle = list()
+
+    def _check_pid(self):
+
+        # Must be called with the lock held
+
+        if self._pid != os.getpid():
+            _log.debug("Process has forked - discarding [%d] inherited connections", len(self._idle))
+            self._idle = list()
+            self._pid = os.getpid()
+
+    def _prune(self, now):
+
+        # Must be called with the lock held - returns the expired connections to be closed outside the lock
+
+        expired = [connection for connection, last_used in self._idle
+                   if connection.closed or (self.idle_timeout and now - last_used > self.idle_timeout)]
+
+        self._idle = [(connection, last_used) for connection, last_used in self._idle if connection not in expired]
+
+        return expired
+
+    def get_connection(self):
+
+        """
+        Borrow a connection from the pool - opening a new one if there are no idle connections
+
+        :return: DB connection
+        :rtype: psycopg2.connection
+        """
+
+        connection = None
+
+        with self._lock:
+            self._check_pid()
+            expired = self._prune(time.time())
+
+            if self._idle:
+                connection, _ = self._idle.pop()
+
+        for c in expired:
+            close_quietly(c)
+
+        if not connection:
+            _log.debug("Opening new pooled connection")
+            connection = self.connection_factory(self.connection_string)
+            prepare_connection(connection)
+
+        return connection
+
+    def put_connection(self, connection):
+
+        """
+        Return a connection to the pool
+
+        :param connection: DB connection
+        :type connection: psycopg2.connection
+        """
+
+        if connection.closed:
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # Borrowed in the parent process - the socket isn't ours to use or to close
+                return
+
+        try:
+            connection.rollback()
+
+        except psycopg2.Error as e:
+            _log.debug("Discarding broken pooled connection [%s]", e)
+            close_quietly(connection)
+            return
+
+        with self._lock:
+            self._check_pid()
+            expired = self._prune(time.time())
+
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.time()))
+            else:
+                expired.append(connection)
+
+        for c in expired:
+            close_quietly(c)
+
+    def reset(self):
+
+        """
+        Discard all idle connections WITHOUT closing them - for use in a freshly forked child process
+        """
+
+        with self._lock:
+            self._idle = list()
+            self._pid = os.getpid()
+
+    def close_all(self):
+
+        """
+        Close all idle connections
+        """
+
+        with self._lock:
+            self._check_pid()
+            idle, self._idle = self._idle, list()
+
+        for connection, _ in idle:
+            close_quietly(connection)
+
+
+def close_quietly(connection):
+
+    try:
+        connection.close()
+
+    except psycopg2.Error as e:
+        _log.debug("Ignoring error closing connection [%s]", e)
+
+
+_connection_pools = dict()
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(config=None):
+
+    """
+    Return the process wide connection pool for the given configuration
+
+    :param config: Configuration
+    :type config: datacube.config.Config
+
+    :return: The connection pool
+    :rtype: datacube.api.query.ConnectionPool
+    """
+
+    if not config:
+        config = get_default_config()
+
+    connection_string = build_connection_string(config)
+
+    with _connection_pools_lock:
+
+        if connection_string not in _connection_pools:
+            _connection_pools[connection_string] = ConnectionPool(connection_string,
+                                                                  size=config.get_pool_size(),
+                                                                  idle_timeout=config.get_pool_idle_timeout())
+
+        return _connection_pools[connection_string]
+
+
+def reset_connection_pools():
+
+    """
+    Discard (WITHOUT closing) all pooled connections and the cached default configuration
+
+    Call this at the start of a forked worker process (luigi worker, MPI rank, ...) so that it doesn't share sockets
+    with its parent.  Pools also detect a change of process themselves but this makes it explicit.
+    """
+
+    global _default_config
+
+    with _connection_pools_lock:
+        for pool in _connection_pools.values():
+            pool.reset()
+
+    _default_config = None
+
+
+def borrow_connection(config=None, server_side=False):
+
+    """
+    Borrow a connection from the connection pool
+
+    .. note::
+        The connection MUST be given back using datacube.api.query.return_connection()
+
+    .. note::
+        A server side cursor only holds the current batch of results in client memory but it can only execute a
+        single query.
+
+    :param config: Configuration
+    :type config: datacube.config.Config
+    :param server_side: Return a server side (named) cursor rather than a client side one
+    :type server_side: bool
+
+    :return: DB connection and cursor
+    :rtype: (psycopg2.connection, psycopg2.cursor)
+    """
+
+    connection = get_connection_pool(config=config).get_connection()
+
+    if server_side:
+        return connection, connection.cursor(name=next_cursor_name(), cursor_factory=psycopg2.extras.DictCursor)
+
+    return connection, connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+
+_cursor_names = itertools.count()
+
+
+def next_cursor_name():
+
+    """
+    Return a name for a server side cursor that is unique within this process
+
+    :rtype: str
+    """
+
+    return "agdc_cursor_{pid}_{count}".format(pid=os.getpid(), count=next(_cursor_names))
+
+
+def return_connection(connection, cursor, config=None):
+
+    """
+    Return a connection borrowed using datacube.api.query.borrow_connection() to the connection pool
+
+    :param connection: DB connection
+    :type connection: psycopg2.connection
+    :param cursor: DB cursor
+    :type cursor: psycopg2.cursor
+    :param config: Configuration
+    :type config: datacube.config.Config
+    """
+
+    if cursor and not cursor.closed:
+        try:
+            cursor.close()
+
+        except psycopg2.Error as e:
+            # A server side cursor no longer exists if the transaction was rolled back
+            _log.debug("Ignoring error closing cursor [%s]", e)
+
+    if connection:
+        get_connection_pool(config=config).put_connection(connection)
+
+
+class QueryCache(object):
+
+    """
+    Cache of query results keyed on the (canonicalised) SQL and parameters
+
+    Results are kept in an in memory LRU and, if a directory is given, also pickled to disk so they can be shared
+    between processes and runs.  Results expire after ttl seconds or when the cache is invalidated (for example after
+    an ingest) - invalidation is recorded on disk as well so that it is seen by other processes using the directory.
+
+    Records are stored as immutable tuples of (column, value) pairs and every get() returns new dicts so callers can't
+    change the cached results.
+    """
+
+    INVALIDATED_FILENAME = "invalidated"
+
+    def __init__(self, size=64, ttl=3600, directory=None):
+
+        """
+        :param size: Maximum number of results kept in memory
+        :type size: int
+        :param ttl: Number of seconds a result remains valid
+        :type ttl: int
+        :param directory: Directory to also write the results to (None for in memory only)
+        :type directory: str
+        """
+
+        self.size = size
+        self.ttl = ttl
+        self.directory = directory
+
+        self._lock = threading.Lock()
+
+        # (key) -> (time cached, records) in least to most recently used order
+
+        self._entries = OrderedDict()
+
+        self._invalidated = 0
+
+    @staticmethod
+    def get_key(sql, params):
+
+        """
+        Return the cache key for the query
+
+        The SQL is normalised for white space and the parameters are sorted so that equivalent queries share a key.
+        The contents of a list parameter are also sorted if it is only used as = ANY(%(name)s) - where its order
+        doesn't matter - otherwise (e.g. an ordered array) its order is kept.
+
+        :type sql: str
+        :type params: dict
+        :rtype: str
+        """
+
+        any_names = re.findall(r"ANY\s*\(\s*%\((\w+)\)s\s*\)", sql, re.IGNORECASE)
+
+        unordered = set(name for name in any_names
+                        if any_names.count(name) == sql.count("%({name})s".format(name=name)))
+
+        def canonicalise(name, value):
+            if isinstance(value, set) or (isinstance(value, (list, tuple)) and name in unordered):
+                return tuple(sorted(value))
+            if isinstance(value, list):
+                return tuple(value)
+            return value
+
+        canonical = (" ".join(sql.split()), sorted((k, canonicalise(k, v)) for k, v in params.iteritems()))
+
+        return hashlib.sha1(repr(canonical)).hexdigest()
+
+    def get_invalidated(self):
+
+        """
+        Return the time the cache was last invalidated (by this or, if there is a cache directory, any process)
+
+        :rtype: float
+        """
+
+        invalidated = self._invalidated
+
+        if self.directory:
+            try:
+                invalidated = max(invalidated, os.path.getmtime(os.path.join(self.directory,
+                                                                             self.INVALIDATED_FILENAME)))
+            except OSError:
+                pass
+
+        return invalidated
+
+    def is_valid(self, cached):
+
+        return cached > time.time() - self.ttl and cached > self.get_invalidated()
+
+    def get(self, sql, params):
+
+        """
+        Return (copies of) the cached records for the query or None if there aren't any (valid ones)
+
+        :rtype: list[dict]
+        """
+
+        key = self.get_key(sql, params)
+
+        with self._lock:
+
+            if key in self._entries:
+
+                cached, records = self._entries.pop(key)
+
+                if self.is_valid(cached):
+                    self._entries[key] = (cached, records)
+                    return [dict(record) for record in records]
+
+        if self.directory:
+
+            path = os.path.join(self.directory, key + ".pickle")
+
+            try:
+                with open(path, "rb") as f:
+                    cached, records = cPickle.load(f)
+
+            except (IOError, EOFError, cPickle.UnpicklingError):
+                return None
+
+            if self.is_valid(cached):
+                self.put_memory(key, cached, records)
+                return [dict(record) for record in records]
+
+        return None
+
+    def put(self, sql, params, records):
+
+        """
+        Cache (an immutable copy of) the records returned by the query
+
+        :type records: list[dict]
+        """
+
+        key = self.get_key(sql, params)
+
+        cached = time.time()
+
+        records = tuple(tuple(record.iteritems()) for record in records)
+
+        self.put_memory(key, cached, records)
+
+        if self.directory:
+
+            # Write to a temporary file and rename so that other processes never see a partial file
+
+            fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    cPickle.dump((cached, records), f, cPickle.HIGHEST_PROTOCOL)
+
+                os.rename(temp, os.path.join(self.directory, key + ".pickle"))
+
+            except (IOError, OSError) as e:
+                _log.warn("Failed to write query cache file [%s]", e)
+
+                if os.path.exists(temp):
+                    os.remove(temp)
+
+    def put_memory(self, key, cached, records):
+
+        with self._lock:
+
+            self._entries.pop(key, None)
+            self._entries[key] = (cached, records)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+
+        """
+        Discard all cached results
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._invalidated = time.time()
+
+        if self.directory:
+
+            # (Re)writing the file updates its modification time which is checked by the other processes
+
+            with open(os.path.join(self.directory, self.INVALIDATED_FILENAME), "w") as f:
+                f.write(str(self._invalidated))
+
+            for filename in os.listdir(self.directory):
+                if filename.endswith(".pickle"):
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        pass
+
+
+_query_caches = dict()
+_query_caches_lock = threading.Lock()
+
+
+def get_query_cache(config=None):
 
     """
-    Connect to the AGDC DB
+    Return the process wide query result cache for the given configuration or None if caching is not enabled
 
     :param config: Configuration
     :type config: datacube.config.Config
 
-    :return: DB connection and cursor
-    :rtype: (psycopg2.connection, psycopg2.cursor)
+    :return: The query cache
+    :rtype: datacube.api.query.QueryCache
+    """
+
+    if not config:
+        config = get_default_config()
+
+    if not config.get_cache_enabled():
+        return None
+
+    return get_or_create_query_cache(config)
+
+
+def get_or_create_query_cache(config):
+
+    key = (build_connection_string(config), config.get_cache_directory())
+
+    with _query_caches_lock:
+
+        if key not in _query_caches:
+
+            directory = config.get_cache_directory() or None
+
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            _query_caches[key] = QueryCache(size=config.get_cache_size(), ttl=config.get_cache_ttl(),
+                                            directory=directory)
+
+        return _query_caches[key]
+
+
+def invalidate_query_cache(config=None):
+
     """
+    Discard all cached query results - call this when the contents of the database change (i.e. after an ingest)
 
-    connection = cursor = None
+    The on disk cache (if any) is cleared regardless of whether caching is enabled for this process so that other
+    processes using it see the change.
+
+    :param config: Configuration
+    :type config: datacube.config.Config
+    """
 
     if not config:
-        config = Config(os.path.expandvars("$HOME/.datacube/config"))
-        _log.debug(config.to_str())
+        config = get_default_config()
 
-    connection_string = ""
+    with _query_caches_lock:
+        caches = _query_caches.values()
 
-    if config.get_db_host():
-        connection_string += "host={host}".format(host=config.get_db_host())
+    if config.get_cache_directory():
+        cache = get_or_create_query_cache(config)
 
-    if config.get_db_port():
-        connection_string += " port={port}".format(port=config.get_db_port())
+        if cache not in caches:
+            caches.append(cache)
 
-    connection_string += " dbname={database} user={user} password={password}".format(database=config.get_db_database(),
-                                                                                     user=config.get_db_username(),
-                                                                                     password=config.get_db_password())
+    for cache in caches:
+        cache.invalidate()
 
-    connection = psycopg2.connect(connection_string)
 
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("set search_path to public, {schema}".format(schema="gis, topology, ztmp"))
+def execute_query_as_generator(sql, params, config=None, use_cache=True):
 
-    return connection, cursor
+    """
+    Execute the query and return the resulting records as a SINGLE-USE generator
+
+    The results are served from (and added to) the query result cache if caching is enabled (and use_cache).
+
+    .. note::
+        Results are only cached once they have been read in full.
+
+    :param sql: The SQL
+    :type sql: str
+    :param params: The SQL parameters
+    :type params: dict
+    :param config: Configuration
+    :type config: datacube.config.Config
+    :param use_cache: Whether to use the query result cache - turn it off for large one off queries (e.g. exports) so
+        the whole result isn't held in memory to be cached
+    :type use_cache: bool
+
+    :return: The records - as dicts whether or not they came from the cache
+    :rtype: list[dict]
+    """
+
+    cache = use_cache and get_query_cache(config=config) or None
+
+    if cache:
+        records = cache.get(sql, params)
+
+        if records is not None:
+            _log.debug("Using [%d] cached records", len(records))
+
+            for record in records:
+                yield record
+
+            return
+
+    conn, cursor = None, None
+
+    try:
+        # borrow a connection from the pool
+
+        conn, cursor = borrow_connection(config=config, server_side=True)
+
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
+
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
+
+        records = list()
+
+        debug = _log.isEnabledFor(logging.DEBUG)
+
+        for record in adaptive_result_generator(cursor):
+            if debug:
+                _log.debug(record)
+
+            if cache:
+                records.append(dict(record))
+
+            yield dict(record)
+
+        if cache:
+            cache.put(sql, params, records)
+
+    except Exception as e:
+
+        _log.error("Caught exception %s", e)
+
+        if conn:
+            conn.rollback()
+
+        raise
+
+    finally:
+
+        return_connection(conn, cursor, config=config)
+        conn = cursor = None
 
 
 def to_file_ify_sql(sql):
@@ -187,6 +880,257 @@ def to_file_ify_sql(sql):
     """.format(sql=sql)
 
 
+class PathTable(object):
+
+    """
+    Table of unique dataset paths stored as a single byte buffer and the offsets into it
+    """
+
+    def __init__(self):
+
+        self._index = dict()
+        self._paths = list()
+
+    def add(self, path):
+
+        if path is None:
+            return -1
+
+        if path not in self._index:
+            self._index[path] = len(self._paths)
+            self._paths.append(path)
+
+        return self._index[path]
+
+    def count(self):
+        return len(self._paths)
+
+    def get_data(self):
+        return numpy.frombuffer("".join(self._paths), dtype=numpy.uint8)
+
+    def get_offsets(self):
+        return numpy.cumsum([0] + [len(path) for path in self._paths], dtype=numpy.int64)
+
+    @staticmethod
+    def get_paths(data, offsets):
+
+        """
+        Return the list of paths from the byte buffer and offsets as returned by get_data() and get_offsets()
+
+        :type data: numpy.ndarray
+        :type offsets: numpy.ndarray
+        :rtype: list[str]
+        """
+
+        data = data.tostring()
+        offsets = offsets.tolist()
+
+        return [data[start:stop] for start, stop in itertools.izip(offsets[:-1], offsets[1:])]
+
+
+NPZ_SATELLITES = [satellite for satellite in Satellite]
+
+NPZ_DATASET_TYPES = [dataset_type for dataset_type in DatasetType]
+
+
+def write_cells_to_npz(filename, sql, params, config=None):
+
+    """
+    Run the (list cells) query and write the cells as typed columns to a NumPy .npz file
+
+    :param filename: The output file
+    :type filename: str
+    :param sql: The SQL
+    :type sql: str
+    :param params: The SQL parameters
+    :type params: dict
+    :param config: Config
+    :type config: datacube.config.Config
+    """
+
+    x_index = list()
+    y_index = list()
+
+    for record in execute_query_as_generator(sql, params, config=config, use_cache=False):
+        x_index.append(record["x_index"])
+        y_index.append(record["y_index"])
+
+    with open(filename, "wb") as f:
+        numpy.savez(f,
+                    x_index=numpy.array(x_index, dtype=numpy.int16),
+                    y_index=numpy.array(y_index, dtype=numpy.int16))
+
+
+def write_tiles_to_npz(filename, sql, params, config=None):
+
+    """
+    Run the (list tiles) query and write the tiles as typed columns to a NumPy .npz file
+
+    The datasets of all the tiles are stored in a single set of columns with each tile having the offset of its first
+    dataset.  Satellites and dataset types are stored as their index in the enum and the paths are stored once.
+
+    :param filename: The output file
+    :type filename: str
+    :param sql: The SQL
+    :type sql: str
+    :param params: The SQL parameters
+    :type params: dict
+    :param config: Config
+    :type config: datacube.config.Config
+    """
+
+    acquisition_id = list()
+    satellite = list()
+    start_datetime = list()
+    end_datetime = list()
+    x_index = list()
+    y_index = list()
+    dataset_offsets = [0]
+    dataset_type = list()
+    dataset_path = list()
+
+    satellites = dict((s.value, i) for i, s in enumerate(NPZ_SATELLITES))
+    dataset_types = dict((d.name, i) for i, d in enumerate(NPZ_DATASET_TYPES))
+
+    paths = PathTable()
+
+    for record in execute_query_as_generator(sql, params, config=config, use_cache=False):
+
+        acquisition_id.append(record["acquisition_id"])
+        satellite.append(satellites[record["satellite"]])
+        start_datetime.append(record["start_datetime"])
+        end_datetime.append(record["end_datetime"])
+        x_index.append(record["x_index"])
+        y_index.append(record["y_index"])
+
+        for t, path in record["datasets"]:
+            dataset_type.append(dataset_types[t])
+            dataset_path.append(paths.add(path))
+
+        dataset_offsets.append(len(dataset_type))
+
+    with open(filename, "wb") as f:
+        numpy.savez(f,
+                    acquisition_id=numpy.array(acquisition_id, dtype=numpy.int64),
+                    satellite=numpy.array(satellite, dtype=numpy.uint8),
+                    start_datetime=numpy.array(start_datetime, dtype="datetime64[us]"),
+                    end_datetime=numpy.array(end_datetime, dtype="datetime64[us]"),
+                    x_index=numpy.array(x_index, dtype=numpy.int16),
+                    y_index=numpy.array(y_index, dtype=numpy.int16),
+                    dataset_offsets=numpy.array(dataset_offsets, dtype=numpy.int64),
+                    dataset_type=numpy.array(dataset_type, dtype=numpy.uint8),
+                    dataset_path=numpy.array(dataset_path, dtype=numpy.int32),
+                    path_data=paths.get_data(),
+                    path_offsets=paths.get_offsets())
+
+
+def read_cells_from_file(filename, file_format=None):
+
+    """
+    Return the cells written by list_cells_to_file() as a SINGLE-USE generator
+
+    :param filename: The file
+    :type filename: str
+    :param file_format: The format of the file - if not given it is determined from the file extension
+    :type file_format: datacube.api.query.FileFormat
+
+    :return: List of cells
+    :rtype: list[datacube.api.model.Cell]
+    """
+
+    if (file_format or get_file_format(filename)) == FileFormat.CSV:
+
+        with open(filename, "rb") as f:
+            for record in csv.DictReader(f):
+                yield Cell.from_csv_record(record)
+
+        return
+
+    with numpy.load(filename) as npz:
+        x_index = npz["x_index"].tolist()
+        y_index = npz["y_index"].tolist()
+
+    for x, y in itertools.izip(x_index, y_index):
+        yield Cell(x_index=x, y_index=y)
+
+
+def read_tiles_from_file(filename, file_format=None):
+
+    """
+    Return the tiles written by list_tiles_to_file() as a SINGLE-USE generator
+
+    The .npz format is read a column at a time so there is no per-field parsing.
+
+    :param filename: The file
+    :type filename: str
+    :param file_format: The format of the file - if not given it is determined from the file extension
+    :type file_format: datacube.api.query.FileFormat
+
+    :return: List of tiles
+    :rtype: list[datacube.api.model.Tile]
+    """
+
+    if (file_format or get_file_format(filename)) == FileFormat.CSV:
+
+        with open(filename, "rb") as f:
+            for record in csv.DictReader(f):
+                yield Tile.from_csv_record(record)
+
+        return
+
+    with numpy.load(filename) as npz:
+
+        acquisition_id = npz["acquisition_id"].tolist()
+        satellite = [NPZ_SATELLITES[i].value for i in npz["satellite"].tolist()]
+        start_datetime = npz["start_datetime"].tolist()
+        end_datetime = npz["end_datetime"].tolist()
+        x_index = npz["x_index"].tolist()
+        y_index = npz["y_index"].tolist()
+
+        dataset_offsets = npz["dataset_offsets"].tolist()
+        dataset_type = [NPZ_DATASET_TYPES[i].name for i in npz["dataset_type"].tolist()]
+
+        paths = PathTable.get_paths(npz["path_data"], npz["path_offsets"])
+        dataset_path = [paths[i] for i in npz["dataset_path"].tolist()]
+
+    for i in xrange(len(acquisition_id)):
+
+        start, stop = dataset_offsets[i], dataset_offsets[i + 1]
+
+        datasets = [[t, path] for t, path in itertools.izip(dataset_type[start:stop], dataset_path[start:stop])]
+
+        yield Tile(acquisition_id=acquisition_id[i], x_index=x_index[i], y_index=y_index[i],
+                   start_datetime=start_datetime[i], end_datetime=end_datetime[i],
+                   end_datetime_year=end_datetime[i].year, end_datetime_month=end_datetime[i].month,
+                   datasets=DatasetTile.from_db_array(satellite[i], datasets))
+
+
+def get_file_extension(file_format):
+
+    """
+    Return the file extension for the format
+
+    :type file_format: datacube.api.query.FileFormat
+    :rtype: str
+    """
+
+    return file_format == FileFormat.NPZ and ".npz" or ".csv"
+
+
+def get_file_format(filename):
+
+    """
+    Return the file format implied by the file extension (.npz or, by default, CSV)
+
+    :rtype: datacube.api.query.FileFormat
+    """
+
+    if filename and filename.lower().endswith(".npz"):
+        return FileFormat.NPZ
+
+    return FileFormat.CSV
+
+
 SatelliteDateExclusion = namedtuple("SatelliteDateExclusion", "satellite acq_min acq_max")
 
 LS7_SLC_OFF_ACQ_MIN = date(2005, 5, 31)
@@ -311,38 +1255,16 @@ def list_cells_as_generator(x, y, satellites, acq_min, acq_max, dataset_types, m
     :rtype: list[datacube.api.model.Cell]
     """
 
-    conn, cursor = None, None
-
-    try:
-        # connect to database
-
-        conn, cursor = connect_to_db(config=config)
-
-        sql, params = build_list_cells_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
-                                                      dataset_types=dataset_types, months=months, exclude=exclude,
-                                                      sort=sort)
-
-        _log.debug(cursor.mogrify(sql, params))
+    sql, params = build_list_cells_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                  dataset_types=dataset_types, months=months, exclude=exclude,
+                                                  sort=sort, acquisition_cell=use_acquisition_cell(config))
 
-        cursor.execute(sql, params)
-
-        for record in result_generator(cursor):
-            _log.debug(record)
-            yield Cell.from_db_record(record)
-
-    except Exception as e:
-
-        _log.error("Caught exception %s", e)
-        conn.rollback()
-        raise
-
-    finally:
-
-        conn = cursor = None
+    for record in execute_query_as_generator(sql, params, config=config):
+        yield Cell.from_db_record(record)
 
 
 def list_cells_to_file(x, y, satellites, acq_min, acq_max, dataset_types, filename, months=None, exclude=None,
-                       sort=SortType.ASC, config=None):
+                       sort=SortType.ASC, config=None, file_format=None):
 
     """
     Write the list of cells matching the criteria to the specified file
@@ -369,18 +1291,33 @@ def list_cells_to_file(x, y, satellites, acq_min, acq_max, dataset_types, filena
     :type sort: datacube.api.query.SortType
     :param config: Config
     :type config: datacube.config.Config
+    :param file_format: The output format - if not given it is determined from the file extension (.npz or CSV)
+    :type file_format: datacube.api.query.FileFormat
     """
 
+    if (file_format or get_file_format(filename)) == FileFormat.NPZ:
+
+        if not filename:
+            raise Exception("A filename is required for the NPZ format")
+
+        sql, params = build_list_cells_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                      dataset_types=dataset_types, months=months, exclude=exclude,
+                                                      sort=sort, acquisition_cell=use_acquisition_cell(config))
+
+        write_cells_to_npz(filename, sql, params, config=config)
+
+        return
+
     conn = cursor = None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql, params = build_list_cells_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
                                                       dataset_types=dataset_types, months=months, exclude=exclude,
-                                                      sort=sort)
+                                                      sort=sort, acquisition_cell=use_acquisition_cell(config))
 
         sql = to_file_ify_sql(sql)
 
@@ -393,16 +1330,20 @@ def list_cells_to_file(x, y, satellites, acq_min, acq_max, dataset_types, filena
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
 def build_list_cells_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
-                                    sort=SortType.ASC):
+                                    sort=SortType.ASC, acquisition_cell=False):
 
     """
     Build the SQL query string and parameters required to return the cells matching the criteria
@@ -425,11 +1366,19 @@ def build_list_cells_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_
     :type exclude: list[datacube.api.query.SatelliteDateExclusion]
     :param sort: Sort order
     :type sort: datacube.api.query.SortType
+    :param acquisition_cell: Query the acquisition_cell table rather than the tile/dataset tables
+    :type acquisition_cell: bool
 
     :return: The SQL query and params
     :rtype: (str, dict)
     """
 
+    if acquisition_cell:
+        return build_list_cells_acquisition_cell_sql_and_params(x=x, y=y, satellites=satellites,
+                                                                 acq_min=acq_min, acq_max=acq_max,
+                                                                 dataset_types=dataset_types, months=months,
+                                                                 exclude=exclude, sort=sort)
+
     sql = """
         SELECT DISTINCT nbar.x_index, nbar.y_index
         FROM acquisition
@@ -715,28 +1664,36 @@ def list_cells_missing_as_generator(x, y, satellites, acq_min, acq_max, dataset_
     conn, cursor = None, None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql, params = build_list_cells_missing_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, sort)
 
-        _log.debug(cursor.mogrify(sql, params))
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
 
-        cursor.execute(sql, params)
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
+
+        debug = _log.isEnabledFor(logging.DEBUG)
 
         for record in result_generator(cursor):
-            _log.debug(record)
+            if debug:
+                _log.debug(record)
             yield Cell.from_db_record(record)
 
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -771,9 +1728,9 @@ def list_cells_missing_to_file(x, y, satellites, acq_min, acq_max, dataset_types
     conn = cursor = None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql, params = build_list_cells_missing_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, sort)
 
@@ -788,11 +1745,15 @@ def list_cells_missing_to_file(x, y, satellites, acq_min, acq_max, dataset_types
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -1002,10 +1963,46 @@ def list_tiles(x, y, satellites, acq_min, acq_max, dataset_types, months=None, e
                config=None):
 
     """
-    Return a list of tiles matching the criteria as a SINGLE-USE generator
-
-    .. warning::
-        Deprecated: use either datacube.api.query.list_tiles_as_list() or datacube.api.query.list_tiles_as_generator()
+    Return a list of tiles matching the criteria as a SINGLE-USE generator
+
+    .. warning::
+        Deprecated: use either datacube.api.query.list_tiles_as_list() or datacube.api.query.list_tiles_as_generator()
+
+    :param x: X cell range
+    :type x: list[int]
+    :param y: Y cell range
+    :type y: list[int]
+    :param satellites: Satellites
+    :type satellites: list[datacube.api.model.Satellite]
+    :param acq_min: Acquisition date range
+    :type acq_min: datetime.datetime
+    :param acq_max: Acquisition date range
+    :type acq_max: datetime.datetime
+    :param dataset_types: Dataset types
+    :type dataset_types: list[datacube.api.model.DatasetType]
+    :param months: Month(s) of acquisition to include
+    :type months: list[datacube.api.query.Month]
+    :param exclude: Exclusions - currently supports satellite/date combinations for LS7 SLC OFF and LS8 PRE WRS 2
+    :type exclude: list[datacube.api.query.SatelliteDateExclusion]
+    :param sort: Sort order
+    :type sort: datacube.api.query.SortType
+    :param config: Config
+    :type config: datacube.config.Config
+
+    :return: List of tiles
+    :rtype: list[datacube.api.model.Tile]
+    """
+
+    return list_tiles_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                   dataset_types=dataset_types, months=months, exclude=exclude, sort=sort,
+                                   config=config)
+
+
+def list_tiles_as_list(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None, sort=SortType.ASC,
+                       config=None):
+
+    """
+    Return a list of cells matching the criteria AS A REUSABLE LIST rather than as a one-use-generator
 
     :param x: X cell range
     :type x: list[int]
@@ -1032,16 +2029,16 @@ def list_tiles(x, y, satellites, acq_min, acq_max, dataset_types, months=None, e
     :rtype: list[datacube.api.model.Tile]
     """
 
-    return list_tiles_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
-                                   dataset_types=dataset_types, months=months, exclude=exclude, sort=sort,
-                                   config=config)
+    return list(list_tiles_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                        dataset_types=dataset_types, months=months, exclude=exclude, sort=sort,
+                                        config=config))
 
 
-def list_tiles_as_list(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None, sort=SortType.ASC,
-                       config=None):
+def list_tiles_as_generator(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                            sort=SortType.ASC, config=None):
 
     """
-    Return a list of cells matching the criteria AS A REUSABLE LIST rather than as a one-use-generator
+    Return a list of tiles matching the criteria as a SINGLE-USE generator
 
     :param x: X cell range
     :type x: list[int]
@@ -1068,16 +2065,26 @@ def list_tiles_as_list(x, y, satellites, acq_min, acq_max, dataset_types, months
     :rtype: list[datacube.api.model.Tile]
     """
 
-    return list(list_tiles_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
-                                        dataset_types=dataset_types, months=months, exclude=exclude, sort=sort,
-                                        config=config))
+    sql, params = build_list_tiles_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                  dataset_types=dataset_types, months=months, exclude=exclude,
+                                                  sort=sort, acquisition_cell=use_acquisition_cell(config))
 
+    for record in execute_query_as_generator(sql, params, config=config):
+        yield Tile.from_db_record(record)
 
-def list_tiles_as_generator(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
-                            sort=SortType.ASC, config=None):
+
+def list_tiles_by_cell_as_generator(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                                    sort=SortType.ASC, config=None):
 
     """
-    Return a list of tiles matching the criteria as a SINGLE-USE generator
+    Return the tiles matching the criteria grouped by cell as a SINGLE-USE generator of (cell, tiles) pairs
+
+    All the cells in the range are queried at once (ordered by cell - see group_by_cell in
+    build_list_tiles_sql_and_params()) and the results streamed in x, y, time order - use this rather than calling
+    list_tiles_as_generator() for one cell at a time.
+
+    .. note::
+        Cells with no matching tiles are not returned
 
     :param x: X cell range
     :type x: list[int]
@@ -1100,42 +2107,78 @@ def list_tiles_as_generator(x, y, satellites, acq_min, acq_max, dataset_types, m
     :param config: Config
     :type config: datacube.config.Config
 
-    :return: List of tiles
-    :rtype: list[datacube.api.model.Tile]
+    :return: Generator of (cell, list of tiles for the cell)
+    :rtype: collections.Iterable[(datacube.api.model.Cell, list[datacube.api.model.Tile])]
     """
 
-    conn, cursor = None, None
+    sql, params = build_list_tiles_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                  dataset_types=dataset_types, months=months, exclude=exclude,
+                                                  sort=sort, acquisition_cell=use_acquisition_cell(config),
+                                                  group_by_cell=True)
 
-    try:
-        # connect to database
+    tiles = (Tile.from_db_record(record) for record in execute_query_as_generator(sql, params, config=config))
 
-        conn, cursor = connect_to_db(config=config)
+    for cell, cell_tiles in group_tiles_by_cell(tiles):
+        yield cell, cell_tiles
 
-        sql, params = build_list_tiles_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
-                                                      dataset_types=dataset_types, months=months, exclude=exclude,
-                                                      sort=sort)
 
-        _log.debug(cursor.mogrify(sql, params))
+def group_tiles_by_cell(tiles):
 
-        cursor.execute(sql, params)
+    """
+    Group tiles that are in cell order (e.g. from a query with group_by_cell) into (cell, tiles) pairs
 
-        for record in result_generator(cursor):
-            _log.debug(record)
-            yield Tile.from_db_record(record)
+    :param tiles: The tiles (ordered by cell)
+    :type tiles: collections.Iterable[datacube.api.model.Tile]
+    :return: Generator of (cell, list of tiles for the cell)
+    :rtype: collections.Iterable[(datacube.api.model.Cell, list[datacube.api.model.Tile])]
+    """
 
-    except Exception as e:
+    for xy, cell_tiles in itertools.groupby(tiles, key=lambda tile: tile.xy):
+        yield Cell(x_index=xy[0], y_index=xy[1]), list(cell_tiles)
 
-        _log.error("Caught exception %s", e)
-        conn.rollback()
-        raise
 
-    finally:
+def list_tiles_by_cell_as_dict(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                               sort=SortType.ASC, config=None):
 
-        conn = cursor = None
+    """
+    Return the tiles matching the criteria grouped by cell AS A REUSABLE DICT keyed on the cell (x, y)
+
+    .. note::
+        Cells with no matching tiles are not present in the dict
+
+    :param x: X cell range
+    :type x: list[int]
+    :param y: Y cell range
+    :type y: list[int]
+    :param satellites: Satellites
+    :type satellites: list[datacube.api.model.Satellite]
+    :param acq_min: Acquisition date range
+    :type acq_min: datetime.datetime
+    :param acq_max: Acquisition date range
+    :type acq_max: datetime.datetime
+    :param dataset_types: Dataset types
+    :type dataset_types: list[datacube.api.model.DatasetType]
+    :param months: Month(s) of acquisition to include
+    :type months: list[datacube.api.query.Month]
+    :param exclude: Exclusions - currently supports satellite/date combinations for LS7 SLC OFF and LS8 PRE WRS 2
+    :type exclude: list[datacube.api.query.SatelliteDateExclusion]
+    :param sort: Sort order
+    :type sort: datacube.api.query.SortType
+    :param config: Config
+    :type config: datacube.config.Config
+
+    :return: Dict of cell (x, y) to the list of tiles for the cell
+    :rtype: dict[(int, int), list[datacube.api.model.Tile]]
+    """
+
+    return dict((cell.xy, tiles) for cell, tiles in
+                list_tiles_by_cell_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                dataset_types=dataset_types, months=months, exclude=exclude,
+                                                sort=sort, config=config))
 
 
 def list_tiles_to_file(x, y, satellites, acq_min, acq_max, dataset_types, filename, months=None, exclude=None,
-                       sort=SortType.ASC, config=None):
+                       sort=SortType.ASC, config=None, file_format=None):
 
     """
     Write the list of tiles matching the criteria to the specified file
@@ -1162,18 +2205,33 @@ def list_tiles_to_file(x, y, satellites, acq_min, acq_max, dataset_types, filena
     :type sort: datacube.api.query.SortType
     :param config: Config
     :type config: datacube.config.Config
+    :param file_format: The output format - if not given it is determined from the file extension (.npz or CSV)
+    :type file_format: datacube.api.query.FileFormat
     """
 
+    if (file_format or get_file_format(filename)) == FileFormat.NPZ:
+
+        if not filename:
+            raise Exception("A filename is required for the NPZ format")
+
+        sql, params = build_list_tiles_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                      dataset_types=dataset_types, months=months, exclude=exclude,
+                                                      sort=sort, acquisition_cell=use_acquisition_cell(config))
+
+        write_tiles_to_npz(filename, sql, params, config=config)
+
+        return
+
     conn = cursor = None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql, params = build_list_tiles_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
                                                       dataset_types=dataset_types, months=months, exclude=exclude,
-                                                      sort=sort)
+                                                      sort=sort, acquisition_cell=use_acquisition_cell(config))
 
         sql = to_file_ify_sql(sql)
 
@@ -1186,15 +2244,20 @@ def list_tiles_to_file(x, y, satellites, acq_min, acq_max, dataset_types, filena
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
-def build_list_tiles_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None, sort=SortType.ASC):
+def build_list_tiles_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                                    sort=SortType.ASC, acquisition_cell=False, group_by_cell=False):
 
     """
     Build the SQL query string and parameters required to return the tiles matching the criteria
@@ -1217,11 +2280,23 @@ def build_list_tiles_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_
     :type exclude: list[datacube.api.query.SatelliteDateExclusion]
     :param sort: Sort order
     :type sort: datacube.api.query.SortType
+    :param acquisition_cell: Query the acquisition_cell table rather than the tile/dataset tables
+    :type acquisition_cell: bool
+    :param group_by_cell: Order by cell (x, y) before end date/time so that the tiles of each cell are contiguous (see
+        list_tiles_by_cell_as_generator()) - otherwise the tiles are in end date/time order
+    :type group_by_cell: bool
 
     :return: The SQL query and params
     :rtype: (str, dict)
     """
 
+    if acquisition_cell:
+        return build_list_tiles_acquisition_cell_sql_and_params(x=x, y=y, satellites=satellites,
+                                                                 acq_min=acq_min, acq_max=acq_max,
+                                                                 dataset_types=dataset_types, months=months,
+                                                                 exclude=exclude, sort=sort,
+                                                                 group_by_cell=group_by_cell)
+
     sql = """
         select
             acquisition.acquisition_id, satellite_tag as satellite, start_datetime, end_datetime,
@@ -1427,8 +2502,8 @@ def build_list_tiles_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_
         sql += " and extract(month from end_datetime) = ANY(%(month)s)"
 
     sql += """
-        order by nbar.x_index, nbar.y_index, end_datetime {sort}, satellite asc
-    """.format(sort=sort.value)
+        order by {cell}end_datetime {sort}, satellite asc
+    """.format(cell=group_by_cell and "nbar.x_index, nbar.y_index, " or "", sort=sort.value)
 
     params = {"tile_type": [TILE_TYPE.value],
               "tile_class": [tile_class.value for tile_class in TILE_CLASSES],
@@ -1473,6 +2548,176 @@ def build_list_tiles_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_
     return sql, params
 
 
+# The acquisition_cell table (database change v7) has one row per NBAR tile with the paths of the other datasets as
+# columns so tiles/cells can be listed without joining tile/dataset once per processing level
+
+ACQUISITION_CELL_PATH_COLUMNS = {
+    DatasetType.ARG25: "nbar_tile_pathname",
+    DatasetType.PQ25: "pqa_tile_pathname",
+    DatasetType.FC25: "fc_tile_pathname",
+    DatasetType.NDVI: "nbar_tile_pathname",
+    DatasetType.EVI: "nbar_tile_pathname",
+    DatasetType.NBR: "nbar_tile_pathname",
+    DatasetType.TCI: "nbar_tile_pathname",
+    DatasetType.DSM: "dsm_tile_pathname",
+    DatasetType.DEM: "dem_tile_pathname",
+    DatasetType.DEM_SMOOTHED: "dem_s_tile_pathname",
+    DatasetType.DEM_HYDROLOGICALLY_ENFORCED: "dem_h_tile_pathname"
+}
+
+
+def use_acquisition_cell(config=None):
+
+    """
+    Return whether tile/cell queries should use the acquisition_cell table
+
+    :param config: Config
+    :type config: datacube.config.Config
+    :rtype: bool
+    """
+
+    if not config:
+        config = get_default_config()
+
+    return config.get_query_acquisition_cell()
+
+
+def build_acquisition_cell_where_and_params(x, y, satellites, acq_min, acq_max, dataset_types, months=None,
+                                            exclude=None):
+
+    """
+    Build the where clause and parameters for the criteria against the acquisition_cell table
+
+    :return: The SQL where clause and params
+    :rtype: (str, dict)
+    """
+
+    sql = """
+        where
+            tile_type_id = ANY(%(tile_type)s) and tile_class_id = ANY(%(tile_class)s) -- mandatory
+            and satellite_tag = ANY(%(satellite)s)
+            and x_index = ANY(%(x)s) and y_index = ANY(%(y)s)
+            and end_datetime::date between %(acq_min)s and %(acq_max)s
+        """
+
+    # The dataset types we need to have
+
+    for column in sorted(set([ACQUISITION_CELL_PATH_COLUMNS[dataset_type] for dataset_type in dataset_types
+                              if dataset_type in ACQUISITION_CELL_PATH_COLUMNS])):
+        sql += " and {column} is not null".format(column=column)
+
+    params = {"tile_type": [TILE_TYPE.value],
+              "tile_class": [tile_class.value for tile_class in TILE_CLASSES],
+              "satellite": [satellite.value for satellite in satellites],
+              "x": x, "y": y,
+              "acq_min": acq_min, "acq_max": acq_max}
+
+    if exclude:
+        for index, exclusion in enumerate(exclude):
+            if type(exclusion) is SatelliteDateExclusion:
+
+                sql += " and (satellite_tag <> %(exclude_satellite_{0})s".format(index)
+
+                params["exclude_satellite_{0}".format(index)] = exclusion.satellite.value
+
+                if exclusion.acq_min and exclusion.acq_max:
+                    sql += " or end_datetime not between %(exclude_acq_min_{0})s and %(exclude_acq_max_{0})s".format(index)
+
+                elif exclusion.acq_min:
+                    sql += " or end_datetime < %(exclude_acq_min_{0})s".format(index)
+
+                elif exclusion.acq_max:
+                    sql += " or end_datetime > %(exclude_acq_max_{0})s".format(index)
+
+                sql += ")"
+
+                if exclusion.acq_min:
+                    params["exclude_acq_min_{0}".format(index)] = exclusion.acq_min
+
+                if exclusion.acq_max:
+                    params["exclude_acq_max_{0}".format(index)] = exclusion.acq_max
+
+    if months:
+        sql += " and extract(month from end_datetime) = ANY(%(month)s)"
+        params["month"] = [month.value for month in months]
+
+    return sql, params
+
+
+def build_list_cells_acquisition_cell_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, months=None,
+                                                     exclude=None, sort=SortType.ASC):
+
+    """
+    Build the SQL query string and parameters required to return the cells matching the criteria from the
+    acquisition_cell table
+
+    See datacube.api.query.build_list_cells_sql_and_params()
+
+    :return: The SQL query and params
+    :rtype: (str, dict)
+    """
+
+    where, params = build_acquisition_cell_where_and_params(x=x, y=y, satellites=satellites,
+                                                            acq_min=acq_min, acq_max=acq_max,
+                                                            dataset_types=dataset_types, months=months,
+                                                            exclude=exclude)
+
+    sql = """
+        select distinct x_index, y_index
+        from acquisition_cell
+        """
+
+    sql += where
+
+    sql += """
+        order by x_index {sort}, y_index {sort}
+    """.format(sort=sort.value)
+
+    return sql, params
+
+
+def build_list_tiles_acquisition_cell_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, months=None,
+                                                     exclude=None, sort=SortType.ASC, group_by_cell=False):
+
+    """
+    Build the SQL query string and parameters required to return the tiles matching the criteria from the
+    acquisition_cell table
+
+    See datacube.api.query.build_list_tiles_sql_and_params()
+
+    :return: The SQL query and params
+    :rtype: (str, dict)
+    """
+
+    where, params = build_acquisition_cell_where_and_params(x=x, y=y, satellites=satellites,
+                                                            acq_min=acq_min, acq_max=acq_max,
+                                                            dataset_types=dataset_types, months=months,
+                                                            exclude=exclude)
+
+    datasets = [DatasetType.ARG25] + [dataset_type for dataset_type in dataset_types
+                                      if dataset_type != DatasetType.ARG25
+                                      and dataset_type in ACQUISITION_CELL_PATH_COLUMNS]
+
+    sql = """
+        select
+            acquisition_id, satellite_tag as satellite, start_datetime, end_datetime,
+            extract(year from end_datetime) as end_datetime_year, extract(month from end_datetime) as end_datetime_month,
+            x_index, y_index, point(x_index, y_index) as xy,
+            ARRAY[{datasets}] as datasets
+        from acquisition_cell
+        """.format(datasets=", ".join(["['{name}', {column}]".format(name=dataset_type.name,
+                                                                      column=ACQUISITION_CELL_PATH_COLUMNS[dataset_type])
+                                       for dataset_type in datasets]))
+
+    sql += where
+
+    sql += """
+        order by {cell}end_datetime {sort}, satellite asc
+    """.format(cell=group_by_cell and "x_index, y_index, " or "", sort=sort.value)
+
+    return sql, params
+
+
 # Tiles that we DON'T have
 
 def list_tiles_missing(x, y, satellites, acq_min, acq_max, dataset_types, sort=SortType.ASC, config=None):
@@ -1584,28 +2829,36 @@ def list_tiles_missing_as_generator(x, y, satellites, acq_min, acq_max, dataset_
     conn, cursor = None, None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql, params = build_list_tiles_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, sort)
 
-        _log.debug(cursor.mogrify(sql, params))
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
 
-        cursor.execute(sql, params)
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
+
+        debug = _log.isEnabledFor(logging.DEBUG)
 
         for record in result_generator(cursor):
-            _log.debug(record)
+            if debug:
+                _log.debug(record)
             yield Tile.from_db_record(record)
 
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -1643,9 +2896,9 @@ def list_tiles_missing_to_file(x, y, satellites, acq_min, acq_max, dataset_types
     conn = cursor = None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql, params = build_list_tiles_missing_sql_and_params(x, y, satellites, acq_min, acq_max, dataset_types, sort)
 
@@ -1660,11 +2913,15 @@ def list_tiles_missing_to_file(x, y, satellites, acq_min, acq_max, dataset_types
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -1932,9 +3189,9 @@ def list_tiles_dtm_as_generator(x, y, datasets, sort=SortType.ASC, config=None):
     conn, cursor = None, None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql = """
             select
@@ -1994,22 +3251,30 @@ def list_tiles_dtm_as_generator(x, y, datasets, sort=SortType.ASC, config=None):
         params = {"tile_type": [1], "tile_class": [tile_class.value for tile_class in TILE_CLASSES],
                   "x": x, "y": y}
 
-        _log.debug(cursor.mogrify(sql, params))
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
+
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
 
-        cursor.execute(sql, params)
+        debug = _log.isEnabledFor(logging.DEBUG)
 
         for record in result_generator(cursor):
-            _log.debug(record)
+            if debug:
+                _log.debug(record)
             yield Tile.from_db_record(record)
 
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -2022,9 +3287,9 @@ def visit_tiles(x, y, satellites, years, datasets, func=print_tile, sort=SortTyp
     conn, cursor = None, None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
         sql = """
             select
@@ -2081,22 +3346,30 @@ def visit_tiles(x, y, satellites, years, datasets, func=print_tile, sort=SortTyp
                   "x": [x], "y": [y],
                   "year": years}
 
-        _log.debug(cursor.mogrify(sql, params))
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
 
-        cursor.execute(sql, params)
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
+
+        debug = _log.isEnabledFor(logging.DEBUG)
 
         for record in cursor:
-            _log.debug(record)
+            if debug:
+                _log.debug(record)
             func(Tile.from_db_record(record))
 
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -2105,11 +3378,21 @@ def list_tiles_wkt(wkt, satellites, years, datasets, sort=SortType.ASC, config=N
     conn, cursor = None, None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
+
+        conn, cursor = borrow_connection(config=config)
 
-        conn, cursor = connect_to_db(config=config)
+        # Find the cells intersecting the polygon first - a single scan of the tile_footprint spatial index
 
         sql = """
+            with footprint as (
+                select x_index, y_index, tile_type_id
+                from tile_footprint
+                where
+                    tile_type_id = ANY(%(tile_type)s)
+                    and bbox && st_geomfromtext(%(polygon)s, 4326)
+                    and st_intersects(bbox, st_geomfromtext(%(polygon)s, 4326))
+            )
             select
                 acquisition.acquisition_id, satellite_tag as satellite, start_datetime, end_datetime,
                 extract(year from end_datetime)::integer as end_datetime_year, extract(month from end_datetime)::integer as end_datetime_month,
@@ -2151,15 +3434,14 @@ def list_tiles_wkt(wkt, satellites, years, datasets, sort=SortType.ASC, config=N
                     fc.acquisition_id=acquisition.acquisition_id
                     and fc.x_index=nbar.x_index and fc.y_index=nbar.y_index
                     and fc.tile_type_id=nbar.tile_type_id and fc.tile_class_id=nbar.tile_class_id
-            join tile_footprint on
-                tile_footprint.x_index = nbar.x_index
-                and tile_footprint.y_index = nbar.y_index
-                and tile_footprint.tile_type_id = nbar.tile_type_id
+            join footprint on
+                footprint.x_index = nbar.x_index
+                and footprint.y_index = nbar.y_index
+                and footprint.tile_type_id = nbar.tile_type_id
 
             where
                 nbar.tile_type_id = ANY(%(tile_type)s) and nbar.tile_class_id = ANY(%(tile_class)s) -- mandatory
                 and satellite.satellite_tag = ANY(%(satellite)s)
-                and st_intersects(tile_footprint.bbox, st_geomfromtext(%(polygon)s, 4326))
                 and extract(year from end_datetime) = ANY(%(year)s)
 
             order by end_datetime asc, satellite asc
@@ -2171,14 +3453,18 @@ def list_tiles_wkt(wkt, satellites, years, datasets, sort=SortType.ASC, config=N
                   "polygon": wkt,
                   "year": years}
 
-        _log.debug(cursor.mogrify(sql, params))
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
 
-        cursor.execute(sql, params)
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
 
         tiles = []
 
+        debug = _log.isEnabledFor(logging.DEBUG)
+
         for record in cursor:
-            _log.debug(record)
+            if debug:
+                _log.debug(record)
             tiles.append(Tile.from_db_record(record))
 
         return tiles
@@ -2186,11 +3472,15 @@ def list_tiles_wkt(wkt, satellites, years, datasets, sort=SortType.ASC, config=N
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -2215,6 +3505,46 @@ def result_generator(cursor, size=100):
             yield result
 
 
+def adaptive_result_generator(cursor, size=100, max_size=10000, target_fetch_seconds=0.5):
+
+    """
+    Return the results of a (server side) cursor as a generator fetching in batches that grow with throughput
+
+    The first batch is small so the first results come back quickly.  The batch size then doubles - up to max_size -
+    for as long as fetching a batch takes less than target_fetch_seconds.
+
+    :param cursor: The cursor on which the query has been executed
+    :type cursor: psycopg2.cursor
+    :param size: Initial batch size
+    :type size: int
+    :param max_size: Maximum batch size
+    :type max_size: int
+    :param target_fetch_seconds: Fetch time below which the batch size is increased
+    :type target_fetch_seconds: float
+    """
+
+    while True:
+
+        start = time.time()
+
+        results = cursor.fetchmany(size)
+
+        elapsed = time.time() - start
+
+        if not results:
+            break
+
+        for result in results:
+            yield result
+
+        if len(results) < size:
+            break
+
+        if size < max_size and elapsed < target_fetch_seconds:
+            size = min(size * 2, max_size)
+            _log.debug("Fetched [%d] records in [%f] seconds - increasing batch size to [%d]", len(results), elapsed, size)
+
+
 ###
 # AREA OF INTEREST / POLYGON QUERIES
 ###
@@ -2399,28 +3729,37 @@ def list_cells_wkb_as_generator(wkb, satellites, acq_min, acq_max, dataset_types
     conn, cursor = None, None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
+
+        conn, cursor = borrow_connection(config=config)
 
-        conn, cursor = connect_to_db(config=config)
+        sql, params = build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types, sort,
+                                                          acquisition_cell=use_acquisition_cell(config))
 
-        sql, params = build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types, sort)
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
 
-        _log.debug(cursor.mogrify(sql, params))
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
 
-        cursor.execute(sql, params)
+        debug = _log.isEnabledFor(logging.DEBUG)
 
         for record in result_generator(cursor):
-            _log.debug(record)
+            if debug:
+                _log.debug(record)
             yield Cell.from_db_record(record)
 
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
@@ -2450,11 +3789,12 @@ def list_cells_wkb_to_file(wkb, satellites, acq_min, acq_max, dataset_types, fil
     conn = cursor = None
 
     try:
-        # connect to database
+        # borrow a connection from the pool
 
-        conn, cursor = connect_to_db(config=config)
+        conn, cursor = borrow_connection(config=config)
 
-        sql, params = build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types, sort)
+        sql, params = build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types, sort,
+                                                          acquisition_cell=use_acquisition_cell(config))
 
         sql = to_file_ify_sql(sql)
 
@@ -2467,15 +3807,35 @@ def list_cells_wkb_to_file(wkb, satellites, acq_min, acq_max, dataset_types, fil
     except Exception as e:
 
         _log.error("Caught exception %s", e)
-        conn.rollback()
+
+        if conn:
+            conn.rollback()
+
         raise
 
     finally:
 
+        return_connection(conn, cursor, config=config)
         conn = cursor = None
 
 
-def build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types, sort=SortType.ASC):
+# The tile footprints (cells) intersecting the shape - as a CTE so that it is evaluated once using the
+# tile_footprint_bbox_idx GiST index (the && bounding box test) before being joined to the tile tables
+
+FOOTPRINT_WKB_SQL = """
+        with footprint as (
+            select x_index, y_index, tile_type_id
+            from tile_footprint
+            where
+                tile_type_id = ANY(%(tile_type)s)
+                and bbox && st_setsrid(st_geomfromwkb(%(geom)s), 4326)
+                and st_intersects(bbox, st_setsrid(st_geomfromwkb(%(geom)s), 4326))
+        )
+        """
+
+
+def build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types, sort=SortType.ASC,
+                                        acquisition_cell=False):
 
     """
     Build the SQL query string and parameters required to return the cells matching the criteria
@@ -2492,12 +3852,23 @@ def build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, datas
     :type dataset_types: list[datacube.api.model.DatasetType]
     :param sort: Sort order
     :type sort: datacube.api.query.SortType
+    :param acquisition_cell: Query the acquisition_cell table rather than the tile/dataset tables
+    :type acquisition_cell: bool
 
     :return: The SQL query and params
     :rtype: (str, dict)
     """
 
-    sql = """
+    if acquisition_cell:
+        return build_list_cells_wkb_acquisition_cell_sql_and_params(wkb=wkb, satellites=satellites,
+                                                                     acq_min=acq_min, acq_max=acq_max,
+                                                                     dataset_types=dataset_types, sort=sort)
+
+    # Find the cells intersecting the shape first - a single scan of the tile_footprint spatial index
+
+    sql = FOOTPRINT_WKB_SQL
+
+    sql += """
         SELECT DISTINCT nbar.x_index, nbar.y_index
         FROM acquisition
         JOIN satellite ON satellite.satellite_id=acquisition.satellite_id
@@ -2515,7 +3886,9 @@ def build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, datas
             """
 
     sql += """
-        join tile_footprint on tile_footprint.x_index=nbar.x_index and tile_footprint.y_index=nbar.y_index
+        join footprint on
+            footprint.x_index=nbar.x_index and footprint.y_index=nbar.y_index
+            and footprint.tile_type_id=nbar.tile_type_id
     """
 
     if DatasetType.PQ25 in dataset_types:
@@ -2609,7 +3982,6 @@ def build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, datas
         where
             nbar.tile_type_id = ANY(%(tile_type)s) and nbar.tile_class_id = ANY(%(tile_class)s) -- mandatory
             and satellite.satellite_tag = ANY(%(satellite)s)
-            and st_intersects(tile_footprint.bbox, st_setsrid(st_geomfromwkb(%(geom)s), 4326))
             and end_datetime::date between %(acq_min)s and %(acq_max)s
         """
 
@@ -2645,6 +4017,50 @@ def build_list_cells_wkb_sql_and_params(wkb, satellites, acq_min, acq_max, datas
     return sql, params
 
 
+def build_list_cells_wkb_acquisition_cell_sql_and_params(wkb, satellites, acq_min, acq_max, dataset_types,
+                                                         sort=SortType.ASC):
+
+    """
+    Build the SQL query string and parameters required to return the cells matching the criteria from the
+    acquisition_cell table
+
+    See datacube.api.query.build_list_cells_wkb_sql_and_params()
+
+    :return: The SQL query and params
+    :rtype: (str, dict)
+    """
+
+    sql = FOOTPRINT_WKB_SQL
+
+    sql += """
+        select distinct acquisition_cell.x_index, acquisition_cell.y_index
+        from acquisition_cell
+        join footprint on
+            footprint.x_index=acquisition_cell.x_index and footprint.y_index=acquisition_cell.y_index
+            and footprint.tile_type_id=acquisition_cell.tile_type_id
+        where
+            acquisition_cell.tile_class_id = ANY(%(tile_class)s) -- mandatory
+            and satellite_tag = ANY(%(satellite)s)
+            and end_datetime::date between %(acq_min)s and %(acq_max)s
+        """
+
+    for column in sorted(set([ACQUISITION_CELL_PATH_COLUMNS[dataset_type] for dataset_type in dataset_types
+                              if dataset_type in ACQUISITION_CELL_PATH_COLUMNS])):
+        sql += " and {column} is not null".format(column=column)
+
+    sql += """
+        order by acquisition_cell.x_index {sort}, acquisition_cell.y_index {sort}
+    """.format(sort=sort.value)
+
+    params = {"tile_type": [TILE_TYPE.value],
+              "tile_class": [tile_class.value for tile_class in TILE_CLASSES],
+              "satellite": [satellite.value for satellite in satellites],
+              "geom": bytearray(wkb),
+              "acq_min": acq_min, "acq_max": acq_max}
+
+    return sql, params
+
+
 # TODO - disabling this for now as I don't think the queries perform very well and nothing is currently using them
 #        as the AOI filtering is done at the CELL level rather than the TILE level.
 #        I'll do some work on the queries shortly!
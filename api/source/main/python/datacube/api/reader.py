@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import itertools
+import logging
+from collections import deque
+from datacube.api.model import DatasetType, Pq25Bands, Wofs25Bands
+from datacube.api.utils import NDV, DEFAULT_MASK_PQA, DEFAULT_MASK_WOFS
+from datacube.api.utils import calculate_mask, get_dataset_data, get_dataset_data_masked
+
+
+_log = logging.getLogger(__name__)
+
+
+# Number of threads reading tiles.  GDAL releases the GIL while reading/decoding so the reads really do overlap.
+
+DEFAULT_READ_WORKERS = 4
+
+# Number of tiles to read ahead of the one being processed
+
+DEFAULT_READ_AHEAD = 8
+
+
+def read_as_generator(items, func, workers=DEFAULT_READ_WORKERS, read_ahead=DEFAULT_READ_AHEAD):
+
+    """
+    Yield (item, func(item)) for each of the items, in order, with func being called for up to read_ahead items ahead
+    of the one being yielded on a pool of worker threads
+
+    Useful for overlapping the reading of tiles (from Lustre/NFS) with processing them.  Note that at most read_ahead
+    + 1 results are held in memory at any one time.
+
+    If workers or read_ahead is 0 then func is simply called in the calling thread as each item is requested.
+
+    :param items: The items (e.g. tiles)
+    :type items: collections.Iterable
+    :param func: The function to call for each item (e.g. to read its data)
+    :type func: callable
+    :param workers: The number of worker threads
+    :type workers: int
+    :param read_ahead: The number of items to read ahead
+    :type read_ahead: int
+    :return: (item, result) tuples
+    """
+
+    if not workers or not read_ahead:
+        for item in items:
+            yield item, func(item)
+
+        return
+
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(processes=workers)
+
+    try:
+        items = iter(items)
+
+        pending = deque()
+
+        for item in itertools.islice(items, read_ahead):
+            pending.append((item, pool.apply_async(func, (item,))))
+
+        while pending:
+            item, result = pending.popleft()
+
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, pool.apply_async(func, (next_item,))))
+
+            yield item, result.get()
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_tile_data(tile, dataset_type, bands=None, x=0, y=0, x_size=None, y_size=None,
+                   mask_pqa_apply=False, mask_pqa_mask=DEFAULT_MASK_PQA,
+                   mask_wofs_apply=False, mask_wofs_mask=DEFAULT_MASK_WOFS, ndv=NDV, mask=None):
+
+    """
+    Return the data for the given dataset of the tile, optionally with the tile's PQA and/or WOFS masks applied
+
+    :param tile: The tile
+    :type tile: datacube.api.model.Tile
+    :param dataset_type: The dataset to read
+    :type dataset_type: datacube.api.model.DatasetType
+    :param bands: The bands to read (defaults to all of them)
+    :type bands: list[datacube.api.model.Band]
+    :type x: int
+    :type y: int
+    :type x_size: int
+    :type y_size: int
+    :param mask_pqa_apply: Whether to apply the PQA mask (if the tile has a PQA dataset)
+    :type mask_pqa_apply: bool
+    :type mask_pqa_mask: list[datacube.api.utils.PqaMask]
+    :param mask_wofs_apply: Whether to apply the WOFS mask (if the tile has a WOFS dataset)
+    :type mask_wofs_apply: bool
+    :type mask_wofs_mask: list[datacube.api.utils.WofsMask]
+    :param ndv: The no data value to use for masked pixels
+    :param mask: An optional mask (e.g. a vector mask) to apply in addition to the PQA/WOFS masks
+    :type mask: numpy.ndarray
+    :return: dictionary of band/data as numpy array
+    :rtype: dict[numpy.ndarray]
+    """
+
+    # Combine the PQA, WOFS and given masks in one go
+
+    pqa = wofs = None
+
+    if mask_pqa_apply and DatasetType.PQ25 in tile.datasets:
+        pqa = get_dataset_data(tile.datasets[DatasetType.PQ25], [Pq25Bands.PQ],
+                               x=x, y=y, x_size=x_size, y_size=y_size)[Pq25Bands.PQ]
+
+    if mask_wofs_apply and DatasetType.WATER in tile.datasets:
+        wofs = get_dataset_data(tile.datasets[DatasetType.WATER], [Wofs25Bands.WATER],
+                                x=x, y=y, x_size=x_size, y_size=y_size)[Wofs25Bands.WATER]
+
+    if pqa is not None or wofs is not None:
+        mask = calculate_mask(pqa=pqa, pqa_masks=mask_pqa_mask, wofs=wofs, wofs_masks=mask_wofs_mask, mask=mask)
+
+    return get_dataset_data_masked(tile.datasets[dataset_type], bands=bands,
+                                   x=x, y=y, x_size=x_size, y_size=y_size, ndv=ndv, mask=mask)
+
+
+def read_tiles_as_generator(tiles, dataset_type, bands=None, x=0, y=0, x_size=None, y_size=None,
+                            mask_pqa_apply=False, mask_pqa_mask=DEFAULT_MASK_PQA,
+                            mask_wofs_apply=False, mask_wofs_mask=DEFAULT_MASK_WOFS, ndv=NDV, mask=None,
+                            workers=DEFAULT_READ_WORKERS, read_ahead=DEFAULT_READ_AHEAD):
+
+    """
+    Yield (tile, data) for each of the tiles, in order, with the data being read (see read_tile_data) in parallel
+    ahead of it being needed
+
+    :type tiles: list[datacube.api.model.Tile]
+    :type dataset_type: datacube.api.model.DatasetType
+    :type bands: list[datacube.api.model.Band]
+    :type x: int
+    :type y: int
+    :type x_size: int
+    :type y_size: int
+    :type mask_pqa_apply: bool
+    :type mask_pqa_mask: list[datacube.api.utils.PqaMask]
+    :type mask_wofs_apply: bool
+    :type mask_wofs_mask: list[datacube.api.utils.WofsMask]
+    :type ndv: int
+    :type mask: numpy.ndarray
+    :param workers: The number of worker threads
+    :type workers: int
+    :param read_ahead: The number of tiles to read ahead
+    :type read_ahead: int
+    :return: (tile, dictionary of band/data as numpy array) tuples
+    """
+
+    def read(tile):
+        return read_tile_data(tile, dataset_type, bands=bands, x=x, y=y, x_size=x_size, y_size=y_size,
+                              mask_pqa_apply=mask_pqa_apply, mask_pqa_mask=mask_pqa_mask,
+                              mask_wofs_apply=mask_wofs_apply, mask_wofs_mask=mask_wofs_mask, ndv=ndv, mask=mask)
+
+    return read_as_generator(tiles, read, workers=workers, read_ahead=read_ahead)
@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import itertools
+import logging
+import numpy
+from datacube.api.model import Tile, Cell, DatasetTile, DatasetType, Satellite, dataset_type_derived_nbar
+from datacube.api.query import SortType, SatelliteDateExclusion, ProcessingLevel, TILE_TYPE, TILE_CLASSES
+from datacube.api.query import borrow_connection, return_connection, adaptive_result_generator, PathTable
+from datacube.api.query import group_tiles_by_cell
+from datacube.api.utils import lazy_mogrify, log_timing
+from datetime import datetime, timedelta
+
+
+_log = logging.getLogger(__name__)
+
+
+# A snapshot of the tile index is a NumPy .npz file containing one column array per field with one row per
+# (acquisition, cell).  The dataset paths are stored once in a single byte buffer with each tile having, for each
+# dataset type, the index of its path (or -1 if it doesn't have that dataset).
+#
+# The rows are sorted by (x, y, end_datetime) so the tiles for a cell are a contiguous slice of the arrays and the
+# tiles in an acquisition range can be found by binary search.
+
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_SATELLITES = [s for s in Satellite]
+
+# The physical datasets included in the snapshot and the processing level they come from
+
+SNAPSHOT_DATASET_TYPES = [
+    (DatasetType.ARG25, ProcessingLevel.NBAR),
+    (DatasetType.PQ25, ProcessingLevel.PQA),
+    (DatasetType.FC25, ProcessingLevel.FC),
+    (DatasetType.DSM, ProcessingLevel.DSM),
+    (DatasetType.DEM, ProcessingLevel.DEM),
+    (DatasetType.DEM_SMOOTHED, ProcessingLevel.DEM_S),
+    (DatasetType.DEM_HYDROLOGICALLY_ENFORCED, ProcessingLevel.DEM_H)
+]
+
+def get_path_column_name(dataset_type):
+    return "path_" + dataset_type.name.lower()
+
+
+def build_tile_index_sql_and_params(x, y, satellites, acq_min, acq_max):
+
+    """
+    Build the SQL query string and parameters required to return the tile index rows for the snapshot
+
+    There is a row for every NBAR tile with the path of each of the other datasets (or NULL if it isn't present).
+
+    :param x: X cell range
+    :type x: list[int]
+    :param y: Y cell range
+    :type y: list[int]
+    :param satellites: Satellites
+    :type satellites: list[datacube.api.model.Satellite]
+    :param acq_min: Acquisition date range
+    :type acq_min: datetime.datetime
+    :param acq_max: Acquisition date range
+    :type acq_max: datetime.datetime
+
+    :return: The SQL query and params
+    :rtype: (str, dict)
+    """
+
+    sql = """
+        select
+            acquisition.acquisition_id, satellite_tag as satellite, start_datetime, end_datetime,
+            nbar.x_index, nbar.y_index
+        """
+
+    for dataset_type, level in SNAPSHOT_DATASET_TYPES:
+        sql += """
+            ,{alias}.tile_pathname as {column}
+        """.format(alias=level.name.lower(), column=get_path_column_name(dataset_type))
+
+    sql += """
+        from acquisition
+        join satellite on satellite.satellite_id=acquisition.satellite_id
+        join
+            (
+            select
+                dataset.acquisition_id, tile.dataset_id, tile.x_index, tile.y_index, tile.tile_pathname, tile.tile_type_id, tile.tile_class_id
+            from tile
+            join dataset on dataset.dataset_id=tile.dataset_id
+            where dataset.level_id = %(level_nbar)s
+            ) as nbar on nbar.acquisition_id=acquisition.acquisition_id
+        """
+
+    params = {"tile_type": [TILE_TYPE.value],
+              "tile_class": [tile_class.value for tile_class in TILE_CLASSES],
+              "satellite": [satellite.value for satellite in satellites],
+              "x": x, "y": y,
+              "acq_min": acq_min, "acq_max": acq_max,
+              "level_nbar": ProcessingLevel.NBAR.value}
+
+    for dataset_type, level in SNAPSHOT_DATASET_TYPES:
+
+        if level == ProcessingLevel.NBAR:
+            continue
+
+        alias = level.name.lower()
+
+        # The DSM/DEM datasets have no acquisition so just match on the cell
+
+        acquisition_join = ""
+
+        if level in [ProcessingLevel.PQA, ProcessingLevel.FC]:
+            acquisition_join = "{alias}.acquisition_id=acquisition.acquisition_id and ".format(alias=alias)
+
+        sql += """
+        left join
+            (
+            select
+                dataset.acquisition_id, tile.dataset_id, tile.x_index, tile.y_index, tile.tile_pathname, tile.tile_type_id, tile.tile_class_id
+            from tile
+            join dataset on dataset.dataset_id=tile.dataset_id
+            where dataset.level_id = %(level_{alias})s
+            ) as {alias} on
+                {acquisition_join}{alias}.x_index=nbar.x_index and {alias}.y_index=nbar.y_index
+                and {alias}.tile_type_id=nbar.tile_type_id and {alias}.tile_class_id=nbar.tile_class_id
+        """.format(alias=alias, acquisition_join=acquisition_join)
+
+        params["level_{alias}".format(alias=alias)] = level.value
+
+    sql += """
+        where
+            nbar.tile_type_id = ANY(%(tile_type)s) and nbar.tile_class_id = ANY(%(tile_class)s) -- mandatory
+            and satellite.satellite_tag = ANY(%(satellite)s)
+            and nbar.x_index = ANY(%(x)s) and nbar.y_index = ANY(%(y)s)
+            and end_datetime::date between %(acq_min)s and %(acq_max)s
+        order by nbar.x_index, nbar.y_index, end_datetime asc, satellite asc
+        """
+
+    return sql, params
+
+
+def export_tile_index(filename, x, y, satellites, acq_min, acq_max, config=None):
+
+    """
+    Export a snapshot of the tile index for the given cells and acquisition range to the specified file
+
+    :param filename: The output (.npz) file
+    :type filename: str
+    :param x: X cell range
+    :type x: list[int]
+    :param y: Y cell range
+    :type y: list[int]
+    :param satellites: Satellites
+    :type satellites: list[datacube.api.model.Satellite]
+    :param acq_min: Acquisition date range
+    :type acq_min: datetime.datetime
+    :param acq_max: Acquisition date range
+    :type acq_max: datetime.datetime
+    :param config: Config
+    :type config: datacube.config.Config
+    """
+
+    acquisition_id = list()
+    satellite = list()
+    start_datetime = list()
+    end_datetime = list()
+    x_index = list()
+    y_index = list()
+
+    paths = dict((dataset_type, list()) for dataset_type, _ in SNAPSHOT_DATASET_TYPES)
+
+    path_table = PathTable()
+
+    conn = cursor = None
+
+    try:
+        # borrow a connection from the pool
+
+        conn, cursor = borrow_connection(config=config, server_side=True)
+
+        sql, params = build_tile_index_sql_and_params(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max)
+
+        _log.debug("%s", lazy_mogrify(cursor, sql, params))
+
+        with log_timing("query_execute", logger=_log):
+            cursor.execute(sql, params)
+
+        for record in adaptive_result_generator(cursor):
+            acquisition_id.append(record["acquisition_id"])
+            satellite.append(SNAPSHOT_SATELLITES.index(Satellite[record["satellite"]]))
+            start_datetime.append(record["start_datetime"])
+            end_datetime.append(record["end_datetime"])
+            x_index.append(record["x_index"])
+            y_index.append(record["y_index"])
+
+            for dataset_type, _ in SNAPSHOT_DATASET_TYPES:
+                paths[dataset_type].append(path_table.add(record[get_path_column_name(dataset_type)]))
+
+    except Exception as e:
+
+        _log.error("Caught exception %s", e)
+
+        if conn:
+            conn.rollback()
+
+        raise
+
+    finally:
+
+        return_connection(conn, cursor, config=config)
+        conn = cursor = None
+
+    columns = {
+        "version": numpy.array([SNAPSHOT_VERSION]),
+        "acquisition_id": numpy.array(acquisition_id, dtype=numpy.int64),
+        "satellite": numpy.array(satellite, dtype=numpy.uint8),
+        "start_datetime": numpy.array(start_datetime, dtype="datetime64[us]"),
+        "end_datetime": numpy.array(end_datetime, dtype="datetime64[us]"),
+        "x_index": numpy.array(x_index, dtype=numpy.int16),
+        "y_index": numpy.array(y_index, dtype=numpy.int16),
+        "path_data": path_table.get_data(),
+        "path_offsets": path_table.get_offsets()
+    }
+
+    for dataset_type, _ in SNAPSHOT_DATASET_TYPES:
+        columns[get_path_column_name(dataset_type)] = numpy.array(paths[dataset_type], dtype=numpy.int32)
+
+    _log.info("Writing tile index snapshot of [%d] tiles with [%d] paths to [%s]",
+              len(acquisition_id), path_table.count(), filename)
+
+    with open(filename, "wb") as f:
+        numpy.savez(f, **columns)
+
+
+class TileIndex(object):
+
+    """
+    In memory tile index loaded from a snapshot created by datacube.api.snapshot.export_tile_index()
+
+    The query methods take the same arguments as the corresponding methods in datacube.api.query but don't touch the
+    database.
+    """
+
+    def __init__(self, columns):
+
+        self.acquisition_id = columns["acquisition_id"]
+        self.satellite = columns["satellite"]
+        self.start_datetime = columns["start_datetime"]
+        self.end_datetime = columns["end_datetime"]
+        self.x_index = columns["x_index"]
+        self.y_index = columns["y_index"]
+
+        self.path_data = columns["path_data"]
+        self.path_offsets = columns["path_offsets"]
+
+        self.paths = dict((dataset_type, columns[get_path_column_name(dataset_type)])
+                          for dataset_type, _ in SNAPSHOT_DATASET_TYPES)
+
+        # Month of the end date/time (1-12) for the month filter
+
+        self.end_datetime_month = self.end_datetime.astype("datetime64[M]").astype(numpy.int64) % 12 + 1
+
+        # Slice of the rows for each cell
+
+        self.cells = dict()
+
+        if len(self.acquisition_id) > 0:
+            boundaries = numpy.flatnonzero((numpy.diff(self.x_index) != 0) | (numpy.diff(self.y_index) != 0)) + 1
+            starts = numpy.concatenate(([0], boundaries))
+            stops = numpy.concatenate((boundaries, [len(self.acquisition_id)]))
+
+            for start, stop in itertools.izip(starts, stops):
+                self.cells[(int(self.x_index[start]), int(self.y_index[start]))] = (start, stop)
+
+    @staticmethod
+    def load(filename):
+
+        """
+        Load a tile index snapshot
+
+        :param filename: The snapshot (.npz) file
+        :type filename: str
+        :rtype: datacube.api.snapshot.TileIndex
+        """
+
+        with numpy.load(filename) as npz:
+
+            if int(npz["version"][0]) != SNAPSHOT_VERSION:
+                raise Exception("Tile index snapshot [%s] is version [%d] - expected [%d]" %
+                                (filename, npz["version"][0], SNAPSHOT_VERSION))
+
+            columns = dict((name, npz[name]) for name in npz.files)
+
+        index = TileIndex(columns)
+
+        _log.info("Loaded tile index snapshot of [%d] tiles in [%d] cells from [%s]",
+                  len(index.acquisition_id), len(index.cells), filename)
+
+        return index
+
+    def get_path(self, path_index):
+        return self.path_data[self.path_offsets[path_index]:self.path_offsets[path_index + 1]].tostring()
+
+    def find_rows(self, x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                  sort=SortType.ASC, group_by_cell=False):
+
+        """
+        Return the indices of the rows matching the criteria - in end date/time order or, with group_by_cell, in
+        x, y, end date/time order (see datacube.api.query.build_list_tiles_sql_and_params())
+
+        :rtype: numpy.ndarray
+        """
+
+        acq_min = numpy.datetime64(datetime(acq_min.year, acq_min.month, acq_min.day), "us")
+        acq_max = numpy.datetime64(datetime(acq_max.year, acq_max.month, acq_max.day) + timedelta(days=1), "us")
+
+        satellites = [SNAPSHOT_SATELLITES.index(satellite) for satellite in satellites]
+
+        required = [dataset_type for dataset_type, _ in SNAPSHOT_DATASET_TYPES
+                    if dataset_type != DatasetType.ARG25 and dataset_type in dataset_types]
+
+        rows = list()
+
+        for cell_x in sorted(x):
+            for cell_y in sorted(y):
+
+                if (cell_x, cell_y) not in self.cells:
+                    continue
+
+                start, stop = self.cells[(cell_x, cell_y)]
+
+                # Rows within the cell are sorted by end date/time
+
+                end_datetime = self.end_datetime[start:stop]
+
+                start, stop = (start + numpy.searchsorted(end_datetime, acq_min, side="left"),
+                               start + numpy.searchsorted(end_datetime, acq_max, side="left"))
+
+                if start >= stop:
+                    continue
+
+                selected = numpy.in1d(self.satellite[start:stop], satellites)
+
+                for dataset_type in required:
+                    selected &= self.paths[dataset_type][start:stop] != -1
+
+                if months:
+                    selected &= numpy.in1d(self.end_datetime_month[start:stop], [month.value for month in months])
+
+                if exclude:
+                    for exclusion in exclude:
+                        if type(exclusion) is SatelliteDateExclusion:
+                            selected &= ~self.is_excluded(exclusion, start, stop)
+
+                cell_rows = numpy.flatnonzero(selected) + start
+
+                # Order by end date/time then satellite
+
+                end_datetime = self.end_datetime[cell_rows].astype(numpy.int64)
+
+                if sort == SortType.DESC:
+                    end_datetime = -end_datetime
+
+                order = numpy.lexsort((self.satellite[cell_rows], end_datetime))
+
+                rows.append(cell_rows[order])
+
+        if not rows:
+            return numpy.empty(0, dtype=numpy.int64)
+
+        rows = numpy.concatenate(rows)
+
+        if not group_by_cell:
+
+            # Merge the cells by end date/time then satellite (lexsort is stable so ties stay in cell order)
+
+            end_datetime = self.end_datetime[rows].astype(numpy.int64)
+
+            if sort == SortType.DESC:
+                end_datetime = -end_datetime
+
+            rows = rows[numpy.lexsort((self.satellite[rows], end_datetime))]
+
+        return rows
+
+    def is_excluded(self, exclusion, start, stop):
+
+        excluded = self.satellite[start:stop] == SNAPSHOT_SATELLITES.index(exclusion.satellite)
+
+        end_datetime = self.end_datetime[start:stop]
+
+        if exclusion.acq_min and exclusion.acq_max:
+            excluded &= ((end_datetime >= numpy.datetime64(exclusion.acq_min, "us")) &
+                         (end_datetime <= numpy.datetime64(exclusion.acq_max, "us")))
+
+        elif exclusion.acq_min:
+            excluded &= end_datetime >= numpy.datetime64(exclusion.acq_min, "us")
+
+        elif exclusion.acq_max:
+            excluded &= end_datetime <= numpy.datetime64(exclusion.acq_max, "us")
+
+        return excluded
+
+    def make_tile(self, row, dataset_types):
+
+        satellite = SNAPSHOT_SATELLITES[self.satellite[row]]
+
+        nbar = self.get_path(self.paths[DatasetType.ARG25][row])
+
+        datasets = [[DatasetType.ARG25.name, nbar]]
+
+        for dataset_type in dataset_types:
+
+            if dataset_type in dataset_type_derived_nbar:
+                datasets.append([dataset_type.name, nbar])
+
+            elif dataset_type != DatasetType.ARG25 and dataset_type in self.paths and self.paths[dataset_type][row] != -1:
+                datasets.append([dataset_type.name, self.get_path(self.paths[dataset_type][row])])
+
+        end_datetime = self.end_datetime[row].item()
+
+        return Tile(acquisition_id=int(self.acquisition_id[row]),
+                    x_index=int(self.x_index[row]), y_index=int(self.y_index[row]),
+                    start_datetime=self.start_datetime[row].item(), end_datetime=end_datetime,
+                    end_datetime_year=end_datetime.year, end_datetime_month=end_datetime.month,
+                    datasets=DatasetTile.from_db_array(satellite.value, datasets))
+
+    def list_cells_as_generator(self, x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                                sort=SortType.ASC, config=None):
+
+        """
+        Return a list of cells matching the criteria as a SINGLE-USE generator
+
+        See datacube.api.query.list_cells_as_generator() - config is ignored
+
+        :rtype: list[datacube.api.model.Cell]
+        """
+
+        rows = self.find_rows(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                              dataset_types=dataset_types, months=months, exclude=exclude)
+
+        cells = sorted(set(itertools.izip(self.x_index[rows].tolist(), self.y_index[rows].tolist())),
+                       reverse=(sort == SortType.DESC))
+
+        for cell_x, cell_y in cells:
+            yield Cell(x_index=cell_x, y_index=cell_y)
+
+    def list_cells_as_list(self, x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                           sort=SortType.ASC, config=None):
+
+        return list(self.list_cells_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                 dataset_types=dataset_types, months=months, exclude=exclude,
+                                                 sort=sort, config=config))
+
+    def list_tiles_as_generator(self, x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                                sort=SortType.ASC, config=None):
+
+        """
+        Return a list of tiles matching the criteria as a SINGLE-USE generator
+
+        See datacube.api.query.list_tiles_as_generator() - config is ignored
+
+        :rtype: list[datacube.api.model.Tile]
+        """
+
+        for row in self.find_rows(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                  dataset_types=dataset_types, months=months, exclude=exclude, sort=sort):
+            yield self.make_tile(row, dataset_types)
+
+    def list_tiles_as_list(self, x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                           sort=SortType.ASC, config=None):
+
+        return list(self.list_tiles_as_generator(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                                                 dataset_types=dataset_types, months=months, exclude=exclude,
+                                                 sort=sort, config=config))
+
+    def list_tiles_by_cell_as_generator(self, x, y, satellites, acq_min, acq_max, dataset_types, months=None,
+                                        exclude=None, sort=SortType.ASC, config=None):
+
+        """
+        Return the tiles matching the criteria grouped by cell as a SINGLE-USE generator of (cell, tiles) pairs
+
+        See datacube.api.query.list_tiles_by_cell_as_generator() - config is ignored
+        """
+
+        rows = self.find_rows(x=x, y=y, satellites=satellites, acq_min=acq_min, acq_max=acq_max,
+                              dataset_types=dataset_types, months=months, exclude=exclude, sort=sort,
+                              group_by_cell=True)
+
+        tiles = (self.make_tile(row, dataset_types) for row in rows)
+
+        for cell, cell_tiles in group_tiles_by_cell(tiles):
+            yield cell, cell_tiles
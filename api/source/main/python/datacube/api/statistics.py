@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import logging
+import numpy
+from enum import Enum
+
+
+_log = logging.getLogger(__name__)
+
+
+class Statistic(Enum):
+    __order__ = "COUNT COUNT_OBSERVED MIN MAX MEAN SUM STANDARD_DEVIATION VARIANCE"
+
+    COUNT = "COUNT"
+    COUNT_OBSERVED = "COUNT_OBSERVED"
+    MIN = "MIN"
+    MAX = "MAX"
+    MEAN = "MEAN"
+    SUM = "SUM"
+    STANDARD_DEVIATION = "STANDARD_DEVIATION"
+    VARIANCE = "VARIANCE"
+
+
+class StatisticsAccumulator(object):
+
+    """
+    Per pixel statistics of a time series accumulated a tile (or chunk) at a time
+
+    Each update() folds an observation into the running count/min/max/sum and (Welford) mean/M2 so memory is
+    proportional to the number of pixels rather than the number of observations.  Pixels that are the no data value (or
+    NaN) are ignored.
+
+    Usage::
+
+        accumulator = StatisticsAccumulator((y_size, x_size), ndv=ndv)
+
+        for tile in tiles:
+            accumulator.update(data)
+
+        statistics = accumulator.get_statistics([Statistic.MEAN, Statistic.STANDARD_DEVIATION])
+    """
+
+    def __init__(self, shape, ndv=None):
+
+        """
+        :param shape: The shape of the data
+        :type shape: tuple(int)
+        :param ndv: The no data value of the data (NaN is always treated as no data)
+        """
+
+        self.shape = shape
+        self.ndv = ndv
+
+        self.observations = 0
+
+        self.count = numpy.zeros(shape, dtype=numpy.int32)
+        self.minimum = numpy.empty(shape, dtype=numpy.float64)
+        self.minimum.fill(numpy.inf)
+        self.maximum = numpy.empty(shape, dtype=numpy.float64)
+        self.maximum.fill(-numpy.inf)
+        self.sum = numpy.zeros(shape, dtype=numpy.float64)
+        self.mean = numpy.zeros(shape, dtype=numpy.float64)
+        self.m2 = numpy.zeros(shape, dtype=numpy.float64)
+
+    def update(self, data):
+
+        """
+        Add an observation
+
+        :param data: The data
+        :type data: numpy.ndarray
+        """
+
+        self.observations += 1
+
+        x = numpy.array(data, dtype=numpy.float64)
+
+        valid = numpy.isfinite(x)
+
+        if self.ndv is not None:
+            numpy.logical_and(valid, x != self.ndv, out=valid)
+
+        invalid = ~valid
+
+        numpy.add(self.count, valid, out=self.count)
+
+        numpy.minimum(self.minimum, x, out=self.minimum, where=valid)
+        numpy.maximum(self.maximum, x, out=self.maximum, where=valid)
+
+        x[invalid] = 0
+
+        numpy.add(self.sum, x, out=self.sum)
+
+        # Welford - mean += delta / n; M2 += delta * (x - mean) (with delta zeroed where there is no observation)
+
+        delta = x - self.mean
+        delta[invalid] = 0
+
+        numpy.add(self.mean, delta / numpy.maximum(self.count, 1), out=self.mean)
+
+        numpy.subtract(x, self.mean, out=x)
+        numpy.multiply(x, delta, out=x)
+        numpy.add(self.m2, x, out=self.m2)
+
+    def combine(self, other):
+
+        """
+        Fold in the statistics of another accumulator (e.g. of a different set of observations of the same pixels)
+
+        :param other: The other accumulator
+        :type other: StatisticsAccumulator
+        """
+
+        self.observations += other.observations
+
+        count = self.count + other.count
+        n = numpy.maximum(count, 1)
+
+        delta = other.mean - self.mean
+
+        numpy.add(self.m2, other.m2 + delta * delta * self.count * other.count / n, out=self.m2)
+        numpy.add(self.mean, delta * other.count / n, out=self.mean)
+
+        numpy.minimum(self.minimum, other.minimum, out=self.minimum)
+        numpy.maximum(self.maximum, other.maximum, out=self.maximum)
+        numpy.add(self.sum, other.sum, out=self.sum)
+
+        self.count = count
+
+    def get_statistics(self, statistics=None, ndv=numpy.nan, dtype=numpy.float32):
+
+        """
+        Return the requested statistics
+
+        The variance and standard deviation are the population ones (as per numpy.nanvar/numpy.nanstd).
+
+        :param statistics: The statistics (defaults to all of them)
+        :type statistics: list[Statistic]
+        :param ndv: The value for pixels with no observations
+        :param dtype: The data type of the returned arrays
+        :return: dictionary of statistic/data
+        """
+
+        if statistics is None:
+            statistics = list(Statistic)
+
+        empty = self.count == 0
+        n = numpy.maximum(self.count, 1)
+
+        out = dict()
+
+        for statistic in statistics:
+
+            if statistic == Statistic.COUNT:
+                data = numpy.empty(self.shape, dtype=dtype)
+                data.fill(self.observations)
+
+            elif statistic == Statistic.COUNT_OBSERVED:
+                data = self.count.astype(dtype)
+
+            elif statistic == Statistic.SUM:
+                data = self.sum.astype(dtype)
+
+            else:
+                if statistic == Statistic.MIN:
+                    data = self.minimum.astype(dtype)
+
+                elif statistic == Statistic.MAX:
+                    data = self.maximum.astype(dtype)
+
+                elif statistic == Statistic.MEAN:
+                    data = self.mean.astype(dtype)
+
+                elif statistic == Statistic.VARIANCE:
+                    data = (self.m2 / n).astype(dtype)
+
+                elif statistic == Statistic.STANDARD_DEVIATION:
+                    data = numpy.sqrt(self.m2 / n).astype(dtype)
+
+                else:
+                    raise ValueError("Unsupported statistic [{statistic}]".format(statistic=statistic))
+
+                data[empty] = ndv
+
+            out[statistic] = data
+
+        return out
+
+
+# Number of pixels processed at a time when calculating percentiles (bounds the size of the float64 copy of the stack)
+
+DEFAULT_PERCENTILE_CHUNK_PIXELS = 256 * 1024
+
+
+class PercentileInterpolation(Enum):
+    __order__ = "LINEAR LOWER RANK"
+
+    LINEAR = "LINEAR"   # As per numpy.percentile - interpolate between the values either side of q * (n - 1)
+    LOWER = "LOWER"     # The value at floor(q * (n - 1))
+    RANK = "RANK"       # The value at floor(q * n) (i.e. the q-th value of the sorted observations)
+
+
+def calculate_percentiles(stack, percentiles, ndv=None, interpolation=PercentileInterpolation.LINEAR,
+                          output_ndv=numpy.nan, dtype=numpy.float32, chunk_pixels=DEFAULT_PERCENTILE_CHUNK_PIXELS):
+
+    """
+    Return several percentiles of a (time, ...) stack at once
+
+    Rather than sorting the stack (once per percentile) the time axis of each chunk of pixels is partitioned once with
+    all the indices needed for all the percentiles.  Observations which are the no data value (or NaN) are ignored.
+
+    :param stack: The stack of observations (time, y, x)
+    :type stack: numpy.ndarray
+    :param percentiles: The percentiles (0 to 100)
+    :type percentiles: list[float]
+    :param ndv: The no data value of the stack (NaN is always treated as no data)
+    :param interpolation: How to calculate the percentile from the ordered observations
+    :type interpolation: PercentileInterpolation
+    :param output_ndv: The value for pixels with no observations
+    :param dtype: The data type of the returned array
+    :param chunk_pixels: The number of pixels to process at a time
+    :type chunk_pixels: int
+    :return: The percentiles (percentile, y, x)
+    :rtype: numpy.ndarray
+    """
+
+    stack = numpy.asarray(stack)
+
+    times = stack.shape[0]
+    shape = stack.shape[1:]
+
+    data = stack.reshape((times, -1))
+    pixels = data.shape[1]
+
+    q = numpy.asarray(percentiles, dtype=numpy.float64)[:, numpy.newaxis] / 100
+
+    out = numpy.empty((len(percentiles), pixels), dtype=dtype)
+
+    for start in xrange(0, pixels, chunk_pixels):
+
+        stop = min(start + chunk_pixels, pixels)
+
+        x = numpy.array(data[:, start:stop], dtype=numpy.float64)
+
+        # Move the no data observations to the end of the ordering
+
+        invalid = ~numpy.isfinite(x)
+
+        if ndv is not None:
+            numpy.logical_or(invalid, x == ndv, out=invalid)
+
+        x[invalid] = numpy.inf
+
+        n = times - invalid.sum(axis=0)
+
+        # The (per pixel) indices of the ordered observations each percentile needs
+
+        if interpolation == PercentileInterpolation.LINEAR:
+            position = q * (n - 1)
+            lower = numpy.floor(position).astype(numpy.int64)
+            upper = numpy.ceil(position).astype(numpy.int64)
+            fraction = position - lower
+
+        elif interpolation == PercentileInterpolation.LOWER:
+            lower = upper = numpy.floor(q * (n - 1)).astype(numpy.int64)
+            fraction = None
+
+        elif interpolation == PercentileInterpolation.RANK:
+            lower = upper = numpy.minimum(numpy.floor(q * n), n - 1).astype(numpy.int64)
+            fraction = None
+
+        else:
+            raise ValueError("Unsupported interpolation [{interpolation}]".format(interpolation=interpolation))
+
+        numpy.maximum(lower, 0, out=lower)
+        numpy.maximum(upper, 0, out=upper)
+
+        # One partition for all of them
+
+        x.partition(numpy.union1d(lower.ravel(), upper.ravel()), axis=0)
+
+        columns = numpy.arange(stop - start)
+
+        result = x[lower, columns]
+
+        # (pixels with no observations are inf - inf here but are set to the output no data value below)
+
+        if fraction is not None:
+            with numpy.errstate(invalid="ignore"):
+                result += (x[upper, columns] - result) * fraction
+
+        result[:, n == 0] = output_ndv
+
+        out[:, start:stop] = result
+
+    return out.reshape((len(percentiles),) + shape)
+
+
+# Number of histogram bins used by the approximate percentiles
+
+DEFAULT_PERCENTILE_BINS = 128
+
+
+class PercentileAccumulator(object):
+
+    """
+    Approximate per pixel percentiles of a time series accumulated a tile (or chunk) at a time
+
+    For stacks that don't fit in memory - each pixel has a histogram of (by default DEFAULT_PERCENTILE_BINS) bins over
+    the (known) range of the data.  The percentiles are interpolated (as per PercentileInterpolation.LINEAR) between the
+    centres of the bins holding the ordered observations either side of them, so they are accurate to within half a bin
+    width.  The counts are uint16 (widened to uint32 once there are more observations than a uint16 can count) so memory
+    is bins x pixels x 2 bytes regardless of the number of observations - 256 bytes a pixel with the default bins.
+    """
+
+    def __init__(self, shape, minimum, maximum, bins=DEFAULT_PERCENTILE_BINS, ndv=None):
+
+        """
+        :param shape: The shape of the data
+        :type shape: tuple(int)
+        :param minimum: The minimum value of the data (values below are counted in the first bin)
+        :param maximum: The maximum value of the data (values above are counted in the last bin)
+        :param bins: The number of histogram bins
+        :type bins: int
+        :param ndv: The no data value of the data (NaN is always treated as no data)
+        """
+
+        self.shape = shape
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.bins = bins
+        self.ndv = ndv
+
+        self.width = (self.maximum - self.minimum) / bins
+
+        self.observations = 0
+
+        self.histogram = numpy.zeros((bins, numpy.prod(shape, dtype=numpy.int64)), dtype=numpy.uint16)
+
+    def update(self, data):
+
+        """
+        Add an observation
+
+        :param data: The data
+        :type data: numpy.ndarray
+        """
+
+        self.observations += 1
+
+        if self.observations > numpy.iinfo(self.histogram.dtype).max:
+            self.histogram = self.histogram.astype(numpy.uint32)
+
+        x = numpy.array(data, dtype=numpy.float64).ravel()
+
+        valid = numpy.isfinite(x)
+
+        if self.ndv is not None:
+            numpy.logical_and(valid, x != self.ndv, out=valid)
+
+        pixels = numpy.flatnonzero(valid)
+
+        index = numpy.floor((x[pixels] - self.minimum) / self.width).astype(numpy.int64)
+        numpy.clip(index, 0, self.bins - 1, out=index)
+
+        # Each pixel is in exactly one bin so there are no repeated indices
+
+        self.histogram[index, pixels] += 1
+
+    def get_percentiles(self, percentiles, output_ndv=numpy.nan, dtype=numpy.float32):
+
+        """
+        Return the (approximate) percentiles
+
+        :param percentiles: The percentiles (0 to 100)
+        :type percentiles: list[float]
+        :param output_ndv: The value for pixels with no observations
+        :param dtype: The data type of the returned array
+        :return: The percentiles (percentile, y, x)
+        :rtype: numpy.ndarray
+        """
+
+        n = self.histogram.sum(axis=0, dtype=numpy.int64)
+
+        # The ranks (0 based) of the ordered observations either side of each percentile - as per
+        # PercentileInterpolation.LINEAR
+
+        position = numpy.asarray(percentiles, dtype=numpy.float64)[:, numpy.newaxis] / 100 * numpy.maximum(n - 1, 0)
+
+        lower = numpy.floor(position)
+        upper = numpy.ceil(position)
+
+        # The bin holding the rank'th ordered observation is the number of bins whose cumulative count is <= rank.  The
+        # bins are walked in order so that only one row of cumulative counts is needed rather than bins x pixels of them
+        # (the last bin's cumulative count is n which is always > rank)
+
+        lower_bin = numpy.zeros(lower.shape, dtype=numpy.int64)
+        upper_bin = numpy.zeros(upper.shape, dtype=numpy.int64)
+
+        cumulative = numpy.zeros(n.shape, dtype=numpy.int64)
+
+        for b in xrange(self.bins - 1):
+            numpy.add(cumulative, self.histogram[b], out=cumulative)
+
+            lower_bin += cumulative <= lower
+            upper_bin += cumulative <= upper
+
+        # The centres of the bins
+
+        result = self.minimum + (lower_bin + 0.5) * self.width
+        result += (upper_bin - lower_bin) * self.width * (position - lower)
+
+        result[:, n == 0] = output_ndv
+
+        return result.astype(dtype).reshape((len(percentiles),) + tuple(self.shape))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import logging
+import numpy
+import os
+from datacube.api.chunk import CELL_SIZE_X, CELL_SIZE_Y
+
+
+_log = logging.getLogger(__name__)
+
+
+# Number of rows written to the raster at a time when converting a store
+
+DEFAULT_STORE_RASTER_ROWS = 256
+
+
+class CellStore(object):
+
+    """
+    A preallocated on-disk (band, y, x) array for a cell that chunk tasks write their windows into directly
+
+    The store is a raw memory-mapped file (rather than a .npy file per chunk per band) so each chunk task writes its
+    results once, in place, and the cell task converts the whole thing to a raster in a single streaming pass (see
+    to_raster()).
+
+    The file is created by whichever task opens it first - extending a file to its (fixed) size doesn't touch any data
+    already written so tasks running concurrently can all open it.  Each chunk task marks its window as done once
+    written (see mark_done() and is_done()) in a small companion flag file so completion can be checked without a
+    file per chunk.
+
+    There is no locking - the chunks' windows don't overlap so concurrent writers rely on the memory mapping of the
+    (shared) file being coherent.  That holds for processes on one node (e.g. --chunk-workers or a local luigi
+    scheduler) but not across nodes on a network filesystem (e.g. NFS) where the data and done flags written by one
+    node may not be seen by another - run all the chunks of a cell on the same node.
+    """
+
+    def __init__(self, path, count, width=CELL_SIZE_X, height=CELL_SIZE_Y, dtype=numpy.float32,
+                 chunk_size_x=None, chunk_size_y=None):
+
+        """
+        :param path: The path of the store file
+        :type path: str
+        :param count: The number of bands
+        :type count: int
+        :param width: Width of the cell
+        :type width: int
+        :param height: Height of the cell
+        :type height: int
+        :param dtype: The data type
+        :param chunk_size_x: The width of the chunk windows (for the done flags)
+        :type chunk_size_x: int
+        :param chunk_size_y: The height of the chunk windows (for the done flags)
+        :type chunk_size_y: int
+        """
+
+        self.path = path
+        self.count = count
+        self.width = width
+        self.height = height
+        self.dtype = numpy.dtype(dtype)
+
+        self.chunk_size_x = chunk_size_x or width
+        self.chunk_size_y = chunk_size_y or height
+
+        self.data = None
+        self.done = None
+
+    @property
+    def shape(self):
+        return self.count, self.height, self.width
+
+    @property
+    def done_path(self):
+        return self.path + ".done"
+
+    @property
+    def done_shape(self):
+        return (-(-self.height // self.chunk_size_y), -(-self.width // self.chunk_size_x))
+
+    def open(self):
+
+        """
+        Open the store (creating it if it doesn't exist yet)
+
+        :return: The (band, y, x) memory-mapped array
+        :rtype: numpy.memmap
+        """
+
+        if self.data is None:
+            self.data = open_memmap(self.path, self.dtype, self.shape)
+
+        return self.data
+
+    def open_done(self):
+
+        if self.done is None:
+            self.done = open_memmap(self.done_path, numpy.uint8, self.done_shape)
+
+        return self.done
+
+    def write(self, band, data, x=0, y=0):
+
+        """
+        Write a window of a band
+
+        Any of the window past the edge of the cell (e.g. a full sized chunk at the right or bottom edge) is dropped.
+
+        :param band: The band number (1 based)
+        :type band: int
+        :param data: The data
+        :type data: numpy.ndarray
+        :param x: X offset of the window
+        :type x: int
+        :param y: Y offset of the window
+        :type y: int
+        """
+
+        data = numpy.asarray(data)[:max(self.height - y, 0), :max(self.width - x, 0)]
+
+        y_size, x_size = numpy.shape(data)
+
+        self.open()[band - 1, y:y + y_size, x:x + x_size] = data
+
+    def read(self, band, x=0, y=0, x_size=None, y_size=None):
+
+        x_size = x_size or self.width - x
+        y_size = y_size or self.height - y
+
+        return self.open()[band - 1, y:y + y_size, x:x + x_size]
+
+    def mark_done(self, x, y):
+
+        """
+        Flush the data and mark the chunk window at (x, y) as written
+
+        :param x: X offset of the window
+        :type x: int
+        :param y: Y offset of the window
+        :type y: int
+        """
+
+        self.open().flush()
+
+        done = self.open_done()
+        done[y // self.chunk_size_y, x // self.chunk_size_x] = 1
+        done.flush()
+
+    def is_done(self, x, y):
+
+        if not os.path.exists(self.done_path):
+            return False
+
+        return bool(self.open_done()[y // self.chunk_size_y, x // self.chunk_size_x])
+
+    def close(self):
+
+        if self.data is not None:
+            self.data.flush()
+
+        self.data = None
+        self.done = None
+
+    def remove(self):
+
+        """
+        Close and delete the store (and its done flags)
+        """
+
+        self.close()
+
+        for path in [self.path, self.done_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def to_raster(self, path, transform, projection, ndv, data_type, rows=DEFAULT_STORE_RASTER_ROWS,
+                  band_descriptions=None, metadata=None, **kwargs):
+
+        """
+        Write the store to a raster in a single streaming pass (a strip of rows of a band at a time)
+
+        :param path: The output raster path
+        :type path: str
+        :param transform: Geo transform
+        :param projection: Projection
+        :param ndv: No data value
+        :param data_type: GDAL data type
+        :param rows: Number of rows written at a time
+        :type rows: int
+        :param band_descriptions: Band descriptions
+        :type band_descriptions: list[str]
+        :param metadata: Raster metadata
+        :type metadata: dict
+        :param kwargs: Additional arguments for the RasterWriter (e.g. driver, options, overviews)
+        """
+
+        from datacube.api.writer import RasterWriter
+
+        data = self.open()
+
+        with RasterWriter(path, self.width, self.height, self.count, data_type, transform, projection, ndv=ndv,
+                          metadata=metadata, **kwargs) as writer:
+
+            for band in range(1, self.count + 1):
+
+                if band_descriptions:
+                    writer.set_band_description(band, band_descriptions[band - 1])
+
+                for y in range(0, self.height, rows):
+                    writer.write(band, data[band - 1, y:y + rows], 0, y)
+
+
+def open_memmap(path, dtype, shape):
+
+    """
+    Open (creating or extending it to size if needed) a raw memory-mapped array file
+
+    :param path: The path
+    :type path: str
+    :param dtype: The data type
+    :param shape: The shape
+    :type shape: tuple(int)
+    :rtype: numpy.memmap
+    """
+
+    size = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o664)
+
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+    return numpy.memmap(path, dtype=dtype, mode="r+", shape=shape)
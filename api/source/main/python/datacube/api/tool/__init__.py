@@ -34,7 +34,7 @@ import argparse
 import logging
 import sys
 from datacube.api.model import Satellite, dataset_type_database, dataset_type_derived_nbar
-from datacube.api.utils import PqaMask, WofsMask
+from datacube.api.utils import PqaMask, WofsMask, lazy_shape
 from datacube.api import satellite_arg, pqa_mask_arg, wofs_mask_arg, parse_date_min, parse_date_max, readable_file
 
 
@@ -379,39 +379,13 @@ class AoiTool(Tool):
 
     def extract_cells_from_vector(self, epsg=4326):
 
-        import ogr
+        from datacube.api.utils import get_cells_for_geometry
 
         feature = self.extract_feature(epsg=epsg)
 
-        geom = feature.GetGeometryRef()
-
-        ulx, lrx, uly, lry = self.extract_bounds_from_vector()
-        _log.debug("cell bounds are [%s]", (ulx, uly, lrx, lry))
-
-        import itertools
-
-        # return [(x, y) for x, y in itertools.product(range(ulx, lrx), range(lry, uly))]
-
-        cells = list()
-
-        for x, y in itertools.product(range(ulx, lrx + 1), range(lry, uly + 1)):
-            _log.debug("Checking if [%03d,%04d] intersects", x, y)
-
-            polygon = ogr.CreateGeometryFromWkt(
-                "POLYGON(({ulx} {uly}, {urx} {ury}, {lrx} {lry}, {llx} {lly}, {ulx} {uly}))".format(
-                    ulx=x, uly=(y+1), urx=(x+1), ury=(y+1), lrx=(x+1), lry=y, llx=x, lly=y
-                ))
-
-            _log.debug("cell polygon is [%s]", polygon.ExportToWkt())
-
-            _log.debug("intersection is [%s]", geom.Intersection(polygon))
-
-            if geom.Intersects(polygon):
-                _log.debug("INTERSECTION")
-                cells.append((x, y))
+        cells = get_cells_for_geometry(feature.GetGeometryRef())
 
-            else:
-                _log.debug("NO INTERSECTION")
+        _log.debug("cells are [%s]", cells)
 
         return cells
 
@@ -467,7 +441,7 @@ class AoiTool(Tool):
         data = band.ReadAsArray()
         import numpy
 
-        _log.debug("Read [%s] from memory AOI mask dataset", numpy.shape(data))
+        _log.debug("Read [%s] from memory AOI mask dataset", lazy_shape(data))
         return numpy.ma.masked_not_equal(data, 1, copy=False).mask
 
 
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import logging
+import os
+from datacube.api.tool import Tool
+from datacube.api.snapshot import export_tile_index
+
+
+_log = logging.getLogger()
+
+
+class ExportTileIndexTool(Tool):
+
+    def __init__(self, name):
+
+        # Call method on super class
+        # super(self.__class__, self).__init__(name)
+        Tool.__init__(self, name)
+
+        self.x_min = None
+        self.x_max = None
+
+        self.y_min = None
+        self.y_max = None
+
+        self.output_file = None
+        self.overwrite = None
+
+    def setup_arguments(self):
+
+        # Call method on super class
+        # super(self.__class__, self).setup_arguments()
+        Tool.setup_arguments(self)
+
+        self.parser.add_argument("--x-min", help="X index of tiles", action="store", dest="x_min", type=int,
+                                 choices=range(110, 155 + 1), default=110, metavar="110 ... 155")
+        self.parser.add_argument("--x-max", help="X index of tiles", action="store", dest="x_max", type=int,
+                                 choices=range(110, 155 + 1), default=155, metavar="110 ... 155")
+
+        self.parser.add_argument("--y-min", help="Y index of tiles", action="store", dest="y_min", type=int,
+                                 choices=range(-45, -10 + 1), default=-45, metavar="-45 ... -10")
+        self.parser.add_argument("--y-max", help="Y index of tiles", action="store", dest="y_max", type=int,
+                                 choices=range(-45, -10 + 1), default=-10, metavar="-45 ... -10")
+
+        self.parser.add_argument("--output-file", help="The tile index snapshot (.npz) file to create",
+                                 action="store", dest="output_file", type=str, required=True)
+
+        self.parser.add_argument("--overwrite", help="Over write existing output file", action="store_true",
+                                 dest="overwrite", default=False)
+
+    def process_arguments(self, args):
+
+        # Call method on super class
+        # super(self.__class__, self).process_arguments(args)
+        Tool.process_arguments(self, args)
+
+        self.x_min = args.x_min
+        self.x_max = args.x_max
+
+        self.y_min = args.y_min
+        self.y_max = args.y_max
+
+        self.output_file = args.output_file
+        self.overwrite = args.overwrite
+
+    def log_arguments(self):
+
+        # Call method on super class
+        # super(self.__class__, self).log_arguments()
+        Tool.log_arguments(self)
+
+        _log.info("""
+        x = {x_min:03d} to {x_max:03d}
+        y = {y_min:04d} to {y_max:04d}
+        output file = {output_file}
+        over write existing = {overwrite}
+        """.format(x_min=self.x_min, x_max=self.x_max, y_min=self.y_min, y_max=self.y_max,
+                   output_file=self.output_file, overwrite=self.overwrite))
+
+    def go(self):
+
+        if os.path.exists(self.output_file) and not self.overwrite:
+            _log.error("Output file [%s] exists", self.output_file)
+            return
+
+        export_tile_index(self.output_file,
+                          x=range(self.x_min, self.x_max + 1), y=range(self.y_min, self.y_max + 1),
+                          satellites=self.satellites, acq_min=self.acq_min, acq_max=self.acq_max)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+
+    ExportTileIndexTool("Export Tile Index").run()
@@ -37,7 +37,7 @@ import csv
 import logging
 import os
 from datacube.api.utils import log_mem, intersection, get_mask_pqa, get_mask_wofs, get_dataset_data, NDV
-from datacube.api.utils import get_dataset_metadata
+from datacube.api.utils import get_dataset_metadata, lazy_shape, log_timing
 from datacube.api.model import DatasetType, Satellite, get_bands
 
 
@@ -175,6 +175,8 @@ class RetrieveAoiTimeSeries(AoiTool):
         cells = intersection(cells_vector, cells_db)
         _log.debug("Combined cells are [%d] [%s]", len(cells), cells)
 
+        debug = _log.isEnabledFor(logging.DEBUG)
+
         for (x, y) in cells:
             _log.info("Processing cell [%3d/%4d]", x, y)
 
@@ -197,7 +199,7 @@ class RetrieveAoiTimeSeries(AoiTool):
 
             pixel_count_aoi = (mask_aoi == False).sum()
 
-            _log.debug("mask_aoi is [%s]\n[%s]", numpy.shape(mask_aoi), mask_aoi)
+            _log.debug("mask_aoi is [%s]\n[%s]", lazy_shape(mask_aoi), mask_aoi)
 
             metadata = None
 
@@ -235,7 +237,7 @@ class RetrieveAoiTimeSeries(AoiTool):
                         pqa = tile.datasets[DatasetType.PQ25]
                         mask_pqa = get_mask_pqa(pqa, self.mask_pqa_mask)
 
-                    _log.debug("mask_pqa is [%s]\n[%s]", numpy.shape(mask_pqa), mask_pqa)
+                    _log.debug("mask_pqa is [%s]\n[%s]", lazy_shape(mask_pqa), mask_pqa)
 
                     # Apply WOFS if specified
 
@@ -246,10 +248,12 @@ class RetrieveAoiTimeSeries(AoiTool):
                         wofs = tile.datasets[DatasetType.WATER]
                         mask_wofs = get_mask_wofs(wofs, self.mask_wofs_mask)
 
-                    _log.debug("mask_wofs is [%s]\n[%s]", numpy.shape(mask_wofs), mask_wofs)
+                    _log.debug("mask_wofs is [%s]\n[%s]", lazy_shape(mask_wofs), mask_wofs)
+
+                    with log_timing("get_dataset_data", logger=_log, path=tile.datasets[self.dataset_type].path):
+                        data = get_dataset_data(tile.datasets[self.dataset_type], bands=bands)
 
-                    data = get_dataset_data(tile.datasets[self.dataset_type], bands=bands)
-                    _log.debug("data is [%s]\n[%s]", numpy.shape(data), data)
+                    _log.debug("data is [%s]\n[%s]", lazy_shape(data), data)
 
                     pixel_count_data = dict()
                     pixel_count_data_pqa = dict()
@@ -262,27 +266,35 @@ class RetrieveAoiTimeSeries(AoiTool):
                     for band in bands:
 
                         data[band] = numpy.ma.masked_equal(data[band], NDV)
-                        _log.debug("masked data is [%s] [%d]\n[%s]", numpy.shape(data), numpy.ma.count(data), data)
 
                         pixel_count_data[band] = numpy.ma.count(data[band])
 
+                        if debug:
+                            _log.debug("masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), pixel_count_data[band], data[band])
+
                         if pqa:
                             data[band].mask = numpy.ma.mask_or(data[band].mask, mask_pqa)
-                            _log.debug("PQA masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), numpy.ma.count(data[band]), data[band])
 
                         pixel_count_data_pqa[band] = numpy.ma.count(data[band])
 
+                        if pqa and debug:
+                            _log.debug("PQA masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), pixel_count_data_pqa[band], data[band])
+
                         if wofs:
                             data[band].mask = numpy.ma.mask_or(data[band].mask, mask_wofs)
-                            _log.debug("WOFS masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), numpy.ma.count(data[band]), data[band])
 
                         pixel_count_data_pqa_wofs[band] = numpy.ma.count(data[band])
 
+                        if wofs and debug:
+                            _log.debug("WOFS masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), pixel_count_data_pqa_wofs[band], data[band])
+
                         data[band].mask = numpy.ma.mask_or(data[band].mask, mask_aoi)
-                        _log.debug("AOI masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), numpy.ma.count(data[band]), data[band])
 
                         pixel_count_data_pqa_wofs_aoi[band] = numpy.ma.count(data[band])
 
+                        if debug:
+                            _log.debug("AOI masked data is [%s] [%d]\n[%s]", numpy.shape(data[band]), pixel_count_data_pqa_wofs_aoi[band], data[band])
+
                         mmin[band] = numpy.ma.min(data[band])
                         mmax[band] = numpy.ma.max(data[band])
                         mmean[band] = numpy.ma.mean(data[band])
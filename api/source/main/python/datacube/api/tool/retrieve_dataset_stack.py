@@ -35,12 +35,13 @@ import logging
 import os
 from datacube.api import dataset_type_arg, writeable_dir, output_format_arg
 from datacube.api.model import DatasetType
+from datacube.api.reader import read_as_generator, read_tile_data
 from datacube.api.tool import CellTool
-from datacube.api.utils import get_mask_pqa, get_mask_wofs, get_dataset_data_masked, format_date, OutputFormat, \
-    get_mask_vector_for_cell
+from datacube.api.utils import format_date, OutputFormat, get_mask_vector_for_cell
 from datacube.api.utils import get_dataset_band_stack_filename
 from datacube.api.utils import get_band_name_union, get_band_name_intersection
 from datacube.api.utils import get_dataset_ndv, get_dataset_datatype, get_dataset_metadata
+from datacube.api.writer import RasterWriter, get_driver_name
 from enum import Enum
 
 
@@ -190,9 +191,7 @@ class RetrieveDatasetStackTool(CellTool):
 
         # TODO move the dicking around with bands stuff into utils?
 
-        import gdal
-
-        driver = raster = None
+        writer = None
         metadata = None
         data_type = ndv = None
 
@@ -217,102 +216,88 @@ class RetrieveDatasetStackTool(CellTool):
 
             _log.info("Total tiles for band [%s] is [%d]", band_name, len(relevant_tiles))
 
-            for index, tile in enumerate(relevant_tiles, start=1):
-
-                dataset = tile.datasets[self.dataset_type]
-                assert dataset
-
-                band = dataset.bands[band_name]
-                assert band
-
-                if self.list_only:
-                    _log.info("Would stack band [%s] from dataset [%s]", band.name, dataset.path)
-                    continue
-
-                pqa = (self.mask_pqa_apply and DatasetType.PQ25 in tile.datasets) and tile.datasets[DatasetType.PQ25] or None
-                wofs = (self.mask_wofs_apply and DatasetType.WATER in tile.datasets) and tile.datasets[DatasetType.WATER] or None
-
-                if self.dataset_type not in tile.datasets:
-                    _log.debug("No [%s] dataset present for [%s] - skipping", self.dataset_type.name, tile.end_datetime)
-                    continue
-
-                filename = os.path.join(self.output_directory,
-                                        get_dataset_band_stack_filename(dataset, band,
-                                                                        output_format=self.output_format,
-                                                                        mask_pqa_apply=self.mask_pqa_apply,
-                                                                        mask_wofs_apply=self.mask_wofs_apply,
-                                                                        mask_vector_apply=self.mask_vector_apply))
-
-                if not metadata:
-                    metadata = get_dataset_metadata(dataset)
-                    assert metadata
+            if self.list_only:
+                for tile in relevant_tiles:
+                    dataset = tile.datasets[self.dataset_type]
+                    _log.info("Would stack band [%s] from dataset [%s]", dataset.bands[band_name].name, dataset.path)
+                continue
 
-                if not data_type:
-                    data_type = get_dataset_datatype(dataset)
-                    assert data_type
+            # Read (and mask) the tiles in parallel ahead of them being written to the stack
 
-                if not ndv:
-                    ndv = get_dataset_ndv(dataset)
-                    assert ndv
+            def read(tile):
+                dataset = tile.datasets[self.dataset_type]
 
-                if not driver:
+                return read_tile_data(tile, self.dataset_type, bands=[dataset.bands[band_name]],
+                                      mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
+                                      mask_wofs_apply=self.mask_wofs_apply, mask_wofs_mask=self.mask_wofs_mask,
+                                      ndv=get_dataset_ndv(dataset), mask=mask)
 
-                    if self.output_format == OutputFormat.GEOTIFF:
-                        driver = gdal.GetDriverByName("GTiff")
-                    elif self.output_format == OutputFormat.ENVI:
-                        driver = gdal.GetDriverByName("ENVI")
+            # Abort (rather than close) the stack on error so that the error isn't replaced by one from the writer
 
-                    assert driver
+            try:
+                for index, (tile, data) in enumerate(read_as_generator(relevant_tiles, read), start=1):
 
-                if not raster:
+                    dataset = tile.datasets[self.dataset_type]
+                    assert dataset
 
-                    if self.output_format == OutputFormat.GEOTIFF:
-                        raster = driver.Create(filename, metadata.shape[0], metadata.shape[1], len(tiles), data_type, options=["BIGTIFF=YES", "INTERLEAVE=BAND"])
-                    elif self.output_format == OutputFormat.ENVI:
-                        raster = driver.Create(filename, metadata.shape[0], metadata.shape[1], len(tiles), data_type, options=["INTERLEAVE=BSQ"])
+                    band = dataset.bands[band_name]
+                    assert band
 
-                    assert raster
+                    pqa = (self.mask_pqa_apply and DatasetType.PQ25 in tile.datasets) and tile.datasets[DatasetType.PQ25] or None
+                    wofs = (self.mask_wofs_apply and DatasetType.WATER in tile.datasets) and tile.datasets[DatasetType.WATER] or None
 
-                    # NOTE: could do this without the metadata!!
-                    raster.SetGeoTransform(metadata.transform)
-                    raster.SetProjection(metadata.projection)
+                    if self.dataset_type not in tile.datasets:
+                        _log.debug("No [%s] dataset present for [%s] - skipping", self.dataset_type.name, tile.end_datetime)
+                        continue
 
-                raster.SetMetadata(self.generate_raster_metadata())
+                    filename = os.path.join(self.output_directory,
+                                            get_dataset_band_stack_filename(dataset, band,
+                                                                            output_format=self.output_format,
+                                                                            mask_pqa_apply=self.mask_pqa_apply,
+                                                                            mask_wofs_apply=self.mask_wofs_apply,
+                                                                            mask_vector_apply=self.mask_vector_apply))
 
-                # mask = None
+                    if not metadata:
+                        metadata = get_dataset_metadata(dataset)
+                        assert metadata
 
-                if pqa:
-                    mask = get_mask_pqa(pqa, self.mask_pqa_mask, mask=mask)
+                    if not data_type:
+                        data_type = get_dataset_datatype(dataset)
+                        assert data_type
 
-                if wofs:
-                    mask = get_mask_wofs(wofs, self.mask_wofs_mask, mask=mask)
+                    if not ndv:
+                        ndv = get_dataset_ndv(dataset)
+                        assert ndv
 
-                _log.info("Stacking [%s] band data from [%s] with PQA [%s] and PQA mask [%s] and WOFS [%s] and WOFS mask [%s] to [%s]",
-                          band.name, dataset.path,
-                          pqa and pqa.path or "",
-                          pqa and self.mask_pqa_mask or "",
-                          wofs and wofs.path or "", wofs and self.mask_wofs_mask or "",
-                          filename)
+                    # The stack is written (and its statistics calculated) on a background thread while the next tile is read
 
-                data = get_dataset_data_masked(dataset, mask=mask, ndv=ndv)
+                    if not writer:
+                        writer = RasterWriter(filename, metadata.shape[0], metadata.shape[1], len(tiles), data_type,
+                                              metadata.transform, metadata.projection, ndv=ndv,
+                                              driver=get_driver_name(self.output_format),
+                                              metadata=self.generate_raster_metadata())
 
-                _log.debug("data is [%s]", data)
+                    _log.info("Stacking [%s] band data from [%s] with PQA [%s] and PQA mask [%s] and WOFS [%s] and WOFS mask [%s] to [%s]",
+                              band.name, dataset.path,
+                              pqa and pqa.path or "",
+                              pqa and self.mask_pqa_mask or "",
+                              wofs and wofs.path or "", wofs and self.mask_wofs_mask or "",
+                              filename)
 
-                stack_band = raster.GetRasterBand(index)
+                    _log.debug("data is [%s]", data)
 
-                stack_band.SetDescription(os.path.basename(dataset.path))
-                stack_band.SetNoDataValue(ndv)
-                stack_band.WriteArray(data[band])
-                stack_band.ComputeStatistics(True)
-                stack_band.SetMetadata({"ACQ_DATE": format_date(tile.end_datetime), "SATELLITE": dataset.satellite.name})
+                    writer.set_band_description(index, os.path.basename(dataset.path))
+                    writer.set_band_metadata(index, {"ACQ_DATE": format_date(tile.end_datetime), "SATELLITE": dataset.satellite.name})
+                    writer.write(index, data[band])
 
-                stack_band.FlushCache()
-                del stack_band
+            except Exception:
+                if writer:
+                    writer.abort()
+                raise
 
-            if raster:
-                raster.FlushCache()
-                del raster
-                raster = None
+            if writer:
+                writer.close()
+                writer = None
 
     def generate_raster_metadata(self):
         return {
@@ -33,11 +33,15 @@ __author__ = "Simon Oldfield"
 
 import csv
 import logging
+import numpy
 import os
 import sys
+from collections import namedtuple
 from enum import Enum
-from datacube.api import dataset_type_arg, writeable_dir
+from datacube.api import dataset_type_arg, writeable_dir, readable_file
+from datacube.api.chunk import get_block_size
 from datacube.api.model import DatasetType, Wofs25Bands, Satellite
+from datacube.api.reader import read_as_generator, read_tile_data
 from datacube.api.tool import Tool
 from datacube.api.utils import latlon_to_cell, latlon_to_xy, UINT16_MAX, BYTE_MAX, get_mask_pqa, get_band_name_union
 from datacube.api.utils import NAN
@@ -57,6 +61,9 @@ class BandListType(Enum):
     COMMON = "COMMON"
 
 
+Point = namedtuple("Point", ["id", "latitude", "longitude"])
+
+
 class RetrievePixelTimeSeriesTool(Tool):
 
     def __init__(self, name):
@@ -68,6 +75,8 @@ class RetrievePixelTimeSeriesTool(Tool):
         self.latitude = None
         self.longitude = None
 
+        self.points_file = None
+
         self.output_no_data = None
 
         self.dataset_type = None
@@ -83,10 +92,13 @@ class RetrievePixelTimeSeriesTool(Tool):
         # super(self.__class__, self).setup_arguments()
         Tool.setup_arguments(self)
 
-        self.parser.add_argument("--lat", help="Latitude value of pixel", action="store", dest="latitude", type=float,
-                                 required=True)
-        self.parser.add_argument("--lon", help="Longitude value of pixel", action="store", dest="longitude", type=float,
-                                 required=True)
+        self.parser.add_argument("--lat", help="Latitude value of pixel", action="store", dest="latitude", type=float)
+        self.parser.add_argument("--lon", help="Longitude value of pixel", action="store", dest="longitude", type=float)
+
+        self.parser.add_argument("--points-file",
+                                 help="File of points to retrieve (instead of --lat/--lon) - either a CSV file with ID, "
+                                      "LATITUDE and LONGITUDE columns or a (lat/lon) vector file of points",
+                                 action="store", dest="points_file", type=readable_file)
 
         self.parser.add_argument("--hide-no-data", help="Don't output records that are completely no data value(s)",
                                  action="store_false", dest="output_no_data", default=True)
@@ -129,6 +141,11 @@ class RetrievePixelTimeSeriesTool(Tool):
         self.latitude = args.latitude
         self.longitude = args.longitude
 
+        self.points_file = args.points_file
+
+        if not self.points_file and (self.latitude is None or self.longitude is None):
+            self.parser.error("Either --lat and --lon or --points-file must be specified")
+
         self.output_no_data = args.output_no_data
 
         self.dataset_type = args.dataset_type
@@ -149,15 +166,16 @@ class RetrievePixelTimeSeriesTool(Tool):
         Tool.log_arguments(self)
 
         _log.info("""
-        longitude = {longitude:f}
-        latitude = {latitude:f}
+        longitude = {longitude}
+        latitude = {latitude}
+        points file = {points_file}
         datasets to retrieve = {dataset_type}
         bands to retrieve = {bands}
         output no data values = {output_no_data}
         output = {output}
         over write = {overwrite}
         delimiter = {delimiter}
-        """.format(longitude=self.longitude, latitude=self.latitude,
+        """.format(longitude=self.longitude, latitude=self.latitude, points_file=self.points_file,
                    dataset_type=self.dataset_type.name,
                    bands=self.bands,
                    output_no_data=self.output_no_data,
@@ -190,9 +208,7 @@ class RetrievePixelTimeSeriesTool(Tool):
                                dataset_types=dataset_types):
             yield tile
 
-    def go(self):
-
-        cell_x, cell_y = latlon_to_cell(self.latitude, self.longitude)
+    def get_ndv(self):
 
         # TODO - PQ is UNIT16 and WOFS is BYTE (others are INT16) and so -999 NDV doesn't work
         ndv = NDV
@@ -206,6 +222,18 @@ class RetrievePixelTimeSeriesTool(Tool):
         elif self.dataset_type in [DatasetType.NDVI, DatasetType.EVI, DatasetType.NBR, DatasetType.TCI]:
             ndv = NAN
 
+        return ndv
+
+    def go(self):
+
+        if self.points_file:
+            self.go_points()
+            return
+
+        cell_x, cell_y = latlon_to_cell(self.latitude, self.longitude)
+
+        ndv = self.get_ndv()
+
         with self.get_output_file(self.dataset_type, self.overwrite) as csv_file:
 
             csv_writer = csv.writer(csv_file, delimiter=self.delimiter)
@@ -230,6 +258,54 @@ class RetrievePixelTimeSeriesTool(Tool):
                     csv_writer.writerow([dataset.satellite.name, format_date_time(tile.end_datetime)] +
                                         decode_data(self.dataset_type, dataset, self.bands, data))
 
+    def go_points(self):
+
+        # Retrieve the points grouped by cell so that each tile is only read once for all the points in it
+
+        ndv = self.get_ndv()
+
+        cells = dict()
+
+        for point in read_points(self.points_file):
+            cells.setdefault(latlon_to_cell(point.latitude, point.longitude), list()).append(point)
+
+        _log.info("Retrieving [%d] points from [%d] cells", sum([len(points) for points in cells.itervalues()]), len(cells))
+
+        with self.get_output_file(self.dataset_type, self.overwrite) as csv_file:
+
+            csv_writer = csv.writer(csv_file, delimiter=self.delimiter)
+
+            # Output a HEADER
+
+            csv_writer.writerow(["POINT ID", "LATITUDE", "LONGITUDE", "SATELLITE", "ACQUISITION DATE"] + self.bands)
+
+            for (cell_x, cell_y), points in sorted(cells.iteritems()):
+
+                _log.info("Retrieving [%d] points from cell [%3d/%4d]", len(points), cell_x, cell_y)
+
+                tiles = [tile for tile in self.get_tiles(x=cell_x, y=cell_y) if self.dataset_type in tile.datasets]
+
+                if not tiles:
+                    continue
+
+                windows = get_point_windows(tiles[0].datasets[self.dataset_type], points)
+
+                def read(tile):
+                    return retrieve_pixel_values(tile, self.dataset_type, windows, len(points),
+                                                 self.mask_pqa_apply, self.mask_pqa_mask,
+                                                 self.mask_wofs_apply, self.mask_wofs_mask, ndv=ndv)
+
+                for tile, data in read_as_generator(tiles, read):
+
+                    dataset = tile.datasets[self.dataset_type]
+
+                    for index, point in enumerate(points):
+
+                        if has_data(dataset.bands, data, no_data_value=ndv, index=index) or self.output_no_data:
+                            csv_writer.writerow([point.id, point.latitude, point.longitude,
+                                                 dataset.satellite.name, format_date_time(tile.end_datetime)] +
+                                                decode_data(self.dataset_type, dataset, self.bands, data, index=index))
+
     def get_output_file(self, dataset_type, overwrite=False):
 
         if not self.output_directory:
@@ -248,9 +324,13 @@ class RetrievePixelTimeSeriesTool(Tool):
 
     def get_output_filename(self, dataset_type):
 
+        if self.points_file:
+            location = os.path.splitext(os.path.basename(self.points_file))[0]
+        else:
+            location = "{longitude:03.5f}_{latitude:03.5f}".format(latitude=self.latitude, longitude=self.longitude)
+
         if dataset_type == DatasetType.WATER:
-            return os.path.join(self.output_directory,"LS_WOFS_{longitude:03.5f}_{latitude:03.5f}_{acq_min}_{acq_max}.csv".format(latitude=self.latitude,
-                                                                                              longitude=self.longitude,
+            return os.path.join(self.output_directory,"LS_WOFS_{location}_{acq_min}_{acq_max}.csv".format(location=location,
                                                                                               acq_min=self.acq_min,
                                                                                               acq_max=self.acq_max))
         satellite_str = ""
@@ -291,24 +371,23 @@ class RetrievePixelTimeSeriesTool(Tool):
             dataset_str += "_WITH_WATER"
 
         return os.path.join(self.output_directory,
-                            "{satellite}_{dataset}_{longitude:03.5f}_{latitude:03.5f}_{acq_min}_{acq_max}.csv".format(satellite=satellite_str, dataset=dataset_str, latitude=self.latitude,
-                                                                                          longitude=self.longitude,
+                            "{satellite}_{dataset}_{location}_{acq_min}_{acq_max}.csv".format(satellite=satellite_str, dataset=dataset_str, location=location,
                                                                                           acq_min=self.acq_min,
                                                                                           acq_max=self.acq_max))
 
 
-def has_data(bands, data, no_data_value=NDV):
-    for value in [data[band][0][0] for band in bands]:
+def has_data(bands, data, no_data_value=NDV, index=(0, 0)):
+    for value in [data[band][index] for band in bands]:
         if value != no_data_value:
             return True
 
     return False
 
 
-def decode_data(dataset_type, dataset, bands, data):
+def decode_data(dataset_type, dataset, bands, data, index=(0, 0)):
 
     if dataset_type == DatasetType.WATER:
-        return [decode_wofs_water_value(data[Wofs25Bands.WATER][0][0]), str(data[Wofs25Bands.WATER][0][0])]
+        return [decode_wofs_water_value(data[Wofs25Bands.WATER][index]), str(data[Wofs25Bands.WATER][index])]
 
     values = list()
 
@@ -317,13 +396,120 @@ def decode_data(dataset_type, dataset, bands, data):
     for b in bands:
 
         if b in dataset_band_names:
-            values.append(str(data[dataset.bands[b]][0, 0]))
+            values.append(str(data[dataset.bands[b]][index]))
         else:
             values.append("")
 
     return values
 
 
+def read_points(filename):
+
+    """
+    Read points from either a CSV file (with ID, LATITUDE and LONGITUDE columns) or a vector file of (lat/lon) points
+
+    :param filename: The points file
+    :type filename: str
+    :return: The points
+    :rtype: list[Point]
+    """
+
+    if os.path.splitext(filename)[1].lower() == ".csv":
+
+        with open(filename, "rb") as f:
+            for record in csv.DictReader(f):
+                record = dict((k.strip().upper(), v) for k, v in record.iteritems())
+                yield Point(record["ID"], float(record["LATITUDE"]), float(record["LONGITUDE"]))
+
+    else:
+        import ogr
+
+        vector = ogr.Open(filename)
+        assert vector
+
+        layer = vector.GetLayer(0)
+        assert layer
+
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            yield Point(str(feature.GetFID()), geometry.GetY(), geometry.GetX())
+
+        del layer, vector
+
+
+def get_point_windows(dataset, points):
+
+    """
+    Group the points (all in the same cell) by the block of the dataset that they are in
+
+    Returns a list of (x, y, x_size, y_size, indexes, xs, ys) tuples being the window covering the points within the
+    block, the indexes of those points in the list of points, and their pixel positions within the window.
+
+    :param dataset: A dataset in the cell
+    :type dataset: datacube.api.model.DatasetTile
+    :param points: The points
+    :type points: list[Point]
+    :rtype: list[(int, int, int, int, numpy.ndarray, numpy.ndarray, numpy.ndarray)]
+    """
+
+    metadata = get_dataset_metadata(dataset)
+
+    block_x, block_y = get_block_size(dataset.path)
+
+    blocks = dict()
+
+    for index, point in enumerate(points):
+        x, y = latlon_to_xy(point.latitude, point.longitude, metadata.transform)
+        blocks.setdefault((x // block_x, y // block_y), list()).append((index, x, y))
+
+    windows = list()
+
+    for block in sorted(blocks):
+        indexes, xs, ys = [numpy.array(a) for a in zip(*blocks[block])]
+
+        x, y = xs.min(), ys.min()
+
+        windows.append((x, y, xs.max() - x + 1, ys.max() - y + 1, indexes, xs - x, ys - y))
+
+    return windows
+
+
+def retrieve_pixel_values(tile, dataset_type, windows, count, mask_pqa_apply, pqa_masks, mask_wofs_apply, wofs_masks,
+                          ndv=NDV):
+
+    """
+    Return the values of the points (see get_point_windows) from the dataset of the tile, reading one window per block
+
+    :type tile: datacube.api.model.Tile
+    :type dataset_type: datacube.api.model.DatasetType
+    :param windows: The point windows as returned by get_point_windows
+    :param count: The number of points
+    :type count: int
+    :type mask_pqa_apply: bool
+    :type pqa_masks: list[datacube.api.utils.PqaMask]
+    :type mask_wofs_apply: bool
+    :type wofs_masks: list[datacube.api.utils.WofsMask]
+    :return: dictionary of band/values (indexed by point) as numpy array
+    :rtype: dict[numpy.ndarray]
+    """
+
+    out = dict()
+
+    for x, y, x_size, y_size, indexes, xs, ys in windows:
+
+        data = read_tile_data(tile, dataset_type, x=x, y=y, x_size=x_size, y_size=y_size,
+                              mask_pqa_apply=mask_pqa_apply, mask_pqa_mask=pqa_masks,
+                              mask_wofs_apply=mask_wofs_apply, mask_wofs_mask=wofs_masks, ndv=ndv)
+
+        for band in data:
+            if band not in out:
+                out[band] = numpy.empty(count, dtype=data[band].dtype)
+
+            out[band][indexes] = data[band][ys, xs]
+
+    return out
+
+
 def retrieve_pixel_value(dataset, pqa, pqa_masks, wofs, wofs_masks, latitude, longitude, ndv=NDV):
 
     _log.debug(
@@ -34,6 +34,10 @@ import logging
 import numpy
 import gdal
 import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from gdalconst import *
 from enum import Enum
 from datacube.api.model import Pq25Bands, Ls57Arg25Bands, Satellite, DatasetType, Ls8Arg25Bands, Wofs25Bands, NdviBands
@@ -169,125 +173,287 @@ class DatasetMetaData:
         self.lr = (self.ul[0] + self.pixel_size_x * self.shape[0], self.ul[1] + self.pixel_size_y * self.shape[1])
 
 
-def get_dataset_metadata(dataset):
+# Number of open GDAL datasets to keep if the file descriptor limit can't be determined
 
-    raster = gdal.Open(dataset.path, GA_ReadOnly)
-    assert raster
+GDAL_DATASET_CACHE_SIZE = 64
 
-    band_metadata = dict()
+# Fraction of the process's file descriptor limit the GDAL dataset cache may use
 
-    for band in dataset.bands:
-        raster_band = raster.GetRasterBand(band.value)
-        assert raster_band
+GDAL_DATASET_CACHE_FD_FRACTION = 0.25
 
-        band_metadata[band] = DatasetBandMetaData(raster_band.GetNoDataValue(), raster_band.DataType)
 
-        raster_band.FlushCache()
-        del raster_band
+def get_gdal_dataset_cache_size():
 
-    dataset_metadata = DatasetMetaData((raster.RasterXSize, raster.RasterYSize), raster.GetGeoTransform(), raster.GetProjection(), band_metadata)
+    """
+    The default number of open GDAL datasets to cache - a fraction of the soft file descriptor limit capped at
+    GDAL_DATASET_CACHE_SIZE
 
-    raster.FlushCache()
-    del raster
+    :rtype: int
+    """
 
-    return dataset_metadata
+    try:
+        import resource
 
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
 
-def get_dataset_data(dataset, bands=None, x=0, y=0, x_size=None, y_size=None):
+        if soft == resource.RLIM_INFINITY:
+            return GDAL_DATASET_CACHE_SIZE
 
-    # dataset_types_physical = [
-    #     DatasetType.ARG25, DatasetType.PQ25, DatasetType.FC25,
-    #     DatasetType.WATER,
-    #     DatasetType.DSM, DatasetType.DEM, DatasetType.DEM_HYDROLOGICALLY_ENFORCED, DatasetType.DEM_SMOOTHED]
-    #
-    # dataset_types_virtual_nbar = [
-    #     DatasetType.NDVI,
-    #     DatasetType.EVI,
-    #     DatasetType.NBR,
-    #     DatasetType.TCI
-    # ]
+        return max(1, min(GDAL_DATASET_CACHE_SIZE, int(soft * GDAL_DATASET_CACHE_FD_FRACTION)))
+
+    except (ImportError, ValueError):
+        return GDAL_DATASET_CACHE_SIZE
 
-    # NDVI calculated using RED and NIR from ARG25
 
-    if dataset.dataset_type == DatasetType.NDVI:
+class GdalDatasetCache(object):
 
-        bands = get_bands(DatasetType.ARG25, dataset.satellite)
+    """
+    Bounded LRU cache of open (read only) GDAL datasets and their metadata
+
+    GDAL dataset handles must not be shared between threads so handles are cached per (thread, path).  The size limit
+    applies across all threads so that it bounds the number of open files.  Metadata is immutable and is shared.
 
-        band_red = bands[Ls57Arg25Bands.RED.name]
-        band_nir = bands[Ls57Arg25Bands.NEAR_INFRARED.name]
+    The cache is emptied if the process has forked (e.g. luigi workers) so that handles are never shared between
+    processes.
 
-        data = read_dataset_data(dataset, bands=[band_red, band_nir], x=x, y=y, x_size=x_size, y_size=y_size)
-        data = calculate_ndvi(data[band_red], data[band_nir])
+    Evicting a handle only drops the cache's reference - a caller still using it keeps it open.
+    """
 
-        return {NdviBands.NDVI: data}
+    def __init__(self, size=None):
 
-    # EVI calculated using RED, BLUE and NIR from ARG25
+        self.size = size or get_gdal_dataset_cache_size()
 
-    elif dataset.dataset_type == DatasetType.EVI:
+        self.lock = threading.RLock()
 
-        bands = get_bands(DatasetType.ARG25, dataset.satellite)
+        self.pid = os.getpid()
 
-        band_red = bands[Ls57Arg25Bands.RED.name]
-        band_blue = bands[Ls57Arg25Bands.BLUE.name]
-        band_nir = bands[Ls57Arg25Bands.NEAR_INFRARED.name]
+        self.datasets = OrderedDict()
+        self.metadata = OrderedDict()
 
-        data = read_dataset_data(dataset, bands=[band_red, band_blue, band_nir], x=x, y=y, x_size=x_size, y_size=y_size)
-        data = calculate_evi(data[band_red], data[band_blue], data[band_nir])
+        self.hits = 0
+        self.misses = 0
 
-        return {EviBands.EVI: data}
+    def check_pid(self):
 
-    # NBR calculated using NIR and SWIR-2 from ARG25
+        if self.pid != os.getpid():
+            self.datasets.clear()
+            self.metadata.clear()
+            self.pid = os.getpid()
 
-    elif dataset.dataset_type == DatasetType.NBR:
+    def open(self, path):
 
-        bands = get_bands(DatasetType.ARG25, dataset.satellite)
+        """
+        Return an open GDAL dataset for the path
 
-        band_nir = bands[Ls57Arg25Bands.NEAR_INFRARED.name]
-        band_swir = bands[Ls57Arg25Bands.SHORT_WAVE_INFRARED_2.name]
+        :param path: The path to the raster file
+        :type path: str
+        :rtype: gdal.Dataset
+        """
 
-        data = read_dataset_data(dataset, bands=[band_nir, band_swir], x=x, y=y, x_size=x_size, y_size=y_size)
-        data = calculate_nbr(data[band_nir], data[band_swir])
+        key = (threading.current_thread().ident, path)
 
-        return {NbrBands.NBR: data}
+        with self.lock:
+            self.check_pid()
 
-    # TCI calculated from ARG25
+            raster = self.datasets.pop(key, None)
 
-    elif dataset.dataset_type == DatasetType.TCI:
+            if raster is not None:
+                self.hits += 1
+                self.datasets[key] = raster
+                return raster
 
-        bands = get_bands(DatasetType.ARG25, dataset.satellite)
+            self.misses += 1
 
-        data = read_dataset_data(dataset, bands=bands, x=x, y=y, x_size=x_size, y_size=y_size)
+        raster = gdal.Open(path, GA_ReadOnly)
+        assert raster
 
-        out = dict()
+        with self.lock:
+            self.datasets[key] = raster
 
-        for index in TasselCapIndex:
-            out[TciBands[index.name]] = calculate_tassel_cap_index(data, TCI_COEFFICIENTS[dataset.satellite][index])
+            while len(self.datasets) > self.size:
+                self.datasets.popitem(last=False)
 
-        return out
+        return raster
 
-    # It is a "physical" dataset so just read it
-    else:
-        return read_dataset_data(dataset, bands, x, y, x_size, y_size)
+    def get_metadata(self, dataset):
+
+        """
+        Return the (cached) metadata for the dataset
+
+        :param dataset: The dataset
+        :type dataset: datacube.api.model.DatasetTile
+        :rtype: DatasetMetaData
+        """
+
+        key = (dataset.path, tuple(dataset.bands))
+
+        with self.lock:
+            self.check_pid()
+
+            metadata = self.metadata.pop(key, None)
+
+            if metadata is not None:
+                self.metadata[key] = metadata
+                return metadata
+
+        metadata = read_dataset_metadata(self.open(dataset.path), dataset.bands)
+
+        with self.lock:
+            self.metadata[key] = metadata
+
+            while len(self.metadata) > self.size * 16:
+                self.metadata.popitem(last=False)
+
+        return metadata
+
+    def clear(self):
+
+        with self.lock:
+            self.datasets.clear()
+            self.metadata.clear()
+
+
+_gdal_dataset_cache = GdalDatasetCache()
+
+
+def set_gdal_dataset_cache_size(size):
+
+    """
+    Set the maximum number of open GDAL datasets to cache (across all threads)
+
+    :param size: The number of datasets
+    :type size: int
+    """
+
+    global _gdal_dataset_cache
+
+    _gdal_dataset_cache = GdalDatasetCache(size=size)
+
+
+def clear_gdal_dataset_cache():
+
+    """
+    Close (or rather drop the references to) the cached GDAL datasets, e.g. at the end of a task
+    """
+
+    _gdal_dataset_cache.clear()
+
+
+def open_dataset(path):
+
+    """
+    Return an open (read only) GDAL dataset for the path from the GDAL dataset cache
+
+    :param path: The path to the raster file
+    :type path: str
+    :rtype: gdal.Dataset
+    """
+
+    return _gdal_dataset_cache.open(path)
+
+
+def read_dataset_metadata(raster, bands):
+
+    band_metadata = dict()
+
+    for band in bands:
+        raster_band = raster.GetRasterBand(band.value)
+        assert raster_band
+
+        band_metadata[band] = DatasetBandMetaData(raster_band.GetNoDataValue(), raster_band.DataType)
+
+        del raster_band
 
+    return DatasetMetaData((raster.RasterXSize, raster.RasterYSize), raster.GetGeoTransform(), raster.GetProjection(), band_metadata)
 
-def read_dataset_data(dataset, bands=None, x=0, y=0, x_size=None, y_size=None):
+
+def get_dataset_metadata(dataset):
+
+    return _gdal_dataset_cache.get_metadata(dataset)
+
+
+def get_dataset_data(dataset, bands=None, x=0, y=0, x_size=None, y_size=None, out=None):
+
+    # dataset_types_physical = [
+    #     DatasetType.ARG25, DatasetType.PQ25, DatasetType.FC25,
+    #     DatasetType.WATER,
+    #     DatasetType.DSM, DatasetType.DEM, DatasetType.DEM_HYDROLOGICALLY_ENFORCED, DatasetType.DEM_SMOOTHED]
+    #
+    # dataset_types_virtual_nbar = [
+    #     DatasetType.NDVI,
+    #     DatasetType.EVI,
+    #     DatasetType.NBR,
+    #     DatasetType.TCI
+    # ]
+
+    # Virtual datasets (NDVI, EVI, ...) are calculated from the bands of their source dataset (see VIRTUAL_DATASETS)
+
+    if dataset.dataset_type in VIRTUAL_DATASETS:
+        return get_virtual_dataset_data(dataset, x=x, y=y, x_size=x_size, y_size=y_size)[dataset.dataset_type]
+
+    # It is a "physical" dataset so just read it (into out if provided)
+
+    return read_dataset_data(dataset, bands, x, y, x_size, y_size, out=out)
+
+
+def read_dataset_data(dataset, bands=None, x=0, y=0, x_size=None, y_size=None, out=None):
 
     """
     Return one or more bands from a dataset
 
+    The bands are read with a single multi-band read into a (bands, y, x) array (see read_dataset_data_array) and
+    the returned arrays are views of it, so for pixel interleaved files each block is only decoded once.
+
     :param dataset: The dataset from which to read the band
     :param bands: A list of bands to read from the dataset
     :param x:
     :param y:
     :param x_size:
     :param y_size:
+    :param out: Optional (bands, y, x) array to read into (e.g. to reuse between reads)
+    :type out: numpy.ndarray
     :return: dictionary of band/data as numpy array
     """
 
-    out = dict()
+    if not bands:
+        bands = dataset.bands
 
-    raster = gdal.Open(dataset.path, GA_ReadOnly)
-    assert raster
+    bands = list(bands)
+
+    data = read_dataset_data_array(dataset, bands, x=x, y=y, x_size=x_size, y_size=y_size, out=out)
+
+    return dict((b, data[i]) for i, b in enumerate(bands))
+
+
+def read_dataset_data_array(dataset, bands=None, x=0, y=0, x_size=None, y_size=None, out=None):
+
+    """
+    Return one or more bands from a dataset as a single (bands, y, x) array
+
+    All the bands are read with a single call (Dataset.ReadAsArray if they are all of the dataset's bands in order,
+    Dataset.ReadRaster with a band list otherwise).
+
+    :param dataset: The dataset from which to read the band
+    :type dataset: datacube.api.model.DatasetTile
+    :param bands: A list of bands to read from the dataset (defaults to all of them)
+    :type bands: list[datacube.api.model.Band]
+    :param x: X offset of the window
+    :type x: int
+    :param y: Y offset of the window
+    :type y: int
+    :param x_size: X size of the window (defaults to the width of the dataset)
+    :type x_size: int
+    :param y_size: Y size of the window (defaults to the height of the dataset)
+    :type y_size: int
+    :param out: Optional array of shape (bands, y_size, x_size) to read into - the data is converted to its data type
+    :type out: numpy.ndarray
+    :return: The data
+    :rtype: numpy.ndarray
+    """
+
+    import gdal_array
+
+    raster = open_dataset(dataset.path)
 
     if not x_size:
         x_size = raster.RasterXSize
@@ -298,18 +464,31 @@ def read_dataset_data(dataset, bands=None, x=0, y=0, x_size=None, y_size=None):
     if not bands:
         bands = dataset.bands
 
-    for b in bands:
+    band_list = [b.value for b in bands]
+
+    shape = (len(band_list), y_size, x_size)
+
+    if out is None:
+        data_type = raster.GetRasterBand(band_list[0]).DataType
+        out = numpy.empty(shape, dtype=gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
 
-        band = raster.GetRasterBand(b.value)
-        assert band
+    elif out.shape != shape:
+        raise ValueError("Output array has shape {actual} but window is {expected}".format(actual=out.shape,
+                                                                                         expected=shape))
 
-        data = band.ReadAsArray(x, y, x_size, y_size)
-        out[b] = data
+    with log_timing("read_dataset_data", path=dataset.path, bands=len(band_list), x=x, y=y, x_size=x_size, y_size=y_size):
 
-        band.FlushCache()
-        del band
+        if len(band_list) == 1:
+            raster.GetRasterBand(band_list[0]).ReadAsArray(x, y, x_size, y_size, buf_obj=out[0])
+
+        elif band_list == range(1, raster.RasterCount + 1):
+            raster.ReadAsArray(x, y, x_size, y_size, buf_obj=out)
+
+        else:
+            buf = raster.ReadRaster(x, y, x_size, y_size, x_size, y_size,
+                                    gdal_array.NumericTypeCodeToGDALTypeCode(out.dtype.type), band_list)
+            out[...] = numpy.frombuffer(buf, dtype=out.dtype).reshape(shape)
 
-    raster.FlushCache()
     del raster
 
     return out
@@ -339,9 +518,11 @@ def get_dataset_data_masked(dataset, bands=None, x=0, y=0, x_size=None, y_size=N
 
     out = get_dataset_data(dataset, bands, x=x, y=y, x_size=x_size, y_size=y_size)
 
+    # The data has just been read so can be masked in place
+
     if mask is not None:
         for band in bands:
-            out[band] = apply_mask(out[band], mask=mask, ndv=ndv)
+            out[band] = apply_mask(out[band], mask=mask, ndv=ndv, out=out[band])
 
     return out
 
@@ -372,35 +553,162 @@ def get_dataset_data_with_pq(dataset, dataset_pqa, bands=None, x=0, y=0, x_size=
     return out
 
 
-def apply_mask(data, mask, ndv=NDV):
-    return numpy.ma.array(data, mask=mask).filled(ndv)
+def apply_mask(data, mask, ndv=NDV, out=None):
 
+    """
+    Return the data with the masked pixels set to the no data value
+
+    The data is copied (into out if provided) unless out is the data itself in which case it is updated in place.
+
+    :param data: The data
+    :type data: numpy.ndarray
+    :param mask: The mask (True means masked)
+    :type mask: numpy.ndarray
+    :param ndv: The no data value
+    :param out: Optional array (possibly data) to put the result in
+    :type out: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+
+    if out is None:
+        out = numpy.array(data, copy=True)
+
+    elif out is not data:
+        numpy.copyto(out, data)
+
+    if mask is not None and mask is not numpy.ma.nomask:
+        numpy.putmask(out, mask, ndv)
+
+    return out
 
-def get_mask_pqa(pqa, pqa_masks=DEFAULT_MASK_PQA, x=0, y=0, x_size=None, y_size=None, mask=None):
+
+def new_mask(shape, mask=None, out=None):
+
+    """
+    Return a boolean mask (True means masked) of the given shape initialised from an existing mask (or to nothing
+    masked)
+
+    The existing mask is never modified unless it is also given as out.
+
+    :param shape: The shape of the mask
+    :param mask: Optional existing mask to start from (e.g. an AOI mask)
+    :type mask: numpy.ndarray
+    :param out: Optional array to put the mask in
+    :type out: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+
+    if out is None:
+        out = numpy.empty(shape, dtype=numpy.bool_)
+
+    if mask is None or mask is numpy.ma.nomask:
+        out.fill(False)
+
+    elif mask is not out:
+        numpy.copyto(out, mask)
+
+    return out
+
+
+def update_mask_pqa(data, pqa_mask, mask):
+
+    """
+    Mask, in place, the pixels where any of the requested bits are not set in the PQ value
+
+    :param data: The PQA data
+    :type data: numpy.ndarray
+    :param pqa_mask: The (consolidated) bits that must be set
+    :type pqa_mask: int
+    :param mask: The mask to update
+    :type mask: numpy.ndarray
+    :return: the mask
+    """
+
+    # Zero where all the requested bits are set
+
+    scratch = numpy.bitwise_and(data, pqa_mask)
+    numpy.bitwise_xor(scratch, pqa_mask, out=scratch)
+
+    numpy.logical_or(mask, scratch, out=mask)
+
+    return mask
+
+
+def update_mask_values(data, values, mask):
+
+    """
+    Mask, in place, the pixels whose value is one of the given values
+
+    :param data: The data (e.g. WOFS)
+    :type data: numpy.ndarray
+    :param values: The values to mask
+    :type values: list[int]
+    :param mask: The mask to update
+    :type mask: numpy.ndarray
+    :return: the mask
+    """
+
+    scratch = numpy.empty(numpy.shape(data), dtype=numpy.bool_)
+
+    for value in values:
+        numpy.equal(data, value, out=scratch)
+        numpy.logical_or(mask, scratch, out=mask)
+
+    return mask
+
+
+def calculate_mask(pqa=None, pqa_masks=DEFAULT_MASK_PQA, wofs=None, wofs_masks=None, mask=None, out=None):
+
+    """
+    Return the combined PQA, WOFS and existing (e.g. AOI) mask as a single boolean array (True means masked)
+
+    :param pqa: Optional PQA data
+    :type pqa: numpy.ndarray
+    :param pqa_masks: Which PQ flags to use
+    :type pqa_masks: list[PqaMask]
+    :param wofs: Optional WOFS data
+    :type wofs: numpy.ndarray
+    :param wofs_masks: Which WOFS values to mask (None for the default, an empty list for none)
+    :type wofs_masks: list[WofsMask]
+    :param mask: Optional existing mask (e.g. AOI) to combine with - it is not modified unless it is also out
+    :type mask: numpy.ndarray
+    :param out: Optional array to put the mask in
+    :type out: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+
+    shape = numpy.shape(pqa if pqa is not None else wofs if wofs is not None else mask)
+
+    out = new_mask(shape, mask=mask, out=out)
+
+    if pqa is not None:
+        update_mask_pqa(pqa, consolidate_masks(pqa_masks), out)
+
+    if wofs is not None:
+        if wofs_masks is None:
+            wofs_masks = DEFAULT_MASK_WOFS
+
+        update_mask_values(wofs, [m.value for m in wofs_masks], out)
+
+    return out
+
+
+def get_mask_pqa(pqa, pqa_masks=DEFAULT_MASK_PQA, x=0, y=0, x_size=None, y_size=None, mask=None, out=None):
 
     """
     Return a pixel quality mask
 
     :param pqa: Pixel Quality dataset
     :param pqa_masks: which PQ flags to use
-    :param mask: an optional existing mask to update
+    :param mask: an optional existing mask to combine with (it is not modified unless it is also out)
+    :param out: an optional array to put the mask in
     :return: the mask
     """
 
-    # Consolidate the list of (bit) masks into a single (bit) mask
-    pqa_mask = consolidate_masks(pqa_masks)
-
     # Read the PQA dataset
     data = get_dataset_data(pqa, [Pq25Bands.PQ], x=x, y=y, x_size=x_size, y_size=y_size)[Pq25Bands.PQ]
 
-    # Create an empty mask if none provided - just to avoid an if below :)
-    if mask is None:
-        mask = numpy.ma.make_mask_none(numpy.shape(data))
-
-    # Mask out values where the requested bits in the PQ value are not set
-    mask = numpy.ma.mask_or(mask, numpy.ma.masked_where(data & pqa_mask != pqa_mask, data).mask)
-
-    return mask
+    return calculate_mask(pqa=data, pqa_masks=pqa_masks, mask=mask, out=out)
 
 
 def consolidate_masks(masks):
@@ -415,28 +723,22 @@ def consolidate_masks(masks):
 DEFAULT_MASK_WOFS = [WofsMask.WET]
 
 
-def get_mask_wofs(wofs, wofs_masks=DEFAULT_MASK_WOFS, x=0, y=0, x_size=None, y_size=None, mask=None):
+def get_mask_wofs(wofs, wofs_masks=DEFAULT_MASK_WOFS, x=0, y=0, x_size=None, y_size=None, mask=None, out=None):
 
     """
     Return a WOFS mask
 
     :param wofs: WOFS dataset
     :param wofs_masks: which WOFS values to mask
-    :param mask: an optional existing mask to update
+    :param mask: an optional existing mask to combine with (it is not modified unless it is also out)
+    :param out: an optional array to put the mask in
     :return: the mask
     """
 
     # Read the WOFS dataset
     data = get_dataset_data(wofs, bands=[Wofs25Bands.WATER], x=x, y=y, x_size=x_size, y_size=y_size)[Wofs25Bands.WATER]
 
-    if mask is None:
-        mask = numpy.ma.make_mask_none(numpy.shape(data))
-
-    # Mask out values where the WOFS value is one of the requested mask values
-    for wofs_mask in wofs_masks:
-        mask = numpy.ma.mask_or(mask, numpy.ma.masked_equal(data, wofs_mask.value).mask)
-
-    return mask
+    return calculate_mask(wofs=data, wofs_masks=wofs_masks, mask=mask, out=out)
 
 
 def get_mask_vector_for_cell(x, y, vector_file, vector_layer, vector_feature, width=4000, height=4000,
@@ -513,10 +815,68 @@ def get_mask_vector_for_cell(x, y, vector_file, vector_layer, vector_feature, wi
     data = band.ReadAsArray()
     import numpy
 
-    _log.debug("Read [%s] from memory AOI mask dataset", numpy.shape(data))
+    _log.debug("Read [%s] from memory AOI mask dataset", lazy_shape(data))
     return numpy.ma.masked_not_equal(data, 1, copy=False).mask
 
 
+def get_cells_for_geometry(geom):
+
+    """
+    Return the cells intersecting the geometry
+
+    The geometry is rasterised (in a single call) onto a one degree grid covering its envelope with every cell it
+    touches burnt in rather than testing each cell in the envelope for intersection in turn.
+
+    :param geom: The geometry - in EPSG:4326
+    :type geom: ogr.Geometry
+
+    :return: The cells as (x, y) in x then y order
+    :rtype: list[(int, int)]
+    """
+
+    import ogr
+    import osr
+
+    min_x, max_x, min_y, max_y = geom.GetEnvelope()
+
+    x_min, x_max = int(math.floor(min_x)), int(math.floor(max_x))
+    y_min, y_max = int(math.floor(min_y)), int(math.floor(max_y))
+
+    driver = gdal.GetDriverByName("MEM")
+    assert driver
+
+    raster = driver.Create("", x_max - x_min + 1, y_max - y_min + 1, 1, gdal.GDT_Byte)
+    assert raster
+
+    raster.SetGeoTransform((x_min, 1.0, 0.0, y_max + 1, 0.0, -1.0))
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+
+    raster.SetProjection(srs.ExportToWkt())
+
+    vector = ogr.GetDriverByName("Memory").CreateDataSource("")
+    assert vector
+
+    layer = vector.CreateLayer("aoi", srs, ogr.wkbUnknown)
+    assert layer
+
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(geom)
+    layer.CreateFeature(feature)
+
+    gdal.RasterizeLayer(raster, [1], layer, burn_values=[1], options=["ALL_TOUCHED=TRUE"])
+
+    del layer
+
+    band = raster.GetRasterBand(1)
+    assert band
+
+    rows, cols = numpy.nonzero(band.ReadAsArray())
+
+    return sorted(zip((x_min + cols).tolist(), (y_max - rows).tolist()))
+
+
 # TODO generalise/refactor this!!!
 
 def raster_create(path, data, transform, projection, no_data_value, data_type,
@@ -556,37 +916,23 @@ def raster_create_geotiff(path, data, transform, projection, no_data_value, data
     _log.debug("filename=%s | shape = %s | bands = %d | data type = %s", path, (numpy.shape(data[0])[0], numpy.shape(data[0])[1]),
                len(data), data_type)
 
-    driver = gdal.GetDriverByName("GTiff")
-    assert driver
+    from datacube.api.writer import RasterWriter
 
     width = width or numpy.shape(data[0])[1]
     height = height or numpy.shape(data[0])[0]
 
-    raster = driver.Create(path, width, height, len(data), data_type, options)
-    assert raster
-
-    raster.SetGeoTransform(transform)
-    raster.SetProjection(projection)
+    # The statistics are calculated from the data as it is written rather than re-reading each band
 
-    if dataset_metadata:
-        raster.SetMetadata(dataset_metadata)
+    with RasterWriter(path, width, height, len(data), data_type, transform, projection, ndv=no_data_value,
+                      driver="GTiff", options=options, metadata=dataset_metadata, background=False) as writer:
 
-    for i in range(0, len(data)):
-        _log.debug("Writing band %d", i + 1)
+        for i in range(0, len(data)):
+            _log.debug("Writing band %d", i + 1)
 
-        band = raster.GetRasterBand(i + 1)
+            if band_ids and len(band_ids) - 1 >= i:
+                writer.set_band_description(i + 1, band_ids[i])
 
-        if band_ids and len(band_ids) - 1 >= i:
-            band.SetDescription(band_ids[i])
-        band.SetNoDataValue(no_data_value)
-        band.WriteArray(data[i])
-        band.ComputeStatistics(True)
-
-        band.FlushCache()
-        del band
-
-    raster.FlushCache()
-    del raster
+            writer.write(i + 1, data[i])
 
 
 def raster_create_envi(path, data, transform, projection, no_data_value, data_type,
@@ -612,37 +958,23 @@ def raster_create_envi(path, data, transform, projection, no_data_value, data_ty
     _log.debug("filename=%s | shape = %s | bands = %d | data type = %s", path, (numpy.shape(data[0])[0], numpy.shape(data[0])[1]),
                len(data), data_type)
 
-    driver = gdal.GetDriverByName("ENVI")
-    assert driver
+    from datacube.api.writer import RasterWriter
 
     width = width or numpy.shape(data[0])[1]
     height = height or numpy.shape(data[0])[0]
 
-    raster = driver.Create(path, width, height, len(data), data_type, options)
-    assert raster
-
-    raster.SetGeoTransform(transform)
-    raster.SetProjection(projection)
-
-    if dataset_metadata:
-        raster.SetMetadata(dataset_metadata)
+    # The statistics are calculated from the data as it is written rather than re-reading each band
 
-    for i in range(0, len(data)):
-        _log.debug("Writing band %d", i + 1)
+    with RasterWriter(path, width, height, len(data), data_type, transform, projection, ndv=no_data_value,
+                      driver="ENVI", options=options, metadata=dataset_metadata, background=False) as writer:
 
-        band = raster.GetRasterBand(i + 1)
+        for i in range(0, len(data)):
+            _log.debug("Writing band %d", i + 1)
 
-        if band_ids and len(band_ids) - 1 >= i:
-            band.SetDescription(band_ids[i])
-        band.SetNoDataValue(no_data_value)
-        band.WriteArray(data[i])
-        band.ComputeStatistics(True)
+            if band_ids and len(band_ids) - 1 >= i:
+                writer.set_band_description(i + 1, band_ids[i])
 
-        band.FlushCache()
-        del band
-
-    raster.FlushCache()
-    del raster
+            writer.write(i + 1, data[i])
 
 
 def propagate_using_selected_pixel(a, b, c, d, ndv=NDV):
@@ -660,23 +992,103 @@ def propagate_using_selected_pixel(a, b, c, d, ndv=NDV):
 #     return ndvi
 
 
-def calculate_ndvi(red, nir, input_ndv=NDV, output_ndv=NDV):
+# Number of rows processed at a time when calculating indices - keeps the float32 temporaries small
+
+INDEX_CHUNK_ROWS = 256
+
+
+def calculate_index(kernel, inputs, input_ndv=NDV, output_ndv=NDV, out=None, chunk_rows=INDEX_CHUNK_ROWS, **kwargs):
+
+    """
+    Calculate an index from the input bands in float32, a chunk of rows at a time
+
+    For each chunk the inputs are converted to float32 (copies the kernel is free to overwrite) and
+    kernel(*inputs, out=out, **kwargs) is called to calculate the index into the output chunk.  Pixels where any input
+    is the input no data value, or where the result is not finite (e.g. divide by zero), are set to the output no data
+    value.
+
+    :param kernel: Function calculating the index in place
+    :type kernel: callable
+    :param inputs: The input bands
+    :type inputs: list[numpy.ndarray]
+    :param input_ndv: The input no data value
+    :param output_ndv: The output no data value
+    :param out: Optional float32 array to put the result in
+    :type out: numpy.ndarray
+    :param chunk_rows: The number of rows to process at a time
+    :type chunk_rows: int
+    :param kwargs: Additional arguments for the kernel
+    :return: The index
+    :rtype: numpy.ndarray
     """
-    Calculate the Normalised Difference Vegetation Index (NDVI) from a Landsat dataset
 
-    NDVI is defined as (NIR - RED) / (NIR + RED)
+    shape = numpy.shape(inputs[0])
+
+    if out is None:
+        out = numpy.empty(shape, dtype=numpy.float32)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+
+        for start in xrange(0, shape[0], chunk_rows):
+
+            rows = slice(start, start + chunk_rows)
+
+            chunk = [numpy.array(a[rows], dtype=numpy.float32) for a in inputs]
+            chunk_out = out[rows]
+
+            kernel(*chunk, out=chunk_out, **kwargs)
+
+            invalid = ~numpy.isfinite(chunk_out)
+
+            for a in inputs:
+                numpy.logical_or(invalid, a[rows] == input_ndv, out=invalid)
+
+            numpy.putmask(chunk_out, invalid, output_ndv)
+
+    return out
+
+
+def normalised_difference_kernel(a, b, out):
+
+    """
+    (A - B) / (A + B) (overwrites b)
     """
 
-    red = numpy.ma.masked_equal(red, input_ndv)
-    nir = numpy.ma.masked_equal(nir, input_ndv)
+    numpy.subtract(a, b, out=out)
+    numpy.add(b, a, out=b)
+    numpy.divide(out, b, out=out)
 
-    ndvi = numpy.true_divide(nir - red, nir + red)
-    ndvi = ndvi.filled(output_ndv)
 
-    return ndvi
+def evi_kernel(red, blue, nir, out, l=1, c1=6, c2=7.5):
+
+    """
+    2.5 * (NIR - RED) / (NIR + C1 * RED - C2 * BLUE + L) (overwrites red and blue)
+    """
 
+    numpy.subtract(nir, red, out=out)
 
-def calculate_evi(red, blue, nir, l=1, c1=6, c2=7.5, input_ndv=NDV, output_ndv=NDV):
+    numpy.multiply(red, c1, out=red)
+    numpy.add(red, nir, out=red)
+    numpy.multiply(blue, c2, out=blue)
+    numpy.subtract(red, blue, out=red)
+    numpy.add(red, l, out=red)
+
+    numpy.divide(out, red, out=out)
+    numpy.multiply(out, 2.5, out=out)
+
+
+def calculate_ndvi(red, nir, input_ndv=NDV, output_ndv=NDV, out=None):
+    """
+    Calculate the Normalised Difference Vegetation Index (NDVI) from a Landsat dataset
+
+    NDVI is defined as (NIR - RED) / (NIR + RED)
+    """
+
+    return calculate_index(normalised_difference_kernel, [nir, red], input_ndv=input_ndv, output_ndv=output_ndv,
+                           out=out)
+
+
+def calculate_evi(red, blue, nir, l=1, c1=6, c2=7.5, input_ndv=NDV, output_ndv=NDV, out=None):
     """
     Calculate the Enhanced Vegetation Index (EVI) from a Landsat dataset first applying Pixel Quality indicators
 
@@ -685,30 +1097,19 @@ def calculate_evi(red, blue, nir, l=1, c1=6, c2=7.5, input_ndv=NDV, output_ndv=N
     Defaults to the standard MODIS EVI of L=1 C1=6 C2=7.5
     """
 
-    red = numpy.ma.masked_equal(red, input_ndv)
-    blue = numpy.ma.masked_equal(blue, input_ndv)
-    nir = numpy.ma.masked_equal(nir, input_ndv)
+    return calculate_index(evi_kernel, [red, blue, nir], input_ndv=input_ndv, output_ndv=output_ndv, out=out,
+                           l=l, c1=c1, c2=c2)
 
-    evi = 2.5 * numpy.true_divide(nir - red, nir + c1 * red - c2 * blue + 1)
-    evi = evi.filled(output_ndv)
 
-    return evi
-
-
-def calculate_nbr(nir, swir, input_ndv=NDV, output_ndv=NDV):
+def calculate_nbr(nir, swir, input_ndv=NDV, output_ndv=NDV, out=None):
     """
     Calculate the Normalised Burn Ratio (NBR) from a Landsat dataset
 
     NBR is defined as (NIR - SWIR 2) / (NIR + SWIR 2)
     """
 
-    nir = numpy.ma.masked_equal(nir, input_ndv)
-    swir = numpy.ma.masked_equal(swir, input_ndv)
-
-    nbr = numpy.true_divide(nir - swir, nir + swir)
-    nbr = nbr.filled(output_ndv)
-
-    return nbr
+    return calculate_index(normalised_difference_kernel, [nir, swir], input_ndv=input_ndv, output_ndv=output_ndv,
+                           out=out)
 
 
 class TasselCapIndex(Enum):
@@ -880,39 +1281,272 @@ TCI_COEFFICIENTS = {
 
 def calculate_tassel_cap_index(bands, coefficients, input_ndv=NDV, output_ndv=numpy.nan):
     """
+    Calculate a single tassel cap index (see calculate_tassel_cap_indices)
+
+    :param bands: dictionary of band/data
+    :param coefficients: dictionary of band/coefficient for the index
+    :param input_ndv: The input no data value
+    :param output_ndv: The output no data value
+    :return: The index
+    """
+
+    return calculate_tassel_cap_indices(bands, {None: coefficients}, input_ndv=input_ndv, output_ndv=output_ndv)[None]
+
+
+def calculate_tassel_cap_indices(bands, coefficients, indices=None, input_ndv=NDV, output_ndv=numpy.nan,
+                                 chunk_rows=INDEX_CHUNK_ROWS):
+    """
+    Calculate tassel cap indices from the (reflectance * 10000) bands
+
+    All the indices are calculated together as a single (index x band) coefficient matrix by (band x pixel) float32
+    matrix product, a chunk of rows at a time.  Pixels where any band used by an index is the input no data value are
+    set to the output no data value.
+
+    :param bands: dictionary of band/data
+    :param coefficients: dictionary of index/(dictionary of band/coefficient) e.g. TCI_COEFFICIENTS[satellite]
+    :param indices: The indices to calculate (defaults to all those in coefficients)
+    :param input_ndv: The input no data value
+    :param output_ndv: The output no data value
+    :param chunk_rows: The number of rows to process at a time
+    :return: dictionary of index/data
+    """
+
+    if indices is None:
+        indices = list(coefficients)
+
+    # Only the bands actually used by one of the indices
+
+    used = [b for b in bands if any(b in coefficients[index] for index in indices)]
+
+    matrix = numpy.array([[coefficients[index].get(b, 0.0) / 10000 for b in used] for index in indices],
+                         dtype=numpy.float32)
+
+    shape = numpy.shape(bands[used[0]])
+
+    out = dict((index, numpy.empty(shape, dtype=numpy.float32)) for index in indices)
+
+    for start in xrange(0, shape[0], chunk_rows):
+
+        rows = slice(start, start + chunk_rows)
+
+        chunk = numpy.array([bands[b][rows] for b in used], dtype=numpy.float32)
+        chunk_shape = chunk.shape[1:]
+
+        result = numpy.dot(matrix, chunk.reshape(len(used), -1))
+
+        for i, index in enumerate(indices):
+
+            chunk_out = out[index][rows]
+            chunk_out[...] = result[i].reshape(chunk_shape)
+
+            for j, b in enumerate(used):
+                if matrix[i, j] != 0:
+                    numpy.putmask(chunk_out, bands[b][rows] == input_ndv, output_ndv)
+
+    return out
+
+
+class VirtualDataset(object):
 
-    :param bands:
-    :param coefficients:
-    :param input_ndv:
-    :param output_ndv:
-    :return:
     """
-    bands_masked = dict()
+    A dataset calculated from bands of a source dataset
+
+    The function is called as function(data, satellite) where data is a dictionary of source band name/data (e.g.
+    data["RED"]) and must return a dictionary of band/data for the bands of the virtual dataset.
+    """
+
+    def __init__(self, dataset_type, function, sources=None, source_dataset_type=DatasetType.ARG25):
+
+        """
+        :param dataset_type: The virtual dataset type
+        :type dataset_type: datacube.api.model.DatasetType
+        :param function: The function calculating the virtual dataset from the source bands
+        :type function: callable
+        :param sources: The names of the source bands used (or None for all of them)
+        :type sources: list[str]
+        :param source_dataset_type: The dataset type the source bands come from
+        :type source_dataset_type: datacube.api.model.DatasetType
+        """
+
+        self.dataset_type = dataset_type
+        self.function = function
+        self.sources = sources
+        self.source_dataset_type = source_dataset_type
+
+    def get_source_bands(self, satellite):
+
+        bands = get_bands(self.source_dataset_type, satellite)
+
+        if self.sources is None:
+            return list(bands)
+
+        return [bands[name] for name in self.sources]
+
+    def __str__(self):
+        return "VirtualDataset(dataset_type={dataset_type}, sources={sources}, source_dataset_type={source})".format(
+            dataset_type=self.dataset_type, sources=self.sources, source=self.source_dataset_type)
+
+
+def normalised_difference(band, a, b):
+
+    """
+    Return a virtual dataset function calculating (A - B) / (A + B) from the source bands named a and b
+
+    :param band: The band of the virtual dataset
+    :param a: The name of the source band A
+    :type a: str
+    :param b: The name of the source band B
+    :type b: str
+    :rtype: callable
+    """
+
+    def function(data, satellite):
+        return {band: calculate_index(normalised_difference_kernel, [data[a], data[b]])}
+
+    return function
 
-    # Drop out no data values - do I need this???
 
-    for b in bands.iterkeys():
-        bands_masked[b] = numpy.ma.masked_equal(bands[b], input_ndv).astype(numpy.float32) / 10000
+def calculate_virtual_evi(data, satellite):
+    return {EviBands.EVI: calculate_evi(data["RED"], data["BLUE"], data["NEAR_INFRARED"])}
+
+
+def calculate_virtual_tci(data, satellite):
+
+    bands = get_bands(DatasetType.ARG25, satellite)
+
+    tci = calculate_tassel_cap_indices(dict((bands[name], array) for name, array in data.iteritems()),
+                                       TCI_COEFFICIENTS[satellite], indices=[index for index in TasselCapIndex])
+
+    return dict((TciBands[index.name], tci[index]) for index in TasselCapIndex)
+
+
+# The virtual datasets by dataset type
+
+VIRTUAL_DATASETS = dict()
+
+
+def register_virtual_dataset(dataset_type, function, sources=None, source_dataset_type=DatasetType.ARG25):
+
+    """
+    Register a virtual dataset so that get_dataset_data() and get_virtual_dataset_data() will calculate it
+
+    For example a NDWI (assuming a NDWI dataset type with NdwiBands bands)::
+
+        register_virtual_dataset(DatasetType.NDWI, normalised_difference(NdwiBands.NDWI, "GREEN", "NEAR_INFRARED"),
+                                 sources=["GREEN", "NEAR_INFRARED"])
+
+    :param dataset_type: The virtual dataset type
+    :type dataset_type: datacube.api.model.DatasetType
+    :param function: The function calculating the virtual dataset (see VirtualDataset)
+    :type function: callable
+    :param sources: The names of the source bands used (or None for all of them)
+    :type sources: list[str]
+    :param source_dataset_type: The dataset type the source bands come from
+    :type source_dataset_type: datacube.api.model.DatasetType
+    """
+
+    VIRTUAL_DATASETS[dataset_type] = VirtualDataset(dataset_type, function, sources, source_dataset_type)
+
+
+register_virtual_dataset(DatasetType.NDVI, normalised_difference(NdviBands.NDVI, "NEAR_INFRARED", "RED"),
+                         sources=["RED", "NEAR_INFRARED"])
+
+register_virtual_dataset(DatasetType.EVI, calculate_virtual_evi, sources=["BLUE", "RED", "NEAR_INFRARED"])
+
+register_virtual_dataset(DatasetType.NBR, normalised_difference(NbrBands.NBR, "NEAR_INFRARED", "SHORT_WAVE_INFRARED_2"),
+                         sources=["NEAR_INFRARED", "SHORT_WAVE_INFRARED_2"])
+
+register_virtual_dataset(DatasetType.TCI, calculate_virtual_tci)
+
+
+def get_virtual_source_bands(dataset_types, satellite):
+
+    """
+    Return the union of the source bands needed to calculate the virtual datasets (in band order)
+
+    :param dataset_types: The virtual dataset types
+    :type dataset_types: list[datacube.api.model.DatasetType]
+    :param satellite: The satellite
+    :type satellite: datacube.api.model.Satellite
+    :return: The source bands
+    """
 
-    tci = 0
+    bands = set()
 
-    for b in bands:
-        if b in coefficients:
-            tci += bands_masked[b] * coefficients[b]
+    for dataset_type in dataset_types:
+        bands.update(VIRTUAL_DATASETS[dataset_type].get_source_bands(satellite))
 
-    tci = tci.filled(output_ndv)
+    return sorted(bands, key=lambda band: band.value)
 
-    return tci
+
+def get_virtual_dataset_data(dataset, dataset_types=None, x=0, y=0, x_size=None, y_size=None, mask=None, ndv=NDV):
+
+    """
+    Calculate one or more virtual datasets from a single read of the source bands they need
+
+    The union of the source bands of all the requested virtual datasets is read once (optionally masked) and each
+    virtual dataset is calculated from those shared arrays.
+
+    The dataset is either the source dataset (e.g. the ARG25 dataset) or one of the virtual datasets (e.g. the NDVI
+    dataset) of a tile - they have the same path.
+
+    :param dataset: The dataset from which to read the source bands
+    :type dataset: datacube.api.model.DatasetTile
+    :param dataset_types: The virtual dataset types to calculate (defaults to the dataset's own dataset type)
+    :type dataset_types: list[datacube.api.model.DatasetType]
+    :param x:
+    :param y:
+    :param x_size:
+    :param y_size:
+    :param mask: Optional mask to apply to the source bands
+    :type mask: numpy.ndarray
+    :param ndv: The no data value
+    :return: dictionary of dataset type/(dictionary of band/data)
+    """
+
+    if not dataset_types:
+        dataset_types = [dataset.dataset_type]
+
+    for dataset_type in dataset_types:
+        if VIRTUAL_DATASETS[dataset_type].source_dataset_type != VIRTUAL_DATASETS[dataset_types[0]].source_dataset_type:
+            raise ValueError("Virtual datasets {dataset_types} have different source datasets".format(
+                dataset_types=dataset_types))
+
+    bands = get_virtual_source_bands(dataset_types, dataset.satellite)
+
+    data = read_dataset_data(dataset, bands=bands, x=x, y=y, x_size=x_size, y_size=y_size)
+
+    if mask is not None:
+        for band in bands:
+            apply_mask(data[band], mask, ndv=ndv, out=data[band])
+
+    data = dict((band.name, array) for band, array in data.iteritems())
+
+    out = dict()
+
+    for dataset_type in dataset_types:
+        out[dataset_type] = VIRTUAL_DATASETS[dataset_type].function(data, dataset.satellite)
+
+    return out
 
 
 def calculate_medoid(X, dist=None):
+
+    """
+    Return the medoid of the columns of X (bands x observations)
+
+    With the default (euclidean) distance this uses calculate_medoid_index().
+    """
+
     _log.debug("X is \n%s", X)
     _log.debug("X.ndim is %d", X.ndim)
 
-    if dist is None:
-        dist = lambda x, y: numpy.sqrt(numpy.square(x-y).sum())
     if X.ndim == 1:
         return X
+
+    if dist is None:
+        return X[:, calculate_medoid_index(X.T[:, :, numpy.newaxis], ndv=None)[0]]
+
     _, n = X.shape
     d = numpy.empty(n)
     for i in range(n):
@@ -920,6 +1554,118 @@ def calculate_medoid(X, dist=None):
     return X[:, numpy.argmin(d)]
 
 
+# Memory budget for the pairwise distance temporaries of the medoid calculation (two time x time x pixel float32 arrays)
+
+MEDOID_CHUNK_BYTES = 128 * 1024 * 1024
+
+
+def calculate_medoid_index(stack, ndv=NDV, chunk_bytes=MEDOID_CHUNK_BYTES):
+
+    """
+    Return the index (along the time axis) of the medoid observation of each pixel of a (time, band, ...) stack
+
+    The medoid is the observation with the smallest sum of euclidean distances (across all bands) to the other
+    observations of the pixel.  Observations where any band is the no data value are ignored.  The pairwise distances
+    are calculated by broadcasting a band at a time over chunks of pixels sized so that the temporaries fit in
+    chunk_bytes.
+
+    :param stack: The stack of observations (time, band, y, x)
+    :type stack: numpy.ndarray
+    :param ndv: The no data value (None if there isn't one)
+    :param chunk_bytes: Memory budget for the distance calculation temporaries
+    :type chunk_bytes: int
+    :return: The medoid index of each pixel (-1 where there are no valid observations)
+    :rtype: numpy.ndarray
+    """
+
+    stack = numpy.asarray(stack)
+
+    times, bands = stack.shape[:2]
+    shape = stack.shape[2:]
+
+    data = stack.reshape((times, bands, -1))
+    pixels = data.shape[2]
+
+    index = numpy.empty(pixels, dtype=numpy.int32)
+
+    chunk = max(1, min(pixels, chunk_bytes // (2 * times * times * 4)))
+
+    distance = numpy.empty((times, times, chunk), dtype=numpy.float32)
+    difference = numpy.empty((times, times, chunk), dtype=numpy.float32)
+
+    for start in xrange(0, pixels, chunk):
+
+        stop = min(start + chunk, pixels)
+        count = stop - start
+
+        x = data[:, :, start:stop]
+
+        chunk_distance = distance[:, :, :count]
+        chunk_difference = difference[:, :, :count]
+
+        chunk_distance.fill(0)
+
+        # Sum of the squared differences across the bands
+
+        for band in xrange(bands):
+            b = x[:, band, :].astype(numpy.float32)
+            numpy.subtract(b[:, numpy.newaxis, :], b[numpy.newaxis, :, :], out=chunk_difference)
+            numpy.square(chunk_difference, out=chunk_difference)
+            numpy.add(chunk_distance, chunk_difference, out=chunk_distance)
+
+        numpy.sqrt(chunk_distance, out=chunk_distance)
+
+        if ndv is None:
+            valid = numpy.ones((times, count), dtype=numpy.bool_)
+        else:
+            valid = numpy.all(x != ndv, axis=1)
+
+        # Only count the distances to valid observations and never pick an invalid one
+
+        numpy.multiply(chunk_distance, valid[numpy.newaxis, :, :], out=chunk_distance)
+
+        total = chunk_distance.sum(axis=1)
+        total[~valid] = numpy.inf
+
+        chunk_index = numpy.argmin(total, axis=0)
+        chunk_index[~numpy.any(valid, axis=0)] = -1
+
+        index[start:stop] = chunk_index
+
+    return index.reshape(shape)
+
+
+def calculate_medoid_stack(stack, ndv=NDV, chunk_bytes=MEDOID_CHUNK_BYTES):
+
+    """
+    Return the medoid composite of a (time, band, ...) stack (see calculate_medoid_index)
+
+    :param stack: The stack of observations (time, band, y, x)
+    :type stack: numpy.ndarray
+    :param ndv: The no data value
+    :param chunk_bytes: Memory budget for the distance calculation temporaries
+    :type chunk_bytes: int
+    :return: The medoid observation of each pixel (band, y, x) - ndv where there are no valid observations
+    :rtype: numpy.ndarray
+    """
+
+    stack = numpy.asarray(stack)
+
+    index = calculate_medoid_index(stack, ndv=ndv, chunk_bytes=chunk_bytes)
+
+    times, bands = stack.shape[:2]
+
+    data = stack.reshape((times, bands, -1))
+    flat = index.ravel()
+
+    pixels = numpy.arange(flat.size)
+
+    out = data[numpy.maximum(flat, 0), :, pixels].T.copy()
+    out[:, flat < 0] = ndv
+
+    return out.reshape(stack.shape[1:])
+
+
 # def calculate_medoid_simon(X):
 #
 #     _log.debug("shape of X is %s", numpy.shape(X))
@@ -1060,6 +1806,99 @@ def log_mem(s=None):
     _log.info("Current MAX RSS  usage is [%d] MB", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
 
+class LazyLogMessage(object):
+
+    """
+    A log argument that is only evaluated if the record is actually emitted
+
+    The logging module already defers the %-formatting of its arguments but not the evaluation of the arguments
+    themselves so passing, for example, cursor.mogrify(sql, params) or numpy.ma.count(data) costs the same whether or
+    not the level is enabled.  Wrap them in one of these instead::
+
+        _log.debug("%s", LazyLogMessage(cursor.mogrify, sql, params))
+    """
+
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def lazy_mogrify(cursor, sql, params):
+
+    """
+    The SQL as it would be sent to the database, but only built if/when it is logged
+
+    :param cursor: The database cursor
+    :type cursor: psycopg2.extensions.cursor
+    :param sql: The SQL
+    :type sql: str
+    :param params: The query parameters
+    :type params: dict
+    :rtype: LazyLogMessage
+    """
+
+    return LazyLogMessage(cursor.mogrify, sql, params)
+
+
+def lazy_shape(data):
+
+    """
+    The shape of the data, but only calculated if/when it is logged
+
+    :param data: The data
+    :type data: numpy.ndarray
+    :rtype: LazyLogMessage
+    """
+
+    return LazyLogMessage(numpy.shape, data)
+
+
+@contextmanager
+def log_timing(event, logger=None, level=logging.DEBUG, **fields):
+
+    """
+    Log a structured timing event for the wrapped block, e.g.
+
+        with log_timing("read_dataset_data", path=dataset.path):
+            ...
+
+    logs
+
+        event=read_dataset_data elapsed=0.123456 path=...
+
+    The fields are logged as key=value pairs in name order.  The fields dict is yielded so that values only known at
+    the end of the block (counts etc) can be added to it.  Nothing is formatted unless the level is enabled.
+
+    :param event: The name of the event
+    :type event: str
+    :param logger: The logger to log to (defaults to this module's)
+    :type logger: logging.Logger
+    :param level: The level to log at
+    :type level: int
+    :param fields: Additional fields to log
+    """
+
+    logger = logger or _log
+
+    start = time.time()
+
+    try:
+        yield fields
+
+    finally:
+        if logger.isEnabledFor(level):
+            elapsed = time.time() - start
+
+            logger.log(level, "event=%s elapsed=%f%s", event, elapsed,
+                       "".join(" %s=%s" % (k, fields[k]) for k in sorted(fields)))
+
+
 def date_to_integer(d):
     # Return an integer representing the YYYYMMDD value
     return d.year * 10000 + d.month * 100 + d.day
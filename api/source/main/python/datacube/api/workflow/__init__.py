@@ -38,13 +38,287 @@ import luigi
 import os
 import sys
 from datacube.api import writeable_dir, satellite_arg, pqa_mask_arg, wofs_mask_arg, parse_date_min, parse_date_max
-from datacube.api.model import Satellite, Cell, DatasetType, Tile
+from datacube.api import readable_file, file_format_arg
+from datacube.api.model import Satellite, Cell, DatasetType
+from datacube.api.query import FileFormat, get_file_extension
 from datacube.api.utils import PqaMask, get_satellite_string, WofsMask, format_date
 
 
 _log = logging.getLogger()
 
 
+# Tile index snapshot (see datacube.api.snapshot) to query instead of the DB - loaded once before the tasks are run
+
+_tile_index = None
+
+
+# Format of the cell/tile list files created (and read) when using --csv - set once before the tasks are run
+
+_list_format = FileFormat.CSV
+
+
+def set_list_format(file_format):
+
+    """
+    Create (and read) the cell/tile list files in the given format
+
+    :type file_format: datacube.api.query.FileFormat
+    """
+
+    global _list_format
+
+    _list_format = file_format or FileFormat.CSV
+
+
+def get_list_format():
+
+    """
+    :rtype: datacube.api.query.FileFormat
+    """
+
+    return _list_format
+
+
+def get_list_file_extension():
+
+    return get_file_extension(_list_format)
+
+
+def set_tile_index(filename):
+
+    """
+    Query the tiles from the given tile index snapshot rather than the DB
+
+    :param filename: The snapshot file created by datacube.api.snapshot.export_tile_index()
+    :type filename: str
+    """
+
+    global _tile_index
+
+    from datacube.api.snapshot import TileIndex
+
+    _tile_index = filename and TileIndex.load(filename) or None
+
+
+def get_tile_query_key(acq_min, acq_max, satellites, dataset_types):
+
+    return (acq_min, acq_max,
+            tuple(sorted([satellite.value for satellite in satellites])),
+            tuple(sorted([dataset_type.value for dataset_type in dataset_types])))
+
+
+def prefetch_tiles(x_min, x_max, y_min, y_max, acq_min, acq_max, satellites, dataset_types):
+
+    """
+    Query the tiles for ALL the cells in the range at once (see SummaryTask.get_cells_from_db())
+
+    :return: The tiles for each cell (x, y) in the range - cells with no tiles are recorded as having none so they
+        aren't queried again
+    :rtype: dict[(int, int), list[datacube.api.model.Tile]]
+    """
+
+    if _tile_index:
+        list_tiles_by_cell_as_generator = _tile_index.list_tiles_by_cell_as_generator
+    else:
+        from datacube.api.query import list_tiles_by_cell_as_generator
+
+    x_list = range(x_min, x_max + 1)
+    y_list = range(y_min, y_max + 1)
+
+    tiles_by_cell = dict(((x, y), []) for x in x_list for y in y_list)
+
+    count = 0
+
+    for cell, tiles in list_tiles_by_cell_as_generator(x=x_list, y=y_list, acq_min=acq_min, acq_max=acq_max,
+                                                       satellites=list(satellites),
+                                                       dataset_types=list(dataset_types)):
+        tiles_by_cell[cell.xy] = tiles
+        count += 1
+
+    _log.info("Pre-fetched tiles for [%d] cells", count)
+
+    return tiles_by_cell
+
+
+def get_tiles_for_cell(x, y, acq_min, acq_max, satellites, dataset_types, prefetched=None):
+
+    """
+    Return the tiles for the cell - from the tiles pre-fetched by the summary task if available otherwise from the DB
+    (or the tile index snapshot if one was given)
+
+    :param prefetched: The tiles pre-fetched for the cell keyed on the query criteria (see Task.prefetched_tiles)
+    :type prefetched: dict[tuple, list[datacube.api.model.Tile]]
+    :rtype: list[datacube.api.model.Tile]
+    """
+
+    key = get_tile_query_key(acq_min, acq_max, satellites, dataset_types)
+
+    if prefetched and key in prefetched:
+        _log.debug("Using pre-fetched tiles for cell [%03d,%04d]", x, y)
+        return prefetched[key]
+
+    if _tile_index:
+        list_tiles_as_list = _tile_index.list_tiles_as_list
+    else:
+        from datacube.api.query import list_tiles_as_list
+
+    return list_tiles_as_list(x=[x], y=[y], acq_min=acq_min, acq_max=acq_max,
+                              satellites=list(satellites), dataset_types=list(dataset_types))
+
+
+# Tasks being run in process by run_tasks() - module level so that forked worker processes inherit them (along with
+# anything they share such as the tile lists) rather than having them pickled
+
+_pool_tasks = None
+
+
+def run_task(index):
+
+    task = _pool_tasks[index]
+
+    if not task.complete():
+        task.run()
+
+    return index
+
+
+def run_tasks(tasks, workers=1, threads=False):
+
+    """
+    Run the tasks in this process (using a pool of worker processes or threads) rather than scheduling each of them
+    with luigi
+
+    Used to run the chunks of a cell within the cell's task - with hundreds of chunks per cell luigi's per task
+    scheduling and complete() checks dominate.  Tasks that are already complete are skipped.  The tasks' requirements
+    are NOT run so must already be complete (e.g. by making them requirements of the calling task - see
+    get_requirements()).
+
+    Worker processes are forked so they share the tasks (and whatever has already been loaded) with the calling
+    process.
+
+    :param tasks: The tasks
+    :type tasks: list[luigi.Task]
+    :param workers: The number of worker processes (or threads) - 1 runs the tasks one after the other
+    :type workers: int
+    :param threads: Use threads rather than processes (when the tasks mostly do I/O or numpy/GDAL calls which release
+        the GIL)
+    :type threads: bool
+    """
+
+    global _pool_tasks
+
+    _pool_tasks = list(tasks)
+
+    _log.info("Running [%d] tasks in process with [%d] %s", len(_pool_tasks), workers,
+              threads and "threads" or "processes")
+
+    try:
+        if workers <= 1:
+            for index in range(len(_pool_tasks)):
+                run_task(index)
+
+            return
+
+        if threads:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(processes=workers)
+
+        else:
+            from multiprocessing import Pool
+            pool = Pool(processes=workers)
+
+        try:
+            for count, index in enumerate(pool.imap_unordered(run_task, range(len(_pool_tasks))), start=1):
+                _log.debug("Ran task [%s] (%d of %d)", _pool_tasks[index], count, len(_pool_tasks))
+
+        finally:
+            pool.terminate()
+            pool.join()
+
+    finally:
+        _pool_tasks = None
+
+
+def get_requirements(tasks):
+
+    """
+    Return the (distinct) requirements of the tasks
+
+    :type tasks: list[luigi.Task]
+    :rtype: list[luigi.Task]
+    """
+
+    from luigi.task import flatten
+
+    requirements = list()
+    seen = set()
+
+    for task in tasks:
+        for requirement in flatten(task.requires()):
+            if requirement.task_id not in seen:
+                seen.add(requirement.task_id)
+                requirements.append(requirement)
+
+    return requirements
+
+
+def get_tile_list_filename(output_directory, satellites, x, y, acq_min, acq_max):
+
+    """
+    Return the path of the tile list file (see --csv) for the cell
+    """
+
+    # TODO other distinguishing characteristics (e.g. dataset types)
+
+    return os.path.join(
+        output_directory,
+        "tiles_{satellites}_{x_min:03d}_{x_max:03d}_{y_min:04d}_{y_max:04d}_{acq_min}_{acq_max}{extension}".format(
+            satellites=get_satellite_string(satellites), x_min=x, x_max=x, y_min=y, y_max=y,
+            acq_min=format_date(acq_min), acq_max=format_date(acq_max), extension=get_list_file_extension()
+        ))
+
+
+def list_tiles_for_planning(x_min, x_max, y_min, y_max, acq_min, acq_max, satellites, dataset_types, csv=False,
+                            output_directory=None):
+
+    """
+    Return the tiles for the range of cells as a SINGLE-USE generator for planning (e.g. aligning the chunk size) before
+    the tasks are run
+
+    The DB is only queried if the workflow is using it - with a tile index snapshot the tiles come from the snapshot
+    and with --csv from the tile list files of the cells that already have one.
+
+    :rtype: list[datacube.api.model.Tile]
+    """
+
+    x_list = range(x_min, x_max + 1)
+    y_list = range(y_min, y_max + 1)
+
+    if _tile_index:
+        for tile in _tile_index.list_tiles_as_generator(x=x_list, y=y_list, acq_min=acq_min, acq_max=acq_max,
+                                                        satellites=list(satellites),
+                                                        dataset_types=list(dataset_types)):
+            yield tile
+
+    elif csv:
+        from datacube.api.query import read_tiles_from_file
+
+        for x in x_list:
+            for y in y_list:
+                filename = get_tile_list_filename(output_directory, satellites, x, y, acq_min, acq_max)
+
+                if os.path.isfile(filename):
+                    for tile in read_tiles_from_file(filename, file_format=get_list_format()):
+                        yield tile
+
+    else:
+        from datacube.api.query import list_tiles_as_generator
+
+        for tile in list_tiles_as_generator(x=x_list, y=y_list, acq_min=acq_min, acq_max=acq_max,
+                                            satellites=list(satellites), dataset_types=list(dataset_types)):
+            yield tile
+
+
 class Workflow(object):
 
     __metaclass__ = abc.ABCMeta
@@ -69,6 +343,8 @@ class Workflow(object):
         self.output_directory = None
 
         self.csv = None
+        self.list_format = None
+        self.tile_index = None
 
         self.dummy = None
 
@@ -125,6 +401,15 @@ class Workflow(object):
         self.parser.add_argument("--csv", help="Get cell/dataset info from pre-created CSV rather than querying DB",
                                  action="store_true", dest="csv", default=False)
 
+        self.parser.add_argument("--list-format",
+                                 help="Format of the cell/tile list files used with --csv (NPZ is quicker to load)",
+                                 action="store", dest="list_format", type=file_format_arg, choices=FileFormat,
+                                 default=FileFormat.CSV, metavar=" ".join([f.name for f in FileFormat]))
+
+        self.parser.add_argument("--tile-index",
+                                 help="Get cell/dataset info from a tile index snapshot rather than querying DB",
+                                 action="store", dest="tile_index", type=readable_file)
+
         self.parser.add_argument("--dummy", help="Dummy run", action="store_true", dest="dummy", default=False)
 
         self.parser.add_argument("--local-scheduler", help="Use local luigi scheduler rather than MPI",
@@ -157,6 +442,8 @@ class Workflow(object):
         self.satellites = args.satellite
 
         self.csv = args.csv
+        self.list_format = args.list_format
+        self.tile_index = args.tile_index
 
         self.dummy = args.dummy
 
@@ -180,6 +467,8 @@ class Workflow(object):
         satellites = {satellites}
         output directory = {output_directory}
         csv = {csv}
+        list format = {list_format}
+        tile index = {tile_index}
         dummy = {dummy}
         PQA mask = {pqa_mask}
         WOFS mask = {wofs_mask}
@@ -188,7 +477,7 @@ class Workflow(object):
         """.format(x_min=self.x_min, x_max=self.x_max, y_min=self.y_min, y_max=self.y_max,
                    acq_min=self.acq_min, acq_max=self.acq_max,
                    satellites=" ".join([s.name for s in self.satellites]), output_directory=self.output_directory,
-                   csv=self.csv,
+                   csv=self.csv, list_format=self.list_format.name, tile_index=self.tile_index,
                    dummy=self.dummy,
                    pqa_mask=self.mask_pqa_apply and " ".join([mask.name for mask in self.mask_pqa_mask]) or "",
                    wofs_mask=self.mask_wofs_apply and " ".join([mask.name for mask in self.mask_wofs_mask]) or "",
@@ -199,12 +488,28 @@ class Workflow(object):
 
         raise Exception("Abstract method should be overridden")
 
+    def prepare(self):
+
+        """
+        Called once the tile index snapshot etc are loaded and before the tasks are created
+        """
+
+        pass
+
     def run(self):
 
         self.setup_arguments()
         self.process_arguments(self.parser.parse_args())
         self.log_arguments()
 
+        # Load the tile index snapshot (if any) once here so it is shared by all the tasks
+
+        set_tile_index(self.tile_index)
+
+        set_list_format(self.list_format)
+
+        self.prepare()
+
         if self.local_scheduler:
             luigi.build(self.create_summary_tasks(), local_scheduler=self.local_scheduler, workers=self.workers)
 
@@ -217,6 +522,11 @@ class Task(luigi.Task):
 
     __metaclass__ = abc.ABCMeta
 
+    # Tiles for the task's cell pre-fetched by the summary task keyed on the query criteria (see
+    # SummaryTask.requires() and get_tiles_for_cell()) - tasks pass them on to the tasks they create
+
+    prefetched_tiles = None
+
     def complete(self):
         from luigi.task import flatten
 
@@ -258,6 +568,15 @@ class SummaryTask(Task):
     mask_wofs_apply = luigi.BooleanParameter()
     mask_wofs_mask = luigi.Parameter()
 
+    # Tiles for every cell in the range pre-fetched by get_cells_from_db() - handed on to the cell tasks and then
+    # released by requires()
+
+    tiles_by_cell = None
+
+    # Cells from get_cells_from_db() - kept as requires() is called again (e.g. when luigi checks complete())
+
+    prefetched_cells = None
+
     def get_cells(self):
 
         # get list of cells from CSV
@@ -273,13 +592,10 @@ class SummaryTask(Task):
     def get_cells_from_csv(self):
 
         if os.path.isfile(self.get_cell_csv_filename()):
-            with open(self.get_cell_csv_filename(), "rb") as f:
-                import csv
+            from datacube.api.query import read_cells_from_file
 
-                reader = csv.DictReader(f)
-                for record in reader:
-                    _log.debug("Found CSV record [%s]", record)
-                    yield Cell.from_csv_record(record)
+            for cell in read_cells_from_file(self.get_cell_csv_filename(), file_format=get_list_format()):
+                yield cell
 
     def get_cell_csv_filename(self):
 
@@ -290,23 +606,31 @@ class SummaryTask(Task):
 
         return os.path.join(
             self.output_directory,
-            "cells_{satellites}_{x_min:03d}_{x_max:03d}_{y_min:04d}_{y_max:04d}_{acq_min}_{acq_max}.csv".format(
+            "cells_{satellites}_{x_min:03d}_{x_max:03d}_{y_min:04d}_{y_max:04d}_{acq_min}_{acq_max}{extension}".format(
                 satellites=get_satellite_string(self.satellites), x_min=self.x_min,
                 x_max=self.x_max, y_min=self.y_min, y_max=self.y_max,
-                acq_min=acq_min, acq_max=acq_max
+                acq_min=acq_min, acq_max=acq_max, extension=get_list_file_extension()
             ))
 
     def get_cells_from_db(self):
 
-        from datacube.api.query import list_cells
+        # Get the tiles for all the cells in one query - the cell tasks then use these rather than querying again
 
-        x_list = range(self.x_min, self.x_max + 1)
-        y_list = range(self.y_min, self.y_max + 1)
+        if self.prefetched_cells is None:
+            self.tiles_by_cell = prefetch_tiles(x_min=self.x_min, x_max=self.x_max, y_min=self.y_min, y_max=self.y_max,
+                                                acq_min=self.acq_min, acq_max=self.acq_max,
+                                                satellites=[satellite for satellite in self.satellites],
+                                                dataset_types=self.get_dataset_types())
+
+            self.prefetched_cells = [Cell(x_index=x, y_index=y) for x, y in sorted(self.tiles_by_cell)
+                                     if self.tiles_by_cell[(x, y)]]
+
+        return self.prefetched_cells
 
-        for cell in list_cells(x=x_list, y=y_list, acq_min=self.acq_min, acq_max=self.acq_max,
-                               satellites=[satellite for satellite in self.satellites],
-                               dataset_types=self.get_dataset_types()):
-            yield cell
+    def get_tile_query_key(self):
+
+        return get_tile_query_key(self.acq_min, self.acq_max, [satellite for satellite in self.satellites],
+                                  self.get_dataset_types())
 
     def requires(self):
 
@@ -315,9 +639,23 @@ class SummaryTask(Task):
                                   acq_min=self.acq_min, acq_max=self.acq_max, satellites=self.satellites,
                                   dataset_types=self.get_dataset_types(), path=self.get_cell_csv_filename())
 
+        from luigi.task import flatten
+
         # yield [self.create_cell_tasks(x=cell.x, y=cell.y) for cell in self.get_cells()]
         for cell in self.get_cells():
-            yield self.create_cell_tasks(x=cell.x, y=cell.y)
+            tasks = self.create_cell_tasks(x=cell.x, y=cell.y)
+
+            # Hand each cell task only its own cell's tiles (luigi reuses the task instances so they keep them)
+
+            if self.tiles_by_cell is not None:
+                for task in flatten(tasks):
+                    task.prefetched_tiles = {self.get_tile_query_key(): self.tiles_by_cell[cell.xy]}
+
+            yield tasks
+
+        # The cell tasks have their tiles now - don't hold on to the whole range
+
+        self.tiles_by_cell = None
 
     @abc.abstractmethod
     def create_cell_tasks(self, x, y):
@@ -369,39 +707,21 @@ class CellTask(Task):
     def get_tiles_from_csv(self):
 
         if os.path.isfile(self.get_tile_csv_filename()):
-            with open(self.get_tile_csv_filename(), "rb") as f:
-                import csv
+            from datacube.api.query import read_tiles_from_file
 
-                reader = csv.DictReader(f)
-                for record in reader:
-                    _log.debug("Found CSV record [%s]", record)
-                    yield Tile.from_csv_record(record)
+            for tile in read_tiles_from_file(self.get_tile_csv_filename(), file_format=get_list_format()):
+                yield tile
 
     def get_tile_csv_filename(self):
 
-        acq_min = format_date(self.acq_min)
-        acq_max = format_date(self.acq_max)
-
-        # TODO other distinguishing characteristics (e.g. dataset types)
-
-        return os.path.join(
-            self.output_directory,
-            "tiles_{satellites}_{x_min:03d}_{x_max:03d}_{y_min:04d}_{y_max:04d}_{acq_min}_{acq_max}.csv".format(
-                satellites=get_satellite_string(self.satellites),
-                x_min=self.x, x_max=self.x, y_min=self.y, y_max=self.y,
-                acq_min=acq_min, acq_max=acq_max
-            ))
+        return get_tile_list_filename(self.output_directory, self.satellites, self.x, self.y, self.acq_min,
+                                        self.acq_max)
 
     def get_tiles_from_db(self):
 
-        from datacube.api.query import list_tiles
-
-        x_list = [self.x]
-        y_list = [self.y]
-
-        for tile in list_tiles(x=x_list, y=y_list, acq_min=self.acq_min, acq_max=self.acq_max,
-                               satellites=[satellite for satellite in self.satellites],
-                               dataset_types=self.get_dataset_types()):
+        for tile in get_tiles_for_cell(x=self.x, y=self.y, acq_min=self.acq_min, acq_max=self.acq_max,
+                                       satellites=[satellite for satellite in self.satellites],
+                                       dataset_types=self.get_dataset_types(), prefetched=self.prefetched_tiles):
             yield tile
 
     @staticmethod
@@ -453,7 +773,7 @@ class CellListCsvTask(Task):
 
         list_cells_to_file(x=x_list, y=y_list, satellites=list(self.satellites),
                            acq_min=self.acq_min, acq_max=self.acq_max, dataset_types=self.dataset_types,
-                           filename=self.output().path, sort=SortType.ASC)
+                           filename=self.output().path, sort=SortType.ASC, file_format=get_list_format())
 
 
 class TileListCsvTask(Task):
@@ -488,4 +808,4 @@ class TileListCsvTask(Task):
 
         list_tiles_to_file(x=x_list, y=y_list, satellites=list(self.satellites),
                            acq_min=self.acq_min, acq_max=self.acq_max, dataset_types=self.dataset_types,
-                           filename=self.output().path, sort=SortType.ASC)
\ No newline at end of file
+                           filename=self.output().path, sort=SortType.ASC, file_format=get_list_format())
\ No newline at end of file
@@ -36,8 +36,10 @@ import luigi
 import os
 from datacube.api import output_format_arg
 from datacube.api.model import dataset_type_database, dataset_type_derived_nbar, DatasetType
-from datacube.api.utils import get_dataset_metadata, get_dataset_datatype, get_dataset_ndv, get_mask_pqa, get_mask_wofs
-from datacube.api.utils import get_dataset_data_masked, format_date, OutputFormat
+from datacube.api.reader import read_as_generator, read_tile_data
+from datacube.api.utils import get_dataset_metadata, get_dataset_datatype, get_dataset_ndv
+from datacube.api.utils import format_date, OutputFormat
+from datacube.api.writer import RasterWriter, get_driver_name
 from datacube.api.workflow.cell_dataset_band import Workflow, SummaryTask, CellTask, CellDatasetBandTask
 
 
@@ -171,9 +173,7 @@ class BandStackCellDatasetBandTask(CellDatasetBandTask):
 
         # TODO move the dicking around with bands stuff into utils?
 
-        import gdal
-
-        driver = raster = None
+        writer = None
         metadata = None
         data_type = ndv = None
 
@@ -197,93 +197,77 @@ class BandStackCellDatasetBandTask(CellDatasetBandTask):
 
         _log.info("Total tiles for band [%s] is [%d]", self.band, len(relevant_tiles))
 
-        for index, tile in enumerate(relevant_tiles, start=1):
+        # Read (and mask) the tiles in parallel ahead of them being written to the stack
 
+        def read(tile):
             dataset = tile.datasets[self.dataset_type]
-            assert dataset
-
-            band = dataset.bands[self.band]
-            assert band
-
-            pqa = (self.mask_pqa_apply and DatasetType.PQ25 in tile.datasets) and tile.datasets[DatasetType.PQ25] or None
-            wofs = (self.mask_wofs_apply and DatasetType.WATER in tile.datasets) and tile.datasets[DatasetType.WATER] or None
-
-            if self.dataset_type not in tile.datasets:
-                _log.debug("No [%s] dataset present for [%s] - skipping", self.dataset_type.name, tile.end_datetime)
-                continue
-
-            filename = self.output().path
-
-            if not metadata:
-                metadata = get_dataset_metadata(dataset)
-                assert metadata
-
-            if not data_type:
-                data_type = get_dataset_datatype(dataset)
-                assert data_type
-
-            if not ndv:
-                ndv = get_dataset_ndv(dataset)
-                assert ndv
 
-            if not driver:
+            return read_tile_data(tile, self.dataset_type, bands=[dataset.bands[self.band]],
+                                  mask_pqa_apply=self.mask_pqa_apply, mask_pqa_mask=self.mask_pqa_mask,
+                                  mask_wofs_apply=self.mask_wofs_apply, mask_wofs_mask=self.mask_wofs_mask,
+                                  ndv=get_dataset_ndv(dataset))
 
-                if self.output_format == OutputFormat.GEOTIFF:
-                    driver = gdal.GetDriverByName("GTiff")
-                elif self.output_format == OutputFormat.ENVI:
-                    driver = gdal.GetDriverByName("ENVI")
+        # Abort (rather than close) the stack on error so that the error isn't replaced by one from the writer
 
-                assert driver
+        try:
+            for index, (tile, data) in enumerate(read_as_generator(relevant_tiles, read), start=1):
 
-            if not raster:
+                dataset = tile.datasets[self.dataset_type]
+                assert dataset
 
-                if self.output_format == OutputFormat.GEOTIFF:
-                    raster = driver.Create(filename, metadata.shape[0], metadata.shape[1], len(tiles), data_type, options=["BIGTIFF=YES", "INTERLEAVE=BAND"])
-                elif self.output_format == OutputFormat.ENVI:
-                    raster = driver.Create(filename, metadata.shape[0], metadata.shape[1], len(tiles), data_type, options=["INTERLEAVE=BSQ"])
+                band = dataset.bands[self.band]
+                assert band
 
-                assert raster
+                pqa = (self.mask_pqa_apply and DatasetType.PQ25 in tile.datasets) and tile.datasets[DatasetType.PQ25] or None
+                wofs = (self.mask_wofs_apply and DatasetType.WATER in tile.datasets) and tile.datasets[DatasetType.WATER] or None
 
-                # NOTE: could do this without the metadata!!
-                raster.SetGeoTransform(metadata.transform)
-                raster.SetProjection(metadata.projection)
+                if self.dataset_type not in tile.datasets:
+                    _log.debug("No [%s] dataset present for [%s] - skipping", self.dataset_type.name, tile.end_datetime)
+                    continue
 
-            raster.SetMetadata(self.generate_raster_metadata())
+                filename = self.output().path
 
-            mask = None
+                if not metadata:
+                    metadata = get_dataset_metadata(dataset)
+                    assert metadata
 
-            if pqa:
-                mask = get_mask_pqa(pqa, self.mask_pqa_mask, mask=mask)
+                if not data_type:
+                    data_type = get_dataset_datatype(dataset)
+                    assert data_type
 
-            if wofs:
-                mask = get_mask_wofs(wofs, self.mask_wofs_mask, mask=mask)
+                if not ndv:
+                    ndv = get_dataset_ndv(dataset)
+                    assert ndv
 
-            _log.info("Stacking [%s] band data from [%s] with PQA [%s] and PQA mask [%s] and WOFS [%s] and WOFS mask [%s] to [%s]",
-                      band.name, dataset.path,
-                      pqa and pqa.path or "",
-                      pqa and self.mask_pqa_mask or "",
-                      wofs and wofs.path or "", wofs and self.mask_wofs_mask or "",
-                      filename)
+                # The stack is written (and its statistics calculated) on a background thread while the next tile is read
 
-            data = get_dataset_data_masked(dataset, mask=mask, ndv=ndv)
+                if not writer:
+                    writer = RasterWriter(filename, metadata.shape[0], metadata.shape[1], len(tiles), data_type,
+                                          metadata.transform, metadata.projection, ndv=ndv,
+                                          driver=get_driver_name(self.output_format),
+                                          metadata=self.generate_raster_metadata())
 
-            _log.debug("data is [%s]", data)
+                _log.info("Stacking [%s] band data from [%s] with PQA [%s] and PQA mask [%s] and WOFS [%s] and WOFS mask [%s] to [%s]",
+                          band.name, dataset.path,
+                          pqa and pqa.path or "",
+                          pqa and self.mask_pqa_mask or "",
+                          wofs and wofs.path or "", wofs and self.mask_wofs_mask or "",
+                          filename)
 
-            stack_band = raster.GetRasterBand(index)
+                _log.debug("data is [%s]", data)
 
-            stack_band.SetDescription(os.path.basename(dataset.path))
-            stack_band.SetNoDataValue(ndv)
-            stack_band.WriteArray(data[band])
-            stack_band.ComputeStatistics(True)
-            stack_band.SetMetadata({"ACQ_DATE": format_date(tile.end_datetime), "SATELLITE": dataset.satellite.name})
+                writer.set_band_description(index, os.path.basename(dataset.path))
+                writer.set_band_metadata(index, {"ACQ_DATE": format_date(tile.end_datetime), "SATELLITE": dataset.satellite.name})
+                writer.write(index, data[band])
 
-            stack_band.FlushCache()
-            del stack_band
+        except Exception:
+            if writer:
+                writer.abort()
+            raise
 
-        if raster:
-            raster.FlushCache()
-            del raster
-            raster = None
+        if writer:
+            writer.close()
+            writer = None
 
     def generate_raster_metadata(self):
         return {
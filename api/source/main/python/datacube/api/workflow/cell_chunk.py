@@ -36,8 +36,8 @@ import datacube.api.workflow as workflow
 import logging
 import luigi
 import os
-from datacube.api.model import DatasetType, Tile
-from datacube.api.utils import get_satellite_string
+from datacube.api.chunk import get_chunks, get_chunk_window_size, plan_chunk_size_for_tiles
+from datacube.api.model import DatasetType
 
 
 _log = logging.getLogger()
@@ -56,6 +56,11 @@ class Workflow(workflow.Workflow):
         self.chunk_size_x = None
         self.chunk_size_y = None
 
+        self.align_chunks = None
+
+        self.chunk_workers = None
+        self.chunk_threads = None
+
     def setup_arguments(self):
 
         # Call method on super class
@@ -67,6 +72,19 @@ class Workflow(workflow.Workflow):
         self.parser.add_argument("--chunk-size-y", help="Y chunk size", action="store", dest="chunk_size_y", type=int,
                                  choices=range(1, 4000 + 1), required=True)
 
+        self.parser.add_argument("--no-align-chunks",
+                                 help="Use the chunk size as given rather than aligning it to the tiles' block layout",
+                                 action="store_false", dest="align_chunks", default=True)
+
+        self.parser.add_argument("--chunk-workers",
+                                 help="Run the chunks of each cell within the cell's task using this many worker "
+                                      "processes rather than as a luigi task per chunk",
+                                 action="store", dest="chunk_workers", type=int, default=0)
+
+        self.parser.add_argument("--chunk-threads",
+                                 help="Use threads rather than processes to run the chunks (with --chunk-workers)",
+                                 action="store_true", dest="chunk_threads", default=False)
+
     def process_arguments(self, args):
 
         # Call method on super class
@@ -76,6 +94,32 @@ class Workflow(workflow.Workflow):
         self.chunk_size_x = args.chunk_size_x
         self.chunk_size_y = args.chunk_size_y
 
+        self.align_chunks = args.align_chunks
+
+        self.chunk_workers = args.chunk_workers
+        self.chunk_threads = args.chunk_threads
+
+    def prepare(self):
+
+        # Call method on super class
+        # super(self.__class__, self).prepare()
+        workflow.Workflow.prepare(self)
+
+        # Align the chunk size to the block layout of the tiles - done here rather than when processing the arguments
+        # so that the tiles come from the tile index snapshot or tile list files (if given) rather than the DB
+
+        if self.align_chunks:
+            tiles = workflow.list_tiles_for_planning(x_min=self.x_min, x_max=self.x_max, y_min=self.y_min,
+                                                     y_max=self.y_max, acq_min=self.acq_min, acq_max=self.acq_max,
+                                                     satellites=self.satellites, dataset_types=[DatasetType.ARG25],
+                                                     csv=self.csv, output_directory=self.output_directory)
+
+            self.chunk_size_x, self.chunk_size_y = plan_chunk_size_for_tiles(tiles, dataset_type=DatasetType.ARG25,
+                                                                             chunk_size_x=self.chunk_size_x,
+                                                                             chunk_size_y=self.chunk_size_y)
+
+            _log.info("Aligned chunk size is [%d x %d]", self.chunk_size_x, self.chunk_size_y)
+
     def log_arguments(self):
 
         # Call method on super class
@@ -85,7 +129,12 @@ class Workflow(workflow.Workflow):
         _log.info("""
         X chunk size = {chunk_size_x}
         Y chunk size = {chunk_size_y}
-        """.format(chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y))
+        align chunks = {align_chunks}
+        chunk workers = {chunk_workers}
+        chunk threads = {chunk_threads}
+        """.format(chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                   align_chunks=self.align_chunks,
+                   chunk_workers=self.chunk_workers, chunk_threads=self.chunk_threads))
 
     def create_summary_tasks(self):
 
@@ -99,6 +148,9 @@ class SummaryTask(workflow.SummaryTask):
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
 
+    chunk_workers = luigi.IntParameter(default=0)
+    chunk_threads = luigi.BooleanParameter()
+
     @abc.abstractmethod
     def create_cell_tasks(self, x, y):
 
@@ -112,26 +164,94 @@ class CellTask(workflow.CellTask):
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
 
+    chunk_workers = luigi.IntParameter(default=0)
+    chunk_threads = luigi.BooleanParameter()
+
     def requires(self):
 
+        # When the chunks are run in process (see run_chunk_tasks()) luigi only schedules the cell - it requires what
+        # the chunks require rather than the chunks themselves
+
+        if self.chunk_workers:
+            for task in workflow.get_requirements(self.create_cell_chunk_tasks()):
+                yield task
+
+            return
+
         # return [self.create_cell_chunk_task(x_offset, y_offset) for x_offset, y_offset in self.get_chunks()]
 
         for x_offset, y_offset in self.get_chunks():
-            yield self.create_cell_chunk_task(x_offset, y_offset)
+            task = self.create_cell_chunk_task(x_offset, y_offset)
+            task.prefetched_tiles = self.prefetched_tiles
+            yield task
 
     def get_chunks(self):
 
-        import itertools
-
-        for x_offset, y_offset in itertools.product(range(0, 4000, self.chunk_size_x), range(0, 4000, self.chunk_size_y)):
+        for x_offset, y_offset in get_chunks(self.chunk_size_x, self.chunk_size_y):
             yield x_offset, y_offset
 
+    def create_cell_chunk_tasks(self):
+
+        tasks = [self.create_cell_chunk_task(x_offset, y_offset) for x_offset, y_offset in self.get_chunks()]
+
+        for task in tasks:
+            task.prefetched_tiles = self.prefetched_tiles
+
+        # The tile list is the same for every chunk of the cell so get it once and share it
+
+        if tasks:
+            tiles = tasks[0].get_tiles()
+
+            for task in tasks:
+                task.tiles = tiles
+
+        return tasks
+
+    def run_chunk_tasks(self):
+
+        """
+        Run the chunk tasks within this task (if running chunks in process)
+        """
+
+        if self.chunk_workers:
+            workflow.run_tasks(self.create_cell_chunk_tasks(), workers=self.chunk_workers, threads=self.chunk_threads)
+
+    def run(self):
+
+        # Run the chunks first if they're being run in process rather than as luigi tasks - subclasses implement
+        # run_cell() rather than run() so this can't be missed
+
+        self.run_chunk_tasks()
+
+        self.run_cell()
+
+    @abc.abstractmethod
+    def run_cell(self):
+
+        raise Exception("Abstract method should be overridden")
+
     @abc.abstractmethod
     def create_cell_chunk_task(self, x_offset, y_offset):
 
         raise Exception("Abstract method should be overridden")
 
 
+class CellStoreChunkTarget(luigi.Target):
+
+    """
+    A chunk task's output when it writes into a shared per cell store (see datacube.api.store.CellStore) rather than
+    to files of its own
+    """
+
+    def __init__(self, store, x_offset, y_offset):
+        self.store = store
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+
+    def exists(self):
+        return self.store.is_done(self.x_offset, self.y_offset)
+
+
 class CellChunkTask(workflow.Task):
 
     __metaclass__ = abc.ABCMeta
@@ -161,8 +281,27 @@ class CellChunkTask(workflow.Task):
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
 
+    # Tile list shared by the cell task (see CellTask.create_cell_chunk_tasks())
+
+    tiles = None
+
+    def get_window_size(self):
+
+        """
+        Return the size of the chunk's window - the chunk size clipped to the cell (the last chunk in each dimension
+        is generally smaller)
+
+        :return: The (x, y) size of the window
+        :rtype: (int, int)
+        """
+
+        return get_chunk_window_size(self.x_offset, self.y_offset, self.chunk_size_x, self.chunk_size_y)
+
     def get_tiles(self):
 
+        if self.tiles is not None:
+            return self.tiles
+
         # get list of tiles from CSV
 
         if self.csv:
@@ -176,39 +315,22 @@ class CellChunkTask(workflow.Task):
     def get_tiles_from_csv(self):
 
         if os.path.isfile(self.get_tile_csv_filename()):
-            with open(self.get_tile_csv_filename(), "rb") as f:
-                import csv
+            from datacube.api.query import read_tiles_from_file
 
-                reader = csv.DictReader(f)
-                for record in reader:
-                    _log.debug("Found CSV record [%s]", record)
-                    yield Tile.from_csv_record(record)
+            for tile in read_tiles_from_file(self.get_tile_csv_filename(), file_format=workflow.get_list_format()):
+                yield tile
 
     def get_tile_csv_filename(self):
 
-        acq_min = workflow.format_date(self.acq_min)
-        acq_max = workflow.format_date(self.acq_max)
-
-        # TODO other distinguishing characteristics (e.g. dataset types)
-
-        return os.path.join(
-            self.output_directory,
-            "tiles_{satellites}_{x_min:03d}_{x_max:03d}_{y_min:04d}_{y_max:04d}_{acq_min}_{acq_max}.csv".format(
-                satellites=get_satellite_string(self.satellites),
-                x_min=self.x, x_max=self.x, y_min=self.y, y_max=self.y,
-                acq_min=acq_min, acq_max=acq_max
-            ))
+        return workflow.get_tile_list_filename(self.output_directory, self.satellites, self.x, self.y, self.acq_min,
+                                                 self.acq_max)
 
     def get_tiles_from_db(self):
 
-        from datacube.api.query import list_tiles
-
-        x_list = [self.x]
-        y_list = [self.y]
-
-        for tile in list_tiles(x=x_list, y=y_list, acq_min=self.acq_min, acq_max=self.acq_max,
-                               satellites=[satellite for satellite in self.satellites],
-                               dataset_types=self.get_dataset_types()):
+        for tile in workflow.get_tiles_for_cell(x=self.x, y=self.y, acq_min=self.acq_min, acq_max=self.acq_max,
+                                                satellites=[satellite for satellite in self.satellites],
+                                                dataset_types=self.get_dataset_types(),
+                                                prefetched=self.prefetched_tiles):
             yield tile
 
     @staticmethod
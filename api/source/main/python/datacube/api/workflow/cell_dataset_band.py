@@ -37,8 +37,8 @@ from enum import Enum
 import logging
 import luigi
 import os
-from datacube.api.model import Tile, DatasetType
-from datacube.api.utils import get_band_name_union, get_band_name_intersection, format_date, get_satellite_string
+from datacube.api.model import DatasetType
+from datacube.api.utils import get_band_name_union, get_band_name_intersection
 from datacube.api import dataset_type_arg
 
 
@@ -163,7 +163,12 @@ class CellTask(workflow.CellTask):
 
     def requires(self):
 
-        return [self.create_cell_dataset_band_task(band) for band in self.bands]
+        tasks = [self.create_cell_dataset_band_task(band) for band in self.bands]
+
+        for task in tasks:
+            task.prefetched_tiles = self.prefetched_tiles
+
+        return tasks
 
     @abc.abstractmethod
     def create_cell_dataset_band_task(self, band):
@@ -212,36 +217,18 @@ class CellDatasetBandTask(workflow.Task):
     def get_tiles_from_csv(self):
 
         if os.path.isfile(self.get_tile_csv_filename()):
-            with open(self.get_tile_csv_filename(), "rb") as f:
-                import csv
+            from datacube.api.query import read_tiles_from_file
 
-                reader = csv.DictReader(f)
-                for record in reader:
-                    _log.debug("Found CSV record [%s]", record)
-                    yield Tile.from_csv_record(record)
+            for tile in read_tiles_from_file(self.get_tile_csv_filename(), file_format=workflow.get_list_format()):
+                yield tile
 
     def get_tile_csv_filename(self):
 
-        acq_min = format_date(self.acq_min)
-        acq_max = format_date(self.acq_max)
-
-        # TODO other distinguishing characteristics (e.g. dataset types)
-
-        return os.path.join(
-            self.output_directory,
-            "tiles_{satellites}_{x_min:03d}_{x_max:03d}_{y_min:04d}_{y_max:04d}_{acq_min}_{acq_max}.csv".format(
-                satellites=get_satellite_string(self.satellites),
-                x_min=self.x, x_max=self.x, y_min=self.y, y_max=self.y,
-                acq_min=acq_min, acq_max=acq_max
-            ))
+        return workflow.get_tile_list_filename(self.output_directory, self.satellites, self.x, self.y, self.acq_min,
+                                                 self.acq_max)
 
     def get_tiles_from_db(self):
 
-        from datacube.api.query import list_tiles
-
-        x_list = [self.x]
-        y_list = [self.y]
-
         dataset_types = [self.dataset_type]
 
         if self.mask_pqa_apply:
@@ -250,7 +237,7 @@ class CellDatasetBandTask(workflow.Task):
         if self.mask_wofs_apply:
             dataset_types.append(DatasetType.WATER)
 
-        for tile in list_tiles(x=x_list, y=y_list, acq_min=self.acq_min, acq_max=self.acq_max,
-                               satellites=[satellite for satellite in self.satellites],
-                               dataset_types=dataset_types):
+        for tile in workflow.get_tiles_for_cell(x=self.x, y=self.y, acq_min=self.acq_min, acq_max=self.acq_max,
+                                                satellites=[satellite for satellite in self.satellites],
+                                                dataset_types=dataset_types, prefetched=self.prefetched_tiles):
             yield tile
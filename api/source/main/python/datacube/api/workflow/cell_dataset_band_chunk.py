@@ -35,6 +35,7 @@ import abc
 import datacube.api.workflow as workflow
 import logging
 import luigi
+from datacube.api.chunk import get_chunks, get_chunk_window_size, plan_chunk_size_for_tiles
 from datacube.api.model import Ls57Arg25Bands, get_bands
 
 
@@ -57,6 +58,11 @@ class Workflow(workflow.Workflow):
         self.chunk_size_x = None
         self.chunk_size_y = None
 
+        self.align_chunks = None
+
+        self.chunk_workers = None
+        self.chunk_threads = None
+
     def setup_arguments(self):
 
         # Call method on super class
@@ -78,6 +84,19 @@ class Workflow(workflow.Workflow):
         self.parser.add_argument("--chunk-size-y", help="Y chunk size", action="store", dest="chunk_size_y", type=int,
                                  choices=range(1, 4000 + 1), required=True)
 
+        self.parser.add_argument("--no-align-chunks",
+                                 help="Use the chunk size as given rather than aligning it to the tiles' block layout",
+                                 action="store_false", dest="align_chunks", default=True)
+
+        self.parser.add_argument("--chunk-workers",
+                                 help="Run the chunks of each cell within the cell's task using this many worker "
+                                      "processes rather than as a luigi task per chunk",
+                                 action="store", dest="chunk_workers", type=int, default=0)
+
+        self.parser.add_argument("--chunk-threads",
+                                 help="Use threads rather than processes to run the chunks (with --chunk-workers)",
+                                 action="store_true", dest="chunk_threads", default=False)
+
     def process_arguments(self, args):
 
         # Call method on super class
@@ -97,6 +116,32 @@ class Workflow(workflow.Workflow):
         self.chunk_size_x = args.chunk_size_x
         self.chunk_size_y = args.chunk_size_y
 
+        self.align_chunks = args.align_chunks
+
+        self.chunk_workers = args.chunk_workers
+        self.chunk_threads = args.chunk_threads
+
+    def prepare(self):
+
+        # Call method on super class
+        # super(self.__class__, self).prepare()
+        workflow.Workflow.prepare(self)
+
+        # Align the chunk size to the block layout of the tiles - done here rather than when processing the arguments
+        # so that the tiles come from the tile index snapshot or tile list files (if given) rather than the DB
+
+        if self.align_chunks:
+            tiles = workflow.list_tiles_for_planning(x_min=self.x_min, x_max=self.x_max, y_min=self.y_min,
+                                                     y_max=self.y_max, acq_min=self.acq_min, acq_max=self.acq_max,
+                                                     satellites=self.satellites, dataset_types=[self.dataset_type],
+                                                     csv=self.csv, output_directory=self.output_directory)
+
+            self.chunk_size_x, self.chunk_size_y = plan_chunk_size_for_tiles(tiles, dataset_type=self.dataset_type,
+                                                                             chunk_size_x=self.chunk_size_x,
+                                                                             chunk_size_y=self.chunk_size_y)
+
+            _log.info("Aligned chunk size is [%d x %d]", self.chunk_size_x, self.chunk_size_y)
+
     def log_arguments(self):
 
         # Call method on super class
@@ -108,8 +153,13 @@ class Workflow(workflow.Workflow):
         bands = {bands}
         X chunk size = {chunk_size_x}
         Y chunk size = {chunk_size_y}
+        align chunks = {align_chunks}
+        chunk workers = {chunk_workers}
+        chunk threads = {chunk_threads}
         """.format(dataset_type=self.dataset_type.name, bands=self.bands,
-                   chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y))
+                   chunk_size_x=self.chunk_size_x, chunk_size_y=self.chunk_size_y,
+                   align_chunks=self.align_chunks,
+                   chunk_workers=self.chunk_workers, chunk_threads=self.chunk_threads))
 
     @abc.abstractmethod
     def create_summary_tasks(self):
@@ -132,6 +182,9 @@ class SummaryTask(workflow.SummaryTask):
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
 
+    chunk_workers = luigi.IntParameter(default=0)
+    chunk_threads = luigi.BooleanParameter()
+
     @abc.abstractmethod
     def create_cell_tasks(self, x, y):
 
@@ -148,6 +201,9 @@ class CellTask(workflow.CellTask):
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
 
+    chunk_workers = luigi.IntParameter(default=0)
+    chunk_threads = luigi.BooleanParameter()
+
     def requires(self):
 
         return [self.create_cell_dataset_band_task(band) for band in self.bands]
@@ -184,17 +240,53 @@ class CellDatasetBandTask(workflow.Task):
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
 
+    chunk_workers = luigi.IntParameter(default=0)
+    chunk_threads = luigi.BooleanParameter()
+
     def requires(self):
 
+        # When the chunks are run in process (see run_chunk_tasks()) luigi only schedules the cell's band - it
+        # requires what the chunks require rather than the chunks themselves
+
+        if self.chunk_workers:
+            return workflow.get_requirements(self.create_cell_dataset_band_chunk_tasks())
+
         return [self.create_cell_dataset_band_chunk_task(x_offset, y_offset) for x_offset, y_offset in self.get_chunks()]
 
     def get_chunks(self):
 
-        import itertools
-
-        for x_offset, y_offset in itertools.product(range(0, 4000, self.chunk_size_x), range(0, 4000, self.chunk_size_y)):
+        for x_offset, y_offset in get_chunks(self.chunk_size_x, self.chunk_size_y):
             yield x_offset, y_offset
 
+    def create_cell_dataset_band_chunk_tasks(self):
+
+        return [self.create_cell_dataset_band_chunk_task(x_offset, y_offset)
+                for x_offset, y_offset in self.get_chunks()]
+
+    def run_chunk_tasks(self):
+
+        """
+        Run the chunk tasks within this task (if running chunks in process)
+        """
+
+        if self.chunk_workers:
+            workflow.run_tasks(self.create_cell_dataset_band_chunk_tasks(), workers=self.chunk_workers,
+                               threads=self.chunk_threads)
+
+    def run(self):
+
+        # Run the chunks first if they're being run in process rather than as luigi tasks - subclasses implement
+        # run_cell_dataset_band() rather than run() so this can't be missed
+
+        self.run_chunk_tasks()
+
+        self.run_cell_dataset_band()
+
+    @abc.abstractmethod
+    def run_cell_dataset_band(self):
+
+        raise Exception("Abstract method should be overridden")
+
     @abc.abstractmethod
     def create_cell_dataset_band_chunk_task(self, x_offset, y_offset):
 
@@ -229,3 +321,15 @@ class CellDatasetBandChunkTask(workflow.Task):
 
     chunk_size_x = luigi.IntParameter()
     chunk_size_y = luigi.IntParameter()
+
+    def get_window_size(self):
+
+        """
+        Return the size of the chunk's window - the chunk size clipped to the cell (the last chunk in each dimension
+        is generally smaller)
+
+        :return: The (x, y) size of the window
+        :rtype: (int, int)
+        """
+
+        return get_chunk_window_size(self.x_offset, self.y_offset, self.chunk_size_x, self.chunk_size_y)
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+__author__ = "Simon Oldfield"
+
+
+import gdal
+import logging
+import numpy
+import Queue
+import threading
+from datacube.api.utils import OutputFormat
+
+
+_log = logging.getLogger(__name__)
+
+
+# Default GeoTIFF creation options - tiled and compressed (the predictor is added based on the data type).  Band
+# interleaved so that writing a band at a time doesn't mean re-compressing blocks shared with the other bands.
+
+DEFAULT_GTIFF_OPTIONS = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "INTERLEAVE=BAND", "BIGTIFF=IF_SAFER"]
+
+DEFAULT_ENVI_OPTIONS = ["INTERLEAVE=BSQ"]
+
+DEFAULT_COMPRESS = "DEFLATE"
+
+# Number of pending writes queued for the background thread before write() blocks
+
+DEFAULT_WRITE_QUEUE_SIZE = 8
+
+
+def get_driver_name(output_format):
+    return {OutputFormat.GEOTIFF: "GTiff", OutputFormat.ENVI: "ENVI"}[output_format]
+
+
+def get_creation_options(driver, data_type, compress=DEFAULT_COMPRESS):
+
+    """
+    Return the default creation options for the driver and data type
+
+    :param driver: The GDAL driver name (GTiff or ENVI)
+    :type driver: str
+    :param data_type: The GDAL data type
+    :param compress: The GeoTIFF compression (DEFLATE, LZW or None)
+    :type compress: str
+    :rtype: list[str]
+    """
+
+    if driver == "ENVI":
+        return list(DEFAULT_ENVI_OPTIONS)
+
+    options = list(DEFAULT_GTIFF_OPTIONS)
+
+    if compress:
+        options.append("COMPRESS={compress}".format(compress=compress))
+
+        # Floating point predictor for floats, horizontal differencing for integers
+
+        if data_type in [gdal.GDT_Float32, gdal.GDT_Float64]:
+            options.append("PREDICTOR=3")
+        else:
+            options.append("PREDICTOR=2")
+
+    return options
+
+
+class BandStatistics(object):
+
+    """
+    Statistics of a band accumulated a chunk at a time (ignoring the no data value)
+
+    Each chunk's count/mean/M2 are folded into the running ones (Chan et al) as per StatisticsAccumulator.combine() so
+    the variance doesn't suffer the cancellation of the naive sum of squares.
+    """
+
+    def __init__(self, ndv=None):
+        self.ndv = ndv
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, data):
+
+        valid = numpy.ones(numpy.shape(data), dtype=numpy.bool_)
+
+        if self.ndv is not None:
+            numpy.not_equal(data, self.ndv, out=valid)
+
+        if data.dtype.kind == "f":
+            numpy.logical_and(valid, numpy.isfinite(data), out=valid)
+
+        values = data[valid].astype(numpy.float64)
+
+        if values.size == 0:
+            return
+
+        minimum, maximum = values.min(), values.max()
+
+        if self.minimum is None:
+            self.minimum, self.maximum = minimum, maximum
+        else:
+            self.minimum, self.maximum = min(self.minimum, minimum), max(self.maximum, maximum)
+
+        # The chunk's mean and M2 (sum of squared differences from its mean) combined with the running ones
+
+        count = values.size
+        mean = values.mean()
+
+        values -= mean
+        m2 = numpy.dot(values, values)
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return numpy.sqrt(self.m2 / self.count)
+
+
+class RasterWriter(object):
+
+    """
+    Write a raster a chunk window at a time
+
+    The GDAL calls are all made on a background thread so that compressing/writing a chunk overlaps with calculating
+    the next one.  Statistics (and optionally nearest neighbour overviews) are accumulated as the chunks are written
+    rather than by re-reading the raster at the end.
+
+    Note that the writer keeps a reference to the data passed to write() until it has been written so don't modify it
+    afterwards.
+
+    Usage::
+
+        with RasterWriter(path, width, height, len(bands), gdal.GDT_Int16, transform, projection, ndv) as writer:
+            for x, y in get_chunks(...):
+                writer.write(1, data, x, y)
+
+    If the with block raises the writer is aborted rather than closed so that its exception isn't replaced by one from
+    the writer.
+    """
+
+    def __init__(self, path, width, height, count, data_type, transform, projection, ndv=None, driver="GTiff",
+                 options=None, compress=DEFAULT_COMPRESS, statistics=True, overviews=None, metadata=None,
+                 background=True, queue_size=DEFAULT_WRITE_QUEUE_SIZE):
+
+        """
+        :param path: The output path
+        :type path: str
+        :param width: Width of the raster
+        :type width: int
+        :param height: Height of the raster
+        :type height: int
+        :param count: Number of bands
+        :type count: int
+        :param data_type: GDAL data type
+        :param transform: Geo transform
+        :param projection: Projection
+        :param ndv: No data value (set on all the bands)
+        :param driver: GDAL driver name (GTiff or ENVI)
+        :type driver: str
+        :param options: Creation options (defaults to get_creation_options(driver, data_type, compress))
+        :type options: list[str]
+        :param compress: The GeoTIFF compression if using the default creation options
+        :type compress: str
+        :param statistics: Whether to set the band statistics on close
+        :type statistics: bool
+        :param overviews: Overview decimation factors (e.g. [2, 4, 8, 16]) to build as the data is written
+        :type overviews: list[int]
+        :param metadata: Raster metadata
+        :type metadata: dict
+        :param background: Whether to write on a background thread
+        :type background: bool
+        :param queue_size: Number of writes queued before write() blocks
+        :type queue_size: int
+        """
+
+        self.path = path
+        self.width = width
+        self.height = height
+        self.count = count
+        self.ndv = ndv
+        self.overviews = overviews or []
+
+        if options is None:
+            options = get_creation_options(driver, data_type, compress)
+
+        _log.debug("Creating raster [%s] with [%d x %d x %d] of [%s] and options %s", path, width, height, count,
+                   gdal.GetDataTypeName(data_type), options)
+
+        gdal_driver = gdal.GetDriverByName(driver)
+        assert gdal_driver
+
+        self.raster = gdal_driver.Create(path, width, height, count, data_type, options)
+        assert self.raster
+
+        self.raster.SetGeoTransform(transform)
+        self.raster.SetProjection(projection)
+
+        if metadata:
+            self.raster.SetMetadata(metadata)
+
+        if ndv is not None:
+            for band in range(1, count + 1):
+                self.raster.GetRasterBand(band).SetNoDataValue(ndv)
+
+        # Create the (empty) overviews up front so that they can be filled in as the chunks are written
+
+        if self.overviews:
+            self.raster.BuildOverviews("NONE", self.overviews)
+
+        self.statistics = None
+
+        if statistics:
+            self.statistics = dict()
+
+        self.error = None
+
+        self.queue = None
+        self.thread = None
+
+        if background:
+            self.queue = Queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._run, name="RasterWriter")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        # Don't hide an exception raised in the with block behind one from the writer
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, band, data, x=0, y=0):
+
+        """
+        Write a chunk of data to a band
+
+        :param band: The band number (1 based)
+        :type band: int
+        :param data: The data
+        :type data: numpy.ndarray
+        :param x: X offset of the chunk
+        :type x: int
+        :param y: Y offset of the chunk
+        :type y: int
+        """
+
+        self._submit(self._write, band, data, x, y)
+
+    def set_band_description(self, band, description):
+        self._submit(self._set_band_description, band, description)
+
+    def set_band_metadata(self, band, metadata):
+        self._submit(self._set_band_metadata, band, metadata)
+
+    def set_metadata(self, metadata):
+        self._submit(self.raster.SetMetadata, metadata)
+
+    def close(self):
+
+        """
+        Wait for the pending writes, set the statistics and close the raster
+        """
+
+        if not self.raster:
+            return
+
+        self._stop()
+
+        try:
+            if self.error:
+                raise self.error
+
+            if self.statistics:
+                for band, statistics in self.statistics.iteritems():
+                    if statistics.count:
+                        self.raster.GetRasterBand(band).SetStatistics(statistics.minimum, statistics.maximum,
+                                                                     statistics.mean, statistics.std)
+
+            self.raster.FlushCache()
+
+        finally:
+            self.raster = None
+
+    def abort(self):
+
+        """
+        Wait for the pending writes and close the raster without setting the statistics or raising any writer error
+
+        For closing the writer when something else has gone wrong (the raster is left incomplete).
+        """
+
+        if not self.raster:
+            return
+
+        self._stop()
+
+        if self.error:
+            _log.error("Discarding error writing to raster [%s] - %s", self.path, self.error)
+
+        self.raster = None
+
+    def _stop(self):
+
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _submit(self, func, *args):
+
+        if self.error:
+            raise self.error
+
+        if self.thread:
+            self.queue.put((func, args))
+        else:
+            func(*args)
+
+    def _run(self):
+
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                return
+
+            # Keep draining the queue after an error so that write() doesn't block forever
+
+            if self.error:
+                continue
+
+            func, args = item
+
+            try:
+                func(*args)
+            except Exception as e:
+                _log.exception("Error writing to raster [%s]", self.path)
+                self.error = e
+
+    def _write(self, band, data, x, y):
+
+        raster_band = self.raster.GetRasterBand(band)
+
+        raster_band.WriteArray(data, xoff=x, yoff=y)
+
+        if self.statistics is not None:
+            if band not in self.statistics:
+                self.statistics[band] = BandStatistics(self.ndv)
+
+            self.statistics[band].update(data)
+
+        # Nearest neighbour overviews - the pixels at multiples of the decimation factor
+
+        for i, factor in enumerate(self.overviews):
+
+            overview = raster_band.GetOverview(i)
+
+            x_offset, y_offset = -x % factor, -y % factor
+
+            decimated = data[y_offset::factor, x_offset::factor]
+
+            if decimated.size:
+                overview.WriteArray(decimated, xoff=(x + x_offset) // factor, yoff=(y + y_offset) // factor)
+
+    def _set_band_description(self, band, description):
+        self.raster.GetRasterBand(band).SetDescription(description)
+
+    def _set_band_metadata(self, band, metadata):
+        self.raster.GetRasterBand(band).SetMetadata(metadata)
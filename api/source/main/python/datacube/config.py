@@ -38,6 +38,9 @@ class Config:
 
     class Section(Enum):
         DATABASE = "DATABASE"
+        POOL = "POOL"
+        CACHE = "CACHE"
+        QUERY = "QUERY"
 
     class DatabaseKey(Enum):
         HOST = "host"
@@ -46,6 +49,19 @@ class Config:
         USERNAME = "username"
         PASSWORD = "password"
 
+    class PoolKey(Enum):
+        SIZE = "size"
+        IDLE_TIMEOUT = "idle_timeout"
+
+    class CacheKey(Enum):
+        ENABLED = "enabled"
+        SIZE = "size"
+        TTL = "ttl"
+        DIRECTORY = "directory"
+
+    class QueryKey(Enum):
+        ACQUISITION_CELL = "acquisition_cell"
+
     _config = None
 
     def __init__(self, path=None):
@@ -67,6 +83,9 @@ class Config:
     def _get_int(self, section, key):
         return int(self._config.get(section.value, key.value))
 
+    def _get_boolean(self, section, key):
+        return self._config.getboolean(section.value, key.value)
+
     def get_db_host(self):
         '''
         Get the DB host
@@ -87,6 +106,62 @@ class Config:
     def get_db_password(self):
         return self._get_string(Config.Section.DATABASE, Config.DatabaseKey.PASSWORD)
 
+    def get_pool_size(self):
+        '''
+        Get the maximum number of idle DB connections kept in the connection pool
+
+        :return:
+        '''
+        return self._get_int(Config.Section.POOL, Config.PoolKey.SIZE)
+
+    def get_pool_idle_timeout(self):
+        '''
+        Get the number of seconds a pooled DB connection may sit idle before it is closed
+
+        :return:
+        '''
+        return self._get_int(Config.Section.POOL, Config.PoolKey.IDLE_TIMEOUT)
+
+    def get_cache_enabled(self):
+        '''
+        Get whether the results of tile/cell queries are cached
+
+        :return:
+        '''
+        return self._get_boolean(Config.Section.CACHE, Config.CacheKey.ENABLED)
+
+    def get_cache_size(self):
+        '''
+        Get the maximum number of query results kept in the in memory cache
+
+        :return:
+        '''
+        return self._get_int(Config.Section.CACHE, Config.CacheKey.SIZE)
+
+    def get_cache_ttl(self):
+        '''
+        Get the number of seconds a cached query result remains valid
+
+        :return:
+        '''
+        return self._get_int(Config.Section.CACHE, Config.CacheKey.TTL)
+
+    def get_cache_directory(self):
+        '''
+        Get the directory cached query results are written to (empty for in memory only)
+
+        :return:
+        '''
+        return self._get_string(Config.Section.CACHE, Config.CacheKey.DIRECTORY)
+
+    def get_query_acquisition_cell(self):
+        '''
+        Get whether tile/cell queries use the denormalised acquisition_cell table (database change v7)
+
+        :return:
+        '''
+        return self._get_boolean(Config.Section.QUERY, Config.QueryKey.ACQUISITION_CELL)
+
     def to_str(self):
         return [(k.value, self._get_string(Config.Section.DATABASE, k)) for k in Config.DatabaseKey]
 
@@ -100,5 +175,18 @@ port: 6432
 database: hypercube_v0
 username: cube_user
 password: GAcube0
+
+[POOL]
+size: 4
+idle_timeout: 300
+
+[CACHE]
+enabled: false
+size: 64
+ttl: 3600
+directory:
+
+[QUERY]
+acquisition_cell: false
 """
 
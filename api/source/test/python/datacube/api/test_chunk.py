@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import itertools
+import numpy
+from datacube.api.chunk import CELL_SIZE_X, CELL_SIZE_Y
+from datacube.api.chunk import plan_chunk_size, snap_to_block, get_chunks, get_chunk_windows, get_chunk_window_size
+
+
+TILED_BLOCK_SIZES = [(128, 128), (256, 256), (512, 512)]
+
+STRIP_1_ROW = (CELL_SIZE_X, 1)
+STRIP_16_ROWS = (CELL_SIZE_X, 16)
+
+REQUESTED_CHUNK_SIZES = [(4000, 4000), (1000, 1000), (1000, 250), (500, 2000), (100, 100), (1, 1)]
+
+
+def assert_windows_cover_cell(chunk_size_x, chunk_size_y):
+
+    windows = get_chunk_windows(chunk_size_x, chunk_size_y)
+
+    coverage = numpy.zeros((CELL_SIZE_Y, CELL_SIZE_X), dtype=numpy.uint8)
+
+    for x, y, x_size, y_size in windows:
+        assert(x_size > 0 and y_size > 0)
+        assert(x + x_size <= CELL_SIZE_X and y + y_size <= CELL_SIZE_Y)
+
+        coverage[y:y + y_size, x:x + x_size] += 1
+
+    # Every pixel in exactly one window
+
+    assert(numpy.all(coverage == 1))
+
+
+def assert_aligned(size, block, extent):
+
+    assert(size == extent or size % block == 0)
+
+
+def test_snap_to_block():
+
+    assert(snap_to_block(1000, 128, 4000) == 896)
+    assert(snap_to_block(4000, 128, 4000) == 4000)
+    assert(snap_to_block(100, 128, 4000) == 128)
+    assert(snap_to_block(2, 16, 4000) == 16)
+    assert(snap_to_block(5000, 128, 4000) == 4000)
+    assert(snap_to_block(100, 4000, 4000) == 100)
+
+
+def test_plan_chunk_size_tiled():
+
+    for block_size, (chunk_size_x, chunk_size_y) in itertools.product(TILED_BLOCK_SIZES, REQUESTED_CHUNK_SIZES):
+
+        x_size, y_size = plan_chunk_size(block_size, chunk_size_x, chunk_size_y)
+
+        assert_aligned(x_size, block_size[0], CELL_SIZE_X)
+        assert_aligned(y_size, block_size[1], CELL_SIZE_Y)
+
+        # Never smaller than a block
+
+        assert(x_size >= block_size[0] and y_size >= block_size[1])
+
+        assert_windows_cover_cell(x_size, y_size)
+
+
+def test_plan_chunk_size_tiled_whole_cell():
+
+    for block_size in TILED_BLOCK_SIZES:
+        assert(plan_chunk_size(block_size, 4000, 4000) == (4000, 4000))
+
+
+def test_plan_chunk_size_128_1000():
+
+    assert(plan_chunk_size((128, 128), 1000, 1000) == (896, 1024))
+
+    windows = get_chunk_windows(896, 1024)
+
+    assert(len(windows) == 20)
+    assert((3584, 3072, 416, 928) in windows)
+
+
+def test_plan_chunk_size_strips():
+
+    for block_size, (chunk_size_x, chunk_size_y) in itertools.product([STRIP_1_ROW, STRIP_16_ROWS],
+                                                                       REQUESTED_CHUNK_SIZES):
+
+        x_size, y_size = plan_chunk_size(block_size, chunk_size_x, chunk_size_y)
+
+        # Whole rows of whole strips
+
+        assert(x_size == CELL_SIZE_X)
+        assert_aligned(y_size, block_size[1], CELL_SIZE_Y)
+
+        assert_windows_cover_cell(x_size, y_size)
+
+
+def test_plan_chunk_size_strips_small_request():
+
+    # 10,000 pixels is 2.5 rows - rounded to the nearest whole strip but never less than one
+
+    assert(plan_chunk_size(STRIP_1_ROW, 100, 100) == (4000, 3))
+    assert(plan_chunk_size(STRIP_16_ROWS, 100, 100) == (4000, 16))
+
+
+def test_plan_chunk_size_strips_keeps_area():
+
+    # The cell width by about the requested area's worth of rows
+
+    for block_size, (chunk_size_x, chunk_size_y) in itertools.product([STRIP_1_ROW, STRIP_16_ROWS],
+                                                                       REQUESTED_CHUNK_SIZES):
+
+        x_size, y_size = plan_chunk_size(block_size, chunk_size_x, chunk_size_y)
+
+        assert(abs(x_size * y_size - chunk_size_x * chunk_size_y) <= x_size * block_size[1] / 2 or
+               y_size == block_size[1])
+
+    assert(plan_chunk_size(STRIP_16_ROWS, 1000, 1000) == (4000, 256))
+
+
+def test_plan_chunk_size_memory():
+
+    # 4 bytes per pixel and 4MB is 1M pixels
+
+    x_size, y_size = plan_chunk_size((256, 256), memory=4 * 1024 * 1024, pixel_bytes=4)
+
+    assert(x_size * y_size <= 1024 * 1024)
+    assert_aligned(x_size, 256, CELL_SIZE_X)
+    assert_aligned(y_size, 256, CELL_SIZE_Y)
+
+
+def test_get_chunks():
+
+    assert(get_chunks(2000, 2000) == [(0, 0), (0, 2000), (2000, 0), (2000, 2000)])
+    assert(len(get_chunks(1000, 500)) == 4 * 8)
+
+
+def test_get_chunk_window_size():
+
+    assert(get_chunk_window_size(0, 0, 1024, 1024) == (1024, 1024))
+    assert(get_chunk_window_size(3072, 3072, 1024, 1024) == (928, 928))
+    assert(get_chunk_window_size(3584, 0, 896, 1024) == (416, 1024))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+from datacube.api.composite import CompositeMethod, Compositor, calculate_composite_index, gather, take_provenance
+from datacube.api.utils import NDV
+
+
+def get_stack(times=8, height=6, width=7, seed=1):
+
+    """
+    A (time, y, x) stack with some no data, repeated values and a pixel with no valid observations
+    """
+
+    numpy.random.seed(seed)
+
+    stack = numpy.random.randint(0, 5, size=(times, height, width)).astype(numpy.int16)
+    stack[numpy.random.random(stack.shape) < 0.3] = NDV
+    stack[:, 0, 0] = NDV
+
+    return stack
+
+
+def get_reference_index(stack, method):
+
+    """
+    The index selected by looping over the observations of each pixel
+    """
+
+    times, height, width = stack.shape
+
+    index = numpy.empty((height, width), dtype=numpy.int64)
+
+    for y in range(height):
+        for x in range(width):
+
+            valid = [t for t in range(times) if stack[t, y, x] != NDV]
+
+            if not valid:
+                index[y, x] = -1
+
+            elif method == CompositeMethod.FIRST:
+                index[y, x] = valid[0]
+
+            elif method == CompositeMethod.LAST:
+                index[y, x] = valid[-1]
+
+            # Ties go to the later observation
+
+            elif method == CompositeMethod.MIN:
+                index[y, x] = max(valid, key=lambda t: (-stack[t, y, x], t))
+
+            elif method == CompositeMethod.MAX:
+                index[y, x] = max(valid, key=lambda t: (stack[t, y, x], t))
+
+    return index
+
+
+def test_calculate_composite_index():
+
+    stack = get_stack()
+
+    for method in CompositeMethod:
+        index = calculate_composite_index(stack, method)
+
+        assert(numpy.array_equal(index, get_reference_index(stack, method)))
+
+
+def test_calculate_composite_index_nan():
+
+    stack = numpy.array([[numpy.nan, 1.0], [2.0, numpy.nan], [numpy.nan, numpy.nan]], dtype=numpy.float32)
+
+    index = calculate_composite_index(stack.reshape((3, 1, 2)), CompositeMethod.LAST)
+
+    assert(numpy.array_equal(index, [[1, 0]]))
+
+
+def test_gather():
+
+    stack = get_stack()
+    index = calculate_composite_index(stack, CompositeMethod.MAX)
+
+    out = gather(stack, index)
+
+    assert(out.shape == stack.shape[1:])
+
+    for y in range(stack.shape[1]):
+        for x in range(stack.shape[2]):
+            if index[y, x] < 0:
+                assert(out[y, x] == NDV)
+            else:
+                assert(out[y, x] == stack[index[y, x], y, x])
+
+
+def test_gather_bands():
+
+    # A (time, band, y, x) stack with the index from one of the bands
+
+    bands = numpy.array([get_stack(seed=1), get_stack(seed=2)]).transpose((1, 0, 2, 3))
+
+    index = calculate_composite_index(bands[:, 0], CompositeMethod.FIRST)
+
+    out = gather(bands, index)
+
+    assert(out.shape == bands.shape[1:])
+
+    for band in range(2):
+        assert(numpy.array_equal(out[band], gather(bands[:, band], index)))
+
+
+def test_take_provenance():
+
+    index = numpy.array([[0, 2], [-1, 1]])
+
+    out = take_provenance([2001, 2005, 2010], index, ndv=-1)
+
+    assert(numpy.array_equal(out, [[2001, 2010], [-1, 2005]]))
+
+
+def test_compositor():
+
+    stack = get_stack()
+    other = get_stack(seed=3)
+
+    for method in CompositeMethod:
+        compositor = Compositor(method, key="KEY")
+
+        for t in range(len(stack)):
+            compositor.update({"KEY": stack[t], "OTHER": other[t]})
+
+        # The same as selecting from the whole stack at once
+
+        index = calculate_composite_index(stack, method)
+
+        assert(numpy.array_equal(compositor.index, index))
+        assert(numpy.array_equal(compositor.layers["KEY"], gather(stack, index)))
+        assert(numpy.array_equal(compositor.layers["OTHER"], gather(other, index)))
+
+
+def test_compositor_complete():
+
+    stack = numpy.array([[[NDV, 1]], [[2, NDV]], [[3, 4]]], dtype=numpy.int16)
+
+    compositor = Compositor(CompositeMethod.FIRST, key="KEY")
+
+    compositor.update({"KEY": stack[0]})
+    assert(not compositor.is_complete())
+
+    compositor.update({"KEY": stack[1]})
+    assert(compositor.is_complete())
+
+    assert(numpy.array_equal(compositor.layers["KEY"], [[2, 1]]))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import os
+import psycopg2
+import time
+from datacube.api import query
+from datacube.api.query import ConnectionPool, adaptive_result_generator, borrow_connection, return_connection
+from datacube.api.query import execute_query_as_generator
+
+
+class FakeCursor(object):
+
+    def __init__(self, name=None, results=None):
+        self.name = name
+        self.results = list(results or [])
+        self.closed = False
+        self.sizes = list()
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        self.sizes.append(size)
+        results, self.results = self.results[:size], self.results[size:]
+        return results
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+
+    def __init__(self, connection_string, broken=False):
+        self.connection_string = connection_string
+        self.broken = broken
+        self.closed = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(name=name)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConnectionFactory(object):
+
+    def __init__(self):
+        self.connections = list()
+
+    def __call__(self, connection_string):
+        connection = FakeConnection(connection_string)
+        self.connections.append(connection)
+        return connection
+
+
+def get_pool(size=2, idle_timeout=60):
+
+    factory = FakeConnectionFactory()
+
+    return ConnectionPool("dbname=test", size=size, idle_timeout=idle_timeout, connection_factory=factory), factory
+
+
+def test_pool_reuses_connections():
+
+    pool, factory = get_pool()
+
+    connection = pool.get_connection()
+
+    # New connections are prepared (search path committed)
+
+    assert(len(factory.connections) == 1 and connection.commits == 1)
+
+    # Returned connections are rolled back and then reused
+
+    pool.put_connection(connection)
+
+    assert(connection.rollbacks == 1 and not connection.closed)
+
+    assert(pool.get_connection() is connection)
+    assert(len(factory.connections) == 1)
+
+
+def test_pool_size():
+
+    pool, factory = get_pool(size=2)
+
+    connections = [pool.get_connection() for _ in range(3)]
+
+    for connection in connections:
+        pool.put_connection(connection)
+
+    # Only size idle connections are kept - the rest are closed
+
+    assert(len(pool._idle) == 2)
+    assert([connection.closed for connection in connections] == [0, 0, 1])
+
+
+def test_pool_prune():
+
+    pool, factory = get_pool(size=3, idle_timeout=60)
+
+    expired, closed, fresh = [pool.get_connection() for _ in range(3)]
+
+    for connection in [expired, closed, fresh]:
+        pool.put_connection(connection)
+
+    now = time.time()
+
+    pool._idle = [(expired, now - 120), (closed, now), (fresh, now)]
+    closed.closed = 1
+
+    assert(pool._prune(now) == [expired, closed])
+    assert(pool._idle == [(fresh, now)])
+
+    # Expired connections are closed when borrowing
+
+    pool._idle = [(expired, now - 120)]
+    expired.closed = 0
+
+    connection = pool.get_connection()
+
+    assert(connection is not expired and expired.closed)
+
+
+def test_pool_discards_broken_connections():
+
+    pool, factory = get_pool()
+
+    connection = pool.get_connection()
+    connection.broken = True
+
+    pool.put_connection(connection)
+
+    assert(connection.closed and not pool._idle)
+
+
+def test_pool_fork():
+
+    pool, factory = get_pool()
+
+    inherited = pool.get_connection()
+    pool.put_connection(inherited)
+
+    # Pretend the pool was created by a parent process - inherited connections are discarded WITHOUT closing them
+
+    pool._pid = os.getpid() + 1
+
+    connection = pool.get_connection()
+
+    assert(connection is not inherited and not inherited.closed)
+    assert(pool._pid == os.getpid())
+
+    # A connection borrowed in the parent is neither rolled back, pooled nor closed
+
+    pool._pid = os.getpid() + 1
+
+    rollbacks = inherited.rollbacks
+
+    pool.put_connection(inherited)
+
+    assert(inherited.rollbacks == rollbacks and not inherited.closed)
+    assert(all(c is not inherited for c, _ in pool._idle))
+
+
+class FakeConfig(object):
+
+    def get_db_host(self):
+        return None
+
+    def get_db_port(self):
+        return None
+
+    def get_db_database(self):
+        return "test"
+
+    def get_db_username(self):
+        return "test"
+
+    def get_db_password(self):
+        return "test"
+
+
+def test_borrow_server_side_connection():
+
+    config = FakeConfig()
+
+    connection_string = query.build_connection_string(config)
+
+    pool, factory = get_pool()
+
+    query._connection_pools[connection_string] = pool
+
+    try:
+        connection, cursor = borrow_connection(config=config, server_side=True)
+        _, other = borrow_connection(config=config, server_side=True)
+
+        # Server side cursors are named - uniquely within the process
+
+        assert(cursor.name.startswith("agdc_cursor_%d_" % os.getpid()))
+        assert(cursor.name != other.name)
+
+        return_connection(connection, cursor, config=config)
+
+        assert(cursor.closed)
+        assert([c for c, _ in pool._idle] == [connection])
+
+    finally:
+        del query._connection_pools[connection_string]
+
+
+def test_execute_query_connection_error():
+
+    config = FakeConfig()
+
+    connection_string = query.build_connection_string(config)
+
+    def connection_factory(connection_string):
+        raise psycopg2.OperationalError("could not connect to server")
+
+    query._connection_pools[connection_string] = ConnectionPool(connection_string, size=2, idle_timeout=60,
+                                                                connection_factory=connection_factory)
+
+    try:
+        # The connection error is raised - not an error from rolling back the connection that was never borrowed
+
+        raised = False
+
+        try:
+            list(execute_query_as_generator("select 1", dict(), config=config, use_cache=False))
+
+        except psycopg2.OperationalError:
+            raised = True
+
+        assert(raised)
+
+    finally:
+        del query._connection_pools[connection_string]
+
+
+def test_adaptive_result_generator():
+
+    cursor = FakeCursor(results=range(1000))
+
+    # Batches double while fetching is quick - stopping after the first short batch
+
+    assert(list(adaptive_result_generator(cursor, size=10, max_size=80)) == range(1000))
+
+    assert(cursor.sizes == [10, 20, 40] + [80] * 12)
+
+    # Batches don't grow when fetching is slow
+
+    cursor = FakeCursor(results=range(95))
+
+    assert(list(adaptive_result_generator(cursor, size=10, max_size=80, target_fetch_seconds=0)) == range(95))
+
+    assert(cursor.sizes == [10] * 10)
+
+    # No results
+
+    cursor = FakeCursor()
+
+    assert(list(adaptive_result_generator(cursor)) == [])
+    assert(cursor.sizes == [100])
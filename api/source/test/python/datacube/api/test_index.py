@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+from datacube.api.model import Satellite, Ls57Arg25Bands
+from datacube.api.utils import NDV, TCI_COEFFICIENTS, TasselCapIndex
+from datacube.api.utils import calculate_ndvi, calculate_evi, calculate_nbr, calculate_tassel_cap_indices
+
+
+def get_band(seed, shape=(300, 40)):
+
+    """
+    Reflectance (* 10000) with some no data pixels
+    """
+
+    numpy.random.seed(seed)
+
+    band = numpy.random.randint(0, 10000, size=shape).astype(numpy.int16)
+    band[numpy.random.random(shape) < 0.05] = NDV
+
+    return band
+
+
+def get_reference(result, bands):
+
+    invalid = ~numpy.isfinite(result)
+
+    for band in bands:
+        numpy.logical_or(invalid, band == NDV, out=invalid)
+
+    result[invalid] = NDV
+
+    return result
+
+
+def test_calculate_ndvi():
+
+    red, nir = get_band(1), get_band(2)
+
+    # Divide by zero
+
+    red[0, :2] = nir[0, :2] = 0
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        expected = get_reference((nir.astype(numpy.float64) - red) / (nir.astype(numpy.float64) + red), [red, nir])
+
+    red_copy, nir_copy = red.copy(), nir.copy()
+
+    actual = calculate_ndvi(red, nir)
+
+    assert(actual.dtype == numpy.float32)
+    assert(numpy.all(actual[0, :2] == NDV))
+    assert(numpy.allclose(actual, expected, rtol=1e-5, atol=1e-6))
+
+    # The kernel works on float32 copies so the inputs are unchanged
+
+    assert(numpy.array_equal(red, red_copy))
+    assert(numpy.array_equal(nir, nir_copy))
+
+
+def test_calculate_nbr():
+
+    nir, swir = get_band(3), get_band(4)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        expected = get_reference((nir.astype(numpy.float64) - swir) / (nir.astype(numpy.float64) + swir), [nir, swir])
+
+    actual = calculate_nbr(nir, swir)
+
+    assert(numpy.allclose(actual, expected, rtol=1e-5, atol=1e-6))
+
+
+def test_calculate_evi():
+
+    red, blue, nir = get_band(5), get_band(6), get_band(7)
+
+    red64, blue64, nir64 = [a.astype(numpy.float64) for a in [red, blue, nir]]
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        expected = get_reference(2.5 * (nir64 - red64) / (nir64 + 6 * red64 - 7.5 * blue64 + 1), [red, blue, nir])
+
+    actual = calculate_evi(red, blue, nir)
+
+    # The denominator can be close to zero so compare relative to the float32 rounding of its terms
+
+    assert(numpy.all((actual == NDV) == (expected == NDV)))
+    assert(numpy.allclose(actual, expected, rtol=1e-4, atol=1e-4))
+
+
+def test_calculate_tassel_cap_indices():
+
+    coefficients = TCI_COEFFICIENTS[Satellite.LS5]
+
+    bands = dict((band, get_band(10 + band.value)) for band in Ls57Arg25Bands)
+
+    # Fewer rows a chunk than there are rows
+
+    actual = calculate_tassel_cap_indices(bands, coefficients, chunk_rows=64)
+
+    for index in TasselCapIndex:
+
+        expected = numpy.zeros(bands[Ls57Arg25Bands.BLUE].shape, dtype=numpy.float64)
+        invalid = numpy.zeros(expected.shape, dtype=numpy.bool_)
+
+        for band, coefficient in coefficients[index].iteritems():
+            expected += bands[band] * coefficient / 10000
+            numpy.logical_or(invalid, bands[band] == NDV, out=invalid)
+
+        assert(numpy.isnan(actual[index][invalid]).all())
+        assert(numpy.allclose(actual[index][~invalid], expected[~invalid], rtol=1e-5, atol=1e-5))
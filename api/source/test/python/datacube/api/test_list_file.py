@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import csv
+import os
+import shutil
+import tempfile
+from datacube.api import query
+from datacube.api.model import DatasetType
+from datacube.api.query import ConnectionPool, FileFormat, get_file_format, get_file_extension
+from datacube.api.query import write_cells_to_npz, write_tiles_to_npz, read_cells_from_file, read_tiles_from_file
+from datetime import datetime
+
+
+CELLS = [{"x_index": 120, "y_index": -21}, {"x_index": 120, "y_index": -20}, {"x_index": 121, "y_index": -20}]
+
+
+def get_tile_records():
+
+    records = list()
+
+    for i, (x, y, satellite, end_datetime) in enumerate([(120, -21, "LS5", datetime(2005, 1, 2, 1, 30, 5)),
+                                                         (120, -20, "LS7", datetime(2005, 1, 10, 1, 31, 0)),
+                                                         (121, -20, "LS8", datetime(2013, 12, 31, 23, 59, 59))]):
+
+        name = "%s_%03d_%04d_%s" % (satellite, x, y, end_datetime.strftime("%Y-%m-%dT%H-%M-%S"))
+
+        datasets = [["ARG25", "/nbar/%s_NBAR.tif" % name], ["PQ25", "/pqa/%s_PQA.tif" % name]]
+
+        # Paths shared between tiles are only stored once in the .npz file
+
+        if i != 1:
+            datasets.append(["DSM", "/dsm/DSM_%03d_%04d.tif" % (x, y)])
+
+        records.append({"acquisition_id": 1000 + i, "satellite": satellite,
+                        "start_datetime": end_datetime.replace(second=0), "end_datetime": end_datetime,
+                        "end_datetime_year": end_datetime.year, "end_datetime_month": end_datetime.month,
+                        "x_index": x, "y_index": y, "datasets": datasets})
+
+    return records
+
+
+class FakeCursor(object):
+
+    def __init__(self, records):
+        self.records = list(records)
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def mogrify(self, sql, params=None):
+        return sql
+
+    def fetchmany(self, size):
+        records, self.records = self.records[:size], self.records[size:]
+        return records
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+
+    def __init__(self, records):
+        self.records = records
+        self.closed = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(name and self.records or [])
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConfig(object):
+
+    def get_db_host(self):
+        return None
+
+    def get_db_port(self):
+        return None
+
+    def get_db_database(self):
+        return "test"
+
+    def get_db_username(self):
+        return "test"
+
+    def get_db_password(self):
+        return "test"
+
+    def get_cache_enabled(self):
+        return False
+
+
+def write_npz(write, filename, records):
+
+    # Run the writer against a connection pool that "returns" the records
+
+    config = FakeConfig()
+
+    connection_string = query.build_connection_string(config)
+
+    query._connection_pools[connection_string] = ConnectionPool(
+        connection_string, size=1, idle_timeout=0, connection_factory=lambda _: FakeConnection(records))
+
+    try:
+        write(filename, "select ...", dict(), config=config)
+
+    finally:
+        del query._connection_pools[connection_string]
+
+
+def write_csv(filename, records, columns):
+
+    # As written by COPY ... TO STDOUT CSV HEADER
+
+    def to_csv(value):
+        if isinstance(value, list):
+            return "{%s}" % ",".join("{%s,%s}" % tuple(dataset) for dataset in value)
+        return str(value)
+
+    with open(filename, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+
+        for record in records:
+            writer.writerow([to_csv(record[column]) for column in columns])
+
+
+def test_get_file_format():
+
+    assert(get_file_format("tiles.npz") == FileFormat.NPZ)
+    assert(get_file_format("TILES.NPZ") == FileFormat.NPZ)
+    assert(get_file_format("tiles.csv") == FileFormat.CSV)
+    assert(get_file_format("tiles") == FileFormat.CSV)
+    assert(get_file_format(None) == FileFormat.CSV)
+
+    for file_format in FileFormat:
+        assert(get_file_format("tiles" + get_file_extension(file_format)) == file_format)
+
+
+def test_cells_round_trip():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        npz = os.path.join(directory, "cells.npz")
+        write_npz(write_cells_to_npz, npz, CELLS)
+
+        csv_filename = os.path.join(directory, "cells.csv")
+        write_csv(csv_filename, CELLS, ["x_index", "y_index"])
+
+        expected = [(cell["x_index"], cell["y_index"]) for cell in CELLS]
+
+        assert([cell.xy for cell in read_cells_from_file(npz)] == expected)
+        assert([cell.xy for cell in read_cells_from_file(csv_filename)] == expected)
+
+        # The format can be given explicitly
+
+        other = os.path.join(directory, "cells.dat")
+        shutil.copy(npz, other)
+
+        assert([cell.xy for cell in read_cells_from_file(other, file_format=FileFormat.NPZ)] == expected)
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_tiles_round_trip():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        records = get_tile_records()
+
+        npz = os.path.join(directory, "tiles.npz")
+        write_npz(write_tiles_to_npz, npz, records)
+
+        csv_filename = os.path.join(directory, "tiles.csv")
+        write_csv(csv_filename, records, ["acquisition_id", "satellite", "start_datetime", "end_datetime",
+                                          "end_datetime_year", "end_datetime_month", "x_index", "y_index",
+                                          "datasets"])
+
+        for tiles in [list(read_tiles_from_file(npz)), list(read_tiles_from_file(csv_filename))]:
+
+            assert(len(tiles) == len(records))
+
+            for tile, record in zip(tiles, records):
+
+                assert(tile.acquisition_id == record["acquisition_id"])
+                assert(tile.xy == (record["x_index"], record["y_index"]))
+                assert(tile.start_datetime == record["start_datetime"])
+                assert(tile.end_datetime == record["end_datetime"])
+                assert((tile.end_datetime_year, tile.end_datetime_month) ==
+                       (record["end_datetime_year"], record["end_datetime_month"]))
+
+                for dataset_type, path in record["datasets"]:
+                    dataset = tile.datasets[DatasetType[dataset_type]]
+
+                    assert(dataset.path == path)
+                    assert(dataset.satellite.value == record["satellite"])
+
+                assert(DatasetType.FC25 not in tile.datasets)
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_empty_round_trip():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        cells = os.path.join(directory, "cells.npz")
+        write_npz(write_cells_to_npz, cells, [])
+
+        tiles = os.path.join(directory, "tiles.npz")
+        write_npz(write_tiles_to_npz, tiles, [])
+
+        assert(list(read_cells_from_file(cells)) == [])
+        assert(list(read_tiles_from_file(tiles)) == [])
+
+    finally:
+        shutil.rmtree(directory)
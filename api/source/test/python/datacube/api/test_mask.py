@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+from datacube.api.utils import calculate_mask, WofsMask, PqaMask
+
+
+def test_calculate_mask_wofs_default():
+
+    wofs = numpy.array([[WofsMask.WET.value, WofsMask.DRY.value], [WofsMask.CLOUD.value, WofsMask.WET.value]],
+                       dtype=numpy.int16)
+
+    mask = calculate_mask(wofs=wofs)
+
+    assert(numpy.array_equal(mask, [[True, False], [False, True]]))
+
+
+def test_calculate_mask_wofs_explicit():
+
+    wofs = numpy.array([[WofsMask.WET.value, WofsMask.DRY.value], [WofsMask.CLOUD.value, WofsMask.WET.value]],
+                       dtype=numpy.int16)
+
+    mask = calculate_mask(wofs=wofs, wofs_masks=[WofsMask.CLOUD, WofsMask.DRY])
+
+    assert(numpy.array_equal(mask, [[False, True], [True, False]]))
+
+
+def test_calculate_mask_wofs_empty():
+
+    wofs = numpy.array([[WofsMask.WET.value, WofsMask.DRY.value], [WofsMask.CLOUD.value, WofsMask.WET.value]],
+                       dtype=numpy.int16)
+
+    mask = calculate_mask(wofs=wofs, wofs_masks=[])
+
+    assert(not mask.any())
+
+
+def test_calculate_mask_pqa_combined():
+
+    pqa = numpy.array([[PqaMask.PQ_MASK_CLEAR.value, 0], [PqaMask.PQ_MASK_CLEAR.value, 0]], dtype=numpy.int16)
+    existing = numpy.array([[False, False], [True, False]])
+
+    mask = calculate_mask(pqa=pqa, pqa_masks=[PqaMask.PQ_MASK_CLEAR], mask=existing)
+
+    assert(numpy.array_equal(mask, [[False, True], [True, True]]))
+    assert(not existing[0, 1])
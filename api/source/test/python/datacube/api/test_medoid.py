@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+from datacube.api.utils import NDV, calculate_medoid, calculate_medoid_index, calculate_medoid_stack
+
+
+def get_stack(times=12, bands=6, height=9, width=11, seed=1):
+
+    """
+    A (time, band, y, x) reflectance stack with some no data observations and a pixel with none at all
+    """
+
+    numpy.random.seed(seed)
+
+    stack = numpy.random.randint(0, 10000, size=(times, bands, height, width)).astype(numpy.int16)
+
+    invalid = numpy.random.random((times, height, width)) < 0.25
+    stack[:, 0][invalid] = NDV
+
+    stack[:, :, 0, 0] = NDV
+
+    return stack
+
+
+def get_totals(stack, y, x):
+
+    """
+    The brute force sum of the (float64) distances from each valid observation of a pixel to the other valid ones
+    """
+
+    observations = stack[:, :, y, x].astype(numpy.float64)
+    valid = [t for t in range(len(observations)) if numpy.all(observations[t] != NDV)]
+
+    totals = dict()
+
+    for i in valid:
+        totals[i] = sum(numpy.sqrt(numpy.sum((observations[i] - observations[j]) ** 2)) for j in valid if j != i)
+
+    return totals
+
+
+def test_calculate_medoid_index():
+
+    stack = get_stack()
+
+    # A small budget so that the pixels are done in several chunks
+
+    index = calculate_medoid_index(stack, chunk_bytes=12 * 12 * 4 * 2 * 10)
+
+    assert(index.shape == stack.shape[2:])
+    assert(index[0, 0] == -1)
+
+    for y in range(stack.shape[2]):
+        for x in range(stack.shape[3]):
+
+            totals = get_totals(stack, y, x)
+
+            if not totals:
+                continue
+
+            # Compare the distances rather than the indices in case of (float32) near ties
+
+            assert(index[y, x] in totals)
+            assert(numpy.isclose(totals[index[y, x]], min(totals.values()), rtol=1e-5))
+
+
+def test_calculate_medoid_stack():
+
+    stack = get_stack()
+
+    index = calculate_medoid_index(stack)
+    medoid = calculate_medoid_stack(stack)
+
+    assert(medoid.shape == stack.shape[1:])
+    assert(numpy.all(medoid[:, 0, 0] == NDV))
+
+    for y in range(stack.shape[2]):
+        for x in range(stack.shape[3]):
+            if index[y, x] >= 0:
+                assert(numpy.array_equal(medoid[:, y, x], stack[index[y, x], :, y, x]))
+
+
+def test_calculate_medoid():
+
+    numpy.random.seed(2)
+
+    X = numpy.random.random((4, 15))
+
+    # The default (vectorised) distance matches the brute force loop with an explicit distance
+
+    expected = calculate_medoid(X, dist=lambda a, b: numpy.sqrt(numpy.sum((a - b) ** 2)))
+
+    assert(numpy.array_equal(calculate_medoid(X), expected))
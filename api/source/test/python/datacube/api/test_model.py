@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import cPickle
+import os
+import shutil
+import tempfile
+from datacube.api import model
+from datacube.api.model import Tile, Cell, DatasetTile, DatasetType, Satellite, TileDatasets
+from datacube.api.model import Ls57Arg25Bands, Ls8Arg25Bands, Pq25Bands, DsmBands
+from datetime import datetime
+
+
+LS5_NBAR = "/nbar/LS5_TM_NBAR_120_-020_2005-11-21T01-27-04.570000.tif"
+LS5_WATER = "LS5_TM_WATER_120_-020_2005-11-21T01-27-04.570000.tif"
+
+LS8_NBAR = "/nbar/LS8_OLI_TIRS_NBAR_120_-020_2013-04-24T01-46-06.vrt"
+LS8_WATER = "LS8_OLI_TIRS_WATER_120_-020_2013-04-24T01-46-06.tif"
+
+
+def get_tile(satellite, nbar, x=120, y=-20):
+
+    end_datetime = datetime(2005, 11, 21, 1, 27, 4)
+
+    return Tile(acquisition_id=1, x_index=x, y_index=y, start_datetime=end_datetime, end_datetime=end_datetime,
+                end_datetime_year=end_datetime.year, end_datetime_month=end_datetime.month,
+                datasets=DatasetTile.from_db_array(satellite.value, [["ARG25", nbar], ["PQ25", "/pqa/PQA.tif"]]))
+
+
+class WofsExtents(object):
+
+    """
+    Point the WOFS extents at a temporary directory containing the given extents
+    """
+
+    def __init__(self, *filenames):
+        self.filenames = filenames
+
+    def __enter__(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.extents_directory = model.WOFS_EXTENTS_DIRECTORY
+
+        os.mkdir(os.path.join(self.directory, "120_-020"))
+
+        for filename in self.filenames:
+            open(os.path.join(self.directory, "120_-020", filename), "w").close()
+
+        model.WOFS_EXTENTS_DIRECTORY = self.directory
+        model.clear_wofs_directory_listings()
+
+        return self
+
+    def __exit__(self, *args):
+
+        model.WOFS_EXTENTS_DIRECTORY = self.extents_directory
+        model.clear_wofs_directory_listings()
+
+        shutil.rmtree(self.directory)
+
+
+def test_wofs_lazy():
+
+    with WofsExtents(LS5_WATER, LS8_WATER) as extents:
+
+        tile = get_tile(Satellite.LS5, LS5_NBAR)
+
+        # Nothing is looked for on the file system until the WOFS dataset is asked for
+
+        assert(not dict.__contains__(tile.datasets, DatasetType.WATER))
+        assert(not model._wofs_directory_listings)
+
+        assert(DatasetType.WATER in tile.datasets)
+        assert(tile.datasets[DatasetType.WATER].path == os.path.join(extents.directory, "120_-020", LS5_WATER))
+        assert(tile.datasets[DatasetType.WATER].satellite == Satellite.LS5)
+
+        # Listing the datasets includes it
+
+        tile = get_tile(Satellite.LS8, LS8_NBAR)
+
+        assert(set(tile.datasets.keys()) == set([DatasetType.ARG25, DatasetType.PQ25, DatasetType.WATER]))
+        assert(len(tile.datasets) == 3)
+
+        # The directory is only listed once
+
+        assert(model._wofs_directory_listings.keys() == [os.path.join(extents.directory, "120_-020")])
+
+
+def test_wofs_missing():
+
+    with WofsExtents(LS8_WATER):
+
+        tile = get_tile(Satellite.LS5, LS5_NBAR)
+
+        assert(DatasetType.WATER not in tile.datasets)
+        assert(tile.datasets.get(DatasetType.WATER) is None)
+        assert(len(tile.datasets) == 2)
+
+        # No extents directory for the cell
+
+        tile = get_tile(Satellite.LS5, LS5_NBAR.replace("_-020_", "_-021_"), y=-21)
+
+        assert(DatasetType.WATER not in tile.datasets)
+
+
+def test_wofs_directory_listings_bounded():
+
+    directory = tempfile.mkdtemp()
+    size = model.WOFS_DIRECTORY_LISTINGS_SIZE
+
+    try:
+        model.WOFS_DIRECTORY_LISTINGS_SIZE = 2
+        model.clear_wofs_directory_listings()
+
+        a, b, c = [os.path.join(directory, name) for name in ["a", "b", "c"]]
+
+        for d in [a, b, c]:
+            os.mkdir(d)
+            open(os.path.join(d, "extent.tif"), "w").close()
+
+        assert(model.wofs_file_exists(os.path.join(a, "extent.tif")))
+        assert(model.wofs_file_exists(os.path.join(b, "extent.tif")))
+
+        # Using a makes b the least recently used
+
+        assert(not model.wofs_file_exists(os.path.join(a, "missing.tif")))
+        assert(model.wofs_file_exists(os.path.join(c, "extent.tif")))
+
+        assert(model._wofs_directory_listings.keys() == [a, c])
+
+    finally:
+        model.WOFS_DIRECTORY_LISTINGS_SIZE = size
+        model.clear_wofs_directory_listings()
+
+        shutil.rmtree(directory)
+
+
+def test_pickle():
+
+    with WofsExtents(LS5_WATER):
+
+        for protocol in [0, cPickle.HIGHEST_PROTOCOL]:
+
+            tile = get_tile(Satellite.LS5, LS5_NBAR)
+
+            copy = cPickle.loads(cPickle.dumps(tile, protocol))
+
+            for name in Tile.__slots__:
+                if name != "datasets":
+                    assert(getattr(copy, name) == getattr(tile, name))
+
+            # The WOFS dataset is resolved when pickled so the copy doesn't need the file system
+
+            model.clear_wofs_directory_listings()
+
+            assert(set(copy.datasets.keys()) == set([DatasetType.ARG25, DatasetType.PQ25, DatasetType.WATER]))
+            assert(not model._wofs_directory_listings)
+
+            for dataset_type, dataset in tile.datasets.iteritems():
+                assert(copy.datasets[dataset_type].path == dataset.path)
+                assert(copy.datasets[dataset_type].satellite == dataset.satellite)
+                assert(copy.datasets[dataset_type].dataset_type == dataset_type)
+
+            cell = cPickle.loads(cPickle.dumps(Cell(x_index=120, y_index=-20), protocol))
+
+            assert(cell.xy == (120, -20))
+
+            dataset = cPickle.loads(cPickle.dumps(DatasetTile(None, "DSM", "/dsm/DSM.tif"), protocol))
+
+            assert(dataset.satellite is None and dataset.dataset_type == DatasetType.DSM)
+
+
+def test_slots():
+
+    # No per instance __dict__
+
+    for o in [get_tile(Satellite.LS5, LS5_NBAR), Cell(x_index=120, y_index=-20), DatasetTile("LS5", "ARG25", "/x"),
+              TileDatasets()]:
+        assert(not hasattr(o, "__dict__"))
+
+
+def test_xy_and_bands():
+
+    tile = get_tile(Satellite.LS5, LS5_NBAR, x=121, y=-22)
+
+    assert(tile.xy == (121, -22))
+    assert(Cell(x_index=121, y_index=-22).xy == (121, -22))
+
+    assert(DatasetTile("LS5", "ARG25", "/x").bands == Ls57Arg25Bands)
+    assert(DatasetTile("LS7", "ARG25", "/x").bands == Ls57Arg25Bands)
+    assert(DatasetTile("LS8", "ARG25", "/x").bands == Ls8Arg25Bands)
+    assert(DatasetTile("LS8", "PQ25", "/x").bands == Pq25Bands)
+
+    # Satellite independent
+
+    assert(DatasetTile(None, "DSM", "/x").bands == DsmBands)
+    assert(DatasetTile("LS5", "DEM", "/x").bands == DsmBands)
@@ -35,6 +35,7 @@ import logging
 from datacube.api import parse_date_min, parse_date_max, Satellite, DatasetType
 from datacube.api.query import list_cells_as_list, list_tiles_as_list
 from datacube.api.query import list_cells_vector_file_as_list
+from datacube.api.query import build_list_tiles_sql_and_params
 from datacube.api.query import MONTHS_BY_SEASON, Season
 from datacube.api.query import LS7_SLC_OFF_EXCLUSION, LS7_SLC_OFF_ACQ_MIN
 from datacube.api.query import LS8_PRE_WRS_2_EXCLUSION, LS8_PRE_WRS_2_ACQ_MAX
@@ -218,6 +219,25 @@ def test_list_tiles_120_020_2005_ls578_summer(config=None):
 
 # AOI
 
+def test_build_list_tiles_sql_order():
+
+    for acquisition_cell in [False, True]:
+
+        query = dict(x=[TEST_CELL_X], y=[TEST_CELL_Y], satellites=[Satellite.LS5, Satellite.LS7],
+                     acq_min=parse_date_min(TEST_YEAR_STR), acq_max=parse_date_max(TEST_YEAR_STR),
+                     dataset_types=[DatasetType.ARG25, DatasetType.PQ25], acquisition_cell=acquisition_cell)
+
+        # Tiles are in end date/time order unless grouping by cell
+
+        sql, _ = build_list_tiles_sql_and_params(**query)
+
+        assert(" ".join(sql.split()).endswith("order by end_datetime ASC, satellite asc"))
+
+        sql, _ = build_list_tiles_sql_and_params(group_by_cell=True, **query)
+
+        assert(" ".join(sql.split()).endswith("y_index, end_datetime ASC, satellite asc"))
+
+
 def test_list_cells_act_2005_ls578(config=None):
     cells = list_cells_vector_file_as_list(vector_file=TEST_VECTOR_FILE,
                                            vector_layer=TEST_VECTOR_LAYER,
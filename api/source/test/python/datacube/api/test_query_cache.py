@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import os
+import shutil
+import tempfile
+import time
+from datacube.api.query import QueryCache
+
+
+SQL = """
+    select x_index, y_index from tile
+    where x_index = ANY(%(x)s) and y_index = ANY(%(y)s)
+    """
+
+RECORDS = [{"x_index": 120, "y_index": -20}, {"x_index": 121, "y_index": -20}]
+
+
+def test_get_key():
+
+    key = QueryCache.get_key(SQL, {"x": [120, 121], "y": [-20]})
+
+    # White space, parameter order and the order of = ANY(...) lists don't matter
+
+    assert(QueryCache.get_key(" ".join(SQL.split()), {"y": [-20], "x": [121, 120]}) == key)
+    assert(QueryCache.get_key(SQL, {"x": (121, 120), "y": [-20]}) == key)
+
+    # Different values do
+
+    assert(QueryCache.get_key(SQL, {"x": [120], "y": [-20]}) != key)
+
+    # The order of a list that isn't only used with = ANY(...) is kept
+
+    sql = "select %(bands)s::int[] as bands from tile where x_index = ANY(%(x)s)"
+
+    assert(QueryCache.get_key(sql, {"bands": [1, 2], "x": [120, 121]}) ==
+           QueryCache.get_key(sql, {"bands": [1, 2], "x": [121, 120]}))
+
+    assert(QueryCache.get_key(sql, {"bands": [1, 2], "x": [120]}) !=
+           QueryCache.get_key(sql, {"bands": [2, 1], "x": [120]}))
+
+    sql = "select * from tile where x_index = ANY(%(x)s) order by array_position(%(x)s, x_index)"
+
+    assert(QueryCache.get_key(sql, {"x": [120, 121]}) != QueryCache.get_key(sql, {"x": [121, 120]}))
+
+
+def test_get_returns_copies():
+
+    cache = QueryCache()
+
+    params = {"x": [120, 121], "y": [-20]}
+
+    assert(cache.get(SQL, params) is None)
+
+    records = [dict(record) for record in RECORDS]
+
+    cache.put(SQL, params, records)
+
+    # Changing the records given to put() or returned by get() doesn't change the cache
+
+    records[0]["x_index"] = 999
+
+    cached = cache.get(SQL, params)
+
+    assert(cached == RECORDS)
+    assert(all(type(record) is dict for record in cached))
+
+    cached[0]["x_index"] = 999
+    del cached[1]
+
+    assert(cache.get(SQL, params) == RECORDS)
+
+
+def test_size():
+
+    cache = QueryCache(size=2)
+
+    for x in [120, 121, 122]:
+        cache.put(SQL, {"x": [x], "y": [-20]}, RECORDS)
+
+    # The least recently used is dropped
+
+    assert(cache.get(SQL, {"x": [120], "y": [-20]}) is None)
+    assert(cache.get(SQL, {"x": [121], "y": [-20]}) == RECORDS)
+    assert(cache.get(SQL, {"x": [122], "y": [-20]}) == RECORDS)
+
+
+def test_ttl_and_invalidate():
+
+    params = {"x": [120], "y": [-20]}
+
+    cache = QueryCache(ttl=3600)
+
+    cache.put(SQL, params, RECORDS)
+
+    # Expired
+
+    cache.ttl = 0
+
+    assert(cache.get(SQL, params) is None)
+
+    # Invalidated
+
+    cache.ttl = 3600
+
+    cache.put(SQL, params, RECORDS)
+
+    assert(cache.get(SQL, params) == RECORDS)
+
+    time.sleep(0.01)
+
+    cache.invalidate()
+
+    assert(cache.get(SQL, params) is None)
+
+
+def test_disk_round_trip():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        params = {"x": [120, 121], "y": [-20]}
+
+        QueryCache(directory=directory).put(SQL, params, RECORDS)
+
+        assert(len([f for f in os.listdir(directory) if f.endswith(".pickle")]) == 1)
+
+        # Another cache (e.g. in another process) using the directory sees the results
+
+        other = QueryCache(directory=directory)
+
+        assert(other.get(SQL, {"y": [-20], "x": [121, 120]}) == RECORDS)
+
+        # ...and invalidation by any of them
+
+        time.sleep(0.01)
+
+        QueryCache(directory=directory).invalidate()
+
+        assert(other.get(SQL, params) is None)
+        assert(not [f for f in os.listdir(directory) if f.endswith(".pickle")])
+
+    finally:
+        shutil.rmtree(directory)
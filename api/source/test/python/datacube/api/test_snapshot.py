@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import itertools
+import numpy
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from datacube.api.model import DatasetType, Satellite, dataset_type_derived_nbar
+from datacube.api.query import PathTable, SortType, Month, LS7_SLC_OFF_EXCLUSION, LS8_PRE_WRS_2_EXCLUSION
+from datacube.api.snapshot import TileIndex, SNAPSHOT_VERSION, SNAPSHOT_SATELLITES, SNAPSHOT_DATASET_TYPES
+from datacube.api.snapshot import get_path_column_name
+from datetime import date, datetime, timedelta
+
+
+TestTile = namedtuple("TestTile", "acquisition_id x y satellite end_datetime dataset_types")
+
+
+def get_test_tiles():
+
+    # Three cells (one with no FC) of LS5, LS7 and LS8 acquisitions either side of the LS7 SLC OFF and LS8 PRE WRS 2
+    # dates - LS5 and LS7 sometimes acquired at the same time - with some tiles missing PQ
+
+    tiles = list()
+
+    satellites = itertools.cycle([Satellite.LS5, Satellite.LS7, Satellite.LS8, Satellite.LS7])
+
+    for x, y in [(120, -20), (120, -21), (121, -20)]:
+
+        end_datetime = datetime(2005, 1, 1, 1, 30)
+
+        for i in range(60):
+
+            satellite = next(satellites)
+
+            dataset_types = [DatasetType.ARG25]
+
+            if i % 7:
+                dataset_types.append(DatasetType.PQ25)
+
+            if (x, y) != (120, -21):
+                dataset_types.append(DatasetType.FC25)
+
+            tiles.append(TestTile(len(tiles), x, y, satellite, end_datetime, dataset_types))
+
+            if satellite == Satellite.LS5 and i % 3 == 0:
+                tiles.append(TestTile(len(tiles), x, y, Satellite.LS7, end_datetime, dataset_types))
+
+            end_datetime += timedelta(days=47, hours=i % 5)
+
+    return tiles
+
+
+def get_tile_index(tiles):
+
+    # Snapshots are in x, y, end date/time order
+
+    tiles = sorted(tiles, key=lambda tile: (tile.x, tile.y, tile.end_datetime))
+
+    path_table = PathTable()
+
+    columns = {
+        "acquisition_id": numpy.array([tile.acquisition_id for tile in tiles], dtype=numpy.int64),
+        "satellite": numpy.array([SNAPSHOT_SATELLITES.index(tile.satellite) for tile in tiles], dtype=numpy.uint8),
+        "start_datetime": numpy.array([tile.end_datetime - timedelta(seconds=30) for tile in tiles],
+                                      dtype="datetime64[us]"),
+        "end_datetime": numpy.array([tile.end_datetime for tile in tiles], dtype="datetime64[us]"),
+        "x_index": numpy.array([tile.x for tile in tiles], dtype=numpy.int16),
+        "y_index": numpy.array([tile.y for tile in tiles], dtype=numpy.int16)
+    }
+
+    for dataset_type, _ in SNAPSHOT_DATASET_TYPES:
+        columns[get_path_column_name(dataset_type)] = numpy.array(
+            [dataset_type in tile.dataset_types and path_table.add(get_path(tile, dataset_type)) or -1
+             for tile in tiles], dtype=numpy.int32)
+
+    columns["version"] = numpy.array([SNAPSHOT_VERSION])
+    columns["path_data"] = path_table.get_data()
+    columns["path_offsets"] = path_table.get_offsets()
+
+    return columns
+
+
+def get_path(tile, dataset_type):
+
+    return "/{dataset_type}/{satellite}_{x:03d}_{y:04d}_{date}.tif".format(
+        dataset_type=dataset_type.name, satellite=tile.satellite.name, x=tile.x, y=tile.y,
+        date=tile.end_datetime.strftime("%Y-%m-%dT%H-%M-%S"))
+
+
+def get_expected(tiles, x, y, satellites, acq_min, acq_max, dataset_types, months=None, exclude=None,
+                 sort=SortType.ASC, group_by_cell=False):
+
+    # The query the simple way
+
+    def excluded(tile):
+        for exclusion in exclude or []:
+            if (tile.satellite == exclusion.satellite and
+                    (not exclusion.acq_min or tile.end_datetime.date() >= exclusion.acq_min) and
+                    (not exclusion.acq_max or tile.end_datetime.date() <= exclusion.acq_max)):
+                return True
+        return False
+
+    selected = [tile for tile in tiles
+                if tile.x in x and tile.y in y and tile.satellite in satellites
+                and acq_min <= tile.end_datetime.date() <= acq_max
+                and all(dataset_type in tile.dataset_types for dataset_type in dataset_types
+                        if dataset_type not in dataset_type_derived_nbar)
+                and (not months or tile.end_datetime.month in [month.value for month in months])
+                and not excluded(tile)]
+
+    # Satellite (then cell) order within the same end date/time - regardless of the sort order
+
+    selected = sorted(selected, key=lambda tile: (SNAPSHOT_SATELLITES.index(tile.satellite), tile.x, tile.y))
+    selected = sorted(selected, key=lambda tile: tile.end_datetime, reverse=(sort == SortType.DESC))
+
+    if group_by_cell:
+        selected = sorted(selected, key=lambda tile: (tile.x, tile.y))
+
+    return [tile.acquisition_id for tile in selected]
+
+
+QUERIES = [
+    dict(x=[120, 121], y=[-21, -20], satellites=[Satellite.LS5, Satellite.LS7, Satellite.LS8],
+         acq_min=date(2005, 1, 1), acq_max=date(2012, 12, 31), dataset_types=[DatasetType.ARG25]),
+
+    # Window - the limits are whole days and inclusive
+
+    dict(x=[120, 121], y=[-21, -20], satellites=[Satellite.LS5, Satellite.LS7, Satellite.LS8],
+         acq_min=date(2006, 4, 4), acq_max=date(2007, 10, 6), dataset_types=[DatasetType.ARG25]),
+
+    dict(x=[120], y=[-20], satellites=[Satellite.LS5, Satellite.LS7, Satellite.LS8],
+         acq_min=date(2005, 1, 1), acq_max=date(2005, 1, 1), dataset_types=[DatasetType.ARG25]),
+
+    # Outside the index
+
+    dict(x=[120, 121], y=[-20], satellites=[Satellite.LS5],
+         acq_min=date(2000, 1, 1), acq_max=date(2004, 12, 31), dataset_types=[DatasetType.ARG25]),
+
+    dict(x=[122], y=[-20], satellites=[Satellite.LS5],
+         acq_min=date(2005, 1, 1), acq_max=date(2012, 12, 31), dataset_types=[DatasetType.ARG25]),
+
+    # Required datasets
+
+    dict(x=[120, 121], y=[-21, -20], satellites=[Satellite.LS5, Satellite.LS7],
+         acq_min=date(2005, 1, 1), acq_max=date(2012, 12, 31),
+         dataset_types=[DatasetType.ARG25, DatasetType.PQ25, DatasetType.FC25]),
+
+    # Derived NBAR datasets don't need anything more
+
+    dict(x=[120, 121], y=[-21, -20], satellites=[Satellite.LS7],
+         acq_min=date(2005, 1, 1), acq_max=date(2012, 12, 31),
+         dataset_types=[DatasetType.ARG25, DatasetType.PQ25, DatasetType.NDVI]),
+
+    # Months
+
+    dict(x=[120, 121], y=[-21, -20], satellites=[Satellite.LS5, Satellite.LS7, Satellite.LS8],
+         acq_min=date(2005, 1, 1), acq_max=date(2012, 12, 31), dataset_types=[DatasetType.ARG25],
+         months=[Month.DECEMBER, Month.JANUARY, Month.FEBRUARY]),
+
+    # Exclusions
+
+    dict(x=[120, 121], y=[-21, -20], satellites=[Satellite.LS5, Satellite.LS7, Satellite.LS8],
+         acq_min=date(2005, 1, 1), acq_max=date(2012, 12, 31), dataset_types=[DatasetType.ARG25],
+         exclude=[LS7_SLC_OFF_EXCLUSION, LS8_PRE_WRS_2_EXCLUSION])
+]
+
+
+def test_list_tiles():
+
+    tiles = get_test_tiles()
+
+    index = TileIndex(get_tile_index(tiles))
+
+    for query in QUERIES:
+        for sort in [SortType.ASC, SortType.DESC]:
+
+            actual = [tile.acquisition_id for tile in index.list_tiles_as_generator(sort=sort, **query)]
+
+            assert(actual == get_expected(tiles, sort=sort, **query))
+
+
+def test_list_tiles_by_cell():
+
+    tiles = get_test_tiles()
+
+    index = TileIndex(get_tile_index(tiles))
+
+    for query in QUERIES:
+        for sort in [SortType.ASC, SortType.DESC]:
+
+            actual = list()
+
+            for cell, cell_tiles in index.list_tiles_by_cell_as_generator(sort=sort, **query):
+                assert(cell_tiles and all(tile.xy == cell.xy for tile in cell_tiles))
+                actual.extend(tile.acquisition_id for tile in cell_tiles)
+
+            assert(actual == get_expected(tiles, sort=sort, group_by_cell=True, **query))
+
+
+def test_list_cells():
+
+    tiles = get_test_tiles()
+
+    index = TileIndex(get_tile_index(tiles))
+
+    for query in QUERIES:
+        for sort in [SortType.ASC, SortType.DESC]:
+
+            expected = sorted(set((tiles[i].x, tiles[i].y) for i in get_expected(tiles, **query)),
+                              reverse=(sort == SortType.DESC))
+
+            assert([cell.xy for cell in index.list_cells_as_generator(sort=sort, **query)] == expected)
+
+
+def test_make_tile():
+
+    tiles = get_test_tiles()
+
+    index = TileIndex(get_tile_index(tiles))
+
+    tile = tiles[10]
+
+    dataset_types = [DatasetType.ARG25, DatasetType.PQ25, DatasetType.FC25, DatasetType.NDVI, DatasetType.DSM]
+
+    actual = index.list_tiles_as_list(x=[tile.x], y=[tile.y], satellites=[tile.satellite],
+                                      acq_min=tile.end_datetime.date(), acq_max=tile.end_datetime.date(),
+                                      dataset_types=[DatasetType.ARG25])
+
+    assert(len(actual) == 1)
+
+    actual = index.make_tile(numpy.flatnonzero(index.acquisition_id == tile.acquisition_id)[0], dataset_types)
+
+    assert(actual.acquisition_id == tile.acquisition_id and actual.xy == (tile.x, tile.y))
+    assert(actual.end_datetime == tile.end_datetime)
+    assert(actual.start_datetime == tile.end_datetime - timedelta(seconds=30))
+
+    # The paths it has (derived NBAR datasets use the NBAR path)
+
+    for dataset_type in tile.dataset_types:
+        assert(actual.datasets[dataset_type].path == get_path(tile, dataset_type))
+
+    assert(actual.datasets[DatasetType.NDVI].path == get_path(tile, DatasetType.ARG25))
+    assert(DatasetType.DSM not in actual.datasets)
+
+
+def test_load():
+
+    tiles = get_test_tiles()
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        columns = get_tile_index(tiles)
+
+        filename = os.path.join(directory, "tile_index.npz")
+
+        with open(filename, "wb") as f:
+            numpy.savez(f, **columns)
+
+        index = TileIndex.load(filename)
+
+        assert(sorted(index.cells) == [(120, -21), (120, -20), (121, -20)])
+
+        for query in QUERIES:
+            actual = [tile.acquisition_id for tile in index.list_tiles_as_generator(**query)]
+            assert(actual == get_expected(tiles, **query))
+
+        # A snapshot from another version
+
+        columns["version"] = numpy.array([SNAPSHOT_VERSION + 1])
+
+        with open(filename, "wb") as f:
+            numpy.savez(f, **columns)
+
+        raised = False
+
+        try:
+            TileIndex.load(filename)
+
+        except Exception:
+            raised = True
+
+        assert(raised)
+
+    finally:
+        shutil.rmtree(directory)
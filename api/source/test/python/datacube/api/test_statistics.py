@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+from datacube.api.statistics import Statistic, StatisticsAccumulator
+from datacube.api.statistics import calculate_percentiles, PercentileInterpolation, PercentileAccumulator
+
+
+NDV = -999
+
+
+def get_stack(times=20, height=30, width=40, seed=1):
+
+    """
+    A float stack with some no data (and NaN) observations and a pixel with none at all
+    """
+
+    numpy.random.seed(seed)
+
+    stack = numpy.random.normal(0.0, 0.3, (times, height, width)).astype(numpy.float32)
+
+    stack[numpy.random.random(stack.shape) < 0.2] = NDV
+    stack[numpy.random.random(stack.shape) < 0.1] = numpy.nan
+    stack[:, 0, 0] = NDV
+
+    return stack
+
+
+def get_reference(stack, percentiles, interpolation="linear"):
+
+    data = stack.astype(numpy.float64)
+    data[data == NDV] = numpy.nan
+
+    out = numpy.empty((len(percentiles),) + stack.shape[1:], dtype=numpy.float64)
+    out.fill(numpy.nan)
+
+    valid = numpy.isfinite(data).any(axis=0)
+
+    for i, percentile in enumerate(percentiles):
+        out[i][valid] = numpy.nanpercentile(data[:, valid], percentile, axis=0, interpolation=interpolation)
+
+    return out
+
+
+def get_masked(stack):
+
+    data = stack.astype(numpy.float64)
+    data[data == NDV] = numpy.nan
+
+    return data
+
+
+def check_statistics(statistics, stack):
+
+    data = get_masked(stack)
+
+    valid = numpy.isfinite(data).any(axis=0)
+
+    expected = {
+        Statistic.COUNT: numpy.full(valid.shape, len(stack)),
+        Statistic.COUNT_OBSERVED: numpy.isfinite(data).sum(axis=0),
+        Statistic.MIN: numpy.nanmin(data[:, valid], axis=0),
+        Statistic.MAX: numpy.nanmax(data[:, valid], axis=0),
+        Statistic.MEAN: numpy.nanmean(data[:, valid], axis=0),
+        Statistic.SUM: numpy.nansum(data, axis=0),
+        Statistic.VARIANCE: numpy.nanvar(data[:, valid], axis=0),
+        Statistic.STANDARD_DEVIATION: numpy.nanstd(data[:, valid], axis=0)
+    }
+
+    for statistic in Statistic:
+        actual = statistics[statistic]
+
+        if statistic in [Statistic.COUNT, Statistic.COUNT_OBSERVED, Statistic.SUM]:
+            assert(numpy.allclose(actual, expected[statistic], atol=1e-5))
+        else:
+            assert(numpy.allclose(actual[valid], expected[statistic], atol=1e-5))
+            assert(numpy.isnan(actual[~valid]).all())
+
+
+def test_statistics_accumulator():
+
+    stack = get_stack()
+
+    accumulator = StatisticsAccumulator(stack.shape[1:], ndv=NDV)
+
+    for data in stack:
+        accumulator.update(data)
+
+    check_statistics(accumulator.get_statistics(), stack)
+
+
+def test_statistics_accumulator_combine():
+
+    stack = get_stack()
+
+    # Including an empty accumulator and one where the pixel with no observations has some
+
+    stack[15:, 0, 0] = 0.5
+
+    accumulators = []
+
+    for start, stop in [(0, 7), (7, 7), (7, 15), (15, 20)]:
+        accumulator = StatisticsAccumulator(stack.shape[1:], ndv=NDV)
+
+        for data in stack[start:stop]:
+            accumulator.update(data)
+
+        accumulators.append(accumulator)
+
+    for accumulator in accumulators[1:]:
+        accumulators[0].combine(accumulator)
+
+    check_statistics(accumulators[0].get_statistics(), stack)
+
+
+def test_statistics_accumulator_large_offset():
+
+    # Welford keeps the variance of values with a large mean
+
+    numpy.random.seed(3)
+
+    stack = 1.0e8 + numpy.random.random((50, 4, 4))
+
+    accumulator = StatisticsAccumulator(stack.shape[1:])
+
+    for data in stack:
+        accumulator.update(data)
+
+    statistics = accumulator.get_statistics([Statistic.VARIANCE], dtype=numpy.float64)
+
+    assert(numpy.allclose(statistics[Statistic.VARIANCE], numpy.var(stack, axis=0), rtol=1e-6))
+
+
+def test_calculate_percentiles_linear():
+
+    stack = get_stack()
+    percentiles = [0, 25, 50, 75, 90, 95, 100]
+
+    actual = calculate_percentiles(stack, percentiles, ndv=NDV, chunk_pixels=100)
+    expected = get_reference(stack, percentiles)
+
+    assert(actual.shape == expected.shape)
+    assert(numpy.allclose(actual, expected, equal_nan=True, atol=1e-6))
+    assert(numpy.isnan(actual[:, 0, 0]).all())
+
+
+def test_calculate_percentiles_lower():
+
+    stack = get_stack()
+    percentiles = [10, 50, 95]
+
+    actual = calculate_percentiles(stack, percentiles, ndv=NDV, interpolation=PercentileInterpolation.LOWER)
+    expected = get_reference(stack, percentiles, interpolation="lower")
+
+    assert(numpy.allclose(actual, expected, equal_nan=True))
+
+
+def test_calculate_percentiles_rank():
+
+    stack = numpy.array([[1, 2], [3, NDV], [2, NDV], [4, NDV]], dtype=numpy.int16).reshape((4, 1, 2))
+
+    actual = calculate_percentiles(stack, [50, 95], ndv=NDV, interpolation=PercentileInterpolation.RANK,
+                                   output_ndv=NDV, dtype=numpy.int16)
+
+    # The q-th of the sorted observations - [1, 2, 3, 4] and [2]
+
+    assert(actual.dtype == numpy.int16)
+    assert(numpy.array_equal(actual[:, 0], [[3, 2], [4, 2]]))
+
+
+def test_percentile_accumulator():
+
+    stack = get_stack()
+    percentiles = [25, 50, 75, 90, 95]
+
+    accumulator = PercentileAccumulator(stack.shape[1:], -2.0, 2.0, bins=200, ndv=NDV)
+
+    for data in stack:
+        accumulator.update(data)
+
+    assert(accumulator.histogram.dtype == numpy.uint16)
+
+    actual = accumulator.get_percentiles(percentiles)
+    expected = get_reference(stack, percentiles)
+
+    # Within half a bin width (plus the float32 rounding)
+
+    assert(actual.shape == expected.shape)
+    assert(numpy.all(numpy.isnan(actual) == numpy.isnan(expected)))
+    assert(numpy.nanmax(numpy.abs(actual - expected)) <= accumulator.width / 2 + 1e-6)
+
+
+def test_percentile_accumulator_clip():
+
+    # Values outside the range are counted in the first/last bin
+
+    accumulator = PercentileAccumulator((1, 2), 0.0, 10.0, bins=10)
+
+    for value in [-5.0, 1.5, 25.0]:
+        accumulator.update(numpy.array([[value, value]]))
+
+    actual = accumulator.get_percentiles([0, 50, 100])
+
+    assert(numpy.allclose(actual[:, 0, 0], [0.5, 1.5, 9.5]))
+
+
+def test_percentile_accumulator_widen():
+
+    accumulator = PercentileAccumulator((1,), 0.0, 1.0, bins=2)
+
+    accumulator.observations = numpy.iinfo(numpy.uint16).max
+    accumulator.histogram[0] = numpy.iinfo(numpy.uint16).max
+
+    accumulator.update(numpy.array([0.25]))
+
+    assert(accumulator.histogram.dtype == numpy.uint32)
+    assert(accumulator.histogram[0, 0] == numpy.iinfo(numpy.uint16).max + 1)
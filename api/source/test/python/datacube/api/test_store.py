@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+import os
+import shutil
+import tempfile
+from datacube.api.chunk import get_chunk_windows
+from datacube.api.store import CellStore, open_memmap
+
+
+def test_cell_store_round_trip():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        path = os.path.join(directory, "store.dat")
+
+        store = CellStore(path, count=2, width=100, height=70, dtype=numpy.float32, chunk_size_x=32, chunk_size_y=32)
+
+        expected = numpy.random.random((2, 70, 100)).astype(numpy.float32)
+
+        # The edge windows are clipped to the cell
+
+        for x, y, x_size, y_size in get_chunk_windows(32, 32, width=100, height=70):
+            for band in [1, 2]:
+                store.write(band, expected[band - 1, y:y + y_size, x:x + x_size], x, y)
+
+            store.mark_done(x, y)
+
+        store.close()
+
+        # A different instance (e.g. the cell task) sees what was written
+
+        other = CellStore(path, count=2, width=100, height=70, dtype=numpy.float32, chunk_size_x=32, chunk_size_y=32)
+
+        assert(numpy.array_equal(other.open(), expected))
+        assert(numpy.array_equal(other.read(2, x=96, y=64), expected[1, 64:, 96:]))
+        assert(numpy.array_equal(other.read(1, x=10, y=20, x_size=5, y_size=3), expected[0, 20:23, 10:15]))
+
+        assert(all(other.is_done(x, y) for x, y, _, _ in get_chunk_windows(32, 32, width=100, height=70)))
+
+        other.remove()
+
+        assert(not os.path.exists(path))
+        assert(not os.path.exists(path + ".done"))
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cell_store_write_clips_edge():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        store = CellStore(os.path.join(directory, "store.dat"), count=1, width=100, height=70,
+                          chunk_size_x=64, chunk_size_y=64)
+
+        # A full sized chunk at the bottom right corner of the cell
+
+        store.write(1, numpy.full((64, 64), 7.0, dtype=numpy.float32), 64, 64)
+
+        data = store.read(1)
+
+        assert(numpy.all(data[64:, 64:] == 7.0))
+        assert(numpy.all(data[:64, :] == 0.0))
+        assert(numpy.all(data[:, :64] == 0.0))
+
+        store.close()
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cell_store_done():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        store = CellStore(os.path.join(directory, "store.dat"), count=1, width=100, height=70,
+                          chunk_size_x=64, chunk_size_y=64)
+
+        assert(store.done_shape == (2, 2))
+        assert(not store.is_done(0, 0))
+
+        store.mark_done(64, 0)
+
+        assert(store.is_done(64, 0))
+        assert(not store.is_done(0, 0))
+        assert(not store.is_done(64, 64))
+
+        store.close()
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_open_memmap_keeps_data():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        path = os.path.join(directory, "data.dat")
+
+        data = open_memmap(path, numpy.int16, (4, 5))
+        data[:] = numpy.arange(20).reshape((4, 5))
+        data.flush()
+        del data
+
+        # Opening it again (e.g. from another task) doesn't truncate it
+
+        data = open_memmap(path, numpy.int16, (4, 5))
+
+        assert(numpy.array_equal(data, numpy.arange(20).reshape((4, 5))))
+        assert(os.path.getsize(path) == 4 * 5 * 2)
+
+        del data
+
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import numpy
+import os
+import shutil
+import tempfile
+from datacube.api import workflow
+from datacube.api.workflow import cell_chunk
+from datacube.api.model import DatasetType, Satellite
+from datacube.api.query import PathTable, group_tiles_by_cell
+from datacube.api.snapshot import TileIndex, SNAPSHOT_SATELLITES, SNAPSHOT_DATASET_TYPES, get_path_column_name
+from datetime import date, datetime
+
+
+# (x, y, satellite, end date/time, has PQ) - cell (120, -21) has no PQ so no tiles when PQ is required
+
+TILES = [
+    (120, -20, Satellite.LS5, datetime(2005, 1, 2, 1), True),
+    (120, -20, Satellite.LS7, datetime(2005, 1, 10, 1), True),
+    (120, -21, Satellite.LS5, datetime(2005, 1, 2, 1), False),
+    (121, -20, Satellite.LS5, datetime(2005, 1, 1, 1), True),
+    (121, -20, Satellite.LS7, datetime(2005, 1, 9, 1), True)
+]
+
+
+def get_tile_index(tiles=TILES):
+
+    path_table = PathTable()
+
+    columns = {
+        "acquisition_id": numpy.arange(len(tiles), dtype=numpy.int64),
+        "satellite": numpy.array([SNAPSHOT_SATELLITES.index(tile[2]) for tile in tiles], dtype=numpy.uint8),
+        "start_datetime": numpy.array([tile[3] for tile in tiles], dtype="datetime64[us]"),
+        "end_datetime": numpy.array([tile[3] for tile in tiles], dtype="datetime64[us]"),
+        "x_index": numpy.array([tile[0] for tile in tiles], dtype=numpy.int16),
+        "y_index": numpy.array([tile[1] for tile in tiles], dtype=numpy.int16)
+    }
+
+    for dataset_type, _ in SNAPSHOT_DATASET_TYPES:
+        columns[get_path_column_name(dataset_type)] = numpy.array([-1] * len(tiles), dtype=numpy.int32)
+
+    for i, (x, y, satellite, end_datetime, pq) in enumerate(tiles):
+        name = "%s_%d_%d_%s" % (satellite.name, x, y, end_datetime.strftime("%Y%m%d"))
+
+        columns["path_arg25"][i] = path_table.add("/nbar/%s.tif" % name)
+
+        if pq:
+            columns["path_pq25"][i] = path_table.add("/pqa/%s.tif" % name)
+
+    columns["path_data"] = path_table.get_data()
+    columns["path_offsets"] = path_table.get_offsets()
+
+    return TileIndex(columns)
+
+
+QUERY = dict(acq_min=date(2005, 1, 1), acq_max=date(2005, 12, 31), satellites=[Satellite.LS5, Satellite.LS7],
+             dataset_types=[DatasetType.ARG25, DatasetType.PQ25])
+
+
+def test_list_tiles_by_cell_as_generator():
+
+    index = get_tile_index()
+
+    cells = list(index.list_tiles_by_cell_as_generator(x=[120, 121], y=[-21, -20], **QUERY))
+
+    # Grouped by cell in x, y order with each cell's tiles in end date/time order
+
+    assert([cell.xy for cell, _ in cells] == [(120, -20), (121, -20)])
+
+    for cell, tiles in cells:
+        assert(all(tile.xy == cell.xy for tile in tiles))
+        assert([tile.end_datetime for tile in tiles] == sorted(tile.end_datetime for tile in tiles))
+
+    # Without grouping the tiles across the cells are in end date/time order
+
+    tiles = index.list_tiles_as_list(x=[120, 121], y=[-21, -20], **QUERY)
+
+    assert([tile.end_datetime for tile in tiles] == sorted(tile.end_datetime for tile in tiles))
+    assert([tile.xy for tile in tiles] == [(121, -20), (120, -20), (121, -20), (120, -20)])
+
+    grouped = group_tiles_by_cell(sorted(tiles, key=lambda tile: tile.xy))
+
+    assert([(cell.xy, len(cell_tiles)) for cell, cell_tiles in grouped] == [((120, -20), 2), ((121, -20), 2)])
+
+
+def test_prefetch_tiles_records_cells_with_no_tiles():
+
+    workflow._tile_index = get_tile_index()
+
+    try:
+        tiles_by_cell = workflow.prefetch_tiles(x_min=120, x_max=122, y_min=-21, y_max=-20, **QUERY)
+
+    finally:
+        workflow._tile_index = None
+
+    # Every cell in the range is recorded - those with no (matching) tiles as having none
+
+    assert(sorted(tiles_by_cell) == [(x, y) for x in [120, 121, 122] for y in [-21, -20]])
+
+    assert([tile.acquisition_id for tile in tiles_by_cell[(120, -20)]] == [0, 1])
+    assert([tile.acquisition_id for tile in tiles_by_cell[(121, -20)]] == [3, 4])
+
+    assert(tiles_by_cell[(120, -21)] == [])
+    assert(tiles_by_cell[(122, -20)] == [])
+
+
+def test_get_tiles_for_cell():
+
+    workflow._tile_index = get_tile_index()
+
+    try:
+        key = workflow.get_tile_query_key(**QUERY)
+
+        prefetched = {key: ["pre-fetched"]}
+
+        # Pre-fetched for the same query criteria
+
+        assert(workflow.get_tiles_for_cell(x=120, y=-20, prefetched=prefetched, **QUERY) == ["pre-fetched"])
+
+        # An empty pre-fetched list is used rather than querying again
+
+        assert(workflow.get_tiles_for_cell(x=120, y=-21, prefetched={key: []}, **QUERY) == [])
+
+        # Different criteria (or nothing pre-fetched) falls back to querying the tile index
+
+        query = dict(QUERY, dataset_types=[DatasetType.ARG25])
+
+        tiles = workflow.get_tiles_for_cell(x=120, y=-21, prefetched=prefetched, **query)
+
+        assert([tile.acquisition_id for tile in tiles] == [2])
+
+        tiles = workflow.get_tiles_for_cell(x=120, y=-20, **QUERY)
+
+        assert([tile.acquisition_id for tile in tiles] == [0, 1])
+
+    finally:
+        workflow._tile_index = None
+
+
+class DummyCellTask(workflow.CellTask):
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class DummySummaryTask(workflow.SummaryTask):
+
+    def __init__(self):
+        self.x_min, self.x_max, self.y_min, self.y_max = 120, 122, -21, -20
+        self.acq_min, self.acq_max, self.satellites = QUERY["acq_min"], QUERY["acq_max"], QUERY["satellites"]
+        self.csv = False
+        self.cell_tasks = dict()
+
+    def create_cell_tasks(self, x, y):
+
+        # luigi returns the same instance for the same parameters
+
+        return self.cell_tasks.setdefault((x, y), DummyCellTask(x, y))
+
+
+def test_summary_task_shares_prefetched_tiles():
+
+    task = DummySummaryTask()
+
+    workflow._tile_index = get_tile_index()
+
+    try:
+        tasks = list(task.requires())
+
+    finally:
+        workflow._tile_index = None
+
+    assert([(cell_task.x, cell_task.y) for cell_task in tasks] == [(120, -20), (121, -20)])
+
+    # Each cell task only has its own cell's tiles and the summary task has released the rest
+
+    key = workflow.get_tile_query_key(**QUERY)
+
+    for cell_task in tasks:
+        assert(list(cell_task.prefetched_tiles) == [key])
+        assert(all(tile.xy == (cell_task.x, cell_task.y) for tile in cell_task.prefetched_tiles[key]))
+
+    assert(task.tiles_by_cell is None)
+
+    # requires() is called again (e.g. when luigi checks complete()) - the cells aren't queried again and the cell
+    # tasks keep their tiles
+
+    assert([(cell_task.x, cell_task.y) for cell_task in task.requires()] == [(120, -20), (121, -20)])
+
+    assert([len(cell_task.prefetched_tiles[key]) for cell_task in tasks] == [2, 2])
+
+
+class FileTask(object):
+
+    """
+    Task that writes its process id to a file - or fails
+    """
+
+    tiles = None
+    prefetched_tiles = None
+
+    def __init__(self, path, fail=False):
+        self.path = path
+        self.fail = fail
+
+    def complete(self):
+        return os.path.isfile(self.path)
+
+    def run(self):
+
+        if self.fail:
+            raise Exception("Task [%s] failed" % self.path)
+
+        with open(self.path, "w") as f:
+            f.write(str(os.getpid()))
+
+    def get_tiles(self):
+        return []
+
+    def get_pid(self):
+
+        with open(self.path) as f:
+            return f.read()
+
+
+def test_run_tasks():
+
+    for workers, threads in [(1, False), (3, False), (3, True)]:
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            tasks = [FileTask(os.path.join(directory, "task_%d" % i)) for i in range(10)]
+
+            # Already complete tasks aren't run again
+
+            with open(tasks[0].path, "w") as f:
+                f.write("done")
+
+            workflow.run_tasks(tasks, workers=workers, threads=threads)
+
+            assert(all(task.complete() for task in tasks))
+            assert(tasks[0].get_pid() == "done")
+
+            pids = set(task.get_pid() for task in tasks[1:])
+
+            if workers > 1 and not threads:
+                assert(str(os.getpid()) not in pids)
+            else:
+                assert(pids == set([str(os.getpid())]))
+
+            assert(workflow._pool_tasks is None)
+
+        finally:
+            shutil.rmtree(directory)
+
+
+def test_run_tasks_error():
+
+    for workers, threads in [(1, False), (3, False), (3, True)]:
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            tasks = [FileTask(os.path.join(directory, "task_%d" % i), fail=(i == 5)) for i in range(10)]
+
+            raised = False
+
+            try:
+                workflow.run_tasks(tasks, workers=workers, threads=threads)
+
+            except Exception as e:
+                raised = "failed" in str(e)
+
+            assert(raised)
+
+            assert(not tasks[5].complete())
+            assert(workflow._pool_tasks is None)
+
+        finally:
+            shutil.rmtree(directory)
+
+
+class ChunkedCellTask(cell_chunk.CellTask):
+
+    def __init__(self, directory, chunk_workers):
+        self.directory = directory
+        self.chunk_size_x = self.chunk_size_y = 2000
+        self.chunk_workers = chunk_workers
+        self.chunk_threads = True
+        self.chunks_done = None
+
+    def create_cell_chunk_task(self, x_offset, y_offset):
+        return FileTask(os.path.join(self.directory, "chunk_%d_%d" % (x_offset, y_offset)))
+
+    def run_cell(self):
+        self.chunks_done = len(os.listdir(self.directory))
+
+
+def test_cell_task_runs_chunk_tasks():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        # In process the chunks are run before run_cell()
+
+        task = ChunkedCellTask(directory, chunk_workers=2)
+        task.run()
+
+        assert(task.chunks_done == 4)
+
+        # Scheduled by luigi the chunks are requirements and aren't run by the cell
+
+        shutil.rmtree(directory)
+        os.mkdir(directory)
+
+        task = ChunkedCellTask(directory, chunk_workers=0)
+
+        assert(len(list(task.requires())) == 4)
+
+        task.run()
+
+        assert(task.chunks_done == 0)
+
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ===============================================================================
+
+
+
+__author__ = "Simon Oldfield"
+
+
+import gdal
+import numpy
+import os
+import shutil
+import tempfile
+from datacube.api.chunk import get_chunk_windows
+from datacube.api.writer import BandStatistics, RasterWriter, get_creation_options
+
+
+def test_band_statistics():
+
+    numpy.random.seed(1)
+
+    data = numpy.random.randint(-100, 10000, size=(300, 200)).astype(numpy.int16)
+    data[::7, ::3] = -999
+
+    statistics = BandStatistics(ndv=-999)
+
+    for y in range(0, 300, 64):
+        statistics.update(data[y:y + 64])
+
+    values = data[data != -999].astype(numpy.float64)
+
+    assert(statistics.count == values.size)
+    assert(statistics.minimum == values.min())
+    assert(statistics.maximum == values.max())
+    assert(numpy.allclose(statistics.mean, values.mean()))
+    assert(numpy.allclose(statistics.std, values.std()))
+
+
+def test_band_statistics_large_offset():
+
+    # The naive sum of squares loses all the precision of the variance when the mean is large compared to it
+
+    numpy.random.seed(2)
+
+    data = (1.0e9 + numpy.random.random((100, 100))).astype(numpy.float64)
+
+    statistics = BandStatistics()
+
+    for y in range(0, 100, 10):
+        statistics.update(data[y:y + 10])
+
+    assert(numpy.allclose(statistics.mean, data.mean()))
+    assert(numpy.allclose(statistics.std, data.std(), rtol=1e-6))
+
+
+def test_band_statistics_nan():
+
+    data = numpy.array([[1.0, numpy.nan], [numpy.nan, 3.0]], dtype=numpy.float32)
+
+    statistics = BandStatistics(ndv=numpy.nan)
+
+    statistics.update(data[:1])
+    statistics.update(data[1:])
+
+    assert(statistics.count == 2)
+    assert(statistics.minimum == 1.0 and statistics.maximum == 3.0)
+    assert(statistics.mean == 2.0)
+    assert(statistics.std == 1.0)
+
+
+TRANSFORM = (120.0, 0.00025, 0.0, -19.0, 0.0, -0.00025)
+
+PROJECTION = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],' \
+             'UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4326"]]'
+
+
+def get_data(count=2, height=200, width=300, ndv=-999):
+
+    numpy.random.seed(3)
+
+    data = numpy.random.randint(-100, 10000, size=(count, height, width)).astype(numpy.int16)
+    data[:, ::5, ::7] = ndv
+
+    return data
+
+
+def write_chunks(writer, data, chunk_size=128):
+
+    for x, y, x_size, y_size in get_chunk_windows(chunk_size, chunk_size, width=data.shape[2], height=data.shape[1]):
+        for band in range(1, data.shape[0] + 1):
+            writer.write(band, data[band - 1, y:y + y_size, x:x + x_size], x, y)
+
+
+def test_raster_writer_round_trip():
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        path = os.path.join(directory, "raster.tif")
+
+        data = get_data()
+
+        with RasterWriter(path, 300, 200, 2, gdal.GDT_Int16, TRANSFORM, PROJECTION, ndv=-999,
+                          overviews=[2, 4], metadata={"SOURCE": "test"}) as writer:
+
+            write_chunks(writer, data)
+
+            writer.set_band_description(1, "RED")
+
+        raster = gdal.Open(path)
+
+        assert((raster.RasterXSize, raster.RasterYSize, raster.RasterCount) == (300, 200, 2))
+        assert(numpy.allclose(raster.GetGeoTransform(), TRANSFORM))
+        assert(raster.GetMetadata()["SOURCE"] == "test")
+        assert(raster.GetRasterBand(1).GetDescription() == "RED")
+
+        for band in [1, 2]:
+
+            raster_band = raster.GetRasterBand(band)
+
+            assert(raster_band.GetNoDataValue() == -999)
+            assert(numpy.array_equal(raster_band.ReadAsArray(), data[band - 1]))
+
+            # Statistics of the valid pixels as accumulated from the chunks
+
+            values = data[band - 1][data[band - 1] != -999].astype(numpy.float64)
+
+            minimum, maximum, mean, std = raster_band.GetStatistics(False, False)
+
+            assert((minimum, maximum) == (values.min(), values.max()))
+            assert(numpy.allclose([mean, std], [values.mean(), values.std()]))
+
+            # Nearest neighbour overviews (the pixels at multiples of the factor)
+
+            assert(raster_band.GetOverviewCount() == 2)
+
+            for i, factor in enumerate([2, 4]):
+                assert(numpy.array_equal(raster_band.GetOverview(i).ReadAsArray(),
+                                         data[band - 1, ::factor, ::factor]))
+
+        del raster
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_raster_writer_foreground():
+
+    data = get_data(count=1)
+
+    writer = RasterWriter("", 300, 200, 1, gdal.GDT_Int16, TRANSFORM, PROJECTION, ndv=-999, driver="MEM",
+                          options=[], background=False)
+
+    # Keep the in memory raster to read back
+
+    raster = writer.raster
+
+    write_chunks(writer, data, chunk_size=64)
+
+    writer.close()
+
+    assert(writer.raster is None)
+    assert(numpy.array_equal(raster.GetRasterBand(1).ReadAsArray(), data[0]))
+
+
+def test_raster_writer_background_error():
+
+    writer = RasterWriter("", 300, 200, 2, gdal.GDT_Int16, TRANSFORM, PROJECTION, driver="MEM", options=[])
+
+    # There is no band 3 - the error happens on the writer thread and is raised by close()
+
+    writer.write(3, get_data(count=1)[0])
+
+    raised = False
+
+    try:
+        writer.close()
+
+    except Exception:
+        raised = True
+
+    assert(raised)
+    assert(writer.raster is None and writer.thread is None)
+
+
+def test_raster_writer_abort():
+
+    raised = None
+
+    try:
+        with RasterWriter("", 300, 200, 2, gdal.GDT_Int16, TRANSFORM, PROJECTION, driver="MEM",
+                          options=[]) as writer:
+
+            writer.write(3, get_data(count=1)[0])
+
+            raise ValueError("Something else went wrong")
+
+    except Exception as e:
+        raised = e
+
+    # The with block's exception is raised rather than the writer's and the writer is closed
+
+    assert(type(raised) is ValueError)
+    assert(writer.raster is None and writer.thread is None)
+
+
+def test_get_creation_options():
+
+    options = get_creation_options("GTiff", gdal.GDT_Float32)
+
+    assert("TILED=YES" in options and "COMPRESS=DEFLATE" in options and "PREDICTOR=3" in options)
+
+    for data_type in [gdal.GDT_Byte, gdal.GDT_Int16, gdal.GDT_UInt16, gdal.GDT_Int32]:
+        options = get_creation_options("GTiff", data_type)
+        assert("PREDICTOR=2" in options and "PREDICTOR=3" not in options)
+
+    assert("PREDICTOR=3" in get_creation_options("GTiff", gdal.GDT_Float64))
+    assert("COMPRESS=LZW" in get_creation_options("GTiff", gdal.GDT_Int16, compress="LZW"))
+
+    # No compression no predictor
+
+    options = get_creation_options("GTiff", gdal.GDT_Float32, compress=None)
+
+    assert(not [option for option in options if option.startswith("COMPRESS") or option.startswith("PREDICTOR")])
+
+    assert(get_creation_options("ENVI", gdal.GDT_Float32) == ["INTERLEAVE=BSQ"])
+
+    # A copy of the defaults each time
+
+    get_creation_options("ENVI", gdal.GDT_Float32).append("X=Y")
+    get_creation_options("GTiff", gdal.GDT_Int16).append("X=Y")
+
+    assert("X=Y" not in get_creation_options("ENVI", gdal.GDT_Float32))
+    assert("X=Y" not in get_creation_options("GTiff", gdal.GDT_Int16))
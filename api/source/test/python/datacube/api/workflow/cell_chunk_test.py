@@ -92,7 +92,7 @@ class CellChunkTestCellTask(CellTask):
 
         return luigi.LocalTarget(filename)
 
-    def run(self):
+    def run_cell(self):
 
         # for tile in self.get_tiles():
         # NBAR is tile.datasets[DatasetType.ARG25]
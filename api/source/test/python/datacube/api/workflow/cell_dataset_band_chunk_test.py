@@ -120,7 +120,7 @@ class CellDatasetBandTestCellDatasetBandTask(CellDatasetBandTask):
 
         return luigi.LocalTarget(filename)
 
-    def run(self):
+    def run_cell_dataset_band(self):
 
         print "****", self.output().path
 
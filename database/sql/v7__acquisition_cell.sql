@@ -0,0 +1,178 @@
+-- Denormalised acquisition/cell table - one row per NBAR tile with the tile paths of the other datasets for the
+-- same acquisition (PQA, FC) and cell (DSM, DEM, DEM-S, DEM-H) as columns.
+--
+-- Listing tiles/cells (datacube.api.query) is then a scan of a single table rather than a join of a derived
+-- tile/dataset sub query per processing level.
+--
+-- The table is kept up to date by the ingester calling refresh_acquisition_cell(dataset_id) for each dataset it
+-- ingests.  refresh_acquisition_cell_all() rebuilds it from scratch.
+
+-- The contents of the table as a view
+
+create or replace view acquisition_cell_view as
+select
+    acquisition.acquisition_id, satellite.satellite_tag, acquisition.start_datetime, acquisition.end_datetime,
+    nbar.x_index, nbar.y_index, nbar.tile_type_id, nbar.tile_class_id,
+    nbar.tile_pathname as nbar_tile_pathname,
+    pqa.tile_pathname as pqa_tile_pathname,
+    fc.tile_pathname as fc_tile_pathname,
+    dsm.tile_pathname as dsm_tile_pathname,
+    dem.tile_pathname as dem_tile_pathname,
+    dem_s.tile_pathname as dem_s_tile_pathname,
+    dem_h.tile_pathname as dem_h_tile_pathname
+from acquisition
+join satellite on satellite.satellite_id = acquisition.satellite_id
+join
+    (
+    select dataset.acquisition_id, tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 2 -- NBAR
+    ) as nbar on nbar.acquisition_id = acquisition.acquisition_id
+left join
+    (
+    select dataset.acquisition_id, tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 3 -- PQA
+    ) as pqa on
+        pqa.acquisition_id = acquisition.acquisition_id
+        and pqa.x_index = nbar.x_index and pqa.y_index = nbar.y_index
+        and pqa.tile_type_id = nbar.tile_type_id and pqa.tile_class_id = nbar.tile_class_id
+left join
+    (
+    select dataset.acquisition_id, tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 4 -- FC
+    ) as fc on
+        fc.acquisition_id = acquisition.acquisition_id
+        and fc.x_index = nbar.x_index and fc.y_index = nbar.y_index
+        and fc.tile_type_id = nbar.tile_type_id and fc.tile_class_id = nbar.tile_class_id
+left join
+    (
+    select tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 100 -- DSM
+    ) as dsm on
+        dsm.x_index = nbar.x_index and dsm.y_index = nbar.y_index
+        and dsm.tile_type_id = nbar.tile_type_id and dsm.tile_class_id = nbar.tile_class_id
+left join
+    (
+    select tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 110 -- DEM
+    ) as dem on
+        dem.x_index = nbar.x_index and dem.y_index = nbar.y_index
+        and dem.tile_type_id = nbar.tile_type_id and dem.tile_class_id = nbar.tile_class_id
+left join
+    (
+    select tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 120 -- DEM-S
+    ) as dem_s on
+        dem_s.x_index = nbar.x_index and dem_s.y_index = nbar.y_index
+        and dem_s.tile_type_id = nbar.tile_type_id and dem_s.tile_class_id = nbar.tile_class_id
+left join
+    (
+    select tile.x_index, tile.y_index, tile.tile_type_id, tile.tile_class_id, tile.tile_pathname
+    from tile
+    join dataset on dataset.dataset_id = tile.dataset_id
+    where dataset.level_id = 130 -- DEM-H
+    ) as dem_h on
+        dem_h.x_index = nbar.x_index and dem_h.y_index = nbar.y_index
+        and dem_h.tile_type_id = nbar.tile_type_id and dem_h.tile_class_id = nbar.tile_class_id
+;
+
+alter view acquisition_cell_view owner to cube_admin;
+
+
+-- The table
+
+create table acquisition_cell as select * from acquisition_cell_view with no data;
+
+alter table acquisition_cell owner to cube_admin;
+
+comment on table acquisition_cell is 'NBAR tiles with the paths of the corresponding PQA, FC, DSM and DEM tiles (maintained from tile/dataset by refresh_acquisition_cell())';
+
+insert into acquisition_cell select * from acquisition_cell_view;
+
+create index acquisition_cell_x_y_end_datetime_idx on acquisition_cell (x_index, y_index, end_datetime);
+create index acquisition_cell_acquisition_id_idx on acquisition_cell (acquisition_id);
+create index acquisition_cell_end_datetime_month_idx on acquisition_cell (extract(month from end_datetime));
+
+analyze acquisition_cell;
+
+
+-- Refresh the rows affected by (re-)ingesting a dataset
+--
+-- NBAR/PQA/FC datasets affect the rows of their acquisition; DSM/DEM datasets the rows of the cells they cover.
+
+create or replace function refresh_acquisition_cell(p_dataset_id bigint) returns void as $$
+declare
+    v_acquisition_id bigint;
+    v_level_name text;
+begin
+    select dataset.acquisition_id, processing_level.level_name into v_acquisition_id, v_level_name
+    from dataset
+    join processing_level on processing_level.level_id = dataset.level_id
+    where dataset.dataset_id = p_dataset_id;
+
+    if v_level_name in ('NBAR', 'PQA', 'FC') then
+
+        delete from acquisition_cell where acquisition_id = v_acquisition_id;
+
+        insert into acquisition_cell
+            select * from acquisition_cell_view where acquisition_id = v_acquisition_id;
+
+    elsif v_level_name in ('DSM', 'DEM', 'DEM-S', 'DEM-H') then
+
+        delete from acquisition_cell
+            where (x_index, y_index) in (select x_index, y_index from tile where dataset_id = p_dataset_id);
+
+        insert into acquisition_cell
+            select * from acquisition_cell_view
+            where (x_index, y_index) in (select x_index, y_index from tile where dataset_id = p_dataset_id);
+
+    end if;
+end;
+$$ language plpgsql;
+
+alter function refresh_acquisition_cell(bigint) owner to cube_admin;
+
+
+-- Refresh the rows of the given cells
+--
+-- Used when the tiles of a DSM/DEM dataset are removed - refresh_acquisition_cell() finds the cells from the tiles of
+-- the dataset so the ingester gets them before removing the tiles and refreshes them with this afterwards.
+
+create or replace function refresh_acquisition_cell_cells(p_x_index integer[], p_y_index integer[]) returns void as $$
+begin
+    delete from acquisition_cell
+        where (x_index, y_index) in (select unnest(p_x_index), unnest(p_y_index));
+
+    insert into acquisition_cell
+        select * from acquisition_cell_view
+        where (x_index, y_index) in (select unnest(p_x_index), unnest(p_y_index));
+end;
+$$ language plpgsql;
+
+alter function refresh_acquisition_cell_cells(integer[], integer[]) owner to cube_admin;
+
+
+-- Rebuild the whole table
+
+create or replace function refresh_acquisition_cell_all() returns void as $$
+begin
+    truncate acquisition_cell;
+
+    insert into acquisition_cell select * from acquisition_cell_view;
+
+    analyze acquisition_cell;
+end;
+$$ language plpgsql;
+
+alter function refresh_acquisition_cell_all() owner to cube_admin;
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+"""
+    test_acquisition_cell.py - tests for the acquisition_cell refresh on ingest
+
+    The acquisition_cell rows must follow the tiles when a dataset is
+    removed and re-ingested. The database is replaced by a small in memory
+    model of the tile and acquisition_cell tables (DummyDB), whose refresh
+    methods do what the v7 database change functions do.
+"""
+
+import logging
+import unittest
+from contextlib import contextmanager
+
+from agdc.abstract_ingester import AbstractIngester
+from agdc.abstract_ingester.dataset_record import DatasetRecord
+from agdc.abstract_ingester.ingest_db_wrapper import IngestDBWrapper
+
+#
+# Set up logger.
+#
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Constants
+#
+
+# dataset_path: (dataset_id, acquisition_id, level_name)
+DATASET_DICT = {
+    'nbar': (1, 1, 'NBAR'),
+    'dsm': (2, None, 'DSM'),
+    }
+
+#
+# Dummy Classes
+#
+
+# pylint: disable = missing-docstring
+#
+# Many of the methods are simple and self documenting and so do not need
+# docstrings.
+#
+
+
+class DummyDB(object):
+    """Dummy database holding the tile and acquisition_cell tables.
+
+    tiles is {dataset_id: {(x_index, y_index): tile_pathname}} and
+    acquisition_cell is {(acquisition_id, x_index, y_index): row}.
+    """
+
+    def __init__(self):
+        self.tiles = {}
+        self.acquisition_cell = {}
+
+    @staticmethod
+    def level_name(dataset_id):
+        for (ds_id, _, level_name) in DATASET_DICT.values():
+            if ds_id == dataset_id:
+                return level_name
+        return None
+
+    def tiles_at_level(self, level_name):
+        for (dataset_id, acquisition_id, name) in DATASET_DICT.values():
+            if name == level_name:
+                for (cell, path) in self.tiles.get(dataset_id, {}).items():
+                    yield acquisition_id, cell, path
+
+    def view_rows(self, acquisition_id=None, cell_list=None):
+        """The acquisition_cell_view rows (for NBAR and DSM only)."""
+
+        dsm_tiles = dict((cell, path) for (_, cell, path)
+                         in self.tiles_at_level('DSM'))
+
+        rows = {}
+        for (acq_id, cell, path) in self.tiles_at_level('NBAR'):
+            if acquisition_id is not None and acq_id != acquisition_id:
+                continue
+            if cell_list is not None and cell not in cell_list:
+                continue
+            rows[(acq_id,) + cell] = {
+                'nbar_tile_pathname': path,
+                'dsm_tile_pathname': dsm_tiles.get(cell)
+                }
+        return rows
+
+    def get_elevation_cells(self, dataset_filter):
+        return [cell for dataset_id in dataset_filter
+                if (self.level_name(dataset_id) in
+                    IngestDBWrapper.ELEVATION_LEVEL_NAMES)
+                for cell in self.tiles.get(dataset_id, {})]
+
+    def refresh_acquisition_cell(self, dataset_id):
+        level_name = self.level_name(dataset_id)
+
+        if level_name == 'NBAR':
+            acquisition_id = [acq_id for (ds_id, acq_id, _)
+                              in DATASET_DICT.values()
+                              if ds_id == dataset_id][0]
+            for key in list(self.acquisition_cell):
+                if key[0] == acquisition_id:
+                    del self.acquisition_cell[key]
+            self.acquisition_cell.update(
+                self.view_rows(acquisition_id=acquisition_id))
+
+        elif level_name in IngestDBWrapper.ELEVATION_LEVEL_NAMES:
+            self.refresh_acquisition_cell_cells(
+                list(self.tiles.get(dataset_id, {})))
+
+    def refresh_acquisition_cell_cells(self, cell_list):
+        for key in list(self.acquisition_cell):
+            if key[1:] in cell_list:
+                del self.acquisition_cell[key]
+        self.acquisition_cell.update(self.view_rows(cell_list=cell_list))
+
+
+class DummyCollection(object):
+    """Dummy collection class for testing."""
+
+    def __init__(self, db):
+        self.db = db
+
+    # pylint: disable = no-self-use, unused-argument
+
+    def check_metadata(self, dataset):
+        pass
+
+    def get_temp_tile_directory(self):
+        return 'temp_tile_dir'
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    @contextmanager
+    def lock_datasets(self, dataset_list):
+        yield
+
+    def create_acquisition_record(self, dataset):
+        return DummyAcquisitionRecord(self)
+
+    # pylint: enable = no-self-use, unused-argument
+
+
+class DummyAcquisitionRecord(object):
+    """Dummy acquisition record class for testing."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def create_dataset_record(self, dataset):
+        return DummyDatasetRecord(self.collection, dataset)
+
+
+class DummyDatasetRecord(DatasetRecord):
+    """Dummy dataset record class for testing.
+
+    The acquisition_cell methods (get_elevation_cells and
+    refresh_acquisition_cells) are the real ones, run against the dummy
+    database. The rest just add or remove the tiles of the dataset.
+    """
+
+    # pylint: disable = super-init-not-called, unused-argument
+
+    def __init__(self, collection, dataset):
+        self.collection = collection
+        self.db = collection.db
+        self.dataset = dataset
+        self.dataset_id = dataset.dataset_id
+        self.needs_update = self.dataset_id in self.db.tiles
+
+    def get_removal_overlaps(self):
+        return []
+
+    def get_creation_overlaps(self):
+        return []
+
+    def remove_mosaics(self, dataset_filter):
+        pass
+
+    def create_mosaics(self, dataset_filter):
+        pass
+
+    def remove_tiles(self):
+        self.db.tiles[self.dataset_id] = {}
+
+    def update(self):
+        pass
+
+    def list_tile_types(self):
+        return [1]
+
+    def get_tile_bands(self, tile_type_id):
+        return None
+
+    def make_tiles(self, tile_type_id, band_stack):
+        return self.dataset.coverage.items()
+
+    def store_tiles(self, tile_list):
+        self.db.tiles.setdefault(self.dataset_id, {}).update(tile_list)
+
+    # pylint: enable = super-init-not-called, unused-argument
+
+
+class DummyDataset(object):
+    """Dummy dataset class for testing.
+
+    'coverage' is {(x_index, y_index): tile_pathname}.
+    """
+
+    def __init__(self, dataset_path, coverage):
+        self.dataset_path = dataset_path
+        self.dataset_id = DATASET_DICT[dataset_path][0]
+        self.coverage = coverage
+
+    # pylint: disable = no-self-use, unused-argument
+
+    def get_x_ref(self):
+        return None
+
+    def get_y_ref(self):
+        return None
+
+    def get_start_datetime(self):
+        return None
+
+    def stack_bands(self, band_list):
+        return DummyBandStack()
+
+    # pylint: enable = no-self-use, unused-argument
+
+
+class DummyBandStack(object):
+    """Dummy band stack class for testing."""
+
+    def buildvrt(self, temp_dir):
+        pass
+
+
+class DummyDatacube(object):
+    """Dummy datacube class for testing: no filter configuration."""
+
+    agdc_root = None
+
+
+class DummyIngester(AbstractIngester):
+    """Dummy Ingester subclass for testing.
+
+    The datasets to ingest are passed in rather than found on disk.
+    """
+
+    # pylint: disable = super-init-not-called
+
+    def __init__(self, collection):
+        self.datacube = DummyDatacube()
+        self.collection = collection
+        self.dataset_dict = {}
+
+    # pylint: enable = super-init-not-called
+
+    def find_datasets(self, source_dir):
+        return [source_dir]
+
+    def open_dataset(self, dataset_path):
+        return self.dataset_dict[dataset_path]
+
+    def ingest_dataset(self, dataset_path, coverage):
+        self.dataset_dict[dataset_path] = DummyDataset(dataset_path, coverage)
+        self.ingest_individual_dataset(dataset_path)
+
+# pylint: enable = missing-docstring
+
+#
+# Test suite
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class (which has too
+# many public methods according to pylint).
+#
+
+
+class TestAcquisitionCell(unittest.TestCase):
+    """Tests that (re-)ingesting refreshes the acquisition_cell rows."""
+
+    def setUp(self):
+        self.db = DummyDB()
+        self.ingester = DummyIngester(DummyCollection(self.db))
+
+        self.ingester.ingest_dataset('nbar', {(1, 1): 'nbar_1_1',
+                                              (2, 1): 'nbar_2_1'})
+        self.ingester.ingest_dataset('dsm', {(1, 1): 'dsm_1_1',
+                                             (2, 1): 'dsm_2_1'})
+
+    def check_rows(self, expected):
+        """Check the acquisition_cell rows against the view."""
+
+        self.assertEqual(self.db.acquisition_cell, self.db.view_rows())
+        self.assertEqual(self.db.acquisition_cell, expected)
+
+    def test_ingest(self):
+        """Ingesting a DSM fills in the rows of the cells it covers."""
+
+        self.check_rows({
+            (1, 1, 1): {'nbar_tile_pathname': 'nbar_1_1',
+                        'dsm_tile_pathname': 'dsm_1_1'},
+            (1, 2, 1): {'nbar_tile_pathname': 'nbar_2_1',
+                        'dsm_tile_pathname': 'dsm_2_1'}
+            })
+
+    def test_remove_dsm(self):
+        """Removing the DSM tiles (on catalog) clears them from the rows."""
+
+        dataset = DummyDataset('dsm', {})
+        self.ingester.catalog(dataset)
+
+        self.check_rows({
+            (1, 1, 1): {'nbar_tile_pathname': 'nbar_1_1',
+                        'dsm_tile_pathname': None},
+            (1, 2, 1): {'nbar_tile_pathname': 'nbar_2_1',
+                        'dsm_tile_pathname': None}
+            })
+
+    def test_reingest_dsm(self):
+        """Re-ingesting a DSM refreshes the cells it no longer covers."""
+
+        self.ingester.ingest_dataset('dsm', {(1, 1): 'dsm_1_1_new'})
+
+        self.check_rows({
+            (1, 1, 1): {'nbar_tile_pathname': 'nbar_1_1',
+                        'dsm_tile_pathname': 'dsm_1_1_new'},
+            (1, 2, 1): {'nbar_tile_pathname': 'nbar_2_1',
+                        'dsm_tile_pathname': None}
+            })
+
+    def test_reingest_nbar(self):
+        """Re-ingesting an NBAR dataset replaces the rows of its acquisition."""
+
+        self.ingester.ingest_dataset('nbar', {(2, 1): 'nbar_2_1_new'})
+
+        self.check_rows({
+            (1, 2, 1): {'nbar_tile_pathname': 'nbar_2_1_new',
+                        'dsm_tile_pathname': 'dsm_2_1'}
+            })
+
+
+#
+# Define test suites
+#
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestAcquisitionCell]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+#
+# Run unit tests if in __main__
+#
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())